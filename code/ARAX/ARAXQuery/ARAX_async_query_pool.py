@@ -0,0 +1,229 @@
+#!/bin/env python3
+import atexit
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import List, Optional
+def eprint(*args, **kwargs): print(*args, file=sys.stderr, **kwargs)
+
+import requests
+
+from ARAX_query_tracker import ARAXQueryTracker
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../ResponseCache")
+from response_cache import ResponseCache
+
+
+class AsyncQueryWorker:
+    """A pool worker process, along with the pipe jobs are sent to it over and the job (if any) it's running"""
+
+    def __init__(self, context):
+        self.connection, worker_connection = context.Pipe()
+        # Not daemonic, since queries themselves may need to start child processes
+        self.process = context.Process(target=run_async_query_worker, args=(worker_connection,),
+                                       name="ARAXAsyncQueryWorker")
+        self.process.start()
+        worker_connection.close()
+        self.job_id = None
+        self.job_was_cancelled = False
+
+
+class ARAXAsyncQueryPool:
+    """
+    A bounded pool of long-lived worker processes that run /asyncquery jobs. Workers are forked once (lazily, on
+    the first submitted job) and keep their database handles and callback HTTP session warm across jobs, rather
+    than each job forking its own process and reconnecting to everything.
+
+    The pool (in the API process) hands each job to an idle worker itself and keeps count of running and queued
+    jobs. A monitor thread hears back from workers over their pipes and watches their sentinels (which work even
+    after the server's SIGCHLD handler has reaped a worker), so a worker that dies mid-job is replaced and its job
+    slot freed.
+    """
+
+    n_workers = 4
+    max_queued_jobs = 16  # Jobs allowed to wait for a free worker before new submissions are turned away
+    monitor_interval = 1  # Seconds between checks for newly started workers
+
+    def __init__(self):
+        self.context = multiprocessing.get_context('fork')
+        self.queued_jobs = deque()
+        self.workers: List[AsyncQueryWorker] = []
+        self.lock = threading.Lock()
+        self.monitor_thread = None
+        self.is_shut_down = False
+        atexit.register(self.shutdown)
+
+    def submit(self, query: dict, job_id) -> bool:
+        """
+        Hands a (pristine, not yet processed) query off to the pool. Returns False without queueing anything if the
+        pool is already at capacity.
+        """
+        with self.lock:
+            num_running_jobs = len([worker for worker in self.workers if worker.job_id is not None])
+            if num_running_jobs + len(self.queued_jobs) >= self.n_workers + self.max_queued_jobs:
+                return False
+            self._start_workers()
+            self.queued_jobs.append((query, job_id))
+            self._dispatch_jobs()
+        return True
+
+    def is_worker(self, pid: int) -> bool:
+        with self.lock:
+            return any(worker.process.pid == pid for worker in self.workers)
+
+    def cancel_job_on_worker(self, pid: int) -> Optional[int]:
+        """
+        Cancels the job running on the given worker, if any, returning its job_id. A running query can't be stopped
+        partway, so the worker is terminated; the monitor thread then replaces it and frees the job's slot.
+        """
+        with self.lock:
+            for worker in self.workers:
+                if worker.process.pid == pid and worker.job_id is not None:
+                    worker.job_was_cancelled = True
+                    worker.process.terminate()
+                    return worker.job_id
+        return None
+
+    def shutdown(self):
+        with self.lock:
+            self.is_shut_down = True
+            for worker in self.workers:
+                worker.process.terminate()
+                worker.connection.close()
+            self.workers = []
+
+    def _start_workers(self):
+        # Called with the lock held
+        while len(self.workers) < self.n_workers:
+            self.workers.append(AsyncQueryWorker(self.context))
+        if self.monitor_thread is None:
+            self.monitor_thread = threading.Thread(target=self._monitor_workers, name="ARAXAsyncQueryPoolMonitor",
+                                                   daemon=True)
+            self.monitor_thread.start()
+
+    def _dispatch_jobs(self):
+        # Called with the lock held
+        for worker in self.workers:
+            if not self.queued_jobs:
+                return
+            if worker.job_id is None:
+                query, job_id = self.queued_jobs.popleft()
+                worker.job_id = job_id
+                try:
+                    worker.connection.send((query, job_id))
+                except (BrokenPipeError, OSError):
+                    # The worker has died; the monitor thread will replace it, so put the job back at the front
+                    worker.job_id = None
+                    self.queued_jobs.appendleft((query, job_id))
+
+    def _monitor_workers(self):
+        while True:
+            with self.lock:
+                if self.is_shut_down:
+                    return
+                workers_by_waitable = dict()
+                for worker in self.workers:
+                    workers_by_waitable[worker.connection] = worker
+                    workers_by_waitable[worker.process.sentinel] = worker
+            ready_waitables = multiprocessing.connection.wait(list(workers_by_waitable), timeout=self.monitor_interval)
+
+            lost_jobs = []
+            with self.lock:
+                if self.is_shut_down:
+                    return
+                for waitable in ready_waitables:
+                    worker = workers_by_waitable[waitable]
+                    if worker not in self.workers:
+                        continue  # Already replaced
+                    if self._receive_finished_jobs(worker) and waitable is worker.connection:
+                        continue
+                    # The worker has exited (killed by the OOM killer, cancelled, etc.)
+                    if worker.job_id is not None:
+                        lost_jobs.append((worker.job_id, worker.job_was_cancelled))
+                    worker.connection.close()
+                    self.workers.remove(worker)
+                    self._start_workers()
+                self._dispatch_jobs()
+
+            for job_id, was_cancelled in lost_jobs:
+                self._record_lost_job(job_id, was_cancelled)
+
+    @staticmethod
+    def _receive_finished_jobs(worker: AsyncQueryWorker) -> bool:
+        # Workers send back the job_id of each job they finish; returns False once the worker's pipe is closed
+        try:
+            while worker.connection.poll():
+                worker.connection.recv()
+                worker.job_id = None
+                worker.job_was_cancelled = False
+        except (EOFError, OSError):
+            return False
+        return True
+
+    @staticmethod
+    def _record_lost_job(job_id, was_cancelled: bool):
+        timestamp = str(datetime.now().isoformat())
+        if was_cancelled:
+            message_code, description = 'Terminated', 'Query was terminated on request'
+        else:
+            message_code, description = 'WorkerDied', 'The /asyncquery worker running this query died unexpectedly'
+        eprint(f"{timestamp}: WARNING: Async query job {job_id} did not finish: {description}")
+        attributes = {
+            'status': 'Completed',
+            'message_id': None,
+            'message_code': message_code,
+            'code_description': description
+        }
+        try:
+            ARAXQueryTracker().update_tracker_entry(job_id, attributes)
+        except Exception:
+            eprint(f"{timestamp}: ERROR: Could not update tracker entry for job {job_id}: {traceback.format_exc()}")
+
+
+def run_async_query_worker(connection: multiprocessing.connection.Connection):
+    # The forked worker cannot use the parent's MySQL connections, so it sets up its own once and reuses them
+    response_cache = ResponseCache()
+    query_tracker = ARAXQueryTracker()
+    callback_session = requests.Session()
+
+    from ARAX_query import ARAXQuery  # Imported here since ARAX_query imports this module
+    while True:
+        try:
+            query, job_id = connection.recv()
+        except EOFError:
+            return  # The pool has shut down
+        try:
+            araxq = ARAXQuery()
+            araxq.response_cache = response_cache
+            araxq.query_tracker = query_tracker
+            araxq.callback_session = callback_session
+            araxq.run_async_job(query, job_id)
+        except Exception:
+            timestamp = str(datetime.now().isoformat())
+            eprint(f"{timestamp}: ERROR: Async query worker {os.getpid()} failed on job {job_id}: "
+                   f"{traceback.format_exc()}")
+        finally:
+            connection.send(job_id)
+
+
+_async_query_pool = None
+_async_query_pool_lock = threading.Lock()
+
+
+def get_async_query_pool() -> ARAXAsyncQueryPool:
+    global _async_query_pool
+    with _async_query_pool_lock:
+        if _async_query_pool is None:
+            _async_query_pool = ARAXAsyncQueryPool()
+        return _async_query_pool
+
+
+def get_started_async_query_pool() -> Optional[ARAXAsyncQueryPool]:
+    """Returns the pool if this process has started one (without starting one otherwise)"""
+    with _async_query_pool_lock:
+        return _async_query_pool
@@ -1,15 +1,13 @@
 #!/bin/env python3
 import copy
 import os
-import sqlite3
 import sys
 from collections import defaultdict
-from typing import List, Dict, Optional, Tuple, Union
-
-import ujson
+from typing import Optional
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))  # ARAXQuery directory
 from ARAX_response import ARAXResponse
+from kg2c_sqlite import KG2cSqliteReader
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../")  # code directory
 from RTXConfiguration import RTXConfiguration
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../UI/OpenAPI/python-flask-server/")
@@ -49,7 +47,6 @@ class ARAXDecorator:
                                  description="The IDs of the original RTX-KG2pre edge(s) corresponding to this edge "
                                              "prior to any synonymization or remapping.")
         }
-        self.array_delimiter_char = "ǂ"
         self.kg2_infores_curie = "infores:rtx-kg2"  # Can't use expand_utilities.py here due to circular imports
         self.use_kg2c_sqlite = use_kg2c_sqlite  # False means Chunyu's special XDTD KG2 data is used
 
@@ -57,38 +54,20 @@ class ARAXDecorator:
         message = response.envelope.message
         response.debug(f"Decorating nodes with metadata from KG2c")
 
-        # Get connected to the local KG2c sqlite database
-        connection, cursor = self._connect_to_sqlite()
-
         # Extract the KG2c nodes from sqlite
         response.debug(f"Looking up corresponding KG2c nodes in sqlite")
-        node_attributes_ordered = list(self.node_attributes)
-        node_keys = set(node_key.replace("'", "''") for node_key in message.knowledge_graph.nodes)  # Escape quotes
-        node_keys_str = "','".join(node_keys)  # SQL wants ('node1', 'node2') format for string lists
-        if self.use_kg2c_sqlite:
-            node_cols_str = ", ".join([f"N.{property_name}" for property_name in node_attributes_ordered])
-            sql_query = f"SELECT N.id, {node_cols_str} " \
-                        f"FROM nodes AS N " \
-                        f"WHERE N.id IN ('{node_keys_str}')"
-        else:
-            node_cols_str = ", ".join([property_name for property_name in node_attributes_ordered])
-            sql_query = f"SELECT id, {node_cols_str} " \
-                        f"FROM NODE_MAPPING_TABLE AS N " \
-                        f"WHERE N.id IN ('{node_keys_str}')"
-        cursor.execute(sql_query)
-        rows = cursor.fetchall()
-        cursor.close()
-        connection.close()
+        sqlite_reader = self._get_sqlite_reader()
+        kg2c_nodes = sqlite_reader.get_node_properties(message.knowledge_graph.nodes)
+        sqlite_reader.close()
 
         # Decorate nodes in the KG with info in these KG2c nodes
         response.debug(f"Adding attributes to nodes in the KG")
-        for row in rows:
+        for node_id, kg2c_node in kg2c_nodes.items():
             # First create the attributes for this KG2c node
-            node_id = row[0]
             trapi_node = message.knowledge_graph.nodes[node_id]
             kg2c_node_attributes = []
-            for index, property_name in enumerate(node_attributes_ordered):
-                value = self._load_property(property_name, row[index + 1])  # Add one to account for 'id' column
+            for property_name in self.node_attributes:
+                value = kg2c_node.get(property_name)
                 if value:
                     kg2c_node_attributes.append(self.create_attribute(property_name, value))
 
@@ -153,46 +132,25 @@ class ARAXDecorator:
             search_key_column = "triple"
 
         # Extract the proper entries from sqlite
-        connection, cursor = self._connect_to_sqlite()
         response.debug(f"Looking up EPC edge info in KG2c sqlite")
-        response.debug(f"Looking up corresponding KG2c nodes in sqlite")
-        edge_attributes_ordered = list(self.edge_attributes)
-        search_keys_set = set(search_key.replace("'", "''") for search_key in set(search_key_to_edge_keys_map))  # Escape quotes
-        search_keys_str = "','".join(search_keys_set)  # SQL wants ('edge1', 'edge2') format for string lists
-        if self.use_kg2c_sqlite:
-            edge_cols_str = ", ".join([f"E.{property_name}" for property_name in edge_attributes_ordered])
-            sql_query = f"SELECT E.{search_key_column}, {edge_cols_str} " \
-                        f"FROM edges AS E " \
-                        f"WHERE E.{search_key_column} IN ('{search_keys_str}')"
-        else:
-            edge_cols_str = ", ".join([property_name for property_name in edge_attributes_ordered])
-            sql_query = f"SELECT triple, {edge_cols_str} " \
-                        f"FROM EDGE_MAPPING_TABLE AS E " \
-                        f"WHERE E.triple IN ('{search_keys_str}')"
-        cursor.execute(sql_query)
-        rows = cursor.fetchall()
-        cursor.close()
-        connection.close()
-            
-        response.debug(f"Got {len(rows)} rows back from KG2c sqlite")
+        if not self.use_kg2c_sqlite:
+            search_key_column = "triple"  # The XDTD database only has this column
+        sqlite_reader = self._get_sqlite_reader()
+        search_key_to_kg2c_edges_map = sqlite_reader.get_edge_properties(search_key_to_edge_keys_map, search_key_column)
+        sqlite_reader.close()
+        response.debug(f"Got {sum(len(kg2c_edges) for kg2c_edges in search_key_to_kg2c_edges_map.values())} "
+                       f"rows back from KG2c sqlite")
 
         response.debug(f"Adding attributes to edges in the KG")
-        # Create a helper lookup map for easy access to returned rows
-        search_key_to_kg2c_edge_tuples_map = defaultdict(list)
-        for row in rows:
-            search_key = row[0]
-            search_key_to_kg2c_edge_tuples_map[search_key].append(row)
-
         attribute_type_id_map = {property_name: self.create_attribute(property_name, "something").attribute_type_id
                                  for property_name in set(self.edge_attributes)}
-        for search_key, kg2c_edge_tuples in search_key_to_kg2c_edge_tuples_map.items():
+        for search_key, kg2c_edges in search_key_to_kg2c_edges_map.items():
             # Join the property values found for all edges matching the given search key
-            merged_kg2c_properties = {property_name: None for property_name in edge_attributes_ordered}
-            for kg2c_edge_tuple in kg2c_edge_tuples:
-                for index, property_name in enumerate(edge_attributes_ordered):
-                    raw_value = kg2c_edge_tuple[index + 1]
-                    if raw_value:  # Skip empty attributes
-                        value = self._load_property(property_name, raw_value)
+            merged_kg2c_properties = {property_name: None for property_name in self.edge_attributes}
+            for kg2c_edge in kg2c_edges:
+                for property_name in self.edge_attributes:
+                    value = kg2c_edge.get(property_name)
+                    if value:  # Skip empty attributes
                         if not merged_kg2c_properties.get(property_name):
                             merged_kg2c_properties[property_name] = set() if isinstance(value, list) else dict()
                         if isinstance(value, list):
@@ -264,7 +222,7 @@ class ARAXDecorator:
                               if source.resource_role == "primary_knowledge_source"] if edge.sources else []
         return primary_ks_sources[0] if primary_ks_sources else ""
 
-    def _connect_to_sqlite(self) -> Tuple[sqlite3.Connection, sqlite3.Cursor]:
+    def _get_sqlite_reader(self) -> KG2cSqliteReader:
         path_list = os.path.realpath(__file__).split(os.path.sep)
         rtx_index = path_list.index("RTX")
         rtxc = RTXConfiguration()
@@ -275,24 +233,10 @@ class ARAXDecorator:
             sqlite_dir_path = os.path.sep.join([*path_list[:(rtx_index + 1)], 'code', 'ARAX', 'KnowledgeSources', 'Prediction'])
             sqlite_name = rtxc.explainable_dtd_db_path.split('/')[-1]
         sqlite_file_path = f"{sqlite_dir_path}{os.path.sep}{sqlite_name}"
-        connection = sqlite3.connect(sqlite_file_path)
-        cursor = connection.cursor()
-        return connection, cursor
-
-    def _load_property(self, property_name: str, raw_value: str) -> Union[str, List[str], Dict[str, any], None]:
-        attributes_info_lookup = self.node_attributes if property_name in self.node_attributes else self.edge_attributes
-        ultimate_value_type = attributes_info_lookup[property_name]
-        if ultimate_value_type is list:
-            return [item for item in raw_value.split(self.array_delimiter_char) if item]
-        elif ultimate_value_type is dict:
-            if '"' not in raw_value:
-                raw_value = raw_value.replace("'", '"')
-            try:
-                return ujson.loads(raw_value)
-            except:
-                return {}
+        if self.use_kg2c_sqlite:
+            return KG2cSqliteReader(sqlite_file_path)
         else:
-            return raw_value
+            return KG2cSqliteReader(sqlite_file_path, nodes_table="NODE_MAPPING_TABLE", edges_table="EDGE_MAPPING_TABLE")
 
     @staticmethod
     def _get_attribute_triple(attribute: Attribute) -> str:
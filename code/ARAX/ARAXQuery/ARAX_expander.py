@@ -2,6 +2,7 @@
 import asyncio
 import copy
 import pickle
+import queue
 import sys
 import os
 import time
@@ -9,9 +10,12 @@ import traceback
 from collections import defaultdict
 from typing import List, Dict, Tuple, Union, Set, Optional
 
+import aiohttp
+
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))  # ARAXQuery directory
 from ARAX_response import ARAXResponse
 from ARAX_decorator import ARAXDecorator
+from background_event_loop import get_background_event_loop, shared_client_session
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../")  # code directory
 from RTXConfiguration import RTXConfiguration
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../BiolinkHelper/")
@@ -28,7 +32,8 @@ from openapi_server.models.q_node import QNode
 from openapi_server.models.edge import Edge
 from openapi_server.models.attribute_constraint import AttributeConstraint
 from Expand.kg2_querier import KG2Querier
-from Expand.trapi_querier import TRAPIQuerier
+from Expand.trapi_querier import TRAPIQuerier, create_kp_client_session
+from Expand.degree_scorer import DegreeScorer
 
 
 def eprint(*args, **kwargs): print(*args, file=sys.stderr, **kwargs)
@@ -120,6 +125,16 @@ class ARAXExpander:
                 "description": "The max number of nodes allowed to fulfill any intermediate QNode. Nodes in "
                                "excess of this threshold will be pruned, using Fisher Exact Test to rank answers."
             },
+            "prune_method": {
+                "is_required": False,
+                "type": "string",
+                "enum": ["fet", "degree"],
+                "default": "fet",
+                "examples": ["fet", "degree"],
+                "description": "How Expand decides which nodes to keep when pruning an intermediate QNode: 'fet' "
+                               "ranks intermediate results (using Fisher Exact Test), while 'degree' is a much "
+                               "cheaper scoring of each node's edges to adjacent answers, damped by its degree in KG2c."
+            },
             "kp_timeout": {
                 "is_required": False,
                 "type": "integer",
@@ -128,12 +143,53 @@ class ARAXExpander:
                 "description": "The number of seconds Expand will wait for a response from a KP before "
                                "cutting the query off and proceeding without results from that KP."
             },
+            "kp_soft_deadline": {
+                "is_required": False,
+                "type": "integer",
+                "default": None,
+                "examples": [15, 60],
+                "description": "The number of seconds after which Expand stops waiting for any KPs still working on "
+                               "a qedge, provided enough KPs have already answered it (see kp_soft_deadline_min_kps "
+                               "and kp_soft_deadline_min_edges). Late KPs are marked as timed out in the query plan."
+            },
+            "kp_soft_deadline_min_kps": {
+                "is_required": False,
+                "type": "integer",
+                "default": 1,
+                "examples": [1, 3],
+                "description": "The number of KPs that must have returned edges for a qedge before Expand will stop "
+                               "waiting for the remaining KPs at the soft deadline."
+            },
+            "kp_soft_deadline_min_edges": {
+                "is_required": False,
+                "type": "integer",
+                "default": None,
+                "examples": [100, 1000],
+                "description": "The number of edges that, once returned for a qedge (by any number of KPs), lets "
+                               "Expand stop waiting for the remaining KPs at the soft deadline."
+            },
+            "kp_hard_deadline": {
+                "is_required": False,
+                "type": "integer",
+                "default": None,
+                "examples": [120, 300],
+                "description": "The max number of seconds Expand will spend on any one KP's answer to a qedge "
+                               "(including processing the answer), after which that KP's answer is discarded."
+            },
             "return_minimal_metadata": {
                 "is_required": False,
                 "examples": ["true", "false"],
                 "type": "boolean",
                 "description": "Whether to omit supporting data on nodes/edges in the results (e.g., publications, "
                                "description, etc.)."
+            },
+            "bypass_cache": {
+                "is_required": False,
+                "examples": ["true", "false"],
+                "type": "boolean",
+                "default": "false",
+                "description": "Whether to ignore cached KP answers and send every query to KPs anew. (Fresh answers "
+                               "are still saved to the cache.)"
             }
         }
         return parameter_info_dict
@@ -216,6 +272,7 @@ class ARAXExpander:
             kp_timeout = parameters["kp_timeout"]
         else:
             kp_timeout = None
+        bypass_cache = parameters["bypass_cache"]
 
         # Verify we understand all constraints
         for qnode_key, qnode in query_graph.nodes.items():
@@ -362,178 +419,197 @@ class ARAXExpander:
                     for edge in query_sub_graph.edges.keys():
                         query_sub_graph.edges[edge].knowledge_type = 'lookup'
 
-            # Expand the query graph edge-by-edge
-            for qedge_key in ordered_qedge_keys_to_expand:
-                log.debug(f"Expanding qedge {qedge_key}")
-                response.update_query_plan(qedge_key, 'edge_properties', 'status', 'Expanding')
-                for kp in kp_selector.valid_kps:
-                    response.update_query_plan(qedge_key, kp, 'Waiting', 'Prepping query to send to KP')
-                message.query_graph.edges[qedge_key].filled = True  # Mark as expanded in overarching QG #1848
-                qedge = query_graph.edges[qedge_key]
-                qedge.filled = True  # Also mark as expanded in local QG #1848
-
-                # Create a query graph for this edge (that uses curies found in prior steps)
-                one_hop_qg = self._get_query_graph_for_edge(qedge_key, query_graph, overarching_kg, log)
-                if mode != "RTXKG2":
-                    # Mark these qedges as 'lookup' if this is an 'inferred' query
-                    if inferred_qedge_keys and len(query_graph.edges) == 1:
-                        for edge in one_hop_qg.edges.keys():
-                            one_hop_qg.edges[edge].knowledge_type = 'lookup'
-                # Figure out the prune threshold (use what user provided or otherwise do something intelligent)
-                if parameters.get("prune_threshold"):
-                    pre_prune_threshold = parameters["prune_threshold"]
-                else:
-                    pre_prune_threshold = self._get_prune_threshold(one_hop_qg)
-                # Prune back any nodes with more than the specified max of answers
-                if mode != "RTXKG2":
-                    log.debug(f"For {qedge_key}, pre-prune threshold is {pre_prune_threshold}")
-                    fulfilled_qnode_keys = set(one_hop_qg.nodes).intersection(set(overarching_kg.nodes_by_qg_id))
-                    for qnode_key in fulfilled_qnode_keys:
-                        num_kg_nodes = len(overarching_kg.nodes_by_qg_id[qnode_key])
-                        if num_kg_nodes > pre_prune_threshold:
-                            if inferred_qedge_keys and len(inferred_qedge_keys) == 1:
-                                overarching_kg = self._prune_kg(qnode_key, pre_prune_threshold, overarching_kg, message.query_graph, log)
-                            else:
-                                overarching_kg = self._prune_kg(qnode_key, pre_prune_threshold, overarching_kg, query_graph, log)
-                            # Re-formulate the QG for this edge now that the KG has been slimmed down
-                            one_hop_qg = self._get_query_graph_for_edge(qedge_key, query_graph, overarching_kg, log)
-                if log.status != 'OK':
-                    return response
-
-                # Figure out which KPs would be best to expand this edge with (if no KP was specified)
-                if not user_specified_kp:
-                    if mode == "RTXKG2":
-                        kps_to_query = {"infores:rtx-kg2"}
-                    else:
-                        queriable_kps = set(kp_selector.get_kps_for_single_hop_qg(one_hop_qg))
-                        # remove kps if this edge has kp constraints
-                        allowlist, denylist = eu.get_knowledge_source_constraints(qedge)
-                        kps_to_query = queriable_kps - denylist
-                        if allowlist:
-                            kps_to_query = {kp for kp in kps_to_query if kp in allowlist}
-
-                        for skipped_kp in queriable_kps.difference(kps_to_query):
-                            skipped_message = "This KP was constrained by this edge"
-                            response.update_query_plan(qedge_key, skipped_kp, "Skipped", skipped_message)
-
-                    log.info(f"Expand decided to use {len(kps_to_query)} KPs to answer {qedge_key}: {kps_to_query}")
-                else:
-                    kps_to_query = set(eu.convert_to_list(parameters["kp"]))
-                    for kp in kp_selector.valid_kps.difference(kps_to_query):
-                        skipped_message = f"Expand was told to use {', '.join(kps_to_query)}"
-                        response.update_query_plan(qedge_key, kp, "Skipped", skipped_message)
-                kps_to_query = list(kps_to_query)
-
-                # Use a non-concurrent method to expand with KG2 when bypassing the KG2 API
-                if kps_to_query == ["infores:rtx-kg2"] and mode == "RTXKG2":
-                    kp_answers = [self._expand_edge_kg2_local(one_hop_qg, log)]
-                # Otherwise concurrently send this query to each KP selected to answer it
-                elif kps_to_query:
-                    kps_to_query = eu.sort_kps_for_asyncio(kps_to_query, log)
-                    log.debug(f"Will use asyncio to run KP queries concurrently")
-                    loop = asyncio.new_event_loop()  # Need to create NEW event loop for threaded environments
-                    asyncio.set_event_loop(loop)
-                    tasks = [self._expand_edge_async(one_hop_qg,
-                                                     kp_to_use,
-                                                     user_specified_kp,
-                                                     kp_timeout,
-                                                     force_local,
-                                                     kp_selector,
-                                                     log,
-                                                     multiple_kps=True)
-                             for kp_to_use in kps_to_query]
-                    task_group = asyncio.gather(*tasks)
-                    kp_answers = loop.run_until_complete(task_group)
-                    loop.close()
-                else:
-                    log.error("Expand could not find any KPs to answer "
-                              f"{qedge_key} with.", error_code="NoResults")
-                    return response
-
-                # Merge KPs' answers into our overarching KG
-                log.debug(f"Got answers from all KPs; merging them into one KG")
-                for index, response_tuple in enumerate(kp_answers):
-                    answer_kg = response_tuple[0]
-                    # Store any kryptonite edge answers as needed
-                    if mode != "RTXKG2" and qedge.exclude and not answer_kg.is_empty():
-                        self._store_kryptonite_edge_info(answer_kg, qedge_key, message.query_graph,
-                                                         message.encountered_kryptonite_edges_info, response)
-                    # Otherwise just merge the answer into the overarching KG
-                    else:
-                        self._merge_answer_into_message_kg(answer_kg, overarching_kg, message.query_graph, query_graph, mode, response)
-                    if response.status != 'OK':
-                        return response
-                log.debug(f"After merging KPs' answers, total KG counts are: {eu.get_printable_counts_by_qg_id(overarching_kg)}")
-
-                # Handle any constraints for this qedge and/or its qnodes (that require post-filtering)
-                qnode_keys = {qedge.subject, qedge.object}
-                qnode_keys_with_answers = qnode_keys.intersection(set(overarching_kg.nodes_by_qg_id))
-                for qnode_key in qnode_keys_with_answers:
-                    qnode = query_graph.nodes[qnode_key]
-                    if qnode.constraints:
-                        for constraint in qnode.constraints:
-                            if constraint.id == "biolink:highest_FDA_approval_status" and constraint.operator == "==" and constraint.value == "regular approval":
-                                log.info(f"Applying qnode {qnode_key} constraint: {'NOT ' if constraint._not else ''}"
-                                         f"biolink:highest_FDA_approval_status == regular approval")
-                                fda_approved_drug_ids = self._load_fda_approved_drug_ids()
-                                answer_node_ids = set(overarching_kg.nodes_by_qg_id[qnode_key])
-                                if constraint._not:
-                                    nodes_to_remove = answer_node_ids.intersection(fda_approved_drug_ids)
-                                else:
-                                    nodes_to_remove = answer_node_ids.difference(fda_approved_drug_ids)
-                                log.debug(f"Removing {len(nodes_to_remove)} nodes fulfilling {qnode_key} for FDA "
-                                          f"approval constraint ({round((len(nodes_to_remove) / len(answer_node_ids)) * 100)}%)")
-                                overarching_kg.remove_nodes(nodes_to_remove, qnode_key, query_graph)
-
-                # Handle knowledge source constraints for this qedge
-                # Removing kedges that have any sources that are constrained
-                log.debug(f"Handling any knowledge source constraints")
-                allowlist, denylist = eu.get_knowledge_source_constraints(qedge)
-                log.debug(f"KP allowlist is {allowlist}, denylist is {denylist}")
-                if qedge_key in overarching_kg.edges_by_qg_id:
-                    kedges_to_remove = []
-                    for kedge_key, kedge in overarching_kg.edges_by_qg_id[qedge_key].items():
-                        edge_sources = {retrieval_source.resource_id for retrieval_source in kedge.sources} if kedge.sources else set()
-                        if edge_sources:
-                            # always accept arax as a source
-                            if edge_sources == {"infores:arax"}:
-                                continue
-                            # Don't keep edges that ONLY come from excluded sources
-                            if edge_sources.issubset(denylist):
-                                kedges_to_remove.append(kedge_key)
-                                break
-                            # Only keep edges that come from at least ONE allowed source
-                            elif allowlist and not edge_sources.intersection(allowlist):
-                                kedges_to_remove.append(kedge_key)
+            # Expand the query graph edge-by-edge. A qedge's KP queries are sent out as soon as the qedges it gets
+            # curies from are done, so independent qedges (e.g., ones hanging off different pinned qnodes) are answered
+            # concurrently. Answers are still merged and post-processed one qedge at a time, in the usual order, so the
+            # resulting KG doesn't depend on which qedge's KPs happened to answer first.
+            qedge_dependencies = self._get_qedge_dependencies(ordered_qedge_keys_to_expand, query_graph)
+            prune_qg = message.query_graph if inferred_qedge_keys and len(inferred_qedge_keys) == 1 else query_graph
+            done_qedge_keys = set()
+            one_hop_qgs = dict()
+            kps_to_query_by_qedge = dict()
+            kp_query_futures = dict()
+            # KP queries run on the background event loop's thread, which hands each KP's answer (along with the log
+            # of its query) back in a queue; answers are only merged on this thread, once it's their qedge's turn
+            kp_answer_queues = dict()
+
+            background_event_loop = get_background_event_loop()
+            try:
+                for qedge_index, qedge_key in enumerate(ordered_qedge_keys_to_expand):
+                    log.debug(f"Expanding qedge {qedge_key}")
+                    qedge = query_graph.edges[qedge_key]
+                    if qedge_key in one_hop_qgs:
+                        # This qedge's KPs were queried early; prune the KG now, at the point it would've been pruned
+                        # if the qedges were expanded one after another. None of its qnodes had answers when it was
+                        # sent, so its QG only uses curies from the QG and doesn't need re-formulating.
+                        if mode != "RTXKG2":
+                            self._pre_prune_kg(qedge_key, one_hop_qgs[qedge_key], overarching_kg, prune_qg, parameters, log)
+                            if log.status != 'OK':
+                                return response
+
+                    # Send out KP queries for this qedge and any later ones that don't depend on qedges still to come
+                    for upcoming_qedge_key in ordered_qedge_keys_to_expand[qedge_index:]:
+                        if upcoming_qedge_key in one_hop_qgs:
+                            continue
+                        if upcoming_qedge_key != qedge_key and not self._can_expand_qedge_early(upcoming_qedge_key,
+                                                                                                 qedge_dependencies,
+                                                                                                 done_qedge_keys,
+                                                                                                 query_graph,
+                                                                                                 overarching_kg):
+                            continue
+                        response.update_query_plan(upcoming_qedge_key, 'edge_properties', 'status', 'Expanding')
+                        for kp in kp_selector.valid_kps:
+                            response.update_query_plan(upcoming_qedge_key, kp, 'Waiting', 'Prepping query to send to KP')
+                        message.query_graph.edges[upcoming_qedge_key].filled = True  # Mark as expanded in overarching QG #1848
+                        query_graph.edges[upcoming_qedge_key].filled = True  # Also mark as expanded in local QG #1848
+
+                        # Create a query graph for this edge (that uses curies found in prior steps)
+                        one_hop_qg = self._get_query_graph_for_edge(upcoming_qedge_key, query_graph, overarching_kg, log)
+                        if upcoming_qedge_key == qedge_key and mode != "RTXKG2":
+                            # Prune back any nodes with more than the max number of answers
+                            if self._pre_prune_kg(qedge_key, one_hop_qg, overarching_kg, prune_qg, parameters, log):
+                                # Re-formulate the QG for this edge now that the KG has been slimmed down
+                                one_hop_qg = self._get_query_graph_for_edge(qedge_key, query_graph, overarching_kg, log)
+                            if log.status != 'OK':
+                                return response
+                        if mode != "RTXKG2":
+                            # Mark these qedges as 'lookup' if this is an 'inferred' query
+                            if inferred_qedge_keys and len(query_graph.edges) == 1:
+                                for edge in one_hop_qg.edges.keys():
+                                    one_hop_qg.edges[edge].knowledge_type = 'lookup'
+                        kps_to_query = self._get_kps_to_query(upcoming_qedge_key, one_hop_qg, kp_selector,
+                                                              user_specified_kp, parameters, mode, response)
+                        one_hop_qgs[upcoming_qedge_key] = one_hop_qg
+                        kps_to_query_by_qedge[upcoming_qedge_key] = kps_to_query
+
+                        # Concurrently send this query to each KP selected to answer it (unless bypassing the KG2 API)
+                        if kps_to_query and not (kps_to_query == ["infores:rtx-kg2"] and mode == "RTXKG2"):
+                            if upcoming_qedge_key != qedge_key:
+                                log.info(f"Sending {upcoming_qedge_key} to KPs now, since it doesn't depend on any qedges "
+                                         f"still being expanded")
+                            kps_to_query = eu.sort_kps_for_asyncio(kps_to_query, log)
+                            log.debug(f"Will use asyncio to run KP queries concurrently")
+                            kp_answer_queues[upcoming_qedge_key] = queue.Queue()
+                            kp_query_futures[upcoming_qedge_key] = background_event_loop.submit(
+                                self._expand_edge_using_kps_async(one_hop_qg,
+                                                                  kps_to_query,
+                                                                  user_specified_kp,
+                                                                  kp_timeout,
+                                                                  bypass_cache,
+                                                                  force_local,
+                                                                  kp_selector,
+                                                                  log,
+                                                                  kp_answer_queues[upcoming_qedge_key],
+                                                                  parameters["kp_soft_deadline"],
+                                                                  parameters["kp_soft_deadline_min_kps"],
+                                                                  parameters["kp_soft_deadline_min_edges"],
+                                                                  parameters["kp_hard_deadline"]))
+
+                    # Merge this qedge's answers into our overarching KG as they come in
+                    one_hop_qg = one_hop_qgs[qedge_key]
+                    kps_to_query = kps_to_query_by_qedge[qedge_key]
+                    if kps_to_query == ["infores:rtx-kg2"] and mode == "RTXKG2":
+                        # Use a non-concurrent method to expand with KG2 when bypassing the KG2 API
+                        answer_kg, _ = self._expand_edge_kg2_local(one_hop_qg, log)
+                        self._merge_kp_answer(answer_kg, qedge_key, overarching_kg, message, query_graph, mode, response)
+                    elif kps_to_query:
+                        # The queue ends with None once all of this qedge's KP queries are done
+                        for answer_kg, kp_log in iter(kp_answer_queues[qedge_key].get, None):
+                            response.merge(kp_log)
+                            if response.status == 'OK' and answer_kg is not None:
+                                self._merge_kp_answer(answer_kg, qedge_key, overarching_kg, message, query_graph, mode,
+                                                      response)
+                            if response.status != 'OK':
                                 break
-                    if kedges_to_remove:
-                        log.debug(f"Removing {len(kedges_to_remove)} edges because they do not fulfill knowledge source constraint")
-                        # remove kedges which have been determined to be constrained
-                        for kedge_key in kedges_to_remove:
-                            if kedge_key in overarching_kg.edges_by_qg_id[qedge_key]:
-                                del overarching_kg.edges_by_qg_id[qedge_key][kedge_key]
-
-                if mode != "RTXKG2":
-                    # Apply any kryptonite ("not") qedges
-                    self._apply_any_kryptonite_edges(overarching_kg, message.query_graph,
-                                                     message.encountered_kryptonite_edges_info, response)
-                    # Remove any paths that are now dead-ends
-                    if inferred_qedge_keys and len(inferred_qedge_keys) == 1:
-                        overarching_kg = self._remove_dead_end_paths(message.query_graph, overarching_kg, response)
+                        else:
+                            kp_query_futures.pop(qedge_key).result()
                     else:
-                        overarching_kg = self._remove_dead_end_paths(query_graph, overarching_kg, response)
+                        log.error("Expand could not find any KPs to answer "
+                                  f"{qedge_key} with.", error_code="NoResults")
+                        return response
                     if response.status != 'OK':
                         return response
+                    log.debug(f"After merging KPs' answers, total KG counts are: {eu.get_printable_counts_by_qg_id(overarching_kg)}")
+
+                    # Handle any constraints for this qedge and/or its qnodes (that require post-filtering)
+                    qnode_keys = {qedge.subject, qedge.object}
+                    qnode_keys_with_answers = qnode_keys.intersection(set(overarching_kg.nodes_by_qg_id))
+                    for qnode_key in qnode_keys_with_answers:
+                        qnode = query_graph.nodes[qnode_key]
+                        if qnode.constraints:
+                            for constraint in qnode.constraints:
+                                if constraint.id == "biolink:highest_FDA_approval_status" and constraint.operator == "==" and constraint.value == "regular approval":
+                                    log.info(f"Applying qnode {qnode_key} constraint: {'NOT ' if constraint._not else ''}"
+                                             f"biolink:highest_FDA_approval_status == regular approval")
+                                    fda_approved_drug_ids = self._load_fda_approved_drug_ids()
+                                    answer_node_ids = set(overarching_kg.nodes_by_qg_id[qnode_key])
+                                    if constraint._not:
+                                        nodes_to_remove = answer_node_ids.intersection(fda_approved_drug_ids)
+                                    else:
+                                        nodes_to_remove = answer_node_ids.difference(fda_approved_drug_ids)
+                                    log.debug(f"Removing {len(nodes_to_remove)} nodes fulfilling {qnode_key} for FDA "
+                                              f"approval constraint ({round((len(nodes_to_remove) / len(answer_node_ids)) * 100)}%)")
+                                    overarching_kg.remove_nodes(nodes_to_remove, qnode_key, query_graph)
+
+                    # Handle knowledge source constraints for this qedge
+                    # Removing kedges that have any sources that are constrained
+                    log.debug(f"Handling any knowledge source constraints")
+                    allowlist, denylist = eu.get_knowledge_source_constraints(qedge)
+                    log.debug(f"KP allowlist is {allowlist}, denylist is {denylist}")
+                    if qedge_key in overarching_kg.edges_by_qg_id:
+                        kedges_to_remove = []
+                        for kedge_key, kedge in overarching_kg.edges_by_qg_id[qedge_key].items():
+                            edge_sources = {retrieval_source.resource_id for retrieval_source in kedge.sources} if kedge.sources else set()
+                            if edge_sources:
+                                # always accept arax as a source
+                                if edge_sources == {"infores:arax"}:
+                                    continue
+                                # Don't keep edges that ONLY come from excluded sources
+                                if edge_sources.issubset(denylist):
+                                    kedges_to_remove.append(kedge_key)
+                                    break
+                                # Only keep edges that come from at least ONE allowed source
+                                elif allowlist and not edge_sources.intersection(allowlist):
+                                    kedges_to_remove.append(kedge_key)
+                                    break
+                        if kedges_to_remove:
+                            log.debug(f"Removing {len(kedges_to_remove)} edges because they do not fulfill knowledge source constraint")
+                            # remove kedges which have been determined to be constrained
+                            for kedge_key in kedges_to_remove:
+                                if kedge_key in overarching_kg.edges_by_qg_id[qedge_key]:
+                                    del overarching_kg.edges_by_qg_id[qedge_key][kedge_key]
+
+                    if mode != "RTXKG2":
+                        # Apply any kryptonite ("not") qedges
+                        self._apply_any_kryptonite_edges(overarching_kg, message.query_graph,
+                                                         message.encountered_kryptonite_edges_info, response)
+                        # Remove any paths that are now dead-ends
+                        if inferred_qedge_keys and len(inferred_qedge_keys) == 1:
+                            overarching_kg = self._remove_dead_end_paths(message.query_graph, overarching_kg, response)
+                        else:
+                            overarching_kg = self._remove_dead_end_paths(query_graph, overarching_kg, response)
+                        if response.status != 'OK':
+                            return response
 
-                # Declare that we are done expanding this qedge
-                response.update_query_plan(qedge_key, 'edge_properties', 'status', 'Done')
+                    # Declare that we are done expanding this qedge
+                    response.update_query_plan(qedge_key, 'edge_properties', 'status', 'Done')
 
-                # Make sure we found at least SOME answers for this edge
-                # TODO: Should this really just return response here? What about returning partial KG?
-                if not eu.qg_is_fulfilled(one_hop_qg, overarching_kg) and not qedge.exclude and not qedge.option_group_id:
-                    log.warning(f"No paths were found in any KPs satisfying qedge {qedge_key}. KPs used were: "
-                                f"{kps_to_query}")
-                    return response
+                    # Make sure we found at least SOME answers for this edge
+                    # TODO: Should this really just return response here? What about returning partial KG?
+                    if not eu.qg_is_fulfilled(one_hop_qg, overarching_kg) and not qedge.exclude and not qedge.option_group_id:
+                        log.warning(f"No paths were found in any KPs satisfying qedge {qedge_key}. KPs used were: "
+                                    f"{kps_to_query}")
+                        return response
+                    done_qedge_keys.add(qedge_key)
+            finally:
+                # Don't leave any KP queries running if we stopped before they were done. Cancelling their futures only
+                # asks them to stop, so wait until each has wound down (its queue then ends with None), so that nothing
+                # is still running on the event loop's thread for this query once we return.
+                for kp_query_future in kp_query_futures.values():
+                    kp_query_future.cancel()
+                for unfinished_qedge_key in kp_query_futures:
+                    for _ in iter(kp_answer_queues[unfinished_qedge_key].get, None):
+                        pass
 
         # Expand any specified nodes
         if qnode_keys_to_expand:
@@ -716,14 +792,116 @@ class ARAXExpander:
         response.debug(f"Done calling ARAX Infer from Expand; returning to regular Expand execution")
         return response, overarching_kg
 
+    async def _expand_edge_using_kps_async(self, edge_qg: QueryGraph,
+                                           kps_to_query: List[str],
+                                           user_specified_kp: bool,
+                                           kp_timeout: Optional[int],
+                                           bypass_cache: bool,
+                                           force_local: bool,
+                                           kp_selector: KPSelector,
+                                           log: ARAXResponse,
+                                           answer_queue: queue.Queue,
+                                           kp_soft_deadline: Optional[int] = None,
+                                           kp_soft_deadline_min_kps: int = 1,
+                                           kp_soft_deadline_min_edges: Optional[int] = None,
+                                           kp_hard_deadline: Optional[int] = None):
+        # Each KP's answer is put in answer_queue as soon as that KP finishes, so fast KPs aren't held up by slow ones.
+        # Past the soft deadline we stop waiting as soon as enough KPs/edges are in; the hard deadline caps each KP on
+        # its own. This runs on the background event loop's thread, so each KP query logs to its own ARAXResponse,
+        # which goes in the queue along with its answer (or None, if the KP didn't answer in time) for the caller to
+        # merge; the queue always ends with None.
+        try:
+            qedge_key = next(qedge_key for qedge_key in edge_qg.edges)
+            start = time.time()
+            num_kps_answered = 0
+            num_edges_answered = 0
+
+            def have_enough_answers() -> bool:
+                return (num_kps_answered >= kp_soft_deadline_min_kps or
+                        (kp_soft_deadline_min_edges is not None and num_edges_answered >= kp_soft_deadline_min_edges))
+
+            # KP queries share one pooled session (kept on the background event loop between calls), so connections
+            # are kept alive and capped per KP (at the limits in config_dbs.json)
+            async with shared_client_session("kp", self._create_kp_client_session) as session:
+                kp_logs = {kp_to_use: self._create_kp_log(log) for kp_to_use in kps_to_query}
+                pending_kps = {asyncio.ensure_future(asyncio.wait_for(self._expand_edge_async(edge_qg,
+                                                                                              kp_to_use,
+                                                                                              user_specified_kp,
+                                                                                              kp_timeout,
+                                                                                              bypass_cache,
+                                                                                              force_local,
+                                                                                              kp_selector,
+                                                                                              kp_logs[kp_to_use],
+                                                                                              multiple_kps=True,
+                                                                                              session=session),
+                                                                      timeout=kp_hard_deadline)): kp_to_use
+                               for kp_to_use in kps_to_query}
+                try:
+                    while pending_kps:
+                        seconds_to_soft_deadline = None
+                        if kp_soft_deadline is not None:
+                            seconds_to_soft_deadline = kp_soft_deadline - (time.time() - start)
+                            if seconds_to_soft_deadline <= 0:
+                                if have_enough_answers():
+                                    break
+                                seconds_to_soft_deadline = None  # Not enough answers yet; wait for the next one
+                        done, _ = await asyncio.wait(pending_kps, timeout=seconds_to_soft_deadline,
+                                                     return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            kp_to_use = pending_kps.pop(task)
+                            kp_log = kp_logs[kp_to_use]
+                            try:
+                                answer_kg, _ = task.result()
+                            except asyncio.TimeoutError:
+                                hard_deadline_message = f"Answer discarded at the {kp_hard_deadline}-second hard deadline"
+                                kp_log.warning(f"{kp_to_use}: {hard_deadline_message} for {qedge_key}")
+                                kp_log.update_query_plan(qedge_key, kp_to_use, "Timed out", hard_deadline_message)
+                                answer_queue.put((None, kp_log))
+                                continue
+                            num_edges = len(answer_kg.edges_by_qg_id.get(qedge_key, dict()))
+                            if num_edges:
+                                num_kps_answered += 1
+                                num_edges_answered += num_edges
+                            answer_queue.put((answer_kg, kp_log))
+                finally:
+                    late_kps = list(pending_kps.values())
+                    for task in pending_kps:
+                        task.cancel()
+                    await asyncio.gather(*pending_kps, return_exceptions=True)
+
+            if late_kps:
+                late_message = (f"Expand stopped waiting at the {kp_soft_deadline}-second soft deadline "
+                                f"({num_kps_answered} KPs had returned {num_edges_answered} edges)")
+                for kp_to_use in late_kps:
+                    kp_log = kp_logs[kp_to_use]
+                    kp_log.info(f"Soft deadline reached for {qedge_key}; proceeding without an answer from {kp_to_use}")
+                    kp_log.update_query_plan(qedge_key, kp_to_use, "Timed out", late_message)
+                    answer_queue.put((None, kp_log))
+        finally:
+            answer_queue.put(None)
+
+    def _create_kp_client_session(self) -> aiohttp.ClientSession:
+        return create_kp_client_session(self.rtxc.kp_connection_limit, self.rtxc.kp_connection_limit_per_kp)
+
+    @staticmethod
+    def _create_kp_log(log: ARAXResponse) -> ARAXResponse:
+        # A KP query's messages and status are kept out of the query's own response until they're merged into it (on
+        # the main thread), but its query plan updates go straight to the query's response, so they're streamed live
+        kp_log = ARAXResponse()
+        kp_log.update_query_plan = log.update_query_plan
+        return kp_log
+
     async def _expand_edge_async(self, edge_qg: QueryGraph,
                                  kp_to_use: str,
                                  user_specified_kp: bool,
                                  kp_timeout: Optional[int],
+                                 bypass_cache: bool,
                                  force_local: bool,
                                  kp_selector: KPSelector,
                                  log: ARAXResponse,
-                                 multiple_kps: bool = False) -> Tuple[QGOrganizedKnowledgeGraph, ARAXResponse]:
+                                 multiple_kps: bool = False,
+                                 session: Optional[aiohttp.ClientSession] = None
+                                 ) -> Tuple[QGOrganizedKnowledgeGraph, ARAXResponse]:
         # This function answers a single-edge (one-hop) query using the specified knowledge provider
         qedge_key = next(qedge_key for qedge_key in edge_qg.edges)
         log.info(f"Expanding qedge {qedge_key} using {kp_to_use}")
@@ -748,7 +926,9 @@ class ARAXExpander:
                                       user_specified_kp=user_specified_kp,
                                       kp_timeout=kp_timeout,
                                       kp_selector=kp_selector,
-                                      force_local=force_local)
+                                      force_local=force_local,
+                                      session=session,
+                                      bypass_cache=bypass_cache)
             answer_kg = await kp_querier.answer_one_hop_query_async(edge_qg)
         except Exception:
             tb = traceback.format_exc()
@@ -838,6 +1018,34 @@ class ARAXExpander:
             log.error(f"Only infores:rtx-kg2 can answer single-node queries currently", error_code="InvalidKP")
             return answer_kg
 
+    @staticmethod
+    def _get_kps_to_query(qedge_key: str, one_hop_qg: QueryGraph, kp_selector: KPSelector, user_specified_kp: bool,
+                          parameters: Dict[str, any], mode: str, log: ARAXResponse) -> List[str]:
+        # Figure out which KPs would be best to expand this edge with (if no KP was specified)
+        qedge = one_hop_qg.edges[qedge_key]
+        if not user_specified_kp:
+            if mode == "RTXKG2":
+                kps_to_query = {"infores:rtx-kg2"}
+            else:
+                queriable_kps = set(kp_selector.get_kps_for_single_hop_qg(one_hop_qg))
+                # remove kps if this edge has kp constraints
+                allowlist, denylist = eu.get_knowledge_source_constraints(qedge)
+                kps_to_query = queriable_kps - denylist
+                if allowlist:
+                    kps_to_query = {kp for kp in kps_to_query if kp in allowlist}
+
+                for skipped_kp in queriable_kps.difference(kps_to_query):
+                    skipped_message = "This KP was constrained by this edge"
+                    log.update_query_plan(qedge_key, skipped_kp, "Skipped", skipped_message)
+
+            log.info(f"Expand decided to use {len(kps_to_query)} KPs to answer {qedge_key}: {kps_to_query}")
+        else:
+            kps_to_query = set(eu.convert_to_list(parameters["kp"]))
+            for kp in kp_selector.valid_kps.difference(kps_to_query):
+                skipped_message = f"Expand was told to use {', '.join(kps_to_query)}"
+                log.update_query_plan(qedge_key, kp, "Skipped", skipped_message)
+        return list(kps_to_query)
+
     def _get_query_graph_for_edge(self, qedge_key: str, full_qg: QueryGraph, overarching_kg: QGOrganizedKnowledgeGraph, log: ARAXResponse) -> QueryGraph:
         # This function creates a query graph for the specified qedge, updating its qnodes' curies as needed
         edge_qg = QueryGraph(nodes=dict(), edges=dict())
@@ -972,6 +1180,17 @@ class ARAXExpander:
 
         return sub_query_graph
 
+    def _merge_kp_answer(self, answer_kg: QGOrganizedKnowledgeGraph, qedge_key: str,
+                         overarching_kg: QGOrganizedKnowledgeGraph, message, query_graph: QueryGraph, mode: str,
+                         log: ARAXResponse):
+        # Store any kryptonite edge answers as needed
+        if mode != "RTXKG2" and query_graph.edges[qedge_key].exclude and not answer_kg.is_empty():
+            self._store_kryptonite_edge_info(answer_kg, qedge_key, message.query_graph,
+                                             message.encountered_kryptonite_edges_info, log)
+        # Otherwise just merge the answer into the overarching KG
+        else:
+            self._merge_answer_into_message_kg(answer_kg, overarching_kg, message.query_graph, query_graph, mode, log)
+
     @staticmethod
     def _merge_answer_into_message_kg(answer_kg: QGOrganizedKnowledgeGraph, overarching_kg: QGOrganizedKnowledgeGraph,
                                       overarching_qg: QueryGraph, expands_qg: QueryGraph, mode: str, log: ARAXResponse):
@@ -1117,12 +1336,48 @@ class ARAXExpander:
                 for edge_key in edge_keys_to_remove:
                     organized_kg.edges_by_qg_id[qedge_key].pop(edge_key)
 
+    def _pre_prune_kg(self, qedge_key: str, one_hop_qg: QueryGraph, overarching_kg: QGOrganizedKnowledgeGraph,
+                      prune_qg: QueryGraph, parameters: Dict[str, any], log: ARAXResponse) -> bool:
+        """
+        Prunes back any qnodes in this qedge's QG that already have more answers in the KG than the prune threshold.
+        Returns whether any pruning was done.
+        """
+        # Figure out the prune threshold (use what user provided or otherwise do something intelligent)
+        if parameters.get("prune_threshold"):
+            pre_prune_threshold = parameters["prune_threshold"]
+        else:
+            pre_prune_threshold = self._get_prune_threshold(one_hop_qg)
+        log.debug(f"For {qedge_key}, pre-prune threshold is {pre_prune_threshold}")
+        did_prune = False
+        fulfilled_qnode_keys = set(one_hop_qg.nodes).intersection(set(overarching_kg.nodes_by_qg_id))
+        for qnode_key in fulfilled_qnode_keys:
+            num_kg_nodes = len(overarching_kg.nodes_by_qg_id[qnode_key])
+            if num_kg_nodes > pre_prune_threshold:
+                self._prune_kg(qnode_key, pre_prune_threshold, overarching_kg, prune_qg, log, parameters["prune_method"])
+                did_prune = True
+        return did_prune
+
     @staticmethod
     def _prune_kg(qnode_key_to_prune: str, prune_threshold: int, kg: QGOrganizedKnowledgeGraph,
-                  qg: QueryGraph, log: ARAXResponse) -> QGOrganizedKnowledgeGraph:
+                  qg: QueryGraph, log: ARAXResponse, prune_method: str = "fet") -> QGOrganizedKnowledgeGraph:
         log.info(f"Pruning back {qnode_key_to_prune} nodes because there are more than {prune_threshold}")
-        kg_copy = copy.deepcopy(kg)
         qg_expanded_thus_far = eu.get_qg_expanded_thus_far(qg, kg)
+        if prune_method == "degree":
+            # Score nodes straight from the KG, rather than building, FET-overlaying and ranking intermediate results
+            node_scores = DegreeScorer().score_nodes(qnode_key_to_prune, kg, qg_expanded_thus_far, log)
+            kept_nodes = sorted(node_scores, key=node_scores.get, reverse=True)[:prune_threshold]
+            if kept_nodes:
+                log.info(f"Kept top {len(kept_nodes)} answers for {qnode_key_to_prune} by degree score. Best score "
+                         f"was {round(node_scores[kept_nodes[0]], 5)}, worst kept was "
+                         f"{round(node_scores[kept_nodes[-1]], 5)}.")
+            else:
+                log.info(f"Kept no answers for {qnode_key_to_prune} (prune threshold is {prune_threshold})")
+            nodes_to_delete = set(kg.nodes_by_qg_id[qnode_key_to_prune]).difference(kept_nodes)
+            kg.remove_nodes(nodes_to_delete, qnode_key_to_prune, qg_expanded_thus_far)
+            log.debug(f"After pruning {qnode_key_to_prune} nodes, KG counts are: {eu.get_printable_counts_by_qg_id(kg)}")
+            return kg
+
+        kg_copy = copy.deepcopy(kg)
         qg_expanded_thus_far.nodes[qnode_key_to_prune].is_set = False  # Necessary for assessment of answer quality
         num_edges_in_kg = sum([len(edges) for edges in kg.edges_by_qg_id.values()])
         overlay_fet = True if num_edges_in_kg < 100000 else False
@@ -1144,8 +1399,11 @@ class ARAXExpander:
                 scores.append(current_result.analyses[0].score)
                 kept_nodes.update({binding.id for binding in current_result.node_bindings[qnode_key_to_prune]})
                 counter += 1
-            log.info(f"Kept top {len(kept_nodes)} answers for {qnode_key_to_prune}. "
-                     f"Best score was {round(max(scores), 5)}, worst kept was {round(min(scores), 5)}.")
+            if scores:
+                log.info(f"Kept top {len(kept_nodes)} answers for {qnode_key_to_prune}. "
+                         f"Best score was {round(max(scores), 5)}, worst kept was {round(min(scores), 5)}.")
+            else:
+                log.info(f"Kept no answers for {qnode_key_to_prune} (prune threshold is {prune_threshold})")
             # Actually eliminate them from the KG
 
             nodes_to_delete = set(kg.nodes_by_qg_id[qnode_key_to_prune]).difference(kept_nodes)
@@ -1233,6 +1491,30 @@ class ARAXExpander:
                     return []
         return ordered_qedge_keys
 
+    @staticmethod
+    def _get_qedge_dependencies(ordered_qedge_keys: List[str], qg: QueryGraph) -> Dict[str, Set[str]]:
+        """
+        Works out which of the qedges expanded before it (in the given order) each qedge gets curies from: those
+        sharing a qnode with it that doesn't have its own curies. Qedges that only share pinned qnodes are independent.
+        """
+        qedge_dependencies = dict()
+        for qedge_index, qedge_key in enumerate(ordered_qedge_keys):
+            qedge = qg.edges[qedge_key]
+            unpinned_qnode_keys = {qnode_key for qnode_key in {qedge.subject, qedge.object} if not qg.nodes[qnode_key].ids}
+            qedge_dependencies[qedge_key] = {prior_qedge_key for prior_qedge_key in ordered_qedge_keys[:qedge_index]
+                                             if unpinned_qnode_keys.intersection({qg.edges[prior_qedge_key].subject,
+                                                                                  qg.edges[prior_qedge_key].object})}
+        return qedge_dependencies
+
+    @staticmethod
+    def _can_expand_qedge_early(qedge_key: str, qedge_dependencies: Dict[str, Set[str]], done_qedge_keys: Set[str],
+                                qg: QueryGraph, overarching_kg: QGOrganizedKnowledgeGraph) -> bool:
+        # A qedge can be sent to KPs before its turn once the qedges it gets curies from are done, as long as none of
+        # its qnodes (pinned or not) already have answers in the KG, which could still be pruned before its turn comes
+        qedge = qg.edges[qedge_key]
+        return (qedge_dependencies[qedge_key].issubset(done_qedge_keys) and
+                not any(qnode_key in overarching_kg.nodes_by_qg_id for qnode_key in {qedge.subject, qedge.object}))
+
     @staticmethod
     def _find_qedge_connected_to_subgraph(subgraph_qedge_keys: List[str], qedge_keys_to_choose_from: List[str],
                                           qg: QueryGraph) -> Optional[str]:
@@ -1329,6 +1611,9 @@ class ARAXExpander:
                     parameters[param_name] = self._convert_bool_string_to_bool(value) if isinstance(value, str) else value
                 elif param_info_dict.get("type") == "integer":
                     parameters[param_name] = int(value)
+                elif "enum" in param_info_dict and value not in param_info_dict["enum"]:
+                    log.error(f"Supplied value {value} is not permitted for Expand parameter {param_name}. Allowable "
+                              f"values are: {param_info_dict['enum']}", error_code="InvalidParameter")
                 else:
                     parameters[param_name] = value
 
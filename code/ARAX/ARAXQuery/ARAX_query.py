@@ -6,6 +6,7 @@ def eprint(*args, **kwargs): print(*args, file=sys.stderr, **kwargs)
 import os
 import json
 import ast
+import queue
 import re
 import time
 from datetime import datetime
@@ -32,6 +33,7 @@ from ARAX_messenger import ARAXMessenger
 from ARAX_ranker import ARAXRanker
 from operation_to_ARAXi import WorkflowToARAXi
 from ARAX_query_tracker import ARAXQueryTracker
+from ARAX_async_query_pool import get_async_query_pool
 from result_transformer import ResultTransformer
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../UI/OpenAPI/python-flask-server/")
@@ -61,23 +63,23 @@ ARAXResponse.output = 'STDERR'
 null_context_manager = contextlib.nullcontext()
 
 
-class response_locking(ARAXResponse):
-    def __init__(self, lock: threading.Lock):
-        self.lock = lock
-        super().__init__()
-
-    def __add_message(self, message, level, code=None):
-        with self.lock:
-            super()._add_message(message, level, code)
-
 class ARAXQuery:
 
+    #### Size (in characters) of the pieces the final streamed message is sent in
+    STREAM_CHUNK_SIZE = 65536
+
     #### Constructor
     def __init__(self):
         self.response = None
         self.message = None
         self.rtxConfig = RTXConfiguration()
         self.lock = None
+        #### Warm handles provided by an async query worker process (see ARAX_async_query_pool)
+        self.response_cache = None
+        self.query_tracker = None
+        self.callback_session = None
+        self.async_input_query = None
+        self.callback_sent = False
 
     def handle_memory_error(self, e):
         with self.lock if self.lock is not None else null_context_manager:
@@ -96,92 +98,50 @@ class ARAXQuery:
 
     def query_return_stream(self, query, mode='ARAX'):
 
-        main_query_thread = threading.Thread(target=self.asynchronous_query, args=(query,mode,))
+        #### The query thread pushes log messages and query_plan changes onto this queue as they happen
+        event_queue = queue.Queue()
         self.lock = threading.Lock()
+        self.response = ARAXResponse()
+        self.response.event_queue = event_queue
+        main_query_thread = threading.Thread(target=self.asynchronous_query, args=(query,mode,))
         main_query_thread.start()
 
-        if self.response is None or "DONE" not in self.response.status:
+        self.response.debug("In query_return_stream")
+        pid = os.getpid()
+        authorization = str(hash('Pickles' + str(pid)))
+        yield(json.dumps( { "pid": pid, "authorization": authorization } )+"\n")
 
-            # Sleep until a response object has been created
-            have_response = False
-            while not have_response:
-                with self.lock:
-                    have_response = (self.response is not None)
-                if not have_response:
-                    time.sleep(0.1)
+        #### Relay events as soon as they arrive until the query thread says it is done
+        try:
+            while True:
+                try:
+                    event_type, event = event_queue.get(timeout=180)
+                except queue.Empty:
+                    timestamp = str(datetime.now().isoformat())
+                    yield json.dumps({ 'timestamp': timestamp, 'level': 'DEBUG', 'code': '', 'message': 'Query is still progressing...' }) + "\n"
+                    continue
+                if event_type == 'done':
+                    break
+                yield(json.dumps(event, sort_keys=True) + "\n")
+        except MemoryError as e:
+            self.handle_memory_error(e)
 
-            try:
-                i_message = 0
-                with self.lock:
-                    n_messages = len(self.response.messages)
-                query_plan_counter = 0
-                idle_ticks = 0.0
-                pid = None
-
-                self.response.debug("In query_return_stream")
-
-                response_status_says_done = False
-                while not response_status_says_done:
-                    with self.lock:
-                        response_status_says_done = ("DONE" in self.response.status)
-                    if response_status_says_done:
-                        break
-                    with self.lock:
-                        n_messages = len(self.response.messages)
-                    while i_message < n_messages:
-                        with self.lock:
-                            i_message_obj = self.response.messages[i_message].copy()
-                        yield(json.dumps(i_message_obj) + "\n")
-                        i_message += 1
-                        idle_ticks = 0.0
-
-                    if pid is None:
-                        pid = os.getpid()
-                        authorization = str(hash('Pickles' + str(pid)))
-                        yield(json.dumps( { "pid": pid, "authorization": authorization } )+"\n")
-
-                    #### Also emit any updates to the query_plan
-                    with self.lock:
-                        self_query_plan_counter = self.response.query_plan['counter']
-                    if query_plan_counter < self_query_plan_counter:
-                        query_plan_counter = self_query_plan_counter
-                        with self.lock:
-                            self_response_query_plan = self.response.query_plan.copy()
-                        yield(json.dumps(self_response_query_plan, sort_keys=True) + "\n")
-                        idle_ticks = 0.0
-                    time.sleep(0.2)
-                    idle_ticks += 0.2
-                    if idle_ticks > 180.0:
-                        timestamp = str(datetime.now().isoformat())
-                        yield json.dumps({ 'timestamp': timestamp, 'level': 'DEBUG', 'code': '', 'message': 'Query is still progressing...' }) + "\n"
-                        idle_ticks = 0.0
-            except MemoryError as e:
-                self.handle_memory_error(e)
-
-                # #### If there are any more logging messages in the queue, send them first
-            n_messages = len(self.response.messages)
-            while i_message < n_messages:
-                yield(json.dumps(self.response.messages[i_message]) + "\n")
-                i_message += 1
-
-            #### Also emit any updates to the query_plan
-            self_response_query_plan_counter = self.response.query_plan['counter']
-            if query_plan_counter < self_response_query_plan_counter:
-                query_plan_counter = self_response_query_plan_counter
-                yield(json.dumps(self.response.query_plan, sort_keys=True) + "\n")
-
-            # Remove the little DONE flag the other thread used to signal this thread that it is done
-            self.response.status = re.sub('DONE,', '', self.response.status)
+        main_query_thread.join()
+        self.response.event_queue = None
 
-            #### Switch OK to Success for TRAPI compliance
-            if self.response.envelope.status == 'OK':
-                self.response.envelope.status = 'Success'
+        #### Switch OK to Success for TRAPI compliance
+        if self.response.envelope.status == 'OK':
+            self.response.envelope.status = 'Success'
 
-            # Stream the resulting message back to the client
-            yield(json.dumps(self.response.envelope.to_dict(), sort_keys=True) + "\n")
+        # Stream the resulting message back to the client (json.dumps uses the fast C encoder, so serialize it all at
+        #   once, but hand it over in chunks so that one huge write doesn't hold up the server)
+        try:
+            envelope_json = json.dumps(self.response.envelope.to_dict(), sort_keys=True) + "\n"
+            for start in range(0, len(envelope_json), self.STREAM_CHUNK_SIZE):
+                yield envelope_json[start:start + self.STREAM_CHUNK_SIZE]
+        except MemoryError as e:
+            self.handle_memory_error(e)
 
-        # Wait until both threads rejoin here and the return
-        main_query_thread.join()
         self.track_query_finish()
         return
 
@@ -189,14 +149,6 @@ class ARAXQuery:
     def asynchronous_query(self,query, mode='ARAX'):
 
         try:
-            #### Define a new response object if one does not yet exist
-            with self.lock:
-                have_response = self.response is not None
-            if not have_response:
-                new_response = response_locking(self.lock)
-                with self.lock:
-                    self.response = new_response
-
             self.response.debug("in asynchronous_query")
 
             #### Execute the query
@@ -205,10 +157,9 @@ class ARAXQuery:
         except MemoryError as e:
             self.handle_memory_error(e)
 
-
-        # Insert a little flag into the response status to denote that this thread is done
-        with self.lock:
-            self.response.status = f"DONE,{self.response.status}"
+        finally:
+            # Let the streaming thread know that this thread is done
+            self.response.event_queue.put( ('done', None) )
 
         return
 
@@ -231,17 +182,8 @@ class ARAXQuery:
             self.track_query_finish()
             return response.envelope
 
-        if mode == 'asynchronous':
-            attributes = {
-                'status': 'Running Async',
-                'message_id': None,
-                'message_code': 'Running',
-                'code_description': 'Query running via /asyncquery (parent)'
-            }
-            query_tracker = ARAXQueryTracker()
-            if hasattr(self.response, 'job_id'):
-                query_tracker.update_tracker_entry(self.response.job_id, attributes)
-        else:
+        #### Asynchronous queries are marked as running when they are handed off to the worker pool
+        if mode != 'asynchronous':
             self.track_query_finish()
             #### Switch OK to Success for TRAPI compliance
             response.envelope.status = 'Success'
@@ -250,10 +192,38 @@ class ARAXQuery:
         return response.envelope
 
 
+    ########################################################################################
+    def run_async_job(self, query, job_id):
+        """Runs a queued /asyncquery job to completion inside an async query worker process"""
+
+        self.response = ARAXResponse()
+        response = self.response
+        response.debug(f"in run_async_job for job_id {job_id}")
+
+        try:
+            self.query(query, mode='asynchronous', origin='async_worker', job_id=job_id)
+        except Exception:
+            response.error(f"Async query job {job_id} failed with an uncaught exception: {traceback.format_exc()}",
+                           error_code="UncaughtError")
+        finally:
+            #### Whatever happened, make sure the caller hears back and the tracker entry is finished
+            if not self.callback_sent:
+                response.job_id = job_id
+                if response.envelope is None:
+                    ARAXMessenger().create_envelope(response)
+                if response.status != 'OK':
+                    response.envelope.status = response.error_code
+                    response.envelope.description = response.message
+                if query.get('callback') is not None:
+                    self.send_to_callback(query['callback'], response)
+                else:
+                    self.track_query_finish()
+
+
     ########################################################################################
     def track_query_finish(self):
 
-        query_tracker = ARAXQueryTracker()
+        query_tracker = self.query_tracker if self.query_tracker is not None else ARAXQueryTracker()
         try:
             response_id = self.response.response_id
         except:
@@ -274,7 +244,7 @@ class ARAXQuery:
 
 
     ########################################################################################
-    def query(self, query, mode='ARAX', origin='local'):
+    def query(self, query, mode='ARAX', origin='local', job_id=None):
 
         #### Create the skeleton of the response
         response = self.response
@@ -292,6 +262,10 @@ class ARAXQuery:
                        f"arax_version={self.rtxConfig.arax_version}, "
                        f"trapi_version={self.rtxConfig.trapi_version}")
 
+        #### Keep an untouched copy of an asynchronous query to hand off to the async query worker pool
+        if mode == 'asynchronous' and origin == 'API':
+            self.async_input_query = copy.deepcopy(query)
+
         #### Create an empty envelope
         messenger = ARAXMessenger()
         messenger.create_envelope(response)
@@ -321,8 +295,7 @@ class ARAXQuery:
             else:
                 response.envelope.submitter = '?'
 
-        #### Create an entry to track this query
-        job_id = None
+        #### Create an entry to track this query (async workers pick up the job_id the API already created)
         if origin == 'API':
             query_tracker = ARAXQueryTracker()
             if 'remote_address' in query and query['remote_address'] is not None:
@@ -395,7 +368,7 @@ class ARAXQuery:
             #### If we have operations, execute them
             if "have_operations" in query_attributes:
                 response.info(f"Found input processing plan. Sending to the ProcessingPlanExecutor")
-                result = self.execute_processing_plan(query, mode=mode)
+                result = self.execute_processing_plan(query, mode=mode, origin=origin)
 
             #### This used to support canned queries, but no longer does
             else:
@@ -518,7 +491,7 @@ class ARAXQuery:
 
     ############################################################################################
     #### Given an input query with a processing plan, execute that processing plan on the input
-    def execute_processing_plan(self,input_operations_dict, mode='ARAX'):
+    def execute_processing_plan(self,input_operations_dict, mode='ARAX', origin='local'):
 
         response = self.response
         response.debug(f"Entering execute_processing_plan")
@@ -537,7 +510,10 @@ class ARAXQuery:
 
         #### Connect to the message store just once, even if we won't use it
         response.debug(f"Connecting to ResponseCache")
-        response_cache = ResponseCache()  #  also calls connect
+        if self.response_cache is not None:
+            response_cache = self.response_cache
+        else:
+            response_cache = ResponseCache()  #  also calls connect
 
         #### Create a messenger object for basic message processing
         response.debug(f"Creating ARAXMessenger instance")
@@ -692,36 +668,41 @@ class ARAXQuery:
                 message.results = []
 
 
-            #### If the mode is asynchronous, then fork here. The parent returns the response thus far that everything checks out and is proceeding
-            #### and the child continues to work on the query, eventually to finish and exit()
+            #### If the mode is asynchronous, then hand the query off to the async query worker pool here. The API process returns
+            #### the response thus far that everything checks out and is proceeding, and a worker re-runs the query to completion
             if mode == 'asynchronous':
                 callback = input_operations_dict['callback']
                 if callback.startswith('http://localhost'):
                     response.error(f"ERROR: A callback to localhost ({callback}) does not work. Please specify a resolvable callback URL")
                     return response
 
-                response.info(f"Everything seems in order to begin processing the query asynchronously. Processing will continue and Response will be posted to {callback}")
-                newpid = os.fork()
-                #### The parent returns to tell the caller that work will proceed
-                if newpid > 0:
+                if origin != 'async_worker':
+                    response.info(f"Everything seems in order to begin processing the query asynchronously. Processing will continue and Response will be posted to {callback}")
+                    attributes = {
+                        'status': 'Running Async',
+                        'message_id': None,
+                        'message_code': 'Queued',
+                        'code_description': 'Query queued for an /asyncquery worker'
+                    }
+                    ARAXQueryTracker().update_tracker_entry(response.job_id, attributes)
+                    if not get_async_query_pool().submit(self.async_input_query, response.job_id):
+                        response.error(f"Query could not be queued because too many asynchronous queries are already waiting. Please try again later",
+                                       error_code="OverLimit", http_status=429)
+                        return response
                     response.envelope.status = 'Running'
                     response.envelope.description = 'Asynchronous answering of query underway'
                     return response
-                #### The child continues
-                #### The child loses the MySQL connection of the parent, so need to reconnect
-                time.sleep(1)
-                response_cache.connect()
-                time.sleep(1)
-
-                child_pid = os.getpid()
-                response.debug(f"Child continues running. Child PID is {child_pid}. Record with alter_tracker_entry()")
+
+                #### Otherwise we are already in a worker, so record which process is doing the work and carry on
+                worker_pid = os.getpid()
                 attributes = {
-                    'pid': child_pid,
-                    'code_description': 'Query executing via /asyncquery (child)'
+                    'pid': worker_pid,
+                    'message_code': 'Running',
+                    'code_description': 'Query executing via /asyncquery (worker)'
                 }
-                query_tracker = ARAXQueryTracker()
-                alter_result = query_tracker.alter_tracker_entry(self.response.job_id, attributes)
-                response.debug(f"Child PID {child_pid} recorded with result {alter_result}")
+                query_tracker = self.query_tracker if self.query_tracker is not None else ARAXQueryTracker()
+                alter_result = query_tracker.alter_tracker_entry(response.job_id, attributes)
+                response.debug(f"Async worker PID {worker_pid} recorded with result {alter_result}")
 
 
             #### If there is already a KG with edges, recompute the qg_keys
@@ -970,7 +951,8 @@ class ARAXQuery:
         while send_attempts < 3 and not post_succeeded:
             response.info(f"Attempting to send (with timeout {timeout}) the Response to callback URL: {callback}")
             try:
-                post_response_content = requests.post(callback, json=envelope_dict, headers={'accept': 'application/json'}, timeout=timeout)
+                http_client = self.callback_session if self.callback_session is not None else requests
+                post_response_content = http_client.post(callback, json=envelope_dict, headers={'accept': 'application/json'}, timeout=timeout)
                 status_code = post_response_content.status_code
                 if status_code in [ 200, 201 ]:
                     response.info(f"POST to callback URL succeeded with status code {status_code}")
@@ -993,8 +975,8 @@ class ARAXQuery:
         if not post_succeeded:
             response.error(f"Did not received a positive acknowledgement from sending the Response to callback URL {callback} after {send_attempts} tries. Work may be lost", error_code="UnreachableCallback")
 
+        self.callback_sent = True
         self.track_query_finish()
-        os._exit(0)
 
 
     ############################################################################################
@@ -577,6 +577,15 @@ class ARAXQueryTracker:
         if authorization is None or str(authorization) != reference_authorization:
             return { 'status': 'ERROR', 'description': 'Invalid authorization provided' }
 
+        #### /asyncquery workers are shared by many jobs, so cancel the job through the pool (which replaces the worker) rather than killing the worker
+        from ARAX_async_query_pool import get_started_async_query_pool
+        async_query_pool = get_started_async_query_pool()
+        if async_query_pool is not None and async_query_pool.is_worker(int(terminate_pid)):
+            job_id = async_query_pool.cancel_job_on_worker(int(terminate_pid))
+            if job_id is None:
+                return { 'status': 'ERROR', 'description': f"Async query worker {terminate_pid} is not running a job" }
+            return { 'status': 'OK', 'description': f"Job {job_id} on async query worker {terminate_pid} terminated" }
+
         try:
             os.kill(terminate_pid, signal.SIGTERM)
         except:
@@ -3,13 +3,14 @@ import math
 import os
 import networkx as nx
 import numpy as np
+import scipy.special
 import scipy.stats
 import sys
 import json
 import ast
-import re
+from collections import defaultdict
 
-from typing import Set, Union, Dict, List, Callable
+from typing import Set, Union, Dict, List, Tuple, Callable, NamedTuple, Optional
 from ARAX_response import ARAXResponse
 from query_graph_info import QueryGraphInfo
 
@@ -19,6 +20,8 @@ from openapi_server.models.result import Result
 from openapi_server.models.edge import Edge
 from openapi_server.models.attribute import Attribute
 
+MAX_QNODES_FOR_CUT_ENUMERATION = 12  # Beyond this, max flows are computed with networkx instead (2^n cuts gets big)
+
 
 def _get_nx_edges_by_attr(G: Union[nx.MultiDiGraph, nx.MultiGraph], key: str, val: str) -> Set[tuple]:
     res_set = set()
@@ -37,53 +40,46 @@ def _get_query_graph_networkx_from_query_graph(query_graph: QueryGraph) -> nx.Mu
     return query_graph_nx
 
 
-def _get_weighted_graph_networkx_from_result_graph(kg_edge_id_to_edge: Dict[str, Edge],
-                                                   qg_nx: Union[nx.MultiDiGraph, nx.MultiGraph],
-                                                   result: Result) -> Union[nx.MultiDiGraph,
-                                                                            nx.MultiGraph]:
-    res_graph = qg_nx.copy()
-    qg_edge_tuples = tuple(qg_nx.edges(keys=True, data=True))
-    qg_edge_key_to_edge_tuple = {edge_tuple[2]: edge_tuple for edge_tuple in qg_edge_tuples}
-    for analysis in result.analyses:  # For now we only ever have one Analysis per Result
-        for key, edge_binding_list in analysis.edge_bindings.items():
-            for edge_binding in edge_binding_list:
-                kg_edge = kg_edge_id_to_edge[edge_binding.id]
-                kg_edge_conf = kg_edge.confidence
-                #kg_edge_conf = kg_edge_attributes["confidence"]
-                qedge_keys = kg_edge.qedge_keys
-                for qedge_key in qedge_keys:
-                    qedge_tuple = qg_edge_key_to_edge_tuple[qedge_key]
-                    res_graph[qedge_tuple[0]][qedge_tuple[1]][qedge_key]['weight'] += kg_edge_conf
-    return res_graph
-
-
-def _get_weighted_graphs_networkx_from_result_graphs(kg_edge_id_to_edge: Dict[str, Edge],
-                                                     qg_nx: Union[nx.MultiDiGraph, nx.MultiGraph],
-                                                     results: List[Result]) -> List[Union[nx.MultiDiGraph,
-                                                                                          nx.MultiGraph]]:
-    res_list = []
-    for result in results:
-        res_list.append(_get_weighted_graph_networkx_from_result_graph(kg_edge_id_to_edge,
-                                                                       qg_nx,
-                                                                       result))
-    return res_list
-
-
-# credit: StackOverflow:15590812
-def _collapse_nx_multigraph_to_weighted_graph(graph_nx: Union[nx.MultiDiGraph,
-                                                              nx.MultiGraph]) -> Union[nx.DiGraph,
-                                                                                       nx.Graph]:
-    if type(graph_nx) == nx.MultiGraph:
-        ret_graph = nx.Graph()
-    elif type(graph_nx) == nx.MultiDiGraph:
-        ret_graph = nx.DiGraph()
-    for u, v, data in graph_nx.edges(data=True):
-        w = data['weight'] if 'weight' in data else 1.0
-        if ret_graph.has_edge(u, v):
-            ret_graph[u][v]['weight'] += w
-        else:
-            ret_graph.add_edge(u, v, weight=w)
-    return ret_graph
+def _get_weighted_adjacency_matrices(kg_edge_id_to_edge: Dict[str, Edge],
+                                     query_graph: QueryGraph,
+                                     results: List[Result]) -> np.ndarray:
+    """
+    Returns a stacked (n_results, n_qnodes, n_qnodes) array holding each result's weighted adjacency matrix: entry
+    [r, i, j] is the summed confidence of the result's KG edges fulfilling qedges from qnode i to qnode j. Since every
+    result shares the shape of the query graph, one array covers them all.
+    """
+    qnode_indexes = {qnode_key: index for index, qnode_key in enumerate(query_graph.nodes)}
+    qedge_index_pairs = {qedge_key: (qnode_indexes[qedge.subject], qnode_indexes[qedge.object])
+                         for qedge_key, qedge in query_graph.edges.items()}
+    result_indexes, subject_indexes, object_indexes, weights = [], [], [], []
+    for result_index, result in enumerate(results):
+        for analysis in result.analyses:  # For now we only ever have one Analysis per Result
+            for edge_binding_list in analysis.edge_bindings.values():
+                for edge_binding in edge_binding_list:
+                    kg_edge = kg_edge_id_to_edge[edge_binding.id]
+                    for qedge_key in kg_edge.qedge_keys:
+                        subject_index, object_index = qedge_index_pairs[qedge_key]
+                        result_indexes.append(result_index)
+                        subject_indexes.append(subject_index)
+                        object_indexes.append(object_index)
+                        weights.append(kg_edge.confidence)
+    adjacency_matrices = np.zeros((len(results), len(qnode_indexes), len(qnode_indexes)))
+    np.add.at(adjacency_matrices, (result_indexes, subject_indexes, object_indexes), np.array(weights, dtype=float))
+    return adjacency_matrices
+
+
+def _get_qnode_index_pairs_with_max_path_len(query_graph_nx: nx.MultiDiGraph) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    Returns the longest shortest-path length in the (directed) query graph and the qnode index pairs at that
+    distance. Result graphs all share the query graph's shape, so this only needs to be worked out once.
+    """
+    qnode_indexes = {qnode_key: index for index, qnode_key in enumerate(query_graph_nx.nodes)}
+    apsp_dict = dict(nx.algorithms.shortest_paths.unweighted.all_pairs_shortest_path_length(query_graph_nx))
+    path_len_with_pairs_list = [(node_i, node_j, path_len) for node_i, node_i_dict in apsp_dict.items() for node_j, path_len in node_i_dict.items()]
+    max_path_len = max(path_len for _, _, path_len in path_len_with_pairs_list)
+    pairs_with_max_path_len = [(qnode_indexes[node_i], qnode_indexes[node_j])
+                               for node_i, node_j, path_len in path_len_with_pairs_list if path_len == max_path_len]
+    return max_path_len, pairs_with_max_path_len
 
 
 # computes quantile ranks in *ascending* order (so a higher x entry has a higher
@@ -94,72 +90,232 @@ def _quantile_rank_list(x: List[float]) -> np.array:
     return y/len(y)
 
 
-def _score_networkx_graphs_by_max_flow(result_graphs_nx: List[Union[nx.MultiDiGraph,
-                                                                    nx.MultiGraph]]) -> List[float]:
+def _score_adjacency_matrices_by_max_flow(adjacency_matrices: np.ndarray, max_path_len: int,
+                                          pairs_with_max_path_len: List[Tuple[int, int]]) -> np.ndarray:
+    """
+    Scores each result by the mean max flow between the qnode pairs that are furthest apart. By the max-flow min-cut
+    theorem, the max flow from s to t is the smallest total capacity crossing any cut separating s from t; query
+    graphs are small enough that every cut can be enumerated and evaluated for all results at once.
+    """
+    num_results, num_qnodes, _ = adjacency_matrices.shape
+    if num_qnodes <= 1:
+        return np.ones(num_results)
+    pairs = [(source_index, target_index) for source_index, target_index in pairs_with_max_path_len
+             if source_index != target_index]
+    if not pairs:
+        return np.zeros(num_results)
+    if num_qnodes > MAX_QNODES_FOR_CUT_ENUMERATION:
+        return _score_adjacency_matrices_by_max_flow_networkx(adjacency_matrices, pairs)
+    # Row m of cut_sides says which side of cut m each qnode is on (1 = the source's side)
+    cut_sides = ((np.arange(2 ** num_qnodes)[:, np.newaxis] >> np.arange(num_qnodes)) & 1).astype(float)
+    cut_capacities = np.einsum("mi,rij,mj->rm", cut_sides, adjacency_matrices, 1 - cut_sides, optimize=True)
+    max_flows = [cut_capacities[:, (cut_sides[:, source_index] == 1) & (cut_sides[:, target_index] == 0)].min(axis=1)
+                 for source_index, target_index in pairs]
+    return np.mean(max_flows, axis=0)
+
+
+def _score_adjacency_matrices_by_max_flow_networkx(adjacency_matrices: np.ndarray,
+                                                   pairs: List[Tuple[int, int]]) -> np.ndarray:
     max_flow_values = []
-    for result_graph_nx in result_graphs_nx:
-        if len(result_graph_nx) > 1:
-            apsp_dict = dict(nx.algorithms.shortest_paths.unweighted.all_pairs_shortest_path_length(result_graph_nx))
-            path_len_with_pairs_list = [(node_i, node_j, path_len) for node_i, node_i_dict in apsp_dict.items() for node_j, path_len in node_i_dict.items()]
-            max_path_len = max([path_len_with_pair_list_item[2] for path_len_with_pair_list_item in
-                                path_len_with_pairs_list])
-            pairs_with_max_path_len = [path_len_with_pair_list_item[0:2] for path_len_with_pair_list_item in path_len_with_pairs_list if
-                                       path_len_with_pair_list_item[2] == max_path_len]
-            max_flow_values_for_node_pairs = []
-            result_graph_collapsed_nx = _collapse_nx_multigraph_to_weighted_graph(result_graph_nx)
-            for source_node_id, target_node_id in pairs_with_max_path_len:
-                max_flow_values_for_node_pairs.append(nx.algorithms.flow.maximum_flow_value(result_graph_collapsed_nx,
-                                                                                            source_node_id,
-                                                                                            target_node_id,
-                                                                                            capacity="weight"))
-            max_flow_value = 0.0
-            if len(max_flow_values_for_node_pairs) > 0:
-                max_flow_value = sum(max_flow_values_for_node_pairs)/float(len(max_flow_values_for_node_pairs))
-        else:
-            max_flow_value = 1.0
-        max_flow_values.append(max_flow_value)
-    return max_flow_values
-
-
-def _score_networkx_graphs_by_longest_path(result_graphs_nx: List[Union[nx.MultiDiGraph,
-                                                                        nx.MultiGraph]]) -> List[float]:
-    result_scores = []
-    for result_graph_nx in result_graphs_nx:
-        apsp_dict = dict(nx.algorithms.shortest_paths.unweighted.all_pairs_shortest_path_length(result_graph_nx))
-        path_len_with_pairs_list = [(node_i, node_j, path_len) for node_i, node_i_dict in apsp_dict.items() for node_j, path_len in node_i_dict.items()]
-        max_path_len = max([path_len_with_pair_list_item[2] for path_len_with_pair_list_item in
-                            path_len_with_pairs_list])
-        pairs_with_max_path_len = [path_len_with_pair_list_item[0:2] for path_len_with_pair_list_item in path_len_with_pairs_list if
-                                   path_len_with_pair_list_item[2] == max_path_len]
-        map_node_name_to_index = {node_id: node_index for node_index, node_id in enumerate(result_graph_nx.nodes)}
-        adj_matrix = nx.to_numpy_matrix(result_graph_nx)
-        adj_matrix_power = np.linalg.matrix_power(adj_matrix, max_path_len)/math.factorial(max_path_len)
-        score_list = [adj_matrix_power[map_node_name_to_index[node_i],
-                                       map_node_name_to_index[node_j]] for node_i, node_j in pairs_with_max_path_len]
-        result_score = np.mean(score_list)
-        result_scores.append(result_score)
-    return result_scores
-
-
-def _score_networkx_graphs_by_frobenius_norm(result_graphs_nx: List[Union[nx.MultiDiGraph,
-                                                                          nx.MultiGraph]]) -> List[float]:
-    result_scores = []
-    for result_graph_nx in result_graphs_nx:
-        adj_matrix = nx.to_numpy_matrix(result_graph_nx)
-        result_score = np.linalg.norm(adj_matrix, ord='fro')
-        result_scores.append(result_score)
-    return result_scores
-
-
-def _score_result_graphs_by_networkx_graph_scorer(kg_edge_id_to_edge: Dict[str, Edge],
-                                                  qg_nx: Union[nx.MultiDiGraph, nx.MultiGraph],
-                                                  results: List[Result],
-                                                  nx_graph_scorer: Callable[[List[Union[nx.MultiDiGraph,
-                                                                                        nx.MultiGraph]]], np.array]) -> List[float]:
-    result_graphs_nx = _get_weighted_graphs_networkx_from_result_graphs(kg_edge_id_to_edge,
-                                                                        qg_nx,
-                                                                        results)
-    return nx_graph_scorer(result_graphs_nx)
+    for adjacency_matrix in adjacency_matrices:
+        graph_nx = nx.from_numpy_array(adjacency_matrix, create_using=nx.DiGraph)
+        max_flow_values.append(np.mean([nx.algorithms.flow.maximum_flow_value(graph_nx, source_index, target_index,
+                                                                               capacity="weight")
+                                        for source_index, target_index in pairs]))
+    return np.array(max_flow_values)
+
+
+def _score_adjacency_matrices_by_longest_path(adjacency_matrices: np.ndarray, max_path_len: int,
+                                              pairs_with_max_path_len: List[Tuple[int, int]]) -> np.ndarray:
+    adjacency_matrix_powers = np.linalg.matrix_power(adjacency_matrices, max_path_len) / math.factorial(max_path_len)
+    source_indexes, target_indexes = zip(*pairs_with_max_path_len)
+    return adjacency_matrix_powers[:, list(source_indexes), list(target_indexes)].mean(axis=1)
+
+
+def _score_adjacency_matrices_by_frobenius_norm(adjacency_matrices: np.ndarray, max_path_len: int,
+                                                pairs_with_max_path_len: List[Tuple[int, int]]) -> np.ndarray:
+    return np.linalg.norm(adjacency_matrices, ord='fro', axis=(1, 2))
+
+
+class EdgeAttributeNormalizer(NamedTuple):
+    normalize: Callable[[np.ndarray, Optional[dict]], np.ndarray]  # Takes an attribute's values and its score stats
+    trust: float  # How much we trust this edge attribute (recorded for future weighting; not applied to scores yet)
+
+
+# Maps each edge attribute we know how to score to its (vectorized) normalizer; add new ones with the decorator below
+EDGE_ATTRIBUTE_NORMALIZERS: Dict[str, EdgeAttributeNormalizer] = dict()
+
+
+def register_edge_attribute_normalizer(*attribute_names: str, trust: float):
+    """
+    Registers the decorated function as the normalizer for the given edge attribute names. A normalizer takes an
+    array of attribute values (plus the min/max stats of that attribute across the KG) and translates them into
+    values in the interval [0,1] where 0 is worse and 1 is better.
+    """
+    def register(normalizer_func: Callable[[np.ndarray, Optional[dict]], np.ndarray]):
+        for attribute_name in attribute_names:
+            EDGE_ATTRIBUTE_NORMALIZERS[attribute_name] = EdgeAttributeNormalizer(normalizer_func, trust)
+        return normalizer_func
+    return register
+
+
+def _logistic(values: np.ndarray, max_value: float, curve_steepness: float, logistic_midpoint: float) -> np.ndarray:
+    # (expit(x) is 1 / (1 + exp(-x)), minus the overflow for large negative x)
+    return max_value * scipy.special.expit(curve_steepness * (values - logistic_midpoint))
+
+
+def _log(values: np.ndarray) -> np.ndarray:
+    """np.log(), except that zeros give -inf (and negative values NaN) without raising numpy warnings"""
+    return np.log(values, out=np.where(values == 0, -np.inf, np.nan), where=values > 0)
+
+
+@register_edge_attribute_normalizer('probability_treats', trust=1.0)
+def _normalize_probability_treats(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    """
+    Normalize the probability drug treats disease value.
+    Empirically we've found that values greater than ~0.75 are "good" and <~0.75 are "bad" predictions of "treats"
+    We will hence throw this in a logistic function so that higher scores remain high, and low scores drop off
+    pretty quickly.
+    To see this curve in Mathematica:
+    L = 1;  (*max value returned*)
+    k = 15;  (*steepness of the logistic curve*)
+    x0 = 0.60;  (*mid point of the logistic curve*)
+    Plot[L/(1 + Exp[-k (x - x0)]), {x, 0, 1}, PlotRange -> All, AxesOrigin -> {0, 0}]
+    or
+    import matplotlib.pyplot as plt
+    x = np.linspace(0,1,200)
+    plt.plot(x, _logistic(x, max_value=1, curve_steepness=15, logistic_midpoint=0.60))
+    plt.show()
+    """
+    # TODO: if "near" to the min value, set to zero (maybe one std dev from the min value of the logistic curve?)
+    # TODO: make sure max value can be obtained
+    return _logistic(values, max_value=1, curve_steepness=15, logistic_midpoint=0.60)
+
+
+@register_edge_attribute_normalizer('normalized_google_distance', trust=0.8)
+def _normalize_normalized_google_distance(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    """
+    Normalize the "normalized_google_distance
+    """
+    return _logistic(values, max_value=1, curve_steepness=-9, logistic_midpoint=0.60)
+
+
+@register_edge_attribute_normalizer('probability', trust=0.5)
+def _normalize_probability(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    """
+    These (as of 7/28/2020 in KG1 and KG2 only "drug->protein binding probabilities"
+    As Vlado suggested, the lower ones are more rubbish, so again throw into a logistic function, but even steeper.
+    see _normalize_probability_treats for how to visualize this
+    """
+    return _logistic(values, max_value=1, curve_steepness=20, logistic_midpoint=0.8)
+
+
+@register_edge_attribute_normalizer('jaccard_index', trust=0.5)
+def _normalize_jaccard_index(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    """
+    The jaccard index is all relative to other results, so there is no reason to use a logistic here.
+    Just compare the value to the maximum value
+    """
+    if not stats or stats['maximum'] is None or stats['maximum'] <= 0:  # No positive jaccard values in the KG
+        return np.zeros(len(values))
+    return values / stats['maximum']
+
+
+@register_edge_attribute_normalizer('paired_concept_frequency', trust=0.5)
+def _normalize_paired_concept_frequency(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    """
+    Again, these are _somewhat_ relative values. In actuality, a logistic here would make sense,
+    but I don't know the distribution of frequencies in COHD, so just go the relative route
+    """
+    # Give logistic a try
+    # TODO: see if we can adjust these params based on the scores stats (or see if that's even a good idea)
+    # curve_steepness is really steep since the max values I've ever seen are quite small (eg .03), and
+    # logistic_midpoint seems like an ok mid point, but....
+    return _logistic(values, max_value=1, curve_steepness=2000, logistic_midpoint=0.002)
+
+
+@register_edge_attribute_normalizer('observed_expected_ratio', trust=0.8)
+def _normalize_observed_expected_ratio(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    """
+    These are log ratios so should be interpreted as Exp[value] times more likely than chance
+    """
+    # Todo: need to fiddle with curve_steepness as it's not quite weighting things enough
+    # logistic_midpoint: Exp[2] more likely than chance
+    return _logistic(values, max_value=1, curve_steepness=2, logistic_midpoint=2)
+
+
+@register_edge_attribute_normalizer('chi_square', 'chi_square_pvalue', trust=0.8)
+def _normalize_chi_square(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    """
+    From COHD: Note that due to large sample sizes, the chi-square can become very large.
+    Hence the p-values will be very, very small... Hard to use logistic function, so instead, take the
+    -log(p_value) approach and use that (taking a page from the geneticist's handbook)
+    """
+    return _logistic(-_log(values), max_value=1, curve_steepness=0.03, logistic_midpoint=200)
+
+
+@register_edge_attribute_normalizer('MAGMA-pvalue', 'pValue', trust=1.0)
+def _normalize_MAGMA_pvalue(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    """
+    For Genetics Provider MAGMA p-value: Convert provided p-value to a number between 0 and 1
+    with 1 being best. Estimated conversion from SAR and DMK 2020-09-22
+    """
+    return _logistic(-_log(values), max_value=1.0, curve_steepness=0.849, logistic_midpoint=4.97)
+
+
+@register_edge_attribute_normalizer('Genetics-quantile', trust=1.0)
+def _normalize_Genetics_quantile(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    """
+    For Genetics Provider MAGMA quantile: We decide 2020-09-22 that just using
+    the quantile as-is is best. With DMK, SAR, EWD.
+    """
+    return values
+
+
+@register_edge_attribute_normalizer('fisher_exact_test_p-value', trust=0.8)
+def _normalize_fisher_exact_test_p_value(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    """
+    For FET p-values: Including two options
+    The first option is to simply use 1-(p-value)
+    The second is a custom logorithmic. 0.05 should correspond to ~0.95 after the logistic is applied.
+    """
+    # option 1:
+    # return 1 - values
+
+    # option 2 (p-values of 0, or nearly so, are awarded the max value):
+    return np.where(values <= np.finfo(float).eps, 1.,
+                    _logistic(-_log(values), max_value=1.0, curve_steepness=3, logistic_midpoint=2.7))
+
+
+@register_edge_attribute_normalizer('CMAP similarity score', trust=1.0)
+def _normalize_CMAP_similarity_score(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    return np.abs(values / 100)
+
+
+@register_edge_attribute_normalizer('Richards-effector-genes', trust=0.5)
+def _normalize_Richards_effector_genes(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    return values
+
+
+@register_edge_attribute_normalizer('feature_coefficient', trust=1.0)
+def _normalize_feature_coefficient(values: np.ndarray, stats: Optional[dict]) -> np.ndarray:
+    return _logistic(_log(np.abs(values)), max_value=1, curve_steepness=2.75, logistic_midpoint=0.15)
+
+
+def _get_float_attribute_value(value) -> Optional[float]:
+    """Returns the given attribute value as a float, or None if it isn't a number"""
+    if value == "no value!":
+        return 0.
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_publication_counts(n_publications: np.ndarray) -> np.ndarray:
+    """Scores edges' publication counts into (0, 1] (edges with no publications get 0.01)"""
+    scores = _logistic(_log(n_publications), max_value=1.0, curve_steepness=3.16993, logistic_midpoint=1.38629)
+    return np.where(n_publications == 0, 0.01, scores)
 
 
 class ARAXRanker:
@@ -170,28 +326,11 @@ class ARAXRanker:
         self.message = None
         self.parameters = None
         # edge attributes we know about
-        self.known_attributes = {'probability', 'normalized_google_distance', 'jaccard_index',
-                                 'probability_treats', 'paired_concept_frequency',
-                                 'observed_expected_ratio', 'chi_square', 'chi_square_pvalue', 'MAGMA-pvalue', 'Genetics-quantile',
-                                 'pValue', 'fisher_exact_test_p-value','Richards-effector-genes',
-                                 'feature_coefficient', 'CMAP similarity score'}
+        # edge attributes we know about (see EDGE_ATTRIBUTE_NORMALIZERS)
+        self.known_attributes = set(EDGE_ATTRIBUTE_NORMALIZERS)
         # how much we trust each of the edge attributes
-        self.known_attributes_to_trust = {'probability': 0.5,
-                                          'normalized_google_distance': 0.8,
-                                          'jaccard_index': 0.5,
-                                          'probability_treats': 1,
-                                          'paired_concept_frequency': 0.5,
-                                          'observed_expected_ratio': 0.8,
-                                          'chi_square': 0.8,
-                                          'chi_square_pvalue': 0.8,
-                                          'MAGMA-pvalue': 1.0,
-                                          'Genetics-quantile': 1.0,
-                                          'pValue': 1.0,
-                                          'fisher_exact_test_p-value': 0.8,
-                                          'Richards-effector-genes': 0.5,
-                                          'feature_coefficient': 1.0,
-                                          'CMAP similarity score': 1.0
-                                          }
+        self.known_attributes_to_trust = {attribute_name: normalizer.trust
+                                          for attribute_name, normalizer in EDGE_ATTRIBUTE_NORMALIZERS.items()}
         self.virtual_edge_types = {}
         self.score_stats = dict()  # dictionary that stores that max's and min's of the edge attribute values
         self.kg_edge_id_to_edge = dict()  # map between the edge id's in the results and the actual edges themselves
@@ -248,273 +387,90 @@ and [frobenius norm](https://en.wikipedia.org/wiki/Matrix_norm#Frobenius_norm).
             #       then assign result confidence as average/median of these "single" edge confidences?
             result.confidence = 1
 
-    def edge_attribute_score_combiner(self, edge):
+    def compute_edge_confidences(self, knowledge_graph, response) -> Dict[str, float]:
         """
-        This function takes a single edge and decides how to combine its attribute scores into a single confidence
-        Eventually we will want
-        1. To weight different attributes by different amounts
-        2. Figure out what to do with edges that have no attributes
+        Normalizes and combines the attribute scores of each edge in the KG into a single confidence, which is stored
+        on the edge (edge.confidence). Returns the confidences by edge key.
         """
-        # Currently a dead simple "just multiply them all together"
-        edge_confidence = 1
-        edge_attribute_dict = {}
-        publications = []
-        if edge.attributes is not None:
+        # #### Make one pass through all the edges in the knowledge graph to:
+        # #### 1) Create a dict of all edges by id
+        # #### 2) Pull the values of every known edge attribute out into columns (along with the index of their edge)
+        # #### 3) Collect the values we need for min,max stats for edge_attributes
+        kg_edge_id_to_edge = self.kg_edge_id_to_edge
+        edge_items = list(knowledge_graph.edges.items())
+        attribute_columns = defaultdict(lambda: ([], []))
+        stats_values = defaultdict(list)
+        n_publications = np.zeros(len(edge_items))
+        preset_confidences = dict()
+        for edge_index, (edge_key, edge) in enumerate(edge_items):
+            kg_edge_id_to_edge[edge_key] = edge
+            if edge.attributes is None:
+                continue
+            publications = set()
+            preset_confidence = None
             for edge_attribute in edge.attributes:
-                if edge_attribute.original_attribute_name is not None:
-                    edge_attribute_dict[edge_attribute.original_attribute_name] = edge_attribute.value
-                    normalized_score = self.edge_attribute_score_normalizer(edge_attribute.original_attribute_name, edge_attribute.value)
-                else:
-                    edge_attribute_dict[edge_attribute.attribute_type_id] = edge_attribute.value
-                    normalized_score = self.edge_attribute_score_normalizer(edge_attribute.attribute_type_id, edge_attribute.value)
-                if edge_attribute.attribute_type_id == "biolink:publications":
-                    if isinstance(edge_attribute.value,str):
-                        publications = publications + [edge_attribute.value]
-                    elif isinstance(edge_attribute.value,list):
-                        publications = publications + edge_attribute.value
-                if normalized_score == -1:  # this means we have no current normalization of this kind of attribute,
-                    continue  # so don't do anything to the score since we don't know what to do with it yet
-                else:  # we have a way to normalize it, so multiply away
-                    edge_confidence *= normalized_score
-        n_publications = len(set(publications))
-        if n_publications == 0:
-            pub_value = 0.01
-        else:
-            pub_value = np.log(n_publications)
-            max_value = 1.0
-            curve_steepness = 3.16993
-            logistic_midpoint = 1.38629
-            pub_value = max_value / float(1 + np.exp(-curve_steepness * (pub_value - logistic_midpoint)))
-        edge_confidence *= pub_value
-        return edge_confidence
-
-    def edge_attribute_score_normalizer(self, edge_attribute_name: str, edge_attribute_value) -> float:
-        """
-        Takes an input edge attribute and value, dispatches it to the appropriate method that translates the value into
-        something in the interval [0,1] where 0 is worse and 1 is better
-        """
-        if edge_attribute_name not in self.known_attributes:
-            return -1  # TODO: might want to change this
-        else:
-            if edge_attribute_value == "no value!":
-                edge_attribute_value = 0
-            try:
-                # check to see if it's convertible to a float (will catch None's as well)
-                edge_attribute_value = float(edge_attribute_value)
-            except TypeError:
-                return 0.
-            except ValueError:
-                return 0.
-            # check to see if it's NaN, if so, return 0
-            if np.isnan(edge_attribute_value):
-                return 0.
-            # else it's all good to proceed
-            else:
-                # Fix hyphens or spaces to underscores in names
-                edge_attribute_name = re.sub(r'[- \:]','_',edge_attribute_name)
-                # then dispatch to the appropriate function that does the score normalizing to get it to be in [0, 1] with 1 better
-                return getattr(self, '_' + self.__class__.__name__ + '__normalize_' + edge_attribute_name)(value=edge_attribute_value)
+                original_attribute_name = edge_attribute.original_attribute_name
+                attribute_type_id = edge_attribute.attribute_type_id
+                if original_attribute_name in EDGE_ATTRIBUTE_NORMALIZERS or attribute_type_id in EDGE_ATTRIBUTE_NORMALIZERS:
+                    if edge_attribute.value == "no value!":
+                        edge_attribute.value = 0
+                    value = _get_float_attribute_value(edge_attribute.value)
+                    if value is not None:
+                        for attribute_name in {original_attribute_name, attribute_type_id}:
+                            if attribute_name in EDGE_ATTRIBUTE_NORMALIZERS:
+                                stats_values[attribute_name].append(value)
+                    scored_attribute_name = original_attribute_name if original_attribute_name is not None else attribute_type_id
+                    if scored_attribute_name in EDGE_ATTRIBUTE_NORMALIZERS:
+                        edge_indexes, values = attribute_columns[scored_attribute_name]
+                        edge_indexes.append(edge_index)
+                        values.append(value if value is not None else np.nan)
+                if original_attribute_name == "confidence":
+                    preset_confidence = edge_attribute.value
+                if attribute_type_id == "biolink:publications":
+                    if isinstance(edge_attribute.value, str):
+                        publications.add(edge_attribute.value)
+                    elif isinstance(edge_attribute.value, list):
+                        publications.update(edge_attribute.value)
+            n_publications[edge_index] = len(publications)
+            if preset_confidence is not None:
+                preset_confidences[edge_index] = preset_confidence
 
-    def __normalize_probability_treats(self, value):
-        """
-        Normalize the probability drug treats disease value.
-        Empirically we've found that values greater than ~0.75 are "good" and <~0.75 are "bad" predictions of "treats"
-        We will hence throw this in a logistic function so that higher scores remain high, and low scores drop off
-        pretty quickly.
-        To see this curve in Mathematica:
-        L = 1;  (*max value returned*)
-        k = 15;  (*steepness of the logistic curve*)
-        x0 = 0.60;  (*mid point of the logistic curve*)
-        Plot[L/(1 + Exp[-k (x - x0)]), {x, 0, 1}, PlotRange -> All, AxesOrigin -> {0, 0}]
-        or
-        import matplotlib.pyplot as plt
-        max_value = 1
-        curve_steepness = 15
-        logistic_midpoint = 0.60
-        x = np.linspace(0,1,200)
-        y = [max_value / float(1+np.exp(-curve_steepness*(value - logistic_midpoint))) for value in x]
-        plt.plot(x,y)
-        plt.show()
-        """
-        max_value = 1
-        curve_steepness = 15
-        logistic_midpoint = 0.60
-        normalized_value = max_value / float(1+np.exp(-curve_steepness*(value - logistic_midpoint)))
-        # TODO: if "near" to the min value, set to zero (maybe one std dev from the min value of the logistic curve?)
-        # TODO: make sure max value can be obtained
-        return normalized_value
-
-    def __normalize_normalized_google_distance(self, value):
-        """
-        Normalize the "normalized_google_distance
-        """
-        max_value = 1
-        curve_steepness = -9
-        logistic_midpoint = 0.60
-        normalized_value = max_value / float(1 + np.exp(-curve_steepness * (value - logistic_midpoint)))
-        # TODO: if "near" to the min value, set to zero (maybe one std dev from the min value of the logistic curve?)
-        # TODO: make sure max value can be obtained
-        return normalized_value
-
-    def __normalize_probability(self, value):
-        """
-        These (as of 7/28/2020 in KG1 and KG2 only "drug->protein binding probabilities"
-        As Vlado suggested, the lower ones are more rubbish, so again throw into a logistic function, but even steeper.
-        see __normalize_probability_treats for how to visualize this
-        """
-        max_value = 1
-        curve_steepness = 20
-        logistic_midpoint = 0.8
-        normalized_value = max_value / float(1 + np.exp(-curve_steepness * (value - logistic_midpoint)))
-        # TODO: if "near" to the min value, set to zero (maybe one std dev from the min value of the logistic curve?)
-        # TODO: make sure max value can be obtained
-        return normalized_value
-
-    def __normalize_jaccard_index(self, value):
-        """
-        The jaccard index is all relative to other results, so there is no reason to use a logistic here.
-        Just compare the value to the maximum value
-        """
-        normalized_value = value / self.score_stats['jaccard_index']['maximum']
-        # print(f"value: {value}, normalized: {normalized_value}")
-        return normalized_value
-
-    def __normalize_paired_concept_frequency(self, value):
-        """
-        Again, these are _somewhat_ relative values. In actuality, a logistic here would make sense,
-        but I don't know the distribution of frequencies in COHD, so just go the relative route
-        """
-        # check to make sure we don't divide by zero
-        # try:
-        #    normalized_value = value / score_stats['paired_concept_frequency']['maximum']
-        # except ZeroDivisionError:
-        #    normalized_value = value / (score_stats['paired_concept_frequency']['maximum'] + np.finfo(float).eps)
-
-        # Give logistic a try
-        # TODO: see if we can adjust these params based on the scores stats (or see if that's even a good idea)
-        max_value = 1
-        curve_steepness = 2000  # really steep since the max values I've ever seen are quite small (eg .03)
-        logistic_midpoint = 0.002  # seems like an ok mid point, but....
-        normalized_value = max_value / float(1 + np.exp(-curve_steepness * (value - logistic_midpoint)))
-        # TODO: if "near" to the min value, set to zero (maybe one std dev from the min value of the logistic curve?)
-        # TODO: make sure max value can be obtained
-        # print(f"value: {value}, normalized: {normalized_value}")
-        return normalized_value
-
-    def __normalize_observed_expected_ratio(self, value):
-        """
-        These are log ratios so should be interpreted as Exp[value] times more likely than chance
-        """
-        max_value = 1
-        curve_steepness = 2  # Todo: need to fiddle with this as it's not quite weighting things enough
-        logistic_midpoint = 2  # Exp[2] more likely than chance
-        normalized_value = max_value / float(1 + np.exp(-curve_steepness * (value - logistic_midpoint)))
-        # TODO: if "near" to the min value, set to zero (maybe one std dev from the min value of the logistic curve?)
-        # TODO: make sure max value can be obtained
-        # print(f"value: {value}, normalized: {normalized_value}")
-        return normalized_value
-
-
-    def __normalize_chi_square(self, value):
-        """
-        From COHD: Note that due to large sample sizes, the chi-square can become very large.
-        Hence the p-values will be very, very small... Hard to use logistic function, so instead, take the
-        -log(p_value) approach and use that (taking a page from the geneticist's handbook)
-        """
-        # Taking value as is:
-        # max_value = 1
-        # curve_steepness = -100
-        # logistic_midpoint = 0.05
-        # normalized_value = max_value / float(1 + np.exp(-curve_steepness * (value - logistic_midpoint)))
-
-        # -Log[p_value] approach
-        value = -np.log(value)
-        max_value = 1
-        curve_steepness = 0.03
-        logistic_midpoint = 200
-        normalized_value = max_value / float(1 + np.exp(-curve_steepness * (value - logistic_midpoint)))
-        # TODO: if "near" to the min value, set to zero (maybe one std dev from the min value of the logistic curve?)
-        # TODO: make sure max value can be obtained
-        # print(f"value: {value}, normalized: {normalized_value}")
-        return normalized_value
-
-    def __normalize_chi_square_pvalue(self, value):
-        return self.__normalize_chi_square(value)
-
-    def __normalize_MAGMA_pvalue(self, value):
-        """
-        For Genetics Provider MAGMA p-value: Convert provided p-value to a number between 0 and 1
-        with 1 being best. Estimated conversion from SAR and DMK 2020-09-22
-        """
-
-        value = -np.log(value)
-        max_value = 1.0
-        curve_steepness = 0.849
-        logistic_midpoint = 4.97
-        normalized_value = max_value / float(1 + np.exp(-curve_steepness * (value - logistic_midpoint)))
-        return normalized_value
-
-    def __normalize_pValue(self, value):
-        """
-        For Genetics Provider MAGMA p-value: Convert provided p-value to a number between 0 and 1
-        with 1 being best. Estimated conversion from SAR and DMK 2020-09-22
-        """
-
-        value = -np.log(value)
-        max_value = 1.0
-        curve_steepness = 0.849
-        logistic_midpoint = 4.97
-        normalized_value = max_value / float(1 + np.exp(-curve_steepness * (value - logistic_midpoint)))
-        return normalized_value
-
-
-    def __normalize_Genetics_quantile(self, value):
-        """
-        For Genetics Provider MAGMA quantile: We decide 2020-09-22 that just using
-        the quantile as-is is best. With DMK, SAR, EWD.
-        """
-
-        return value
-
-    def __normalize_fisher_exact_test_p_value(self, value):
-        """
-        For FET p-values: Including two options
-        The first option is to simply use 1-(p-value)
-        The second is a custom logorithmic. 0.05 should correspond to ~0.95 after the logistic is applied.
-        """
-
-        # option 1:
-        # normalized_value = 1-value
-
-        # option 2:
-        try:
-            if value <= np.finfo(float).eps:
-                normalized_value = 1.
+        score_stats = self.score_stats
+        no_non_inf_float_flag = True
+        for attribute_name, values in stats_values.items():
+            values = np.array(values, dtype=float)
+            finite_values = values[np.isfinite(values)]  # Ignore inf, -inf, and nan
+            if len(finite_values):
+                no_non_inf_float_flag = False
+                score_stats[attribute_name] = {'minimum': float(finite_values.min()),
+                                               'maximum': float(finite_values.max())}
             else:
-                value = -np.log(value)
-                max_value = 1.0
-                curve_steepness = 3
-                logistic_midpoint = 2.7
-                normalized_value = max_value / float(1 + np.exp(-curve_steepness * (value - logistic_midpoint)))
-        except RuntimeWarning:  # this is the case when value is 0 (or nearly so), so should award the max value
-            normalized_value = 1.
-
-        return normalized_value
-
-    def __normalize_CMAP_similarity_score(self, value):
-        normalized_value = abs(value/100)
-        return normalized_value
-
-    def __normalize_Richards_effector_genes(self, value):
-        return value
-
-    def __normalize_feature_coefficient(self, value):
-        log_abs_value = np.log(abs(value))
-        max_value = 1
-        curve_steepness = 2.75
-        logistic_midpoint = 0.15
-        normalized_value = max_value / float(1+np.exp(-curve_steepness*(log_abs_value - logistic_midpoint)))
-        return normalized_value
+                score_stats[attribute_name] = {'minimum': None, 'maximum': None}  # FIXME: doesn't handle the case when all values are inf|NaN
+        if no_non_inf_float_flag:
+            response.warning(
+                        f"No non-infinite value was encountered in any edge attribute in the knowledge graph.")
+        response.info(f"Summary of available edge metrics: {score_stats}")
+
+        # Normalize each attribute column and multiply the normalized scores into the confidences of their edges
+        # (along with a score for the number of publications), then store the confidences on the edges
+        # NOTE: Each normalizer's trust level is intentionally not applied here (e.g., as score ** trust): the ranker
+        # has never weighted attributes by trust, and doing so would change result rankings, so it's deferred to the
+        # attribute weighting rework in aggregate_scores_dmk's FIXME
+        confidences = np.ones(len(edge_items))
+        for attribute_name, (edge_indexes, values) in attribute_columns.items():
+            values = np.array(values, dtype=float)
+            normalized_values = EDGE_ATTRIBUTE_NORMALIZERS[attribute_name].normalize(values, score_stats.get(attribute_name))
+            # Attribute values that aren't numbers (or that are out of the normalizer's domain) get a score of 0
+            normalized_values[~np.isfinite(normalized_values)] = 0.
+            np.multiply.at(confidences, np.array(edge_indexes, dtype=int), normalized_values)
+        confidences *= normalize_publication_counts(n_publications)
+        for (edge_key, edge), confidence in zip(edge_items, confidences.tolist()):
+            edge.confidence = confidence
+        # don't touch preset confidences, since apparently someone already knows what the confidence should be
+        for edge_index, preset_confidence in preset_confidences.items():
+            edge_items[edge_index][1].confidence = preset_confidence
+
+        return {edge_key: edge.confidence for edge_key, edge in edge_items}
 
     def aggregate_scores_dmk(self, response):
         """
@@ -538,69 +494,13 @@ and [frobenius norm](https://en.wikipedia.org/wiki/Matrix_norm#Frobenius_norm).
         #     return response
 
         # DMK FIXME: This need to be refactored so that:
-        #    1. The attribute names are dynamically mapped to functions that handle their weightings (for ease of renaming attribute names)
-        #    2. Weighting of individual attributes (eg. "probability" should be trusted MUCH less than "probability_treats")
-        #    3. Auto-handling of normalizing scores to be in [0,1] (eg. observed_expected ration \in (-inf, inf) while probability \in (0,1)
-        #    4. Auto-thresholding of values (eg. if chi_square <0.05, penalize the most, if probability_treats < 0.8, penalize the most, etc.)
-        #    5. Allow for ranked answers (eg. observed_expected can have a single, huge value, skewing the rest of them
-
-        # #### Iterate through all the edges in the knowledge graph to:
-        # #### 1) Create a dict of all edges by id
-        # #### 2) Collect some min,max stats for edge_attributes that we may need later
-        kg_edge_id_to_edge = self.kg_edge_id_to_edge
-        score_stats = self.score_stats
-        no_non_inf_float_flag = True
-        for edge_key,edge in message.knowledge_graph.edges.items():
-            kg_edge_id_to_edge[edge_key] = edge
-            if edge.attributes is not None:
-                for edge_attribute in edge.attributes:
-                    for attribute_name in self.known_attributes:
-                        if edge_attribute.original_attribute_name == attribute_name or edge_attribute.attribute_type_id == attribute_name:
-                            if edge_attribute.value == "no value!":
-                                edge_attribute.value = 0
-                                value = 0
-                            else:
-                                try:
-                                    value = float(edge_attribute.value)
-                                except ValueError:
-                                    continue
-                                except TypeError:
-                                    continue
-                            # initialize if not None already
-                            if attribute_name not in score_stats:
-                                score_stats[attribute_name] = {'minimum': None, 'maximum': None}  # FIXME: doesn't handle the case when all values are inf|NaN
-                            if not np.isinf(value) and not np.isinf(-value) and not np.isnan(value):  # Ignore inf, -inf, and nan
-                                no_non_inf_float_flag = False
-                                if not score_stats[attribute_name]['minimum']:
-                                    score_stats[attribute_name]['minimum'] = value
-                                if not score_stats[attribute_name]['maximum']:
-                                    score_stats[attribute_name]['maximum'] = value
-                                if value > score_stats[attribute_name]['maximum']:
-                                    score_stats[attribute_name]['maximum'] = value
-                                if value < score_stats[attribute_name]['minimum']:
-                                    score_stats[attribute_name]['minimum'] = value
-
-        if no_non_inf_float_flag:
-            response.warning(
-                        f"No non-infinite value was encountered in any edge attribute in the knowledge graph.")
-        response.info(f"Summary of available edge metrics: {score_stats}")
+        #    1. Weighting of individual attributes (eg. "probability" should be trusted MUCH less than "probability_treats")
+        #       (the trust levels are in EDGE_ATTRIBUTE_NORMALIZERS, but aren't used to combine the scores yet)
+        #    2. Auto-handling of normalizing scores to be in [0,1] (eg. observed_expected ration \in (-inf, inf) while probability \in (0,1)
+        #    3. Auto-thresholding of values (eg. if chi_square <0.05, penalize the most, if probability_treats < 0.8, penalize the most, etc.)
+        #    4. Allow for ranked answers (eg. observed_expected can have a single, huge value, skewing the rest of them
 
-        # Loop over the entire KG and normalize and combine the score of each edge, place that information in the confidence attribute of the edge
-        for edge_key,edge in message.knowledge_graph.edges.items():
-            if edge.attributes is not None:
-                edge_attributes = {x.original_attribute_name:x.value for x in edge.attributes}
-            else:
-                edge_attributes = {}
-            if edge_attributes.get("confidence", None) is not None:
-            #if False:       # FIXME: there is no longer such an attribute. Stored as a generic attribute?
-            #if edge.confidence is not None:
-                # don't touch the confidence, since apparently someone already knows what the confidence should be
-                edge.confidence = edge_attributes['confidence']
-                #continue
-            else:
-                confidence = self.edge_attribute_score_combiner(edge)
-                #edge.attributes.append(Attribute(name="confidence", value=confidence))
-                edge.confidence = confidence
+        self.compute_edge_confidences(message.knowledge_graph, response)
 
         # Now that each edge has a confidence attached to it based on it's attributes, we can now:
         # 1. consider edge types of the results
@@ -613,14 +513,13 @@ and [frobenius norm](https://en.wikipedia.org/wiki/Matrix_norm#Frobenius_norm).
         qg_nx = _get_query_graph_networkx_from_query_graph(message.query_graph)
         kg_edge_id_to_edge = self.kg_edge_id_to_edge
         results = message.results
-        ranks_list = list(map(_quantile_rank_list,
-                              map(lambda scorer_func: _score_result_graphs_by_networkx_graph_scorer(kg_edge_id_to_edge,
-                                                                                                    qg_nx,
-                                                                                                    results,
-                                                                                                    scorer_func),
-                                  [_score_networkx_graphs_by_max_flow,
-                                   _score_networkx_graphs_by_longest_path,
-                                   _score_networkx_graphs_by_frobenius_norm])))
+        # Build every result's weighted adjacency matrix once and score them all in batch
+        adjacency_matrices = _get_weighted_adjacency_matrices(kg_edge_id_to_edge, message.query_graph, results)
+        max_path_len, pairs_with_max_path_len = _get_qnode_index_pairs_with_max_path_len(qg_nx)
+        ranks_list = [_quantile_rank_list(scorer_func(adjacency_matrices, max_path_len, pairs_with_max_path_len))
+                      for scorer_func in [_score_adjacency_matrices_by_max_flow,
+                                          _score_adjacency_matrices_by_longest_path,
+                                          _score_adjacency_matrices_by_frobenius_norm]]
         #print(ranks_list)
         #print(float(len(ranks_list)))
         result_scores = sum(ranks_list)/float(len(ranks_list))
@@ -39,6 +39,10 @@ class ARAXResponse:
 
         self.query_plan = { 'qedge_keys': {}, 'counter': 0 }
 
+        #### Optional queue.Queue that new log messages and query_plan changes are pushed to as they happen,
+        #### as ('message', message) or ('query_plan', query_plan_delta) tuples (used for streaming responses)
+        self.event_queue = None
+
 
     #### Add a debugging message
     def debug(self, message, code=None):
@@ -131,8 +135,11 @@ class ARAXResponse:
 
         timestamp = str(datetime.datetime.now().isoformat())
         pid = os.getpid()
-        self.messages.append( { 'timestamp': timestamp, 'level': self.level_names[level], 'code': code, 'message': message } )
+        message_dict = { 'timestamp': timestamp, 'level': self.level_names[level], 'code': code, 'message': message }
+        self.messages.append(message_dict)
         self.n_messages += 1
+        if self.event_queue is not None:
+            self.event_queue.put( ('message', message_dict) )
 
         # Create a pretty printable message prefix
         prefix = f"{timestamp} {self.level_names[level]}: ({pid}) "
@@ -162,6 +169,8 @@ class ARAXResponse:
         self.n_warnings += response_to_merge.n_warnings
         for message in response_to_merge.messages:
             self.messages.append(message)
+            if self.event_queue is not None:
+                self.event_queue.put( ('message', message) )
         if response_to_merge.status != 'OK':
             self.status = response_to_merge.status
             self.error_code = response_to_merge.error_code
@@ -247,16 +256,25 @@ class ARAXResponse:
             if provider not in self.query_plan['qedge_keys'][qedge_key]:
                 self.query_plan['qedge_keys'][qedge_key][provider] = {}
             self.query_plan['qedge_keys'][qedge_key][provider][status] = description
+            changes = { status: description }
         else:
             if provider not in self.query_plan['qedge_keys'][qedge_key]:
                 self.query_plan['qedge_keys'][qedge_key][provider] = { 'status': status, 'description': description, 'query': query }
+                changes = { 'status': status, 'description': description, 'query': query }
             else:
                 self.query_plan['qedge_keys'][qedge_key][provider]['status'] = status
                 self.query_plan['qedge_keys'][qedge_key][provider]['description'] = description
+                changes = { 'status': status, 'description': description }
                 if query is not None:
                     self.query_plan['qedge_keys'][qedge_key][provider]['query'] = query
+                    changes['query'] = query
         self.query_plan['counter'] += 1
 
+        #### Only the part of the query_plan that changed is streamed; consumers merge it into what they have
+        if self.event_queue is not None:
+            query_plan_delta = { 'qedge_keys': { qedge_key: { provider: changes } }, 'counter': self.query_plan['counter'], 'is_delta': True }
+            self.event_queue.put( ('query_plan', query_plan_delta) )
+
 
 ##########################################################################################
 import unittest
@@ -287,6 +305,21 @@ class ResponseTests(unittest.TestCase):
     def test_show(self):
         self.assertGreater(len(self.response.show(level=self.response.INFO)), 285)
 
+    def test_event_queue(self):
+        import queue
+        response = ARAXResponse()
+        response.event_queue = queue.Queue()
+        response.info('So far so good')
+        response.update_query_plan('e00', 'infores:rtx-kg2', 'Waiting', "Query with 12 CURIEs sent: waiting for response", query={'message': {}})
+        response.update_query_plan('e00', 'infores:rtx-kg2', 'Done', "Query returned 89 results")
+        event_type, event = response.event_queue.get_nowait()
+        self.assertEqual((event_type, event['message']), ('message', 'So far so good'))
+        self.assertEqual(response.event_queue.get_nowait()[1]['qedge_keys']['e00']['infores:rtx-kg2']['query'], {'message': {}})
+        #### Later deltas only carry what changed
+        event_type, event = response.event_queue.get_nowait()
+        self.assertEqual(event['qedge_keys'], { 'e00': { 'infores:rtx-kg2': { 'status': 'Done', 'description': "Query returned 89 results" } } })
+        self.assertTrue(response.event_queue.empty())
+
 
 ##########################################################################################
 def main():
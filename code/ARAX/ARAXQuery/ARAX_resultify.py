@@ -17,10 +17,14 @@ default is to ignore edge direction).
 
 import collections
 import copy
+import heapq
 import math
 import os
 import sys
-from typing import List, Dict, Set, Union, Iterable, cast, Optional, Tuple, DefaultDict
+from typing import List, Dict, Set, Union, Iterable, Iterator, cast, Optional, Tuple, DefaultDict
+
+import numpy as np
+
 from ARAX_response import ARAXResponse
 
 __author__ = 'Stephen Ramsey and Amy Glen'
@@ -49,7 +53,7 @@ from openapi_server.models.analysis import Analysis
 
 
 class ARAXResultify:
-    ALLOWED_PARAMETERS = {'debug', 'ignore_edge_direction'}
+    ALLOWED_PARAMETERS = {'debug', 'ignore_edge_direction', 'max_results'}
 
     def __init__(self):
         self.response = None
@@ -66,6 +70,9 @@ information contained in the message knowledge graph (KG). Every subgraph
 through the KG that satisfies the GQ is returned. Such use cases include:
 - `resultify()` Returns all subgraphs in the knowledge graph that satisfy the
   query graph
+- `resultify(max_results=500)` Only creates the 500 results whose edges have the
+highest combined confidence, rather than creating every result and filtering
+them afterwards
 - `resultiy(ignore_edge_direction=false)` This mode checks edge directions in
 the QG to ensure that matching an edge in the KG to an edge in the QG is only
 allowed if the two edges point in the same direction. The default is to not
@@ -89,6 +96,14 @@ automated reasoning system, not just ones generated by Team ARA Expander."""
                     "type": "boolean",
                     "description": "Whether to ignore (vs. obey) edge directions in the query graph when identifying "
                                    "paths that fulfill it.",
+                },
+                "max_results": {
+                    "is_required": False,
+                    "examples": [100, 500],
+                    "type": "integer",
+                    "description": "If specified, only this many results are created: candidate results are scored "
+                                   "by the confidence of their edges as they are enumerated, and only the best are "
+                                   "kept. Much faster than creating every result and then using filter_results.",
                 }
             }
         }
@@ -250,12 +265,27 @@ automated reasoning system, not just ones generated by Team ARA Expander."""
                 else:
                     raise e
 
+        max_results = parameters.get('max_results', None)
+        if max_results is not None:
+            try:
+                max_results = int(max_results)
+                if max_results < 1:
+                    raise ValueError("max_results must be a positive integer")
+            except ValueError as e:
+                error_string = "parameter value is not allowed in ARAXResultify: " + str(max_results)
+                if not debug_mode:
+                    self.response.error(error_string)
+                    return
+                else:
+                    raise e
+
         # Actually create results
         results = _get_results_for_kg_by_qg(kg,
                                             qg,
                                             mode,
                                             ignore_edge_direction,
-                                            self.response)
+                                            self.response,
+                                            max_results)
         message_code = 'OK'
         code_description = 'Result list computed from KG and QG'
 
@@ -457,10 +487,11 @@ def _get_results_for_kg_by_qg(kg: KnowledgeGraph,              # all nodes *must
                               qg: QueryGraph,
                               mode: str = "ARAX",
                               ignore_edge_direction: bool = True,
-                              log: ARAXResponse = ARAXResponse()) -> List[Result]:
+                              log: ARAXResponse = ARAXResponse(),
+                              max_results: Optional[int] = None) -> List[Result]:
 
     if ignore_edge_direction is None:
-        return _get_results_for_kg_by_qg(kg, qg, mode, log=log)
+        return _get_results_for_kg_by_qg(kg, qg, mode, log=log, max_results=max_results)
 
     kg_node_keys_without_qnode_key = [node_key for node_key, node in kg.nodes.items() if not node.qnode_keys]
     if len(kg_node_keys_without_qnode_key) > 0:
@@ -601,8 +632,6 @@ def _get_results_for_kg_by_qg(kg: KnowledgeGraph,              # all nodes *must
     else:
         # Build up some indexes for edges in the KG (by their subject/object nodes and qedge keys)
         log.debug(f"Building helper indexes for faster lookup of edges")
-        edge_keys_by_subject_collapsed = collections.defaultdict(lambda: collections.defaultdict(lambda: set()))
-        edge_keys_by_object_collapsed = collections.defaultdict(lambda: collections.defaultdict(lambda: set()))
         edge_keys_by_node_pair_collapsed = collections.defaultdict(lambda: collections.defaultdict(lambda: set()))
         for edge_key, edge in kg.edges.items():
             for qedge_id in edge.qedge_keys:
@@ -611,8 +640,6 @@ def _get_results_for_kg_by_qg(kg: KnowledgeGraph,              # all nodes *must
                 qnode_subj_fulfills, qnode_obj_fulfills = _get_qnodes_subj_and_obj_fulfill(edge, qedge, kg_node_keys_by_qg_key)
                 edge_subject = child_to_parent_map[qnode_subj_fulfills][edge.subject] if qnode_subj_fulfills in subclass_qnode_keys else edge.subject
                 edge_object = child_to_parent_map[qnode_obj_fulfills][edge.object] if qnode_obj_fulfills in subclass_qnode_keys else edge.object
-                edge_keys_by_subject_collapsed[qedge_id][edge_subject].add(edge_key)
-                edge_keys_by_object_collapsed[qedge_id][edge_object].add(edge_key)
                 edge_keys_by_node_pair_collapsed[qedge_id][(edge_subject, edge_object)].add(edge_key)
                 edge_keys_by_node_pair[qedge_id][(edge.subject, edge.object)].add(edge_key)
                 if ignore_edge_direction:
@@ -637,19 +664,23 @@ def _get_results_for_kg_by_qg(kg: KnowledgeGraph,              # all nodes *must
             log.debug(f"KG does not fulfill the (required portion of the) QG. Unfulfilled qnodes: {unfulfilled_qnode_keys}. "
                       f"Unfulfilled qedges: {unfulfilled_qedge_keys}.")
             return results
-        log.info(f"Creating result graphs for required portion of QG")
-        result_graphs_required = _create_result_graphs(required_qg, kg_node_keys_by_qg_key_collapsed,
-                                                       edge_keys_by_subject_collapsed, edge_keys_by_object_collapsed,
-                                                       edge_keys_by_node_pair_collapsed,
-                                                       ignore_edge_direction, log)
-        log.debug(f"Created {len(result_graphs_required)} required result graphs")
-
-        # Then create results for each of the 'option groups' in the QG (including the 'required' portion with each)
         subclass_self_qedge_groups = {qedge.option_group_id for qedge_key, qedge in qg.edges.items()
                                       if _is_subclass_self_qedge(qedge)}
         option_groups_in_qg = {qedge.option_group_id for qedge in qg.edges.values()
                                if qedge.option_group_id}.difference(subclass_self_qedge_groups)
         # NOTE: We ignore subclass self-qedge option groups and instead process those in a different way
+        log.info(f"Creating result graphs for required portion of QG")
+        if max_results is not None and not option_groups_in_qg:
+            # Nothing needs to be merged into these, so we can stream them and only hold on to the best candidates
+            result_graphs_required = _get_top_result_graphs(_iter_result_graphs(required_qg, kg_node_keys_by_qg_key_collapsed,
+                                                                                edge_keys_by_node_pair_collapsed, log),
+                                                            max_results, kg, qg, log)
+        else:
+            result_graphs_required = _create_result_graphs(required_qg, kg_node_keys_by_qg_key_collapsed,
+                                                           edge_keys_by_node_pair_collapsed, log)
+        log.debug(f"Created {len(result_graphs_required)} required result graphs")
+
+        # Then create results for each of the 'option groups' in the QG (including the 'required' portion with each)
         if option_groups_in_qg:
             log.info(f"Distinct option groups detected in the QG are: {option_groups_in_qg}")
         option_group_results_dict = dict()
@@ -669,10 +700,8 @@ def _get_results_for_kg_by_qg(kg: KnowledgeGraph,              # all nodes *must
                 return []
             log.info(f"Creating result graphs for option group {option_group_id}")
             result_graphs_for_option_group = _create_result_graphs(option_group_qg, kg_node_keys_by_qg_key_collapsed,
-                                                                   edge_keys_by_subject_collapsed, edge_keys_by_object_collapsed,
-                                                                   edge_keys_by_node_pair_collapsed,
-                                                                   ignore_edge_direction, log,
-                                                                   base_result_graphs=copy.deepcopy(result_graphs_required))
+                                                                   edge_keys_by_node_pair_collapsed, log,
+                                                                   base_result_graphs=result_graphs_required)
             log.debug(f"Created {len(result_graphs_for_option_group)} option group {option_group_id} result graphs")
             option_group_results_dict[option_group_id] = result_graphs_for_option_group
 
@@ -694,6 +723,8 @@ def _get_results_for_kg_by_qg(kg: KnowledgeGraph,              # all nodes *must
                 result_graphs_by_key[result_key] = _merge_optional_into_required_result_graph(option_group_result_graph, corresponding_result_graph)
 
         final_result_graphs = list(result_graphs_by_key.values())
+        if max_results is not None and option_groups_in_qg:
+            final_result_graphs = _get_top_result_graphs(final_result_graphs, max_results, kg, qg, log)
         log.debug(f"There are a total of {len(final_result_graphs)} final result graphs")
 
     # ---------------------- Separate children from parents now that results have been formed ------------------ #
@@ -1045,17 +1076,6 @@ def _is_subclass_self_qedge(qedge: QEdge) -> bool:
     return qedge.subject == qedge.object and qedge.predicates == ["biolink:subclass_of"]
 
 
-def _get_all_adjacent_nodes(kg_node_keys: Set[str], start_qnode_key: str, target_qnode_key: str,
-                            kg_node_adj_map_by_qg_key: Dict[str, Dict[str, Dict[str, Set[str]]]]) -> Set[str]:
-    """
-    This function returns all nodes adjacent to a set of nodes (kg_node_keys) that fulfill the target_qnode_key. The
-    start_qnode_key is the qnode ID that the set of input nodes fulfill. Being adjacent to the set of nodes means that
-    the node is connected to ANY of the individual input nodes in the set (not ALL).
-    """
-    connections = [kg_node_adj_map_by_qg_key[start_qnode_key][kg_node_key][target_qnode_key] for kg_node_key in kg_node_keys]
-    return {node_key for node_key_set in connections for node_key in node_key_set}
-
-
 def _find_qnode_connected_to_sub_qg(qnode_keys_to_connect_to: Set[str], qnode_keys_to_choose_from: Set[str],
                                     qg: QueryGraph) -> Tuple[str, Set[str]]:
     """
@@ -1089,15 +1109,6 @@ def _get_qg_adj_map_undirected(qg: QueryGraph) -> Dict[str, Set[str]]:
     return qg_adj_map
 
 
-def _extract_sub_qg_adj_map(qg_adj_map: Dict[str, Set[str]], allowed_qnode_keys: Set[str]) -> Dict[str, Set[str]]:
-    """
-    This function extracts the node adjacency info for a "subgraph" of the query graph (represented by
-    allowed_qnode_keys). Example of qg_adj_map: {"n0": {"n1"}, "n1": {"n0"}}
-    """
-    return {qnode_key: neighbor_qnode_keys.intersection(allowed_qnode_keys)
-            for qnode_key, neighbor_qnode_keys in qg_adj_map.items() if qnode_key in allowed_qnode_keys}
-
-
 def _get_subclass_clusters(kg_edge_keys_by_qg_key: Dict[str, Set[str]], kg_node_keys_by_qg_key: Dict[str, Set[str]],
                            kg: KnowledgeGraph, qg: QueryGraph,
                            log: ARAXResponse) -> Tuple[Dict[str, Dict[str, Set[str]]], Dict[str, Dict[str, str]]]:
@@ -1148,165 +1159,312 @@ def _get_best_parent_id(parent_ids: Iterable[str]) -> str:
     return list(sorted(list(parent_ids)))[0]
 
 
-def _clean_up_dead_ends(result_graph: Dict[str, Dict[str, Set[str]]],
-                        sub_qg_adj_map: Dict[str, Set[str]],
-                        kg_node_adj_map_by_qg_key: Dict[str, Dict[str, Dict[str, Set[str]]]],
-                        log: ARAXResponse) -> Dict[str, Dict[str, Set[str]]]:
+def _indexes_to_bits(indexes: np.ndarray, num_nodes: int) -> int:
+    """Packs an array of node indexes into a bitset (a Python int with bit i set for each index i)"""
+    if len(indexes) <= 8:
+        bits = 0
+        for index in indexes.tolist():
+            bits |= 1 << index
+        return bits
+    mask = np.zeros(num_nodes, dtype=bool)
+    mask[indexes] = True
+    return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(), "little")
+
+
+def _bits_to_indexes(bits: int, num_nodes: int) -> np.ndarray:
+    """Unpacks a bitset (see _indexes_to_bits()) into a sorted array of node indexes"""
+    if not bits & (bits - 1):  # Zero or one bits set
+        return np.array([bits.bit_length() - 1] if bits else [], dtype=np.int64)
+    packed_bits = np.frombuffer(bits.to_bytes((num_nodes + 7) // 8, "little"), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(packed_bits, bitorder="little"))
+
+
+class _ResultGraphEnumerator:
     """
-    This function iteratively removes "dead ends" from a result graph until no more dead ends can be found. Dead ends
-    can be thought of as intermediate nodes (typically for is_set=True qnodes) that connect to only a subset of the
-    nodes they should be connected to according to the query graph. Only the part of the result graph that has been
-    "fulfilled" so far during the result construction process is evaluated here: the sub_qg_adj_map must contain only
-    info for qnodes fulfilled thus far.
+    An integer-indexed view of the (collapsed) KG that is used to enumerate result graphs for a QG. The KG nodes
+    fulfilling each qnode are interned to integer indexes, so the candidate nodes for a qnode can be held as a bitset
+    and the KG connections between the nodes of two adjacent qnodes as CSR arrays. Result graphs are then enumerated
+    as a join over the QG: each is_set=False qnode is bound to one node at a time (its candidates being the
+    intersection of the nodes adjacent to its already-bound neighbors), while each is_set=True qnode keeps all of its
+    candidates in a single bitset. After every binding, nodes that have lost their connection to an adjacent qnode's
+    candidates are pruned ("dead ends") until every remaining node is connected in every direction the QG requires.
     """
-    fulfilled_qnode_keys = set(sub_qg_adj_map)
-    found_dead_ends = True
-    while found_dead_ends:
-        found_dead_ends = False
-        nodes_to_remove = dict()
-        # Go through each qnode "role" in our result graph, and check the nodes corresponding to that qnode
-        for qnode_key in fulfilled_qnode_keys:
-            corresponding_node_keys = result_graph["nodes"][qnode_key]
-            required_neighbor_qnode_keys = sub_qg_adj_map[qnode_key]
-            # Make sure each node for this qnode ID is connected to at LEAST one node fulfilling each neighbor qnode ID
-            for corresponding_node_key in corresponding_node_keys:
-                for neighbor_qnode_key in required_neighbor_qnode_keys:
-                    # Look for at least one node in the result graph in this neighbor spot that this node is linked to
-                    neighbors_in_kg = kg_node_adj_map_by_qg_key[qnode_key][corresponding_node_key][neighbor_qnode_key]
-                    if not neighbors_in_kg.intersection(result_graph["nodes"][neighbor_qnode_key]):
-                        # Mark this node for removal from this result graph since it's lacking a neighbor here
-                        found_dead_ends = True
-                        if qnode_key not in nodes_to_remove:
-                            nodes_to_remove[qnode_key] = set()
-                        nodes_to_remove[qnode_key].add(corresponding_node_key)
-        # Actually go through and remove our nodes marked for removal
-        for qnode_key, node_keys in nodes_to_remove.items():
-            result_graph["nodes"][qnode_key] = result_graph["nodes"][qnode_key].difference(node_keys)
-    return result_graph
+
+    def __init__(self, qg: QueryGraph, kg_node_keys_by_qg_key: Dict[str, Set[str]],
+                 edge_keys_by_node_pair: DefaultDict[str, DefaultDict[Tuple[str], set]]):
+        self.qg = qg
+        self.qg_adj_map = _get_qg_adj_map_undirected(qg)
+        self.node_keys = {qnode_key: sorted(kg_node_keys_by_qg_key[qnode_key]) for qnode_key in qg.nodes}
+        self.node_indexes = {qnode_key: {node_key: index for index, node_key in enumerate(node_keys)}
+                             for qnode_key, node_keys in self.node_keys.items()}
+        self.num_nodes = {qnode_key: len(node_keys) for qnode_key, node_keys in self.node_keys.items()}
+        self.adjacency = self._build_adjacency(edge_keys_by_node_pair)
+        self.neighbor_bits_cache = {qnode_pair: dict() for qnode_pair in self.adjacency}
+        self.edge_index = self._build_edge_index(edge_keys_by_node_pair)
+        # Nodes that can't be part of ANY result are pruned up front, since every result graph is a subset of this
+        all_nodes = {qnode_key: (1 << num_nodes) - 1 for qnode_key, num_nodes in self.num_nodes.items()}
+        candidate_bits = self._remove_dead_ends(all_nodes, list(qg.nodes))
+        self.candidate_bits = candidate_bits if candidate_bits else {qnode_key: 0 for qnode_key in qg.nodes}
+
+    def _build_adjacency(self, edge_keys_by_node_pair: DefaultDict[str, DefaultDict[Tuple[str], set]]) -> Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns CSR (indptr, indices) arrays for each pair of adjacent qnodes (in both directions). Two nodes only count
+        as connected if ALL qedges between their two qnodes are fulfilled by edges between them.
+        """
+        index_pairs = {(qnode_key, neighbor_qnode_key): ([], [])
+                       for qnode_key, neighbor_qnode_keys in self.qg_adj_map.items()
+                       for neighbor_qnode_key in neighbor_qnode_keys}
+
+        def add_connection(qnode_key_1: str, index_1: int, qnode_key_2: str, index_2: int):
+            index_pairs[(qnode_key_1, qnode_key_2)][0].append(index_1)
+            index_pairs[(qnode_key_1, qnode_key_2)][1].append(index_2)
+            index_pairs[(qnode_key_2, qnode_key_1)][0].append(index_2)
+            index_pairs[(qnode_key_2, qnode_key_1)][1].append(index_1)
+
+        for qedge_key, qedge in self.qg.edges.items():
+            parallel_node_pairs = [edge_keys_by_node_pair.get(parallel_qedge_key, dict())
+                                   for parallel_qedge_key in _get_parallel_qedge_keys(qedge, self.qg)
+                                   if parallel_qedge_key != qedge_key]
+            subject_indexes = self.node_indexes[qedge.subject]
+            object_indexes = self.node_indexes[qedge.object]
+            for node_a, node_b in edge_keys_by_node_pair.get(qedge_key, dict()):
+                if all((node_a, node_b) in node_pairs for node_pairs in parallel_node_pairs):
+                    if node_a in subject_indexes and node_b in object_indexes:
+                        add_connection(qedge.subject, subject_indexes[node_a], qedge.object, object_indexes[node_b])
+                    if node_a in object_indexes and node_b in subject_indexes:
+                        add_connection(qedge.object, object_indexes[node_a], qedge.subject, subject_indexes[node_b])
+
+        adjacency = dict()
+        for (qnode_key, neighbor_qnode_key), (indexes, neighbor_indexes) in index_pairs.items():
+            # Dedupe the connections and sort them by the first node's index
+            index_pair_ids = np.unique(np.array(indexes, dtype=np.int64) * self.num_nodes[neighbor_qnode_key] +
+                                       np.array(neighbor_indexes, dtype=np.int64))
+            rows = index_pair_ids // self.num_nodes[neighbor_qnode_key]
+            indptr = np.zeros(self.num_nodes[qnode_key] + 1, dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=self.num_nodes[qnode_key]), out=indptr[1:])
+            adjacency[(qnode_key, neighbor_qnode_key)] = (indptr, index_pair_ids % self.num_nodes[neighbor_qnode_key])
+        return adjacency
+
+    def _build_edge_index(self, edge_keys_by_node_pair: DefaultDict[str, DefaultDict[Tuple[str], set]]) -> Dict[str, tuple]:
+        """
+        Indexes the edges for each qedge by the (subject qnode index, object qnode index) of their node pair, both
+        directly and from each end. Node pairs are only listed in the reverse direction when edge direction is ignored.
+        """
+        edge_index = dict()
+        for qedge_key, qedge in self.qg.edges.items():
+            by_index_pair = dict()
+            by_subject_index = collections.defaultdict(list)
+            by_object_index = collections.defaultdict(list)
+            subject_indexes = self.node_indexes[qedge.subject]
+            object_indexes = self.node_indexes[qedge.object]
+            for (node_a, node_b), edge_keys in edge_keys_by_node_pair.get(qedge_key, dict()).items():
+                if node_a in subject_indexes and node_b in object_indexes:
+                    subject_index, object_index = subject_indexes[node_a], object_indexes[node_b]
+                    by_index_pair[(subject_index, object_index)] = edge_keys
+                    by_subject_index[subject_index].append((object_index, edge_keys))
+                    by_object_index[object_index].append((subject_index, edge_keys))
+            subject_degrees = np.zeros(self.num_nodes[qedge.subject], dtype=np.int64)
+            subject_degrees[list(by_subject_index)] = [len(pairs) for pairs in by_subject_index.values()]
+            object_degrees = np.zeros(self.num_nodes[qedge.object], dtype=np.int64)
+            object_degrees[list(by_object_index)] = [len(pairs) for pairs in by_object_index.values()]
+            edge_index[qedge_key] = (by_index_pair, by_subject_index, by_object_index, subject_degrees, object_degrees)
+        return edge_index
+
+    def _get_neighbor_bits(self, qnode_key: str, neighbor_qnode_key: str, node_bits: int) -> int:
+        """Returns the nodes fulfilling neighbor_qnode_key that are connected to ANY of the given nodes"""
+        indptr, indices = self.adjacency[(qnode_key, neighbor_qnode_key)]
+        node_indexes = _bits_to_indexes(node_bits, self.num_nodes[qnode_key])
+        if len(node_indexes) == 1:
+            # Single nodes are looked up over and over as is_set=False qnodes get bound, so these are cached
+            cache = self.neighbor_bits_cache[(qnode_key, neighbor_qnode_key)]
+            node_index = int(node_indexes[0])
+            if node_index not in cache:
+                cache[node_index] = _indexes_to_bits(indices[indptr[node_index]:indptr[node_index + 1]],
+                                                     self.num_nodes[neighbor_qnode_key])
+            return cache[node_index]
+        starts = indptr[node_indexes]
+        counts = indptr[node_indexes + 1] - starts
+        offsets = np.cumsum(counts) - counts
+        neighbor_positions = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+        return _indexes_to_bits(indices[neighbor_positions], self.num_nodes[neighbor_qnode_key])
+
+    def _remove_dead_ends(self, node_bits: Dict[str, int], changed_qnode_keys: List[str]) -> Optional[Dict[str, int]]:
+        """
+        Iteratively removes nodes (among the qnodes in node_bits) that aren't connected to at least one node fulfilling
+        each of their qnode's neighbors, starting from the qnodes whose nodes have changed. Returns None if this
+        leaves any qnode without nodes.
+        """
+        if not all(node_bits.values()):
+            return None
+        qnode_keys_to_check = collections.deque(changed_qnode_keys)
+        queued_qnode_keys = set(changed_qnode_keys)
+        while qnode_keys_to_check:
+            changed_qnode_key = qnode_keys_to_check.popleft()
+            queued_qnode_keys.remove(changed_qnode_key)
+            for neighbor_qnode_key in self.qg_adj_map[changed_qnode_key]:
+                if neighbor_qnode_key in node_bits:
+                    connected_bits = node_bits[neighbor_qnode_key] & self._get_neighbor_bits(changed_qnode_key,
+                                                                                            neighbor_qnode_key,
+                                                                                            node_bits[changed_qnode_key])
+                    if connected_bits != node_bits[neighbor_qnode_key]:
+                        if not connected_bits:
+                            return None
+                        node_bits[neighbor_qnode_key] = connected_bits
+                        if neighbor_qnode_key not in queued_qnode_keys:
+                            qnode_keys_to_check.append(neighbor_qnode_key)
+                            queued_qnode_keys.add(neighbor_qnode_key)
+        return node_bits
+
+    def _get_join_order(self, qnode_keys_already_bound: Set[str]) -> List[str]:
+        """
+        Orders the remaining qnodes so that each connects to one already bound, preferring those that fan out to the
+        fewest result graphs (is_set=True qnodes don't fan out at all).
+        """
+        join_order = []
+        qnode_keys_bound = set(qnode_keys_already_bound)
+        qnode_keys_remaining = set(self.qg.nodes).difference(qnode_keys_bound)
+        while qnode_keys_remaining:
+            connected_qnode_keys = {qnode_key for qnode_key in qnode_keys_remaining
+                                    if not qnode_keys_bound or self.qg_adj_map[qnode_key].intersection(qnode_keys_bound)}
+            next_qnode_key = min(connected_qnode_keys,
+                                 key=lambda qnode_key: (1 if self.qg.nodes[qnode_key].is_set else bin(self.candidate_bits[qnode_key]).count("1"),
+                                                        qnode_key))
+            join_order.append(next_qnode_key)
+            qnode_keys_bound.add(next_qnode_key)
+            qnode_keys_remaining.remove(next_qnode_key)
+        return join_order
+
+    def _enumerate_node_bits(self, node_bits: Dict[str, int], join_order: List[str]) -> Iterator[Dict[str, int]]:
+        if not join_order:
+            yield node_bits
+            return
+        qnode_key = join_order[0]
+        # Candidates must be connected to the nodes of EVERY bound qnode this qnode is adjacent to
+        candidate_bits = self.candidate_bits[qnode_key]
+        for neighbor_qnode_key in self.qg_adj_map[qnode_key]:
+            if neighbor_qnode_key in node_bits and candidate_bits:
+                candidate_bits &= self._get_neighbor_bits(neighbor_qnode_key, qnode_key, node_bits[neighbor_qnode_key])
+        if not candidate_bits:
+            return
+        if self.qg.nodes[qnode_key].is_set:
+            bindings = [candidate_bits]
+        else:
+            bindings = (1 << int(index) for index in _bits_to_indexes(candidate_bits, self.num_nodes[qnode_key]))
+        for binding in bindings:
+            pruned_node_bits = self._remove_dead_ends({**node_bits, qnode_key: binding}, [qnode_key])
+            if pruned_node_bits:
+                yield from self._enumerate_node_bits(pruned_node_bits, join_order[1:])
+
+    def _get_edge_keys(self, qedge_key: str, node_bits: Dict[str, int]) -> Set[str]:
+        qedge = self.qg.edges[qedge_key]
+        subject_indexes = _bits_to_indexes(node_bits[qedge.subject], self.num_nodes[qedge.subject])
+        object_indexes = _bits_to_indexes(node_bits[qedge.object], self.num_nodes[qedge.object])
+        by_index_pair, by_subject_index, by_object_index, subject_degrees, object_degrees = self.edge_index[qedge_key]
+        # Either look up every possible node pair or walk the edges from one end, whichever means fewer lookups
+        num_pairs = len(subject_indexes) * len(object_indexes)
+        num_subject_edges = int(subject_degrees[subject_indexes].sum())
+        num_object_edges = int(object_degrees[object_indexes].sum())
+        edge_keys = set()
+        if num_pairs <= min(num_subject_edges, num_object_edges):
+            for subject_index in subject_indexes.tolist():
+                for object_index in object_indexes.tolist():
+                    edge_keys.update(by_index_pair.get((subject_index, object_index), ()))
+            return edge_keys
+        if num_subject_edges <= num_object_edges:
+            start_indexes, other_indexes, edge_lookup = subject_indexes, set(object_indexes.tolist()), by_subject_index
+        else:
+            start_indexes, other_indexes, edge_lookup = object_indexes, set(subject_indexes.tolist()), by_object_index
+        for start_index in start_indexes.tolist():
+            for other_index, pair_edge_keys in edge_lookup[start_index]:
+                if other_index in other_indexes:
+                    edge_keys.update(pair_edge_keys)
+        return edge_keys
+
+    def create_result_graphs(self, base_result_graphs: Optional[List[dict]] = None) -> Iterator[dict]:
+        if base_result_graphs is None:
+            starting_points = [(dict(), dict())]
+        else:
+            # Build off of the 'base' result graphs rather than starting anew (used for option group processing)
+            starting_points = []
+            for base_result_graph in base_result_graphs:
+                node_bits = {qnode_key: self.candidate_bits[qnode_key] &
+                             _indexes_to_bits(np.array([self.node_indexes[qnode_key][node_key] for node_key in node_keys],
+                                                       dtype=np.int64), self.num_nodes[qnode_key])
+                             for qnode_key, node_keys in base_result_graph["nodes"].items()}
+                pruned_node_bits = self._remove_dead_ends(node_bits, list(node_bits))
+                if pruned_node_bits:
+                    starting_points.append((pruned_node_bits, base_result_graph["edges"]))
+        for node_bits, base_edge_keys in starting_points:
+            for result_node_bits in self._enumerate_node_bits(node_bits, self._get_join_order(set(node_bits))):
+                result_graph = _create_new_empty_result_graph()
+                for qnode_key, bits in result_node_bits.items():
+                    node_keys = self.node_keys[qnode_key]
+                    result_graph["nodes"][qnode_key] = {node_keys[index] for index in
+                                                        _bits_to_indexes(bits, self.num_nodes[qnode_key]).tolist()}
+                for qedge_key in self.qg.edges:
+                    # Edges the base result already has for this qedge are kept (they'll be merged back into it anyway)
+                    result_graph["edges"][qedge_key] = self._get_edge_keys(qedge_key, result_node_bits).union(base_edge_keys.get(qedge_key, set()))
+                # Filter out results for which not every qedge is fulfilled (with the exception of subclass self-qedges)
+                if _result_graph_is_fulfilled(result_graph, self.qg):
+                    yield result_graph
+
+
+def _iter_result_graphs(qg: QueryGraph,
+                        kg_node_keys_by_qg_key: Dict[str, Set[str]],
+                        edge_keys_by_node_pair: DefaultDict[str, DefaultDict[Tuple[str], set]],
+                        log: ARAXResponse = ARAXResponse(),
+                        base_result_graphs: Optional[List[dict]] = None) -> Iterator[dict]:
+    log.debug(f"Indexing the KG by qnode for result graph construction")
+    result_graph_enumerator = _ResultGraphEnumerator(qg, kg_node_keys_by_qg_key, edge_keys_by_node_pair)
+    log.debug(f"Enumerating result graphs")
+    return result_graph_enumerator.create_result_graphs(base_result_graphs)
 
 
 def _create_result_graphs(qg: QueryGraph,
                           kg_node_keys_by_qg_key: Dict[str, Set[str]],
-                          edge_keys_by_subject: DefaultDict[str, DefaultDict[str, set]],
-                          edge_keys_by_object: DefaultDict[str, DefaultDict[str, set]],
                           edge_keys_by_node_pair: DefaultDict[str, DefaultDict[Tuple[str], set]],
-                          ignore_edge_direction: bool = True,
                           log: ARAXResponse = ARAXResponse(),
                           base_result_graphs: Optional[List[dict]] = None) -> List[dict]:
-    kg_node_adj_map_by_qg_key = _get_kg_node_adj_map_by_qg_key(kg_node_keys_by_qg_key, edge_keys_by_node_pair, qg)
-    qg_adj_map = _get_qg_adj_map_undirected(qg)
+    result_graphs = list(_iter_result_graphs(qg, kg_node_keys_by_qg_key, edge_keys_by_node_pair, log, base_result_graphs))
+    log.debug(f"Created {len(result_graphs)} result graphs with all qnodes/qedges fulfilled")
+    return result_graphs
 
-    # Iteratively construct "result graphs" (initially containing only nodes, not edges) by walking through all qnodes
-    log.debug(f"Constructing result graphs qnode by qnode")
-    if base_result_graphs:
-        # We'll build off of the 'base' result graphs rather than start anew (saves time for option group processing)
-        result_graphs = base_result_graphs
-        qnode_keys_already_handled = set(result_graphs[0]["nodes"])
-        qnode_keys_remaining = set(qg.nodes).difference(qnode_keys_already_handled)
-    else:
-        result_graphs = []
-        qnode_keys_already_handled = set()
-        qnode_keys_remaining = set(qg.nodes)
-    log.debug(f"Qnode keys already handled are: {qnode_keys_already_handled}")
-    while qnode_keys_remaining:
-        # Start with a random qnode if this is our first iteration
-        if not qnode_keys_already_handled:
-            current_qnode_key = list(qnode_keys_remaining)[0]
-            prior_qnode_connections = set()
-        # Otherwise find a yet unhandled qnode ID that connects somehow to the part of the QG we've already handled
-        else:
-            current_qnode_key, prior_qnode_connections = _find_qnode_connected_to_sub_qg(qnode_keys_already_handled, qnode_keys_remaining, qg)
-            log.debug(f"Next qnode chosen is: {current_qnode_key}")
-        current_qnode = qg.nodes[current_qnode_key]
-
-        # Initialize our result graphs if this is our first iteration
-        if not result_graphs:
-            log.debug(f"Initiating result graphs with nodes for {current_qnode_key} (is_set={current_qnode.is_set})")
-            all_node_keys_in_kg_for_this_qnode_key = kg_node_keys_by_qg_key.get(current_qnode_key)
-            # We'll start with one result graph with ALL corresponding nodes in the KG in this spot if is_set=True
-            if current_qnode.is_set:
-                log.debug(f"Starting with one result graph because is_set=True for {current_qnode_key}")
-                new_result_graph = _create_new_empty_result_graph()
-                new_result_graph["nodes"][current_qnode_key] = all_node_keys_in_kg_for_this_qnode_key  # Parents included already
-                result_graphs.append(new_result_graph)
-            # Otherwise, we'll start with a result graph for EACH corresponding node in the KG
-            else:
-                log.debug(f'Starting with a result graph for each {current_qnode_key} node')
-                for node_key in all_node_keys_in_kg_for_this_qnode_key:
-                    new_result_graph = _create_new_empty_result_graph()
-                    new_result_graph["nodes"][current_qnode_key] = {node_key}
-                    result_graphs.append(new_result_graph)
-        # Otherwise fan out our existing result graphs, filling out this qnode spot in them based on prior contents
-        else:
-            log.debug(f"Adding a layer to each result graph for qnode {current_qnode_key} (is_set={current_qnode.is_set})")
-            new_result_graphs = []
-            sub_qg_adj_map = _extract_sub_qg_adj_map(qg_adj_map, qnode_keys_already_handled.union({current_qnode_key}))
-            for result_graph in result_graphs:
-                # Figure out which KG nodes could fulfill the current qnode in this result
-                prior_qnodes_kg_nodes = {prior_qnode_key: result_graph["nodes"][prior_qnode_key] for prior_qnode_key in prior_qnode_connections}
-                current_kg_node_possibilities = [_get_all_adjacent_nodes(corresponding_kg_nodes, prior_qnode_key, current_qnode_key, kg_node_adj_map_by_qg_key)
-                                                 for prior_qnode_key, corresponding_kg_nodes in prior_qnodes_kg_nodes.items()]
-                # Only keep connections that have links to KG nodes in ALL prior connected qnode roles
-                final_connected_kg_nodes = set.intersection(*current_kg_node_possibilities)
-
-                # Fan out or add to result graphs as appropriate
-                if final_connected_kg_nodes:
-                    if current_qnode.is_set:
-                        # Replace this result graph with a new one with all valid connections listed under this qnode
-                        new_result_graph = _copy_result_graph(result_graph)
-                        new_result_graph["nodes"][current_qnode_key] = final_connected_kg_nodes
-                        pruned_result_graph = _clean_up_dead_ends(result_graph=new_result_graph,
-                                                                  sub_qg_adj_map=sub_qg_adj_map,
-                                                                  kg_node_adj_map_by_qg_key=kg_node_adj_map_by_qg_key,
-                                                                  log=log)
-                        new_result_graphs.append(pruned_result_graph)
-                    else:
-                        # Create a new result graph for each new valid connected node
-                        for connected_node_key in final_connected_kg_nodes:
-                            new_result_graph = _copy_result_graph(result_graph)
-                            new_result_graph["nodes"][current_qnode_key] = {connected_node_key}
-                            pruned_result_graph = _clean_up_dead_ends(result_graph=new_result_graph,
-                                                                      sub_qg_adj_map=sub_qg_adj_map,
-                                                                      kg_node_adj_map_by_qg_key=kg_node_adj_map_by_qg_key,
-                                                                      log=log)
-                            new_result_graphs.append(pruned_result_graph)
-
-            result_graphs = new_result_graphs
-        log.debug(f"Current count of result graphs is {len(result_graphs)}")
-
-        # Update our records about which qnodes we've already processed
-        qnode_keys_remaining.remove(current_qnode_key)
-        qnode_keys_already_handled.add(current_qnode_key)
-    log.debug(f"Done assigning nodes to result graphs.")
-
-    # Then add edges to our result graphs as appropriate (note, we DON'T add subclass self-qedges for now)
-    log.debug(f"Adding edges to result graphs")
+
+def _get_result_graph_quick_score(result_graph: Dict[str, Dict[str, Set[str]]], kg: KnowledgeGraph,
+                                  qg: QueryGraph) -> float:
+    """
+    A cheap stand-in for the ranker's score of a result: the Frobenius norm of the result's qnode-by-qnode matrix of
+    summed edge confidences (i.e., the ranker's Frobenius norm component, computed without building any graphs).
+    """
+    weights_by_qnode_pair = collections.defaultdict(float)
+    for edge_keys in result_graph["edges"].values():
+        for edge_key in edge_keys:
+            edge = kg.edges[edge_key]
+            for qedge_key in edge.qedge_keys:
+                qedge = qg.edges.get(qedge_key)
+                if qedge:
+                    weights_by_qnode_pair[(qedge.subject, qedge.object)] += edge.confidence
+    return math.sqrt(sum(weight ** 2 for weight in weights_by_qnode_pair.values()))
+
+
+def _get_top_result_graphs(result_graphs: Iterable[Dict[str, Dict[str, Set[str]]]], max_results: int,
+                           kg: KnowledgeGraph, qg: QueryGraph, log: ARAXResponse) -> List[Dict[str, Dict[str, Set[str]]]]:
+    """
+    Consumes the (possibly lazily generated) result graphs, keeping only the max_results with the best quick score
+    in a bounded heap, so that the much more expensive work of turning result graphs into TRAPI Results (and ranking
+    them) is only done for candidates that could make the cut. Ties go to the earlier result graph.
+    """
+    from ARAX_ranker import ARAXRanker  # Imported here since only this mode needs edge confidences this early
+    ARAXRanker().compute_edge_confidences(kg, log)
+    top_result_graphs = []  # Min-heap of (score, tiebreaker, result graph)
+    num_candidates = 0
     for result_graph in result_graphs:
-        for qedge_key, qedge in qg.edges.items():
-            qedge_source_node_ids = result_graph['nodes'][qedge.subject]
-            qedge_target_node_ids = result_graph['nodes'][qedge.object]
-            # Pick the more efficient method for edge-finding depending on the number of nodes for this result/qedge
-            if len(qedge_source_node_ids) < 10 or len(qedge_target_node_ids) < 10:
-                possible_node_pairs = {(node_1, node_2) for node_1 in qedge_source_node_ids
-                                       for node_2 in qedge_target_node_ids}
-                for node_pair in possible_node_pairs:
-                    ids_of_matching_edges = edge_keys_by_node_pair[qedge_key].get(node_pair, set())
-                    result_graph['edges'][qedge_key].update(ids_of_matching_edges)
-            else:
-                # This technique is more efficient when there are large numbers of both subject and object nodes
-                edges_with_matching_subject = {edge_key for source_node in qedge_source_node_ids
-                                               for edge_key in edge_keys_by_subject[qedge_key][source_node]}
-                edges_with_matching_object = {edge_key for target_node in qedge_target_node_ids
-                                              for edge_key in edge_keys_by_object[qedge_key][target_node]}
-                result_graph['edges'][qedge_key] = edges_with_matching_subject.intersection(edges_with_matching_object)
-                if ignore_edge_direction:
-                    edges_with_reverse_subject = {edge_key for target_node in qedge_target_node_ids
-                                                  for edge_key in edge_keys_by_subject[qedge_key][target_node]}
-                    edges_with_reverse_object = {edge_key for source_node in qedge_source_node_ids
-                                                 for edge_key in edge_keys_by_object[qedge_key][source_node]}
-                    result_graph['edges'][qedge_key].update(edges_with_reverse_subject.intersection(edges_with_reverse_object))
-
-    # Filter out any results for which not every qnode/qedge is fulfilled (with the exception of subclass self-qedges)
-    final_result_graphs = [result_graph for result_graph in result_graphs if _result_graph_is_fulfilled(result_graph, qg)]
-    log.debug(f"After pruning out result graphs missing edges, there are {len(final_result_graphs)} result graphs")
-    return final_result_graphs
+        score = _get_result_graph_quick_score(result_graph, kg, qg)
+        entry = (score, -num_candidates, result_graph)
+        num_candidates += 1
+        if len(top_result_graphs) < max_results:
+            heapq.heappush(top_result_graphs, entry)
+        elif entry[:2] > top_result_graphs[0][:2]:
+            heapq.heapreplace(top_result_graphs, entry)
+    log.info(f"Keeping the top {len(top_result_graphs)} of {num_candidates} candidate results (max_results={max_results})")
+    return [result_graph for _, _, result_graph in sorted(top_result_graphs, key=lambda entry: entry[:2], reverse=True)]
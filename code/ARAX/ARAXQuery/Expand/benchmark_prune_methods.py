@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Compares Expand's prune methods ('fet' and 'degree') on a synthetic one-hop KG: a set of input disease nodes linked to
+many candidate gene nodes, whose KG2c degrees are drawn from a long-tailed distribution. The candidates' degrees are
+written to a throwaway kg2c sqlite file (in KnowledgeSources/KG2c, deleted afterwards) that both methods read from,
+while Resultify, FET and the ranker run for real. Prints how long each method took and how many kept nodes they share.
+Usage: python benchmark_prune_methods.py <num inputs> <num candidates> <prune threshold> [--seed <seed>]
+       (e.g., 5 2000 200, 20 20000 1000, or 1 5000 500)
+"""
+import argparse
+import copy
+import os
+import sqlite3
+import sys
+import time
+from unittest import mock
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../")  # ARAXQuery directory
+from ARAX_expander import ARAXExpander
+from ARAX_response import ARAXResponse
+import Expand.degree_scorer as degree_scorer
+import Expand.expand_utilities as eu
+import Overlay.fisher_exact_test as fisher_exact_test
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../../UI/OpenAPI/python-flask-server/")
+from openapi_server.models.attribute import Attribute
+from openapi_server.models.edge import Edge
+from openapi_server.models.node import Node
+from openapi_server.models.q_edge import QEdge
+from openapi_server.models.q_node import QNode
+from openapi_server.models.query_graph import QueryGraph
+from openapi_server.models.retrieval_source import RetrievalSource
+
+BENCHMARK_SQLITE_NAME = "kg2c_prune_benchmark.sqlite"
+
+
+def build_synthetic_kg(num_inputs: int, num_candidates: int, sqlite_file_path: str,
+                       rng: np.random.Generator) -> eu.QGOrganizedKnowledgeGraph:
+    input_curies = [f"MONDO:{num}" for num in range(num_inputs)]
+    candidate_curies = [f"NCBIGene:{num}" for num in range(num_candidates)]
+    degrees = np.maximum(1, rng.lognormal(3, 1.5, num_candidates)).astype(int)
+    kg = eu.QGOrganizedKnowledgeGraph()
+    for curie in input_curies:
+        kg.add_node(curie, Node(name=curie, categories=["biolink:Disease"], attributes=[]), "n0")
+    kg2_source = RetrievalSource(resource_id="infores:rtx-kg2", resource_role="primary_knowledge_source")
+    degree_rows = [(curie, 5, 500) for curie in input_curies]
+    edge_num = 0
+    for curie, degree in zip(candidate_curies, degrees):
+        kg.add_node(curie, Node(name=curie, categories=["biolink:Gene"], attributes=[]), "n1")
+        # Lower-degree candidates tend to be linked to more of the inputs
+        num_links = min(num_inputs, 1 + rng.poisson(0.5 + 3 / np.log2(2 + degree)))
+        for disease_curie in rng.choice(input_curies, num_links, replace=False):
+            for _ in range(1 + rng.poisson(0.3)):
+                publications = [f"PMID:{pmid}" for pmid in rng.integers(0, 10 ** 6, rng.poisson(2))]
+                edge = Edge(subject=curie, object=str(disease_curie), predicate="biolink:related_to",
+                            attributes=[Attribute(attribute_type_id="biolink:publications", value=publications)],
+                            sources=[kg2_source])
+                kg.add_edge(f"edge{edge_num}", edge, "e0")
+                edge_num += 1
+        degree_rows.append((curie, int(max(degree, num_links)), 5))
+
+    connection = sqlite3.connect(sqlite_file_path)
+    connection.execute('CREATE TABLE neighbor_counts_by_category (id TEXT PRIMARY KEY, "biolink:Disease" INTEGER, '
+                       '"biolink:Gene" INTEGER) WITHOUT ROWID')
+    connection.execute("CREATE TABLE category_counts (category TEXT, count INTEGER)")
+    connection.executemany("INSERT INTO category_counts VALUES (?, ?)", [("biolink:Disease", 20000),
+                                                                         ("biolink:Gene", 40000)])
+    connection.executemany("INSERT INTO neighbor_counts_by_category VALUES (?, ?, ?)", degree_rows)
+    connection.commit()
+    connection.close()
+    return kg
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmarks Expand's prune methods on a synthetic KG")
+    arg_parser.add_argument("num_inputs", type=int)
+    arg_parser.add_argument("num_candidates", type=int)
+    arg_parser.add_argument("prune_threshold", type=int)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    kg2c_dir_path = os.path.sep.join([os.path.dirname(os.path.abspath(__file__)), "..", "..", "KnowledgeSources",
+                                      "KG2c"])
+    sqlite_file_path = os.path.realpath(f"{kg2c_dir_path}{os.path.sep}{BENCHMARK_SQLITE_NAME}")
+    os.makedirs(os.path.dirname(sqlite_file_path), exist_ok=True)
+    if os.path.exists(sqlite_file_path):
+        os.remove(sqlite_file_path)
+    # Point both FET and the degree scorer at the synthetic kg2c sqlite file
+    fisher_exact_test.RTXConfig.kg2c_sqlite_path = BENCHMARK_SQLITE_NAME
+    try:
+        kg = build_synthetic_kg(args.num_inputs, args.num_candidates, sqlite_file_path, np.random.default_rng(args.seed))
+        qg = QueryGraph(nodes={"n0": QNode(ids=list(kg.nodes_by_qg_id["n0"]), categories=["biolink:Disease"]),
+                               "n1": QNode(categories=["biolink:Gene"]),
+                               "n2": QNode(categories=["biolink:ChemicalEntity"])},
+                        edges={"e0": QEdge(subject="n1", object="n0", predicates=["biolink:related_to"]),
+                               "e1": QEdge(subject="n1", object="n2", predicates=["biolink:related_to"])})
+        qg.edges["e0"].filled = True
+        print(f"{args.num_inputs} inputs, {args.num_candidates} candidates, {len(kg.edges_by_qg_id['e0'])} edges; "
+              f"keeping {args.prune_threshold}")
+
+        kept_nodes = dict()
+        with mock.patch.object(degree_scorer, "RTXConfiguration", lambda: fisher_exact_test.RTXConfig):
+            for prune_method in ["fet", "degree"]:
+                kg_to_prune = copy.deepcopy(kg)
+                log = ARAXResponse()
+                start = time.time()
+                ARAXExpander._prune_kg("n1", args.prune_threshold, kg_to_prune, qg, log, prune_method)
+                print(f"{prune_method}: {round(time.time() - start, 2)} seconds, kept "
+                      f"{len(kg_to_prune.nodes_by_qg_id['n1'])} nodes (status: {log.status})")
+                kept_nodes[prune_method] = set(kg_to_prune.nodes_by_qg_id["n1"])
+        num_shared = len(kept_nodes["fet"] & kept_nodes["degree"])
+        print(f"Overlap: {num_shared}/{len(kept_nodes['fet'])} nodes kept by both methods")
+    finally:
+        if os.path.exists(sqlite_file_path):
+            os.remove(sqlite_file_path)
+
+
+if __name__ == "__main__":
+    main()
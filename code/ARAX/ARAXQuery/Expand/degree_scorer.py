@@ -0,0 +1,125 @@
+#!/bin/env python3
+import os
+import sqlite3
+import sys
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../")  # ARAXQuery directory
+from ARAX_response import ARAXResponse
+from ARAX_ranker import normalize_publication_counts
+from Expand.expand_utilities import QGOrganizedKnowledgeGraph
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../../")  # code directory
+from RTXConfiguration import RTXConfiguration
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../../UI/OpenAPI/python-flask-server/")
+from openapi_server.models.edge import Edge
+from openapi_server.models.query_graph import QueryGraph
+
+_kg2c_connections = threading.local()
+_category_columns = dict()
+
+
+class DegreeScorer:
+    """
+    A cheap alternative to resultify + FET + the ranker for deciding which nodes to keep when Expand prunes a qnode.
+    Each candidate node is scored directly from the QG-organized KG: every edge linking it to a node fulfilling an
+    adjacent qnode adds a weight (scored from its publication count, as the ranker does), and the sum for each
+    adjacent qnode is damped by the node's degree in KG2c (its number of neighbors of that qnode's category), so
+    nodes that are specifically connected to the input nodes beat hubs that are connected to everything.
+    """
+
+    max_sql_variables = 999
+
+    def __init__(self):
+        path_list = os.path.realpath(__file__).split(os.path.sep)
+        rtx_index = path_list.index("RTX")
+        sqlite_dir_path = os.path.sep.join([*path_list[:(rtx_index + 1)], 'code', 'ARAX', 'KnowledgeSources', 'KG2c'])
+        self.sqlite_file_path = f"{sqlite_dir_path}{os.path.sep}{RTXConfiguration().kg2c_sqlite_path.split('/')[-1]}"
+
+    def score_nodes(self, qnode_key: str, kg: QGOrganizedKnowledgeGraph, qg: QueryGraph,
+                    log: ARAXResponse) -> Dict[str, float]:
+        """Returns a score for each node fulfilling the given qnode (higher is better)"""
+        candidate_node_keys = list(kg.nodes_by_qg_id.get(qnode_key, dict()))
+        node_indexes = {node_key: index for index, node_key in enumerate(candidate_node_keys)}
+        scores = np.zeros(len(candidate_node_keys))
+        for qedge_key, qedge in qg.edges.items():
+            if qnode_key not in {qedge.subject, qedge.object} or qedge.subject == qedge.object:
+                continue
+            adjacent_qnode_key = qedge.object if qedge.subject == qnode_key else qedge.subject
+            adjacent_node_keys = kg.nodes_by_qg_id.get(adjacent_qnode_key, dict())
+            edge_node_indexes = []
+            edge_num_publications = []
+            neighbors = defaultdict(set)
+            for edge in kg.edges_by_qg_id.get(qedge_key, dict()).values():
+                if edge.subject in node_indexes and edge.object in adjacent_node_keys:
+                    node_key, neighbor_key = edge.subject, edge.object
+                elif edge.object in node_indexes and edge.subject in adjacent_node_keys:
+                    node_key, neighbor_key = edge.object, edge.subject
+                else:
+                    continue
+                edge_node_indexes.append(node_indexes[node_key])
+                edge_num_publications.append(self._get_num_publications(edge))
+                neighbors[node_key].add(neighbor_key)
+            # Edges are weighted the way the ranker scores publication counts, so unpublished edges count for little
+            edge_weights = normalize_publication_counts(np.array(edge_num_publications, dtype=float))
+            node_weights = np.bincount(np.array(edge_node_indexes, dtype=int), weights=edge_weights,
+                                       minlength=len(candidate_node_keys))
+
+            # Nodes KG2c doesn't know about are only damped by how many neighbors they have in this KG
+            connected_node_keys = list(neighbors)
+            adjacent_category = next(iter(qg.nodes[adjacent_qnode_key].categories or []), None)
+            kg2c_degrees = self._get_kg2c_degrees(connected_node_keys, adjacent_category, log) if adjacent_category else dict()
+            degrees = np.zeros(len(candidate_node_keys))
+            for node_key in connected_node_keys:
+                degrees[node_indexes[node_key]] = max(kg2c_degrees.get(node_key, 0), len(neighbors[node_key]))
+            scores += node_weights / np.log2(2 + degrees)
+        return dict(zip(candidate_node_keys, scores.tolist()))
+
+    def _get_kg2c_degrees(self, node_keys: List[str], category: str, log: ARAXResponse) -> Dict[str, int]:
+        connection = self._get_connection(log)
+        if connection is None:
+            return dict()
+        # The category comes from the user's query graph, so only look it up if it names one of the neighbor count
+        # columns (older kg2c.sqlite files don't have typed neighbor counts, nor columns for categories with no nodes)
+        if self.sqlite_file_path not in _category_columns:
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(neighbor_counts_by_category)")]
+            _category_columns[self.sqlite_file_path] = set(columns[1:])
+        if category not in _category_columns[self.sqlite_file_path]:
+            log.debug(f"Couldn't look up KG2c degrees of {category} neighbors for pruning: {self.sqlite_file_path} "
+                      f"has no neighbor counts for that category")
+            return dict()
+        degrees = dict()
+        for start_index in range(0, len(node_keys), self.max_sql_variables):
+            batch = node_keys[start_index:start_index + self.max_sql_variables]
+            placeholders = ", ".join("?" * len(batch))
+            rows = connection.execute(f'SELECT id, "{category}" FROM neighbor_counts_by_category '
+                                      f'WHERE id IN ({placeholders})', batch)
+            degrees.update((node_key, degree) for node_key, degree in rows if degree is not None)
+        return degrees
+
+    def _get_connection(self, log: ARAXResponse) -> Optional[sqlite3.Connection]:
+        # One read-only connection per thread, kept open so repeated prunes reuse the same warm page cache
+        connections = getattr(_kg2c_connections, "connections", None)
+        if connections is None:
+            connections = dict()
+            _kg2c_connections.connections = connections
+        if self.sqlite_file_path not in connections:
+            if not os.path.exists(self.sqlite_file_path):
+                log.warning(f"KG2c sqlite file not found at {self.sqlite_file_path}; will prune without KG2c degrees")
+                return None
+            connections[self.sqlite_file_path] = sqlite3.connect(f"file:{self.sqlite_file_path}?mode=ro", uri=True)
+        return connections[self.sqlite_file_path]
+
+    @staticmethod
+    def _get_num_publications(edge: Edge) -> int:
+        publications = set()
+        for attribute in edge.attributes or []:
+            if attribute.attribute_type_id == "biolink:publications":
+                if isinstance(attribute.value, str):
+                    publications.add(attribute.value)
+                elif isinstance(attribute.value, list):
+                    publications.update(attribute.value)
+        return len(publications)
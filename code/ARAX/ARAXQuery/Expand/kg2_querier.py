@@ -1,10 +1,12 @@
 #!/bin/env python3
+import asyncio
 import random
 import sys
 import os
 import time
 from collections import defaultdict
-from typing import Dict, Tuple, Union, Set
+from typing import Dict, List, Optional, Tuple, Union, Set
+import aiohttp
 import requests
 import traceback
 import json
@@ -14,6 +16,7 @@ import expand_utilities as eu
 from expand_utilities import QGOrganizedKnowledgeGraph
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../")  # ARAXQuery directory
 from ARAX_response import ARAXResponse
+from background_event_loop import get_background_event_loop
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../UI/OpenAPI/python-flask-server/")
 from openapi_server.models.node import Node
 from openapi_server.models.edge import Edge
@@ -25,15 +28,19 @@ from openapi_server.models.retrieval_source import RetrievalSource
 
 class KG2Querier:
 
-    def __init__(self, response_object: ARAXResponse, plover_url: str):
+    def __init__(self, response_object: ARAXResponse, plover_url: str,
+                 session: Optional[aiohttp.ClientSession] = None):
         self.response = response_object
         self.kg2_infores_curie = "infores:rtx-kg2"
         self.max_allowed_edges = 1000000
         self.max_edges_per_input_curie = 1000
         self.curie_batch_size = 100
+        self.max_concurrent_batches = 4  # Max curie batches in flight to Plover at once
+        self.plover_timeout = 60
         self.plover_url = plover_url
+        self.session = session  # Pooled session to send batches through (the background event loop's is used if None)
 
-    def answer_one_hop_query(self, query_graph: QueryGraph) -> Tuple[QGOrganizedKnowledgeGraph, float]:
+    def answer_one_hop_query(self, query_graph: QueryGraph) -> QGOrganizedKnowledgeGraph:
         """
         This function answers a one-hop (single-edge) query using KG2c, via PloverDB.
         :param query_graph: A TRAPI query graph.
@@ -66,20 +73,41 @@ class KG2Querier:
         qedge_key = next(qedge_key for qedge_key in query_graph.edges)
         input_qnode_key = self._get_input_qnode_key(query_graph)
         input_curies = query_graph.nodes[input_qnode_key].ids
-        input_curie_set = set(input_curies)
         curie_batches = [input_curies[i:i+self.curie_batch_size] for i in range(0, len(input_curies), self.curie_batch_size)]
-        log.debug(f"Split {len(input_curies)} input curies into {len(curie_batches)} batches to send to Plover")
+        log.debug(f"Split {len(input_curies)} input curies into {len(curie_batches)} batches to send to Plover "
+                  f"(up to {self.max_concurrent_batches} at a time)")
         log.info(f"Max edges allowed per input curie for this query is: {self.max_edges_per_input_curie}")
-        batch_num = 1
         start = time.time()
-        for curie_batch in curie_batches:
-            log.debug(f"Sending batch {batch_num} to Plover (has {len(curie_batch)} input curies)")
-            query_graph.nodes[input_qnode_key].ids = curie_batch
-            plover_answer, response_status = \
-                KG2Querier._answer_query_using_plover(query_graph,
-                                                      log,
-                                                      self.plover_url)
-            if response_status == 200:
+        final_kg = get_background_event_loop().run(self._answer_curie_batches_async(query_graph, qedge_key,
+                                                                                    input_qnode_key, curie_batches))
+        duration = time.time() - start
+        log.info(f"***ploverdbduration:{duration}")
+        return final_kg
+
+    async def _answer_curie_batches_async(self, query_graph: QueryGraph, qedge_key: str, input_qnode_key: str,
+                                          curie_batches: List[List[str]]) -> QGOrganizedKnowledgeGraph:
+        """
+        Sends the curie batches to Plover concurrently and merges each batch's answer as soon as it arrives, checking
+        the edge budget as it goes. Batches still outstanding once the query has failed (e.g., exceeded
+        max_allowed_edges even after pruning) are cancelled.
+        """
+        log = self.response
+        final_kg = QGOrganizedKnowledgeGraph()
+        input_curie_set = set(query_graph.nodes[input_qnode_key].ids)
+        plover_query = self._prep_plover_query(query_graph)
+        semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+        # Plover connections stay open on the background event loop's shared session between queries
+        shared_session = get_background_event_loop().get_session("plover", self._create_plover_client_session)
+        session = self.session or shared_session or self._create_plover_client_session()
+        tasks = [asyncio.create_task(self._answer_curie_batch_async(plover_query, input_qnode_key, curie_batch,
+                                                                    batch_num, session, semaphore))
+                 for batch_num, curie_batch in enumerate(curie_batches, start=1)]
+        try:
+            for next_batch_answer in asyncio.as_completed(tasks):
+                plover_answer, response_status = await next_batch_answer
+                if response_status != 200:
+                    log.error(f"Plover returned response of {response_status}. Answer was: {plover_answer}", error_code="RequestFailed")
+                    return final_kg
                 filtered_plover_answer = eu.filter_response_domain_range_exclusion(plover_answer, query_graph, log)
                 batch_kg = self._load_plover_answer_into_object_model(filtered_plover_answer, log)
                 final_kg = eu.merge_two_kgs(batch_kg, final_kg)
@@ -97,16 +125,47 @@ class KG2Querier:
                                   f"which is too much for the system to handle. You must somehow make your query "
                                   f"smaller (specify fewer input curies or use more specific predicates/categories).",
                                   error_code="QueryTooLarge")
-                        return final_kg, 1000
-            else:
-                log.error(f"Plover returned response of {response_status}. Answer was: {plover_answer}", error_code="RequestFailed")
-                return final_kg, 1000
-            batch_num += 1
-        
-        duration = time.time() - start
-        log.info(f"***ploverdbduration:{duration}")
+                        return final_kg
+        finally:
+            # Don't leave any batches running (or waiting to run) once we're done, successfully or not
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if session is not self.session and session is not shared_session:
+                await session.close()
         return final_kg
 
+    async def _answer_curie_batch_async(self, plover_query: dict, input_qnode_key: str, curie_batch: List[str],
+                                        batch_num: int, session: aiohttp.ClientSession,
+                                        semaphore: asyncio.Semaphore) -> Tuple[Dict[str, Dict[str, Union[set, dict]]], int]:
+        log = self.response
+        batch_query = {**plover_query, "nodes": {qnode_key: dict(qnode) for qnode_key, qnode in plover_query["nodes"].items()}}
+        batch_query["nodes"][input_qnode_key]["ids"] = curie_batch
+        self._set_plover_subclass_reasoning(batch_query)
+        async with semaphore:
+            log.debug(f"Sending batch {batch_num} to Plover (has {len(curie_batch)} input curies)")
+            try:
+                async with session.post(f"{self.plover_url}/query",
+                                        json=batch_query,
+                                        timeout=aiohttp.ClientTimeout(total=self.plover_timeout),
+                                        headers={'accept': 'application/json'}) as response:
+                    status_code = response.status
+                    response_text = await response.text()
+            except Exception as e:
+                log.error(f"Error querying PloverDB: {e} "
+                          f"TRACE {traceback.format_exc()}")
+                raise e
+        if status_code == 200:
+            log.debug(f"Plover returned status code {status_code} for batch {batch_num}")
+            return json.loads(response_text), status_code
+        else:
+            log.warning(f"Plover returned status code {status_code} for batch {batch_num}."
+                        f" Response was: {response_text}")
+            return dict(), status_code
+
+    def _create_plover_client_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_concurrent_batches))
+
     def answer_single_node_query(self, single_node_qg: QueryGraph) -> QGOrganizedKnowledgeGraph:
         log = self.response
         qnode_key = next(qnode_key for qnode_key in single_node_qg.nodes)
@@ -177,18 +236,27 @@ class KG2Querier:
         return kg
 
     @staticmethod
-    def _answer_query_using_plover(qg: QueryGraph,
-                                   log: ARAXResponse,
-                                   url: str) -> Tuple[Dict[str, Dict[str, Union[set, dict]]], int]:
-        # First prep the query graph (requires some minor additions for Plover)
+    def _prep_plover_query(qg: QueryGraph) -> dict:
+        # Prep the query graph (requires some minor additions for Plover)
         dict_qg = qg.to_dict()
         dict_qg["include_metadata"] = True  # Ask plover to return node/edge objects (not just IDs)
         dict_qg["respect_predicate_symmetry"] = True  # Ignore direction for symmetric predicate, enforce for asymmetric
+        return dict_qg
+
+    @staticmethod
+    def _set_plover_subclass_reasoning(dict_qg: dict):
         # Allow subclass_of reasoning for qnodes with a small number of curies
         for qnode in dict_qg["nodes"].values():
             if qnode.get("ids") and len(qnode["ids"]) < 5:
                 if "allow_subclasses" not in qnode or qnode["allow_subclasses"] is None:
                     qnode["allow_subclasses"] = True
+
+    @staticmethod
+    def _answer_query_using_plover(qg: QueryGraph,
+                                   log: ARAXResponse,
+                                   url: str) -> Tuple[Dict[str, Dict[str, Union[set, dict]]], int]:
+        dict_qg = KG2Querier._prep_plover_query(qg)
+        KG2Querier._set_plover_subclass_reasoning(dict_qg)
         # Then send the actual query
         log.debug(f"Sending query to {url}")
         try:
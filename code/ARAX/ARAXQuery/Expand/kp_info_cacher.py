@@ -7,8 +7,10 @@ import os
 import pathlib
 import pickle
 import sys
+import threading
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Set, Dict, Optional
+from typing import Set, Dict, Optional, Tuple
 
 import requests
 import requests_cache
@@ -26,6 +28,11 @@ from ARAX_response import ARAXResponse
 sys.path.append(os.path.sep.join([*pathlist[:(rtx_index + 1)], 'code', 'ARAX', 'ARAXQuery', 'Expand']))
 from smartapi import SmartAPI
 
+# Process-wide copy of the KP info cache file, shared by every KPSelector in this process. It is replaced wholesale
+# (never mutated) whenever the cache file on disk changes, so readers holding an older copy are unaffected.
+_loaded_kp_info = None
+_loaded_kp_info_lock = threading.Lock()
+
 
 class KPInfoCacher:
 
@@ -124,14 +131,20 @@ class KPInfoCacher:
     def cache_file_present(self):
         return os.path.exists(self.smart_api_and_meta_map_cache)
 
-    def load_kp_info_caches(self, log: ARAXResponse):
+    def load_kp_info_caches(self, log: ARAXResponse) -> tuple:
         """
         This method is meant to be used anywhere the meta map or smart API
         caches need to be used (i.e., by KPSelector).  Other modules should
         NEVER try to load the caches directly! They should only load them via
         this method.  It ensures that caches are up to date and that they don't
         become corrupted while refreshing.
+
+        The cache file is only unpickled once per process; later calls reuse
+        that copy until the background tasker swaps a new file into place.
+        Returns the smart API info, the meta map, and an index of the meta map
+        (see _build_meta_map_index()).
         """
+        global _loaded_kp_info
 
         # At this point the KP info caches must NOT be in the process of being
         # refreshed, so we create/update if needed.  In particular, this ensures
@@ -140,24 +153,58 @@ class KPInfoCacher:
         one_day_ago = datetime.now() - timedelta(hours=24)
 
         smart_api_and_meta_map_pathlib_path = pathlib.Path(self.smart_api_and_meta_map_cache)
+        file_signature = None
         try:
             if not smart_api_and_meta_map_pathlib_path.exists():
                 raise Exception("KP info cache(s) do not exist.")
-            elif (datetime.fromtimestamp(smart_api_and_meta_map_pathlib_path.stat().st_mtime) < one_day_ago):
+            file_stats = smart_api_and_meta_map_pathlib_path.stat()
+            # Refreshes rename a new file into place, so the inode changes even if the mtime happens to match
+            file_signature = (file_stats.st_ino, file_stats.st_mtime_ns, file_stats.st_size)
+            if datetime.fromtimestamp(file_stats.st_mtime) < one_day_ago:
                 raise Exception("KP info cache(s) are older than 24 hours.")
-            
+
         except Exception as e:
             log.error(f"Unable to load KP info caches: {e}")
 
-        # The caches MUST be up to date at this point, so we just load them
-        log.debug(f"Loading cached Smart API amd meta map info")
-        with open(self.smart_api_and_meta_map_cache, "rb") as cache:
-            cache = pickle.load(cache)
-            smart_api_info = cache['smart_api_cache']
-            meta_map = cache['meta_map_cache']
+        loaded_kp_info = _loaded_kp_info
+        if not self._loaded_kp_info_is_current(loaded_kp_info, file_signature):
+            with _loaded_kp_info_lock:
+                # Another thread may have already reloaded the file while we waited for the lock
+                loaded_kp_info = _loaded_kp_info
+                if not self._loaded_kp_info_is_current(loaded_kp_info, file_signature):
+                    # The caches MUST be up to date at this point, so we just load them
+                    log.debug(f"Loading cached Smart API amd meta map info")
+                    with open(self.smart_api_and_meta_map_cache, "rb") as cache:
+                        cache = pickle.load(cache)
+                    loaded_kp_info = {"path": self.smart_api_and_meta_map_cache,
+                                      "file_signature": file_signature,
+                                      "smart_api_info": cache['smart_api_cache'],
+                                      "meta_map": cache['meta_map_cache'],
+                                      "meta_map_index": self._build_meta_map_index(cache['meta_map_cache'])}
+                    _loaded_kp_info = loaded_kp_info
+        else:
+            log.debug(f"Using already loaded Smart API and meta map info")
 
+        return loaded_kp_info["smart_api_info"], loaded_kp_info["meta_map"], loaded_kp_info["meta_map_index"]
 
-        return smart_api_info, meta_map
+    def _loaded_kp_info_is_current(self, loaded_kp_info: Optional[dict], file_signature: Optional[tuple]) -> bool:
+        return (loaded_kp_info is not None and file_signature is not None and
+                loaded_kp_info["path"] == self.smart_api_and_meta_map_cache and
+                loaded_kp_info["file_signature"] == file_signature)
+
+    @staticmethod
+    def _build_meta_map_index(meta_map: dict) -> Dict[Tuple[str, str, str], Set[str]]:
+        """
+        Inverts the meta map into a lookup of which KPs support each (subject category, predicate, object category)
+        triple. Like: {("biolink:Drug", "biolink:treats", "biolink:Disease"): {"infores:rtx-kg2", ...}, ...}
+        """
+        meta_map_index = defaultdict(set)
+        for kp, kp_meta_map in meta_map.items():
+            for subject_category, object_dict in kp_meta_map.get("predicates", dict()).items():
+                for object_category, predicates in object_dict.items():
+                    for predicate in predicates:
+                        meta_map_index[(subject_category, predicate, object_category)].add(kp)
+        return dict(meta_map_index)
 
     # --------------------------------- METHODS FOR BUILDING META MAP ----------------------------------------------- #
     # --- Note: These methods can't go in KPSelector because it would create a circular dependency with this class -- #
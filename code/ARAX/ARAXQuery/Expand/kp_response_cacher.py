@@ -0,0 +1,156 @@
+#!/bin/env python3
+import asyncio
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../")  # ARAXQuery directory
+from Expand.expand_utilities import QGOrganizedKnowledgeGraph
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../../")  # code directory
+from RTXConfiguration import RTXConfiguration
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class KPResponseCacher:
+    """
+    An on-disk cache of the answers KPs have returned for one-hop queries, shared by all ARAX processes on a host.
+    Entries are keyed by the KP and a canonical hash of the exact request body sent to it, expire after a per-KP
+    time-to-live, and the least recently used entries are evicted once the cache grows beyond its size limit.
+    """
+
+    default_ttl = 24 * 60 * 60  # Seconds
+    kp_ttls = {"infores:rtx-kg2": 3 * 24 * 60 * 60}  # KG2 only changes with new releases
+    max_size_bytes = 2 * 1024 ** 3
+    cache_format_version = 1  # Bump this when the format of what's pickled into the cache changes
+    _thread_local = threading.local()  # Holds each thread's open connections to cache files
+
+    def __init__(self):
+        self.rtx_config = RTXConfiguration()
+        version_string = f"{self.rtx_config.trapi_major_version}--{self.rtx_config.maturity}"
+        self.cache_path = f"{os.path.dirname(os.path.abspath(__file__))}/cache_kp_responses_{version_string}.sqlite"
+
+    def get_cache_key(self, kp_curie: str, request_body: dict) -> str:
+        canonical_request = json.dumps(request_body, sort_keys=True, separators=(",", ":"))
+        key_material = f"{self.cache_format_version}|{kp_curie}|{canonical_request}"
+        return hashlib.sha256(key_material.encode()).hexdigest()
+
+    def get_ttl(self, kp_curie: str) -> int:
+        return self.kp_ttls.get(kp_curie, self.default_ttl)
+
+    def get_cached_answer(self, cache_key: str, kp_curie: str) -> Optional[Tuple[QGOrganizedKnowledgeGraph, float]]:
+        """
+        Returns the cached answer for the given key (plus the time it was cached at), or None if there is no
+        unexpired entry for it. Problems reading the cache are treated as misses.
+        """
+        try:
+            with self._open_cache() as connection:
+                row = connection.execute("SELECT answer, created_at, size FROM kp_responses WHERE cache_key = ?",
+                                         (cache_key,)).fetchone()
+                if not row:
+                    return None
+                answer_blob, created_at, size = row
+                now = time.time()
+                if now - created_at > self.get_ttl(kp_curie):
+                    connection.execute("DELETE FROM kp_responses WHERE cache_key = ?", (cache_key,))
+                    self._add_to_total_size(connection, -size)
+                    return None
+                connection.execute("UPDATE kp_responses SET last_accessed = ? WHERE cache_key = ?", (now, cache_key))
+            return pickle.loads(answer_blob), created_at
+        except Exception as e:
+            eprint(f"Could not read from the KP response cache: {e}")
+            return None
+
+    def cache_answer(self, cache_key: str, kp_curie: str, answer_kg: QGOrganizedKnowledgeGraph) -> bool:
+        """
+        Saves the given answer to the cache under the given key. Returns whether it was saved (answers too big for the
+        cache aren't, and problems writing to the cache are reported but not raised).
+        """
+        try:
+            answer_blob = pickle.dumps(answer_kg, protocol=pickle.HIGHEST_PROTOCOL)
+            if len(answer_blob) > self.max_size_bytes:
+                return False
+            now = time.time()
+            with self._open_cache() as connection:
+                replaced_row = connection.execute("SELECT size FROM kp_responses WHERE cache_key = ?",
+                                                  (cache_key,)).fetchone()
+                connection.execute("INSERT OR REPLACE INTO kp_responses VALUES (?, ?, ?, ?, ?, ?)",
+                                   (cache_key, kp_curie, now, now, len(answer_blob), answer_blob))
+                self._add_to_total_size(connection, len(answer_blob) - (replaced_row[0] if replaced_row else 0))
+                self._evict_least_recently_used(connection)
+            return True
+        except Exception as e:
+            eprint(f"Could not write to the KP response cache: {e}")
+            return False
+
+    async def get_cached_answer_async(self, cache_key: str,
+                                      kp_curie: str) -> Optional[Tuple[QGOrganizedKnowledgeGraph, float]]:
+        """Like get_cached_answer(), but does the disk I/O and unpickling in a thread so the event loop isn't blocked"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_cached_answer, cache_key, kp_curie)
+
+    async def cache_answer_async(self, cache_key: str, kp_curie: str, answer_kg: QGOrganizedKnowledgeGraph) -> bool:
+        """Like cache_answer(), but does the pickling and disk I/O in a thread so the event loop isn't blocked"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.cache_answer, cache_key, kp_curie, answer_kg)
+
+    @staticmethod
+    def _add_to_total_size(connection: sqlite3.Connection, num_bytes: int):
+        connection.execute("UPDATE kp_responses_size SET total_size = total_size + ?", (num_bytes,))
+
+    def _evict_least_recently_used(self, connection: sqlite3.Connection):
+        total_size = connection.execute("SELECT total_size FROM kp_responses_size").fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        # Shrink a bit below the limit so we aren't evicting on every single insert
+        target_size = int(self.max_size_bytes * 0.9)
+        keys_to_evict = []
+        for cache_key, size in connection.execute("SELECT cache_key, size FROM kp_responses "
+                                                  "ORDER BY last_accessed"):
+            if total_size <= target_size:
+                break
+            keys_to_evict.append((cache_key,))
+            self._add_to_total_size(connection, -size)
+            total_size -= size
+        connection.executemany("DELETE FROM kp_responses WHERE cache_key = ?", keys_to_evict)
+
+    @contextmanager
+    def _open_cache(self) -> Iterator[sqlite3.Connection]:
+        connection = self._get_connection()
+        try:
+            with connection:  # Commits (or rolls back) everything done in the block as one transaction
+                yield connection
+        except sqlite3.Error:
+            # Start over with a fresh connection next time (e.g., in case the cache file was deleted)
+            self._thread_local.connections.pop(self.cache_path, None)
+            connection.close()
+            raise
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # Each thread keeps its own connection to the cache (sqlite connections can't be shared across threads or
+        # carried into forked Expand processes), so connections are set up, and the tables created, only once
+        if not hasattr(self._thread_local, "connections"):
+            self._thread_local.connections = dict()
+        connection_pid, connection = self._thread_local.connections.get(self.cache_path, (None, None))
+        if connection is None or connection_pid != os.getpid():
+            connection = sqlite3.connect(self.cache_path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")  # Lets readers proceed while another process writes
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS kp_responses (cache_key TEXT PRIMARY KEY, kp TEXT, "
+                                   "created_at REAL, last_accessed REAL, size INTEGER, answer BLOB)")
+                connection.execute("CREATE INDEX IF NOT EXISTS kp_responses_last_accessed "
+                                   "ON kp_responses (last_accessed)")
+                # The cache's total size is kept up to date as entries come and go, rather than summed on every write
+                connection.execute("CREATE TABLE IF NOT EXISTS kp_responses_size (total_size INTEGER)")
+                connection.execute("INSERT INTO kp_responses_size SELECT COALESCE(SUM(size), 0) FROM kp_responses "
+                                   "WHERE NOT EXISTS (SELECT 1 FROM kp_responses_size)")
+            self._thread_local.connections[self.cache_path] = (os.getpid(), connection)
+        return connection
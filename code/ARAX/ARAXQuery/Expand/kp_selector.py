@@ -25,27 +25,27 @@ class KPSelector:
         self.log = log
         self.kg2_mode = kg2_mode
         self.kp_cacher = KPInfoCacher()
-        self.meta_map, self.kp_urls, self.kps_excluded_by_version, self.kps_excluded_by_maturity = self._load_cached_kp_info()
+        (self.meta_map, self.meta_map_index, self.kp_urls,
+         self.kps_excluded_by_version, self.kps_excluded_by_maturity) = self._load_cached_kp_info()
         self.valid_kps = {"infores:rtx-kg2"} if self.kg2_mode else set(self.kp_urls.keys())
         self.bh = BiolinkHelper()
 
     def _load_cached_kp_info(self) -> tuple:
         if self.kg2_mode:
             # We don't need any KP meta info when in KG2 mode, because there are no KPs to choose from
-            return None, None, None, None
+            return None, None, None, None, None
         else:
-            # Load cached KP info
-            kp_cacher = KPInfoCacher()
+            # Load cached KP info (shared across the process; only re-read when the cache file changes)
             try:
-                smart_api_info, meta_map = kp_cacher.load_kp_info_caches(self.log)
+                smart_api_info, meta_map, meta_map_index = self.kp_cacher.load_kp_info_caches(self.log)
             except Exception as e:
                 self.log.error(f"Failed to load KP info caches due to {e}", error_code="LoadKPCachesFailed")
-                return None, None, None, None
+                return None, None, None, None, None
 
             # Record None URLs for our local KPs
             allowed_kp_urls = smart_api_info["allowed_kp_urls"]
 
-            return (meta_map, allowed_kp_urls, smart_api_info["kps_excluded_by_version"],
+            return (meta_map, meta_map_index, allowed_kp_urls, smart_api_info["kps_excluded_by_version"],
                     smart_api_info["kps_excluded_by_maturity"])
 
     def get_kps_for_single_hop_qg(self, qg: QueryGraph) -> Optional[Set[str]]:
@@ -69,23 +69,15 @@ class KPSelector:
 
         symmetrical_predicates = set(filter(self.bh.is_symmetric, predicates))
 
-        # use metamap to check kp for predicate triple
+        # use the (pre-indexed) metamap to look up which kps support any of the predicate triples
         self.log.debug(f"selecting from {len(self.valid_kps)} kps")
-        accepting_kps = set()
-        for kp in self.meta_map:
-            if self._triple_is_in_meta_map(kp,
-                                           sub_categories,
-                                           predicates,
-                                           obj_categories):
-                accepting_kps.add(kp)
-            # account for symmetrical predicates by checking if kp accepts with swapped sub and obj categories
-            elif symmetrical_predicates and self._triple_is_in_meta_map(kp,
-                                                                        obj_categories,
-                                                                        symmetrical_predicates,
-                                                                        sub_categories):
-                accepting_kps.add(kp)
-            else:
-                self.log.update_query_plan(qedge_key, kp, "Skipped", "MetaKG indicates this qedge is unsupported")
+        accepting_kps = self._get_kps_supporting_triples(sub_categories, predicates, obj_categories)
+        # account for symmetrical predicates by checking which kps accept with swapped sub and obj categories
+        if symmetrical_predicates:
+            accepting_kps |= self._get_kps_supporting_triples(obj_categories, symmetrical_predicates, sub_categories)
+        accepting_kps = accepting_kps.intersection(self.meta_map)
+        for kp in set(self.meta_map).difference(accepting_kps):
+            self.log.update_query_plan(qedge_key, kp, "Skipped", "MetaKG indicates this qedge is unsupported")
         kps_missing_meta_info = self.valid_kps.difference(set(self.meta_map))
         for missing_kp in kps_missing_meta_info:
             self.log.update_query_plan(qedge_key, missing_kp, "Skipped", "No MetaKG info available")
@@ -211,6 +203,28 @@ class KPSelector:
                               for prefix in self.meta_map[kp]["prefixes"].get(category, set())}
         return supported_prefixes
 
+    def _get_kps_supporting_triples(self, subject_categories: Set[str], predicates: Set[str],
+                                    object_categories: Set[str]) -> Set[str]:
+        """
+        Returns the KPs whose meta map contains at least one of the possible (subject, predicate, object) triples.
+        Empty subject/object category sets are treated as 'any' category (like in _triple_is_in_meta_map()).
+        """
+        accepting_kps = set()
+        if subject_categories and object_categories and \
+                len(subject_categories) * len(predicates) * len(object_categories) <= len(self.meta_map_index):
+            # Cheaper to look up every possible triple than to scan the whole index
+            for triple in product(subject_categories, predicates, object_categories):
+                kps = self.meta_map_index.get(triple)
+                if kps:
+                    accepting_kps |= kps
+        else:
+            for (subject_category, predicate, object_category), kps in self.meta_map_index.items():
+                if predicate in predicates and \
+                        (not subject_categories or subject_category in subject_categories) and \
+                        (not object_categories or object_category in object_categories):
+                    accepting_kps |= kps
+        return accepting_kps
+
     def _triple_is_in_meta_map(self, kp: str,
                                subject_categories: Set[str],
                                predicates: Set[str],
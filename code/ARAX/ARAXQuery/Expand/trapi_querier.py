@@ -8,6 +8,7 @@ from collections import defaultdict
 
 import aiohttp
 import asyncio
+import ijson
 import requests
 from typing import List, Dict, Set, Union, Optional, Tuple
 
@@ -17,6 +18,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import Expand.expand_utilities as eu
 from Expand.expand_utilities import QGOrganizedKnowledgeGraph
 from Expand.kp_selector import KPSelector
+from Expand.kp_response_cacher import KPResponseCacher
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../")  # ARAXQuery directory
 from ARAX_response import ARAXResponse
 from ARAX_messenger import ARAXMessenger
@@ -24,6 +26,8 @@ from ARAX_query import ARAXQuery
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../UI/OpenAPI/python-flask-server/")
 from openapi_server.models.node import Node
 from openapi_server.models.edge import Edge
+from openapi_server.models.knowledge_graph import KnowledgeGraph
+from openapi_server.models.message import Message
 from openapi_server.models.q_node import QNode
 from openapi_server.models.q_edge import QEdge
 from openapi_server.models.query_graph import QueryGraph
@@ -31,16 +35,49 @@ from openapi_server.models.result import Result
 from openapi_server.models.attribute import Attribute
 from openapi_server.models.retrieval_source import RetrievalSource
 
+# Defaults for the pooled aiohttp session that KP queries share (see create_kp_client_session()); the connection
+# limits can be set in the "kp_connections" section of config_dbs.json
+KP_CONNECTION_LIMIT = 100  # Max open connections across all KPs
+KP_CONNECTION_LIMIT_PER_KP = 10  # Max open connections to any one KP host
+KP_DNS_CACHE_TTL = 300  # Seconds to cache resolved KP hostnames for
+KP_KEEPALIVE_TIMEOUT = 60  # Seconds to keep idle connections open for reuse
+KP_EDGE_BUDGET = 1000000  # Max edges to load from any one KP's answer (see TRAPIQuerier._stream_kp_message_async())
+
+
+def create_kp_client_session(connection_limit: Optional[int] = None,
+                             connection_limit_per_kp: Optional[int] = None) -> aiohttp.ClientSession:
+    """
+    Creates an aiohttp session meant to be shared by many KP queries, so that connections (and their TCP/TLS
+    handshakes) are reused via keep-alive and bursts of queries can't open an unbounded number of sockets. Requests
+    beyond the connection limits (which default to KP_CONNECTION_LIMIT and KP_CONNECTION_LIMIT_PER_KP) wait for a
+    free connection. Must be called (and closed) within a running event loop.
+    """
+    connector = aiohttp.TCPConnector(ssl=False,
+                                     limit=connection_limit if connection_limit is not None else KP_CONNECTION_LIMIT,
+                                     limit_per_host=(connection_limit_per_kp if connection_limit_per_kp is not None
+                                                     else KP_CONNECTION_LIMIT_PER_KP),
+                                     use_dns_cache=True,
+                                     ttl_dns_cache=KP_DNS_CACHE_TTL,
+                                     keepalive_timeout=KP_KEEPALIVE_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector)
+
 
 class TRAPIQuerier:
 
     def __init__(self, response_object: ARAXResponse, kp_name: str, user_specified_kp: bool, kp_timeout: Optional[int],
-                 kp_selector: KPSelector = None, force_local: bool = False):
+                 kp_selector: KPSelector = None, force_local: bool = False,
+                 session: Optional[aiohttp.ClientSession] = None, edge_budget: int = KP_EDGE_BUDGET,
+                 bypass_cache: bool = False):
         self.log = response_object
         self.kp_infores_curie = kp_name
         self.user_specified_kp = user_specified_kp
         self.kp_timeout = kp_timeout
         self.force_local = force_local
+        self.session = session  # Pooled session to send async queries through (a one-off one is used if None)
+        self.edge_budget = edge_budget
+        self.edge_budget_message = None  # Set if this KP's answer had to be cut off at the edge budget
+        self.bypass_cache = bypass_cache
+        self.kp_response_cacher = KPResponseCacher()
         if kp_selector is None:
             kp_selector = KPSelector()
         self.kp_selector = kp_selector
@@ -229,24 +266,39 @@ class TRAPIQuerier:
         query_timeout = self._get_query_timeout_length()
         qedge_key = next(qedge_key for qedge_key in query_graph.edges)
 
+        # Use this KP's cached answer to this exact query, if we have a fresh one
+        cache_key = self.kp_response_cacher.get_cache_key(self.kp_infores_curie, request_body)
+        if not self.bypass_cache:
+            cached_answer = await self.kp_response_cacher.get_cached_answer_async(cache_key, self.kp_infores_curie)
+            if cached_answer:
+                answer_kg, cached_at = cached_answer
+                cache_age = round((time.time() - cached_at) / 60)
+                cache_hit_message = (f"Returned {len(answer_kg.edges_by_qg_id.get(qedge_key, dict()))} edges from "
+                                     f"cache (cache hit; answer is {cache_age} minutes old)")
+                self.log.debug(f"{self.kp_infores_curie}: Using cached answer")
+                self.log.update_query_plan(qedge_key, self.kp_infores_curie, "Done", cache_hit_message,
+                                           query=query_sent)
+                return answer_kg
+
         # Avoid calling the KG2 TRAPI endpoint if the 'force_local' flag is set (used only for testing/dev work)
         num_input_curies = max([len(eu.convert_to_list(qnode.ids)) for qnode in query_graph.nodes.values()])
         waiting_message = f"Query with {num_input_curies} curies sent: waiting for response"
         self.log.update_query_plan(qedge_key, self.kp_infores_curie, "Waiting", waiting_message, query=query_sent)
         start = time.time()
         if self.force_local and self.kp_infores_curie == 'infores:rtx-kg2':
-            json_response = self._answer_query_force_local(request_body)
+            kp_message = self._convert_kp_json_response_to_message(self._answer_query_force_local(request_body))
         # Otherwise send the query graph to the KP's TRAPI API
         else:
             self.log.debug(f"{self.kp_infores_curie}: Sending query to {self.kp_infores_curie} API ({self.kp_endpoint})")
-            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False)) as session:
+            session = self.session if self.session else create_kp_client_session()
+            try:
                 try:
                     async with session.post(f"{self.kp_endpoint}/query",
                                             json=request_body,
                                             headers={'accept': 'application/json'},
                                             timeout=query_timeout) as response:
                         if response.status == 200:
-                            json_response = await response.json()
+                            kp_message = await self._stream_kp_message_async(response)
                         else:
                             wait_time = round(time.time() - start)
                             http_error_message = f"Returned HTTP error {response.status} after {wait_time} seconds"
@@ -264,10 +316,20 @@ class TRAPIQuerier:
                     self.log.warning(f"{self.kp_infores_curie}: {exception_message}")
                     self.log.update_query_plan(qedge_key, self.kp_infores_curie, "Error", exception_message)
                     return QGOrganizedKnowledgeGraph()
+            finally:
+                if session is not self.session:
+                    await session.close()
 
         wait_time = round(time.time() - start)
-        answer_kg = self._load_kp_json_response(json_response, query_graph)
+        answer_kg = self._load_kp_message(kp_message, query_graph)
         done_message = f"Returned {len(answer_kg.edges_by_qg_id.get(qedge_key, dict()))} edges in {wait_time} seconds"
+        if self.edge_budget_message:
+            done_message += f" ({self.edge_budget_message})"
+        elif not self.force_local and kp_message:
+            if await self.kp_response_cacher.cache_answer_async(cache_key, self.kp_infores_curie, answer_kg):
+                done_message += " (cache bypassed)" if self.bypass_cache else " (cache miss)"
+            else:
+                self.log.debug(f"{self.kp_infores_curie}: Couldn't save this answer to the KP response cache")
         self.log.update_query_plan(qedge_key, self.kp_infores_curie, "Done", done_message)
         return answer_kg
 
@@ -334,19 +396,104 @@ class TRAPIQuerier:
         return json_response
 
     def _load_kp_json_response(self, json_response: dict, qg: QueryGraph) -> QGOrganizedKnowledgeGraph:
-        # Load the results into the object model
-        answer_kg = QGOrganizedKnowledgeGraph()
+        return self._load_kp_message(self._convert_kp_json_response_to_message(json_response), qg)
+
+    def _convert_kp_json_response_to_message(self, json_response: dict) -> Optional[Message]:
         if not json_response.get("message"):
             self.log.warning(f"{self.kp_infores_curie}: No 'message' was included in the response from {self.kp_infores_curie}. "
                              f"Response was: {json.dumps(json_response, indent=4)}")
-            return answer_kg
+            return None
         elif not json_response["message"].get("results"):
-            self.log.debug(f"{self.kp_infores_curie}: No 'results' were returned.")
             json_response["message"]["results"] = []  # Setting this to empty list helps downstream processing
+            return Message(results=[])
+        else:
+            return ARAXMessenger().from_dict(json_response["message"])
+
+    async def _stream_kp_message_async(self, response: aiohttp.ClientResponse) -> Optional[Message]:
+        """
+        Incrementally parses a KP's JSON response as its bytes arrive, deserializing each node, edge, and result as
+        soon as it is complete rather than holding the entire payload (and a parsed copy of it) in memory. Other parts
+        of the message (logs, auxiliary graphs, etc.) are never materialized. Edges beyond this KP's edge budget are
+        skipped (along with nodes used only by them), and we stop reading once nothing else we need is left to come.
+        """
+        nodes = dict()
+        edges = dict()
+        results = []
+        sections_left = {"nodes", "edges", "results"}
+        got_message = False
+        num_skipped_edges = 0
+        builder, building, depth = None, None, 0
+        async for prefix, event, value in ijson.parse_async(response.content, use_float=True):
+            # Feed events to the builder for the node/edge/result currently being read, if any
+            if building:
+                if builder:
+                    builder.event(event, value)
+                if event in ("start_map", "start_array"):
+                    depth += 1
+                elif event in ("end_map", "end_array"):
+                    depth -= 1
+                if depth == 0:
+                    section, item_key = building
+                    if builder:
+                        if section == "nodes":
+                            nodes[item_key] = self._convert_streamed_node(builder.value)
+                        elif section == "edges":
+                            edges[item_key] = Edge.from_dict(builder.value)
+                        else:
+                            results.append(Result.from_dict(builder.value))
+                    builder, building = None, None
+            elif prefix == "message" and event == "start_map":
+                got_message = True
+            elif prefix == "message.knowledge_graph.nodes" and event == "map_key":
+                builder, building = ijson.ObjectBuilder(), ("nodes", value)
+            elif prefix == "message.knowledge_graph.edges" and event == "map_key":
+                if len(edges) < self.edge_budget:
+                    builder = ijson.ObjectBuilder()
+                else:
+                    builder = None  # Just skip past this edge's events
+                    num_skipped_edges += 1
+                building = ("edges", value)
+            elif prefix == "message.results.item" and event == "start_map":
+                builder, building, depth = ijson.ObjectBuilder(), ("results", None), 1
+                builder.event(event, value)
+            elif prefix in ("message.knowledge_graph.nodes", "message.knowledge_graph.edges", "message.results") \
+                    and event in ("end_map", "end_array", "null"):
+                sections_left.discard(prefix.split(".")[-1])
+            elif prefix == "message.knowledge_graph" and event == "null":
+                sections_left.difference_update({"nodes", "edges"})
+
+            if sections_left == {"edges"} and num_skipped_edges:
+                break  # Everything else we need is already in hand, so don't bother reading the remaining edges
+
+        if not got_message:
+            self.log.warning(f"{self.kp_infores_curie}: No 'message' was included in the response from "
+                             f"{self.kp_infores_curie}.")
+            return None
+        if num_skipped_edges:
+            self.edge_budget_message = (f"answer exceeded the edge budget of {self.edge_budget} edges; "
+                                        f"skipped {num_skipped_edges}{'+' if 'edges' in sections_left else ''} edges")
+            self.log.warning(f"{self.kp_infores_curie}: Stopped loading edges; {self.edge_budget_message}")
+            node_keys_used_by_edges = {node_key for edge in edges.values() for node_key in (edge.subject, edge.object)}
+            nodes = {node_key: node for node_key, node in nodes.items() if node_key in node_keys_used_by_edges}
+        return Message(knowledge_graph=KnowledgeGraph(nodes=nodes, edges=edges), results=results)
+
+    @staticmethod
+    def _convert_streamed_node(node_dict: dict) -> Node:
+        # Mirror ARAXMessenger.from_dict(), which tolerates categories given as a string
+        if isinstance(node_dict.get("categories"), str):
+            node_dict["categories"] = [node_dict["categories"]]
+        return Node.from_dict(node_dict)
+
+    def _load_kp_message(self, kp_message: Optional[Message], qg: QueryGraph) -> QGOrganizedKnowledgeGraph:
+        # Load the results into the object model
+        answer_kg = QGOrganizedKnowledgeGraph()
+        if not kp_message:
+            return answer_kg
+        elif not kp_message.results:
+            self.log.debug(f"{self.kp_infores_curie}: No 'results' were returned.")
             return answer_kg
         else:
             self.log.debug(f"{self.kp_infores_curie}: Got results from {self.kp_infores_curie}.")
-            kp_message = ARAXMessenger().from_dict(json_response["message"])
 
         # Work around genetics provider's curie whitespace bug for now  TODO: remove once they've fixed it
         if self.kp_infores_curie == "infores:genetics-data-provider":
@@ -1,6 +1,5 @@
 # This class will overlay the normalized google distance on a message (all edges)
 #!/bin/env python3
-import functools
 import json
 import math
 import subprocess
@@ -10,8 +9,7 @@ import sqlite3
 import traceback
 import numpy as np
 from datetime import datetime
-from typing import List
-import itertools
+from typing import Dict, Iterable, List, Tuple
 import copy
 
 import random
@@ -26,6 +24,8 @@ from openapi_server.models.attribute import Attribute as EdgeAttribute
 from openapi_server.models.edge import Edge
 from openapi_server.models.q_edge import QEdge
 from openapi_server.models.retrieval_source import RetrievalSource
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/ngd/")
+from curie_to_pmids_store import CuriePMIDStore, PMID_DTYPE
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../NodeSynonymizer/")
 from node_synonymizer import NodeSynonymizer
 
@@ -49,6 +49,7 @@ class ComputeNGD:
         self.global_iter = 0
         self.ngd_database_name = RTXConfig.curie_to_pmids_path.split('/')[-1]
         self.connection, self.cursor = self._setup_ngd_database()
+        self.curie_to_pmids_store = CuriePMIDStore.open(self._get_ngd_database_path())
         self.curie_to_pmids_map = dict()
         self.ngd_normalizer = 3.5e+7 * 20  # From PubMed home page there are 35 million articles (based on the information on https://pubmed.ncbi.nlm.nih.gov/ on 08/09/2023); avg 20 MeSH terms per article
         self.first_ngd_log = True
@@ -104,13 +105,15 @@ class ComputeNGD:
                     canonicalized_curie_lookup = self._get_canonical_curies_map(list(involved_curies))
                     self.load_curie_to_pmids_data(canonicalized_curie_lookup.values())
                     added_flag = False  # check to see if any edges where added
-                    self.response.debug(f"Looping through {len(node_pairs_to_evaluate)} node pairs and calculating NGD values")
+                    self.response.debug(f"Calculating NGD values for {len(node_pairs_to_evaluate)} node pairs")
+                    canonical_curie_pairs = [(canonicalized_curie_lookup.get(subject_curie, subject_curie),
+                                              canonicalized_curie_lookup.get(object_curie, object_curie))
+                                             for (subject_curie, object_curie) in node_pairs_to_evaluate]
+                    ngd_results = self.calculate_ngd_in_bulk(canonical_curie_pairs)
                     # iterate over all pairs of these nodes, add the virtual edge, decorate with the correct attribute
-                    for (subject_curie, object_curie) in node_pairs_to_evaluate:
+                    for (subject_curie, object_curie), canonical_curie_pair in zip(node_pairs_to_evaluate, canonical_curie_pairs):
                         # create the edge attribute if it can be
-                        canonical_subject_curie = canonicalized_curie_lookup.get(subject_curie, subject_curie)
-                        canonical_object_curie = canonicalized_curie_lookup.get(object_curie, object_curie)
-                        ngd_value, pmid_set = self.calculate_ngd_fast(canonical_subject_curie, canonical_object_curie)
+                        ngd_value, pmid_set = ngd_results[canonical_curie_pair]
                         if np.isfinite(ngd_value):  # if ngd is finite, that's ok, otherwise, stay with default
                             edge_value = ngd_value
                         else:
@@ -218,13 +221,15 @@ class ComputeNGD:
             canonicalized_curie_lookup = self._get_canonical_curies_map(list(involved_curies))
             self.load_curie_to_pmids_data(canonicalized_curie_lookup.values())
             added_flag = False  # check to see if any edges where added
-            self.response.debug(f"Looping through {len(node_pairs_to_evaluate)} node pairs and calculating NGD values")
+            self.response.debug(f"Calculating NGD values for {len(node_pairs_to_evaluate)} node pairs")
+            canonical_curie_pairs = [(canonicalized_curie_lookup.get(subject_curie, subject_curie),
+                                      canonicalized_curie_lookup.get(object_curie, object_curie))
+                                     for (subject_curie, object_curie) in node_pairs_to_evaluate]
+            ngd_results = self.calculate_ngd_in_bulk(canonical_curie_pairs)
             # iterate over all pairs of these nodes, add the virtual edge, decorate with the correct attribute
-            for (subject_curie, object_curie) in node_pairs_to_evaluate:
+            for (subject_curie, object_curie), canonical_curie_pair in zip(node_pairs_to_evaluate, canonical_curie_pairs):
                 # create the edge attribute if it can be
-                canonical_subject_curie = canonicalized_curie_lookup.get(subject_curie, subject_curie)
-                canonical_object_curie = canonicalized_curie_lookup.get(object_curie, object_curie)
-                ngd_value, pmid_set = self.calculate_ngd_fast(canonical_subject_curie, canonical_object_curie)
+                ngd_value, pmid_set = ngd_results[canonical_curie_pair]
                 if np.isfinite(ngd_value):  # if ngd is finite, that's ok, otherwise, stay with default
                     edge_value = ngd_value
                 else:
@@ -328,17 +333,16 @@ class ComputeNGD:
                 # Map all nodes to their canonicalized curies in one batch (need canonical IDs for the local NGD system)
                 canonicalized_curie_map = self._get_canonical_curies_map([key for key in self.message.knowledge_graph.nodes.keys()])
                 self.load_curie_to_pmids_data(canonicalized_curie_map.values())
-                self.response.debug(f"Looping through edges and calculating NGD values")
-                for edge in self.message.knowledge_graph.edges.values():
+                self.response.debug(f"Calculating NGD values for all edges")
+                canonical_curie_pairs = [(canonicalized_curie_map.get(edge.subject, edge.subject),
+                                          canonicalized_curie_map.get(edge.object, edge.object))
+                                         for edge in self.message.knowledge_graph.edges.values()]
+                ngd_results = self.calculate_ngd_in_bulk(canonical_curie_pairs)
+                for edge, canonical_curie_pair in zip(self.message.knowledge_graph.edges.values(), canonical_curie_pairs):
                     # Make sure the attributes are not None
                     if not edge.attributes:
                         edge.attributes = []  # should be an array, but why not a list?
-                    # now go and actually get the NGD
-                    subject_curie = edge.subject
-                    object_curie = edge.object
-                    canonical_subject_curie = canonicalized_curie_map.get(subject_curie, subject_curie)
-                    canonical_object_curie = canonicalized_curie_map.get(object_curie, object_curie)
-                    ngd_value, pmid_set = self.calculate_ngd_fast(canonical_subject_curie, canonical_object_curie)
+                    ngd_value, pmid_set = ngd_results[canonical_curie_pair]
                     if np.isfinite(ngd_value):  # if ngd is finite, that's ok, otherwise, stay with default
                         edge_value = ngd_value
                     else:
@@ -361,8 +365,18 @@ class ComputeNGD:
         return self.response
 
     def load_curie_to_pmids_data(self, canonicalized_curies):
+        curies = list(set(canonicalized_curies).difference(self.curie_to_pmids_map))
+        if self.curie_to_pmids_store:
+            self.response.debug(f"Looking up PMID lists in the curie->PMIDs store for relevant nodes")
+            try:
+                self.curie_to_pmids_map.update(self.curie_to_pmids_store.get_pmids(curies))
+                return
+            except ValueError:
+                # The store was rebuilt after we opened it; switch to the rebuilt one, or to sqlite if it isn't complete
+                self.response.debug(f"The curie->PMIDs store has been rebuilt; reopening it")
+                self.curie_to_pmids_store = CuriePMIDStore.open(self._get_ngd_database_path())
+                return self.load_curie_to_pmids_data(curies)
         self.response.debug(f"Extracting PMID lists from sqlite database for relevant nodes")
-        curies = list(set(canonicalized_curies))
         chunk_size = 20000
         num_chunks = len(curies) // chunk_size if len(curies) % chunk_size == 0 else (len(curies) // chunk_size) + 1
         start_index = 0
@@ -373,54 +387,76 @@ class ComputeNGD:
             self.cursor.execute(f"SELECT * FROM curie_to_pmids WHERE curie in ({curie_list_str})")
             rows = self.cursor.fetchall()
             for row in rows:
-                self.curie_to_pmids_map[row[0]] = json.loads(row[1])  # PMID list is stored as JSON string in sqlite db
+                # PMID list is stored as JSON string in sqlite db; decode it just once, into a sorted, deduplicated array
+                self.curie_to_pmids_map[row[0]] = self._get_pmids_array(json.loads(row[1]))
             start_index += chunk_size
             stop_index += chunk_size
 
+    @staticmethod
+    def _get_pmids_array(pmids: List[int]) -> np.ndarray:
+        # Use the store's compact PMID dtype when the PMIDs fit in it (as they all do at present), but never truncate
+        pmids_array = np.unique(np.array(pmids, dtype=np.int64))
+        pmid_dtype_info = np.iinfo(PMID_DTYPE)
+        if not len(pmids_array) or (pmids_array[0] >= pmid_dtype_info.min and pmids_array[-1] <= pmid_dtype_info.max):
+            pmids_array = pmids_array.astype(PMID_DTYPE)
+        return pmids_array
+
     def calculate_ngd_fast(self, subject_curie, object_curie):
-        if subject_curie in self.curie_to_pmids_map and object_curie in self.curie_to_pmids_map:
-            pubmed_ids_for_curies = [self.curie_to_pmids_map.get(subject_curie),
-                                     self.curie_to_pmids_map.get(object_curie)]
-            pubmed_id_set = set(self.curie_to_pmids_map.get(subject_curie)).intersection(set(self.curie_to_pmids_map.get(object_curie)))
-            n_pmids = len(pubmed_id_set)
-            if n_pmids > 30:
-                if self.first_ngd_log:
-                    #self.response.debug(f"{n_pmids} publications found for edge ({subject_curie})-[]-({object_curie}) limiting to 30...")
-                    self.response.debug(f"More than 30 publications found for some edges limiting to 30...")
-                    self.first_ngd_log = False
-                # limited_pmids = set()
-                # for i, val in enumerate(itertools.islice(pubmed_id_set, 30)):
-                #     limited_pmids.add(val)
-                # pubmed_id_set = limited_pmids
-                pubmed_id_set = set([val for val in itertools.islice(pubmed_id_set, 30)])
-            counts_res = self._compute_marginal_and_joint_counts(pubmed_ids_for_curies)
-            return self._compute_multiway_ngd_from_counts(*counts_res), pubmed_id_set
-        else:
-            return math.nan, {}
+        return self.calculate_ngd_in_bulk([(subject_curie, object_curie)])[(subject_curie, object_curie)]
+
+    def calculate_ngd_in_bulk(self, canonical_curie_pairs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Tuple[float, List[int]]]:
+        """
+        Computes the NGD (and a sample of up to 30 shared PMIDs) for each of the given pairs of canonical curies, whose
+        PMIDs must already be loaded via load_curie_to_pmids_data(). Pairs missing PMIDs get NaN and no PMIDs.
+        """
+        ngd_results = dict()
+        computable_pairs = []
+        for curie_pair in set(canonical_curie_pairs):
+            if curie_pair[0] in self.curie_to_pmids_map and curie_pair[1] in self.curie_to_pmids_map:
+                computable_pairs.append(curie_pair)
+            else:
+                ngd_results[curie_pair] = (math.nan, [])
+        if not computable_pairs:
+            return ngd_results
+
+        marginal_counts = np.zeros((len(computable_pairs), 2), dtype=np.float64)
+        joint_counts = np.zeros(len(computable_pairs), dtype=np.float64)
+        pmid_samples = []
+        for index, (subject_curie, object_curie) in enumerate(computable_pairs):
+            subject_pmids = self.curie_to_pmids_map[subject_curie]
+            object_pmids = self.curie_to_pmids_map[object_curie]
+            shared_pmids = self._intersect_sorted_pmids(subject_pmids, object_pmids)
+            marginal_counts[index] = (len(subject_pmids), len(object_pmids))
+            joint_counts[index] = len(shared_pmids)
+            if len(shared_pmids) > 30 and self.first_ngd_log:
+                self.response.debug(f"More than 30 publications found for some edges limiting to 30...")
+                self.first_ngd_log = False
+            pmid_samples.append(shared_pmids[-30:].tolist())  # The 30 most recent (highest-numbered) PMIDs
+
+        ngd_values = self._compute_multiway_ngd_from_count_arrays(marginal_counts, joint_counts)
+        for curie_pair, ngd_value, pmid_sample in zip(computable_pairs, ngd_values.tolist(), pmid_samples):
+            ngd_results[curie_pair] = (ngd_value, pmid_sample)
+        return ngd_results
 
     @staticmethod
-    def _compute_marginal_and_joint_counts(concept_pubmed_ids: List[List[int]]) -> list:
-        return [list(map(lambda pmid_list: len(set(pmid_list)), concept_pubmed_ids)),
-                len(functools.reduce(lambda pmids_intersec_cumul, pmids_next:
-                                     set(pmids_next).intersection(pmids_intersec_cumul),
-                                     concept_pubmed_ids))]
-
-    def _compute_multiway_ngd_from_counts(self, marginal_counts: List[int],
-                                          joint_count: int) -> float:
-        # Make sure that things are within the right domain for the logs
-        # Should also make sure things are not negative, but I'll just do this with a ValueError
-        if None in marginal_counts:
-            return math.nan
-        elif 0 in marginal_counts or 0. in marginal_counts:
-            return math.nan
-        elif joint_count == 0 or joint_count == 0.:
-            return math.nan
-        else:
-            try:
-                return (max([math.log(count) for count in marginal_counts]) - math.log(joint_count)) / \
-                   (math.log(self.ngd_normalizer) - min([math.log(count) for count in marginal_counts]))
-            except ValueError:
-                return math.nan
+    def _intersect_sorted_pmids(pmids_a: np.ndarray, pmids_b: np.ndarray) -> np.ndarray:
+        # Binary-search the smaller sorted array's PMIDs in the larger one, rather than merging the two
+        smaller, larger = (pmids_a, pmids_b) if len(pmids_a) <= len(pmids_b) else (pmids_b, pmids_a)
+        if len(smaller) == 0:
+            return smaller
+        positions = np.searchsorted(larger, smaller)
+        positions[positions == len(larger)] = 0
+        return smaller[larger[positions] == smaller]
+
+    def _compute_multiway_ngd_from_count_arrays(self, marginal_counts: np.ndarray,
+                                                joint_counts: np.ndarray) -> np.ndarray:
+        # Counts of zero make the logs undefined, so NGD is NaN for those pairs
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_marginal_counts = np.log(marginal_counts)
+            ngd_values = (log_marginal_counts.max(axis=1) - np.log(joint_counts)) / \
+                         (math.log(self.ngd_normalizer) - log_marginal_counts.min(axis=1))
+        ngd_values[(marginal_counts == 0).any(axis=1) | (joint_counts == 0)] = math.nan
+        return ngd_values
 
     def _get_canonical_curies_map(self, curies):
         self.response.debug(f"Canonicalizing curies of relevant nodes using NodeSynonymizer")
@@ -441,13 +477,16 @@ class ComputeNGD:
                     canonical_curies_map[input_curie] = input_curie
             return canonical_curies_map
 
-    def _setup_ngd_database(self):
+    def _get_ngd_database_path(self):
         ngd_filepath = os.path.sep.join([*pathlist[:(RTXindex + 1)],
                                          'code',
                                          'ARAX',
                                          'KnowledgeSources',
                                          'NormalizedGoogleDistance'])
-        db_path_local = f"{ngd_filepath}{os.path.sep}{self.ngd_database_name}"
+        return f"{ngd_filepath}{os.path.sep}{self.ngd_database_name}"
+
+    def _setup_ngd_database(self):
+        db_path_local = self._get_ngd_database_path()
         # Set up a connection to the database so it's ready for use
         try:
             connection = sqlite3.connect(db_path_local)
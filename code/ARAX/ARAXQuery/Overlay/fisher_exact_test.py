@@ -4,11 +4,14 @@
 
 # relative imports
 import scipy.stats as stats
+import numpy as np
 import traceback
 import sys
 import os
 import re
+import json
 import multiprocessing
+import threading
 from datetime import datetime
 from neo4j import GraphDatabase, basic_auth
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../../")
@@ -27,8 +30,66 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import overlay_utilities as ou
 import collections
 import sqlite3
+
+
+_kg2c_connections = threading.local()
+_neighbor_count_columns = dict()
+_category_counts = dict()
+
+
+def get_kg2c_connection(sqlite_file_path: str) -> sqlite3.Connection:
+    # Read-only connections are kept open (one per thread) so repeated FET runs reuse the same warm page cache
+    connections = getattr(_kg2c_connections, "connections", None)
+    if connections is None or _kg2c_connections.pid != os.getpid():
+        connections = dict()
+        _kg2c_connections.connections = connections
+        _kg2c_connections.pid = os.getpid()
+    if sqlite_file_path not in connections:
+        connection = sqlite3.connect(f"file:{sqlite_file_path}?mode=ro", uri=True)
+        connection.execute("PRAGMA mmap_size = 1073741824")
+        connections[sqlite_file_path] = connection
+    return connections[sqlite_file_path]
+
+
+def compute_fisher_exact_pvalues(a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+    """
+    Vectorized two-sided Fisher's exact test p-values for the 2x2 tables [[a, b], [c, d]]. This follows the same
+    approach as scipy.stats.fisher_exact: one tail starts at the observed count, and a binary search (done on all
+    tables at once) finds where the opposite tail starts, on the other side of the mode.
+    """
+    a, b, c, d = (np.asarray(counts, dtype=np.int64) for counts in (a, b, c, d))
+    total, row_total, col_total = a + b + c + d, a + b, a + c
+    hypergeom = stats.hypergeom(total, row_total, col_total)
+    mode = (col_total + 1) * (row_total + 1) // (total + 2)
+    pexact = hypergeom.pmf(a)
+    pmode = hypergeom.pmf(mode)
+    threshold = pexact * (1 + 1e-14)
+
+    # Below the mode, the opposite tail starts at the first count above the mode that's no more likely than observed;
+    # above the mode, it ends at the last count below the mode that's no more likely than observed
+    is_below_mode = a < mode
+    low, high = np.where(is_below_mode, mode, 0), np.where(is_below_mode, col_total + 1, mode + 1)
+    while np.any(low < high):
+        middle = (low + high) // 2
+        pmf_middle = hypergeom.pmf(middle)
+        is_past_boundary = np.where(is_below_mode, pmf_middle < threshold, pmf_middle > threshold)
+        searching = low < high
+        high = np.where(searching & is_past_boundary, middle, high)
+        low = np.where(searching & ~is_past_boundary, middle + 1, low)
+    pvalues = np.where(is_below_mode,
+                       hypergeom.cdf(a) + hypergeom.sf(low - 1),
+                       hypergeom.sf(a - 1) + hypergeom.cdf(low - 1))
+    pvalues[np.abs(pexact - pmode) / np.maximum(pexact, pmode) <= 1e-14] = 1.0
+    pvalues[(row_total == 0) | (c + d == 0) | (col_total == 0) | (b + d == 0)] = 1.0  # Degenerate tables
+    return np.minimum(pvalues, 1.0)
+
+
 class ComputeFTEST:
 
+    pvalue_pool_threshold = 200000  # Candidate sets at least this big have their p-values computed by a process pool
+    pvalue_pool_size = 8
+    max_sql_variables = 999
+
     #### Constructor
     def __init__(self, response, message, parameters):
         self.response = response
@@ -351,38 +412,27 @@ class ComputeFTEST:
             self.response.debug(f"Computing Fisher's Exact Test P-value")
             # calculate FET p-value for each target node in parallel
 
-            parameter_list = []
-            del_list = []
-            for node in object_node_dict:
-                temp = [len(object_node_dict[node]), size_of_object[node]-len(object_node_dict[node]), size_of_query_sample - len(object_node_dict[node]), (size_of_total - size_of_object[node]) - (size_of_query_sample - len(object_node_dict[node]))]
-                if any([value < 0 for value in temp]) is True:
-                    del_list.append(node)
-                    self.response.warning(f"Skipping node {node} to calculate FET p-value due to issue1438 (which causes negative value).")
-
-            for del_node in del_list:
-                del object_node_dict[del_node]
-            parameter_list = [(node, len(object_node_dict[node]), size_of_object[node]-len(object_node_dict[node]), size_of_query_sample - len(object_node_dict[node]), (size_of_total - size_of_object[node]) - (size_of_query_sample - len(object_node_dict[node]))) for node in object_node_dict]
+            object_nodes = list(object_node_dict)
+            a = np.array([len(object_node_dict[node]) for node in object_nodes], dtype=np.int64)
+            b = np.array([size_of_object[node] for node in object_nodes], dtype=np.int64) - a
+            c = size_of_query_sample - a
+            d = (size_of_total - (a + b)) - c
+            has_negative_count = (a < 0) | (b < 0) | (c < 0) | (d < 0)
+            for node in np.array(object_nodes, dtype=object)[has_negative_count]:
+                del object_node_dict[node]
+                self.response.warning(f"Skipping node {node} to calculate FET p-value due to issue1438 (which causes negative value).")
+            object_nodes = list(object_node_dict)
 
             try:
-                # with multiprocessing.Pool() as executor:
-                #     FETpvalue_list = [elem for elem in executor.map(self._calculate_FET_pvalue_parallel, parameter_list)]
-                FETpvalue_list = [elem for elem in map(self._calculate_FET_pvalue_parallel, parameter_list)]
+                pvalues = self._calculate_FET_pvalues(a[~has_negative_count], b[~has_negative_count],
+                                                      c[~has_negative_count], d[~has_negative_count])
             except:
                 tb = traceback.format_exc()
                 error_type, error, _ = sys.exc_info()
                 self.response.error(tb, error_code=error_type.__name__)
                 self.response.error(f"Something went wrong with computing Fisher's Exact Test P-value")
                 return self.response
-
-            if any([type(elem) is list for elem in FETpvalue_list]):
-                for msg in [elem2 for elem1 in FETpvalue_list if type(elem1) is list for elem2 in elem1]:
-                    if type(msg) is tuple:
-                        self.response.error(msg[0], error_code=msg[1])
-                    else:
-                        self.response.error(msg)
-                return self.response
-            else:
-                output = dict(FETpvalue_list)
+            output = dict(zip(object_nodes, pvalues.tolist()))
 
             # check if the results need to be filtered
             output = dict(sorted(output.items(), key=lambda x: x[1]))
@@ -467,27 +517,11 @@ class ComputeFTEST:
             mapping = {node:normalized_nodes[node]['preferred_curie'] for node in normalized_nodes if normalized_nodes[node] is not None}
             failure_nodes += list(normalized_nodes.keys() - mapping.keys())
             query_nodes = list(set(mapping.values()))
-            query_nodes = [curie_id.replace("'", "''") if "'" in curie_id else curie_id for curie_id in query_nodes]
-            # special_curie_ids = [curie_id for curie_id in query_nodes if "'" in curie_id]
-
-            # Get connected to kg2c sqlite
-            connection = sqlite3.connect(self.sqlite_file_path)
-            cursor = connection.cursor()
-
-            # Extract the neighbor count data
-            node_keys_str = "','".join(query_nodes)  # SQL wants ('node1', 'node2') format for string lists
-            sql_query = f"SELECT N.id, N.neighbor_counts " \
-                        f"FROM neighbors AS N " \
-                        f"WHERE N.id IN ('{node_keys_str}')"
-            cursor.execute(sql_query)
-            rows = cursor.fetchall()
-            rows = [curie_id.replace("\'","'").replace("''", "'") if "'" in curie_id else curie_id for curie_id in rows]
-            connection.close()
-
-            # Load the counts into a dictionary
-            neighbor_counts_dict = {row[0]:eval(row[1]) for row in rows}
-
-            res_dict = {node:neighbor_counts_dict[mapping[node]].get(adjacent_type) for node in mapping if mapping[node] in neighbor_counts_dict and neighbor_counts_dict[mapping[node]].get(adjacent_type) is not None}
+
+            # Extract the neighbor count data from kg2c sqlite
+            neighbor_counts_dict = self._get_neighbor_counts(query_nodes, adjacent_type)
+
+            res_dict = {node:neighbor_counts_dict[mapping[node]] for node in mapping if mapping[node] in neighbor_counts_dict}
             failure_nodes += list(mapping.keys() - res_dict.keys())
 
             if len(failure_nodes) != 0:
@@ -581,51 +615,54 @@ class ComputeFTEST:
         node_type = ComputeFTEST.convert_string_to_snake_case(node_type.replace('biolink:',''))
         node_type = ComputeFTEST.convert_string_biolinkformat(node_type)
 
-        # Get connected to kg2c sqlite
-        connection = sqlite3.connect(self.sqlite_file_path)
-        cursor = connection.cursor()
-
-        # Extract total count of nodes with certain type in kg2c
-        sql_query = f"SELECT C.count " \
-                    f"FROM category_counts AS C " \
-                    f"WHERE C.category = '{node_type}'"
-
-        cursor.execute(sql_query)
-        rows = cursor.fetchall()
-        size_of_total = rows[0][0]
-        connection.close()
+        # Extract total count of nodes with certain type in kg2c (these are small, so they're all loaded just once)
+        if self.sqlite_file_path not in _category_counts:
+            connection = get_kg2c_connection(self.sqlite_file_path)
+            _category_counts[self.sqlite_file_path] = dict(connection.execute("SELECT C.category, C.count FROM category_counts AS C"))
+        size_of_total = _category_counts[self.sqlite_file_path][node_type]
 
         return size_of_total
 
-    def _calculate_FET_pvalue_parallel(self, this):
-        # *Note*: The arugment 'this' is a list containing five sub-arguments below since this function is exectued in parallel.
-        # This method is expected to be run within this class
+    def _get_neighbor_counts(self, curies, adjacent_type):
         """
-        Calculate Fisher Exact Test' p-value.
-        *param this is a list containing five sub-arguments below since this function is exectued in parallel.
-        :return a list of FET p-values
+        Get the number of neighbors of the given category that each of the given (canonical) curies has in KG2c
+        :return a dict mapping curies to neighbor counts (curies with no such neighbors are left out)
         """
-        #:sub-argument node: (required) the curie name of node, eg. "UniProtKB:Q13330"
-        #:sub-argument a: (required) count of in_sample and in_pathway
-        #:sub-argument b: (required) count of not_in_sample but in_pathway
-        #:sub-argument c: (required) count of in_sample but not in_pathway
-        #:sub-argument d: (required) count of not in_sample and not in_pathway
-
-        # this should contain five variables and assign them to different variables
-        node, a, b, c, d = this
-        error_message = []
-
-        try:
-            contingency_table = [[a, b], [c, d]]
-            pvalue = stats.fisher_exact(contingency_table)[1]
-            return (node, pvalue)
-        except:
-            tb = traceback.format_exc()
-            error_type, error, _ = sys.exc_info()
-            error_message.append((tb, error_type.__name__))
-            error_message.append(f"Something went wrong for target node {node} to calculate FET p-value")
-            error_message.append(f"a, b, c, d are respectively {a}, {b}, {c}, {d} ")
-            return error_message
+        connection = get_kg2c_connection(self.sqlite_file_path)
+        if self.sqlite_file_path not in _neighbor_count_columns:
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(neighbor_counts_by_category)")]
+            _neighbor_count_columns[self.sqlite_file_path] = set(columns[1:]) if columns else None
+        category_columns = _neighbor_count_columns[self.sqlite_file_path]
+
+        neighbor_counts = dict()
+        for start_index in range(0, len(curies), self.max_sql_variables):
+            batch = curies[start_index:start_index + self.max_sql_variables]
+            placeholders = ", ".join("?" * len(batch))
+            if category_columns is None:
+                # Older kg2c.sqlite files only have the neighbor counts as JSON strings
+                rows = connection.execute(f"SELECT N.id, N.neighbor_counts FROM neighbors AS N WHERE N.id IN ({placeholders})", batch)
+                neighbor_counts.update({curie: json.loads(counts_json).get(adjacent_type) for curie, counts_json in rows})
+            elif adjacent_type in category_columns:
+                rows = connection.execute(f'SELECT id, "{adjacent_type}" FROM neighbor_counts_by_category WHERE id IN ({placeholders})', batch)
+                neighbor_counts.update(rows)
+        return {curie: count for curie, count in neighbor_counts.items() if count is not None}
+
+    def _calculate_FET_pvalues(self, a, b, c, d):
+        """
+        Calculate Fisher Exact Test' p-values for a set of target nodes all at once.
+        :param a: count of in_sample and in_pathway for each target node
+        :param b: count of not_in_sample but in_pathway for each target node
+        :param c: count of in_sample but not in_pathway for each target node
+        :param d: count of not in_sample and not in_pathway for each target node
+        :return a numpy array of FET p-values
+        """
+        if len(a) < self.pvalue_pool_threshold:
+            return compute_fisher_exact_pvalues(a, b, c, d)
+        num_processes = min(self.pvalue_pool_size, multiprocessing.cpu_count())
+        self.response.debug(f"Computing FET p-values for {len(a)} target nodes using {num_processes} processes")
+        chunks = list(zip(*(np.array_split(counts, num_processes) for counts in (a, b, c, d))))
+        with multiprocessing.Pool(num_processes) as executor:
+            return np.concatenate(executor.starmap(compute_fisher_exact_pvalues, chunks))
 
     @staticmethod
     def convert_string_to_snake_case(input_string: str) -> str:
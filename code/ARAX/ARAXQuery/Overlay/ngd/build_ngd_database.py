@@ -12,6 +12,8 @@ There are two halves to the (full) build process:
      - Contains mappings from canonicalized curies to their list of PMIDs based on the data scraped from Pubmed AND
        from KG2 data (node.publications and edge.publications)
      - The NodeSynonymizer is used to link curies to concept names from step 1
+     - The same mappings are also written to a memory-mapped binary store (see curie_to_pmids_store.py) that NGD
+       reads from at query time
 Usage: python build_ngd_database.py [--test] [--full]
        By default, only step 2 above will be performed. To do a "full" build, use the --full flag.
 """
@@ -40,6 +42,7 @@ sys.path.append(os.path.sep.join([*pathlist[:(RTXindex + 1)], 'code', 'ARAX', 'N
 from node_synonymizer import NodeSynonymizer
 sys.path.append(os.path.sep.join([*pathlist[:(RTXindex + 1)], 'code']))  # code directory
 from RTXConfiguration import RTXConfiguration
+from curie_to_pmids_store import build_curie_to_pmids_store
 
 
 class NGDDatabaseBuilder:
@@ -145,6 +148,7 @@ class NGDDatabaseBuilder:
         self._add_pmids_from_kg2_nodes(curie_to_pmids_map)
         logging.info(f"  In the end, found PMID lists for {len(curie_to_pmids_map)} (canonical) curies")
         self._save_data_in_sqlite_db(curie_to_pmids_map)
+        self._save_data_in_pmids_store(curie_to_pmids_map)
         logging.info(f"Done! Building {self.curie_to_pmids_db_name} took {round((time.time() - start) / 60)} minutes.")
 
     # Helper methods
@@ -241,6 +245,13 @@ class NGDDatabaseBuilder:
         logging.info(f"  Done saving data in sqlite; database contains {count} rows.")
         cursor.close()
 
+    def _save_data_in_pmids_store(self, curie_to_pmids_map):
+        logging.info("  Saving data in memory-mapped curie->PMIDs store..")
+        build_curie_to_pmids_store(((curie, filter(None, {self._get_local_id_as_int(pmid) for pmid in pmids}))
+                                    for curie, pmids in curie_to_pmids_map.items()),
+                                   self.curie_to_pmids_db_path)
+        logging.info(f"  Done saving data in curie->PMIDs store.")
+
     def _get_canonicalized_curies_dict(self, curies: List[str]) -> Dict[str, str]:
         logging.info(f"  Sending a batch of {len(curies)} curies to NodeSynonymizer.get_canonical_curies()")
         canonicalized_nodes_info = self.synonymizer.get_canonical_curies(curies)
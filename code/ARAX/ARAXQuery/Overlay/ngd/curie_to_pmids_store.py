@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+A compact, memory-mapped version of the curie->PMIDs data in the NGD sqlite database. It consists of two files:
+  1. "<name>.pmids.int32" - every curie's sorted, deduplicated PMIDs concatenated into one raw little-endian int32 array,
+     followed by the store's 16-byte build id
+  2. "<name>.index.sqlite" - a table mapping each curie to the offset and length of its PMIDs in that array, plus the
+     build id and the length of the array
+The build id lets readers tell that the two files came from the same build (the files are replaced one at a time, and
+a process may still have an older version of one of them open).
+At query time the PMID array is memory-mapped, so looking up a curie's PMIDs costs no decoding and all worker processes
+share a single page-cache copy of the data.
+Usage: python curie_to_pmids_store.py <path to curie_to_pmids sqlite database>
+       (Builds the store next to the given sqlite database, which is how build_ngd_database.py creates it too.)
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+PMID_DTYPE = np.dtype("<i4")
+BUILD_ID_SIZE = 16  # Bytes
+
+
+def get_curie_to_pmids_store_paths(curie_to_pmids_db_path: str) -> Tuple[str, str]:
+    base_path = curie_to_pmids_db_path[:-len(".sqlite")] if curie_to_pmids_db_path.endswith(".sqlite") else curie_to_pmids_db_path
+    return f"{base_path}.index.sqlite", f"{base_path}.pmids.int32"
+
+
+def build_curie_to_pmids_store(curie_to_pmids: Iterable[Tuple[str, Iterable[int]]], curie_to_pmids_db_path: str):
+    """
+    Writes the store for the given (curie, PMIDs) pairs next to the given curie_to_pmids sqlite database. Files are
+    written under temporary names and then moved into place, so readers never see a partially built store. PMIDs that
+    don't fit in the store's PMID dtype are left out (and counted in a warning).
+    """
+    index_path, pmids_path = get_curie_to_pmids_store_paths(curie_to_pmids_db_path)
+    temp_index_path, temp_pmids_path = f"{index_path}.tmp", f"{pmids_path}.tmp"
+    if os.path.exists(temp_index_path):
+        os.remove(temp_index_path)
+    connection = sqlite3.connect(temp_index_path)
+    connection.execute("CREATE TABLE curie_index (curie TEXT PRIMARY KEY, start INTEGER, length INTEGER) WITHOUT ROWID")
+    connection.execute("CREATE TABLE store_info (build_id BLOB, num_pmids INTEGER)")
+    pmid_dtype_info = np.iinfo(PMID_DTYPE)
+    offset = 0
+    index_rows = []
+    num_dropped_pmids = 0
+    curies_with_dropped_pmids = []
+    with open(temp_pmids_path, "wb") as pmids_file:
+        for curie, pmids in curie_to_pmids:
+            pmids_array = np.unique(np.fromiter(pmids, dtype=np.int64))
+            if len(pmids_array) and (pmids_array[0] < pmid_dtype_info.min or pmids_array[-1] > pmid_dtype_info.max):
+                in_range = (pmids_array >= pmid_dtype_info.min) & (pmids_array <= pmid_dtype_info.max)
+                num_dropped_pmids += len(pmids_array) - int(in_range.sum())
+                curies_with_dropped_pmids.append(curie)
+                pmids_array = pmids_array[in_range]
+            pmids_array = pmids_array.astype(PMID_DTYPE)
+            pmids_file.write(pmids_array.tobytes())
+            index_rows.append((curie, offset, len(pmids_array)))
+            offset += len(pmids_array)
+            if len(index_rows) >= 5000:
+                connection.executemany("INSERT INTO curie_index VALUES (?, ?, ?)", index_rows)
+                index_rows = []
+        build_id = uuid.uuid4().bytes
+        pmids_file.write(build_id)
+    connection.executemany("INSERT INTO curie_index VALUES (?, ?, ?)", index_rows)
+    connection.execute("INSERT INTO store_info VALUES (?, ?)", (build_id, offset))
+    connection.commit()
+    connection.close()
+    os.replace(temp_pmids_path, pmids_path)
+    os.replace(temp_index_path, index_path)
+    if num_dropped_pmids:
+        logging.warning(f"Left {num_dropped_pmids} PMIDs that don't fit in {PMID_DTYPE} out of the curie->PMIDs store; "
+                        f"they belonged to {len(curies_with_dropped_pmids)} curies (e.g., "
+                        f"{curies_with_dropped_pmids[:5]})")
+
+
+def build_curie_to_pmids_store_from_sqlite(curie_to_pmids_db_path: str):
+    connection = sqlite3.connect(curie_to_pmids_db_path)
+    rows = connection.execute("SELECT curie, pmids FROM curie_to_pmids")
+    build_curie_to_pmids_store(((curie, json.loads(pmids_json)) for curie, pmids_json in rows), curie_to_pmids_db_path)
+    connection.close()
+
+
+class CuriePMIDStore:
+    """
+    Read-only access to a curie->PMIDs store built by build_curie_to_pmids_store(). Use open() rather than the
+    constructor so that the memory map is shared by everything in the process.
+    """
+
+    _open_stores = dict()
+    _open_stores_lock = threading.Lock()
+    max_sql_variables = 999
+
+    def __init__(self, index_path: str, pmids_path: str, build_id: bytes, num_pmids: int):
+        """Raises ValueError if the PMID array at pmids_path isn't the one from the given build"""
+        self.index_path = index_path
+        self.build_id = build_id
+        with open(pmids_path, "rb") as pmids_file:
+            # Checked against the already-open file, so the array mapped below is the one that was checked
+            if os.fstat(pmids_file.fileno()).st_size != num_pmids * PMID_DTYPE.itemsize + BUILD_ID_SIZE:
+                raise ValueError(f"{pmids_path} is not the size its index says it should be")
+            pmids_file.seek(num_pmids * PMID_DTYPE.itemsize)
+            if pmids_file.read(BUILD_ID_SIZE) != build_id:
+                raise ValueError(f"{pmids_path} is not from the same build as {index_path}")
+            # A zero-length array can't be memory-mapped (and wouldn't contain any PMIDs anyway)
+            if num_pmids:
+                self.pmids = np.memmap(pmids_file, dtype=PMID_DTYPE, mode="r", shape=(num_pmids,))
+            else:
+                self.pmids = np.zeros(0, dtype=PMID_DTYPE)
+        self._connections = threading.local()
+
+    @classmethod
+    def open(cls, curie_to_pmids_db_path: str) -> Optional["CuriePMIDStore"]:
+        """
+        Returns the store for the given curie_to_pmids sqlite database, or None if it hasn't been built (or if its
+        files are from different builds, as they briefly are while a new store is moved into place)
+        """
+        index_path, pmids_path = get_curie_to_pmids_store_paths(curie_to_pmids_db_path)
+        if not (os.path.exists(index_path) and os.path.exists(pmids_path)):
+            return None
+        connection = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+        try:
+            build_id, num_pmids = connection.execute("SELECT build_id, num_pmids FROM store_info").fetchone()
+        except (sqlite3.DatabaseError, TypeError):
+            return None  # Not a complete store index
+        finally:
+            connection.close()
+        with cls._open_stores_lock:
+            store = cls._open_stores.get((os.getpid(), index_path))
+            # A store cached before the index was rebuilt would pair the new index with the old PMID array
+            if store is None or store.build_id != build_id:
+                try:
+                    store = cls(index_path, pmids_path, build_id, num_pmids)
+                except ValueError:
+                    return None
+                cls._open_stores[(os.getpid(), index_path)] = store
+            return store
+
+    def get_pmids(self, curies: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Returns the sorted PMIDs for each of the given curies that is in the store. The arrays are read-only views
+        into the memory map, not copies. Raises ValueError if the store has been rebuilt since it was opened (in which
+        case open() returns the rebuilt store).
+        """
+        connection = getattr(self._connections, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True)
+            # The index may have been replaced by a newer build since this store's PMID array was mapped
+            if connection.execute("SELECT build_id FROM store_info").fetchone()[0] != self.build_id:
+                connection.close()
+                raise ValueError(f"{self.index_path} has been rebuilt since this store was opened; reopen it")
+            self._connections.connection = connection
+        curie_to_pmids = dict()
+        for start_index in range(0, len(curies), self.max_sql_variables):
+            batch = curies[start_index:start_index + self.max_sql_variables]
+            placeholders = ", ".join("?" * len(batch))
+            rows = connection.execute(f"SELECT curie, start, length FROM curie_index WHERE curie IN ({placeholders})",
+                                      batch)
+            for curie, start, length in rows:
+                curie_to_pmids[curie] = self.pmids[start:start + length]
+        return curie_to_pmids
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Builds the memory-mapped curie->PMIDs store used by NGD")
+    arg_parser.add_argument("curie_to_pmids_db_path")
+    args = arg_parser.parse_args()
+    if not os.path.exists(args.curie_to_pmids_db_path):
+        print(f"ERROR: {args.curie_to_pmids_db_path} does not exist", file=sys.stderr)
+        sys.exit(1)
+    build_curie_to_pmids_store_from_sqlite(args.curie_to_pmids_db_path)
+
+
+if __name__ == "__main__":
+    main()
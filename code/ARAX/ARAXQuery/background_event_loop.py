@@ -0,0 +1,120 @@
+#!/bin/env python3
+"""
+A per-process asyncio event loop that runs forever in a background thread, shared by everything in ARAX that runs
+coroutines (Expand's KP queries, KG2/Plover batches, Infer's expansions, etc.). Coroutines are submitted to it from
+any thread, and aiohttp sessions kept on it stay open between submissions, so keep-alive connections, DNS lookups
+and connection limits carry over from one hop (and query) to the next instead of being thrown away with a new loop.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import contextlib
+import os
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import aiohttp
+
+_background_event_loop = None
+_background_event_loop_lock = threading.Lock()
+
+
+class BackgroundEventLoop:
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.sessions: Dict[str, aiohttp.ClientSession] = dict()
+        self.thread = threading.Thread(target=self._run_loop, name="ARAXBackgroundEventLoop", daemon=True)
+        self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine: Awaitable) -> concurrent.futures.Future:
+        """Schedules the coroutine on the loop (from any thread) and returns a future for its result"""
+        if threading.current_thread() is self.thread:
+            # A coroutine on the loop is making a blocking call that needs the loop (e.g., a KG2 query run locally
+            # from within a KP query); waiting on the loop from its own thread would deadlock, so use a throwaway loop
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            future = executor.submit(asyncio.run, coroutine)
+            executor.shutdown(wait=False)
+            return future
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine: Awaitable, timeout: Optional[float] = None):
+        """Runs the coroutine on the loop and blocks until it's done, returning its result"""
+        return self.submit(coroutine).result(timeout)
+
+    def get_session(self, session_name: str,
+                    create_session: Callable[[], aiohttp.ClientSession]) -> Optional[aiohttp.ClientSession]:
+        """
+        Returns the named session, creating it the first time (or if it was closed). Only coroutines running on this
+        loop can use its sessions, so None is returned when called from anywhere else.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+        if running_loop is not self.loop:
+            return None
+        session = self.sessions.get(session_name)
+        if session is None or session.closed:
+            session = create_session()
+            self.sessions[session_name] = session
+        return session
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        if self.thread.is_alive():
+            self.run(self._close_sessions())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        self.loop.close()
+
+    async def _close_sessions(self):
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions = dict()
+
+
+def get_background_event_loop() -> BackgroundEventLoop:
+    """Returns this process's background event loop, starting it on first use"""
+    global _background_event_loop
+    with _background_event_loop_lock:
+        if _background_event_loop is None:
+            _background_event_loop = BackgroundEventLoop()
+        return _background_event_loop
+
+
+@contextlib.asynccontextmanager
+async def shared_client_session(session_name: str,
+                                create_session: Callable[[], aiohttp.ClientSession]) -> AsyncIterator[aiohttp.ClientSession]:
+    """
+    Yields the named session kept on the background event loop, which stays open afterwards. When used on any other
+    loop, a new session is created instead and closed on exit.
+    """
+    session = get_background_event_loop().get_session(session_name, create_session)
+    if session:
+        yield session
+    else:
+        async with create_session() as session:
+            yield session
+
+
+def _close_background_event_loop():
+    if _background_event_loop is not None:
+        _background_event_loop.close()
+
+
+def _forget_background_event_loop():
+    # The loop's thread doesn't survive fork(), so a forked child (e.g., a query-handling child of the ARAX server)
+    # starts its own loop the first time it needs one
+    global _background_event_loop, _background_event_loop_lock
+    _background_event_loop = None
+    _background_event_loop_lock = threading.Lock()
+
+
+atexit.register(_close_background_event_loop)
+os.register_at_fork(after_in_child=_forget_background_event_loop)
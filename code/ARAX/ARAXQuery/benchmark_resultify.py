@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Times Resultify on a synthetic two-hop KG shaped like a typical ARAX answer: a few pinned disease nodes (n0) linked to
+many gene nodes (n1), which are in turn linked to chemical nodes (n2), with some parallel edges along the way. Edges
+are split between the two qedges roughly 1:3 and every node/edge has its qnode/qedge keys set, as they would be after
+Expand. Prints how long building the results took and how many were created (and, with --max-results, how long it took
+to keep only the top results instead).
+Usage: python benchmark_resultify.py <num edges> [--num-inputs <num>] [--max-results <num>] [--seed <seed>]
+       (e.g., 10000, 100000, or 100000 --max-results 500)
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))  # ARAXQuery directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../UI/OpenAPI/python-flask-server/")
+import ARAX_resultify
+from ARAX_response import ARAXResponse
+from openapi_server.models.edge import Edge
+from openapi_server.models.knowledge_graph import KnowledgeGraph
+from openapi_server.models.node import Node
+from openapi_server.models.q_edge import QEdge
+from openapi_server.models.q_node import QNode
+from openapi_server.models.query_graph import QueryGraph
+
+
+def build_synthetic_kg(num_edges: int, num_inputs: int, rng: np.random.Generator) -> KnowledgeGraph:
+    num_e0_edges = max(num_inputs, num_edges // 4)
+    num_genes = max(1, num_e0_edges // 2)
+    num_chemicals = max(1, num_edges // 20)
+    nodes = dict()
+    for qnode_key, prefix, category, num_nodes in [("n0", "MONDO", "biolink:Disease", num_inputs),
+                                                   ("n1", "NCBIGene", "biolink:Gene", num_genes),
+                                                   ("n2", "CHEBI", "biolink:SmallMolecule", num_chemicals)]:
+        for num in range(num_nodes):
+            curie = f"{prefix}:{num}"
+            nodes[curie] = Node(name=curie, categories=[category], attributes=[])
+            nodes[curie].qnode_keys = [qnode_key]
+
+    edges = dict()
+    qedge_specs = [("e0", "MONDO", num_inputs, num_e0_edges), ("e1", "CHEBI", num_chemicals, num_edges - num_e0_edges)]
+    for qedge_key, prefix, num_other_nodes, num_qedge_edges in qedge_specs:
+        gene_nums = rng.integers(0, num_genes, num_qedge_edges)
+        # Popular nodes get many more edges than the rest, and some node pairs get parallel edges
+        other_nums = np.minimum(rng.zipf(1.5, num_qedge_edges) - 1, num_other_nodes - 1)
+        for edge_num, (gene_num, other_num) in enumerate(zip(gene_nums, other_nums)):
+            edge = Edge(subject=f"NCBIGene:{gene_num}", object=f"{prefix}:{other_num}", predicate="biolink:related_to",
+                        attributes=[])
+            edge.qedge_keys = [qedge_key]
+            edges[f"{qedge_key}_edge{edge_num}"] = edge
+    return KnowledgeGraph(nodes=nodes, edges=edges)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmarks Resultify on a synthetic KG")
+    arg_parser.add_argument("num_edges", type=int)
+    arg_parser.add_argument("--num-inputs", type=int, default=3)
+    arg_parser.add_argument("--max-results", type=int, default=None)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    kg = build_synthetic_kg(args.num_edges, args.num_inputs, np.random.default_rng(args.seed))
+    qg = QueryGraph(nodes={"n0": QNode(ids=[f"MONDO:{num}" for num in range(args.num_inputs)],
+                                       categories=["biolink:Disease"]),
+                           "n1": QNode(categories=["biolink:Gene"]),
+                           "n2": QNode(categories=["biolink:SmallMolecule"])},
+                    edges={"e0": QEdge(subject="n1", object="n0", predicates=["biolink:related_to"]),
+                           "e1": QEdge(subject="n1", object="n2", predicates=["biolink:related_to"])})
+    print(f"{len(kg.nodes)} nodes, {len(kg.edges)} edges")
+
+    for max_results in [None, args.max_results] if args.max_results else [None]:
+        log = ARAXResponse()
+        start = time.time()
+        results = ARAX_resultify._get_results_for_kg_by_qg(kg, qg, log=log, max_results=max_results)
+        print(f"max_results={max_results}: {round(time.time() - start, 2)} seconds, created {len(results)} results "
+              f"(status: {log.status})")
+
+
+if __name__ == "__main__":
+    main()
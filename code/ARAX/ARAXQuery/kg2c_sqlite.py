@@ -0,0 +1,185 @@
+#!/bin/env python3
+"""
+The layout of the node/edge tables in kg2c.sqlite (written by create_kg2c_files.py) and read access to them. Each node
+and edge has an integer row number; text properties are columns of the nodes/edges tables, while list properties live
+in child tables ("node_<property>"/"edge_<property>") with one row per item, so nothing needs to be decoded at query
+time. Older kg2c.sqlite files, which store list and dict properties as delimited/JSON strings, can still be read.
+"""
+import sqlite3
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+import ujson
+
+NODE_TEXT_PROPERTIES = ["iri", "description"]
+NODE_LIST_PROPERTIES = ["all_categories", "all_names", "equivalent_curies", "publications"]
+EDGE_LIST_PROPERTIES = ["publications", "kg2_ids"]
+# Maps the keys of the per-PMID dictionaries in an edge's publications_info to (typed) columns in edge_publications_info
+PUBLICATIONS_INFO_COLUMNS = {"publication date": ("publication_date", "TEXT"),
+                             "sentence": ("sentence", "TEXT"),
+                             "subject score": ("subject_score", "INTEGER"),
+                             "object score": ("object_score", "INTEGER")}
+# Any other publications_info keys (or a non-dict value for a PMID) are kept as JSON in this edge_publications_info column
+PUBLICATIONS_INFO_OTHER_COLUMN = "other_info"
+LEGACY_ARRAY_DELIMITER = "ǂ"
+
+
+def get_child_table_name(node_or_edge: str, property_name: str) -> str:
+    return f"{node_or_edge}_{property_name}"
+
+
+def get_publications_info_row_values(info: any) -> list:
+    """
+    Returns the values of the edge_publications_info columns (those in PUBLICATIONS_INFO_COLUMNS, in order, followed by
+    PUBLICATIONS_INFO_OTHER_COLUMN) for one PMID's publications_info.
+    """
+    if not isinstance(info, dict):
+        return [None] * len(PUBLICATIONS_INFO_COLUMNS) + [ujson.dumps(info)]
+    other_info = {key: value for key, value in info.items() if key not in PUBLICATIONS_INFO_COLUMNS}
+    return [info.get(info_key) for info_key in PUBLICATIONS_INFO_COLUMNS] + \
+        [ujson.dumps(other_info) if other_info else None]
+
+
+class KG2cSqliteReader:
+    """
+    Looks up node and edge properties in a kg2c.sqlite file (or, with the table names overridden, another database
+    that uses the older KG2c layout). Property values come back as Python strings, lists, and dicts.
+    """
+
+    max_sql_variables = 999
+
+    def __init__(self, sqlite_file_path: str, nodes_table: str = "nodes", edges_table: str = "edges"):
+        self.connection = sqlite3.connect(f"file:{sqlite_file_path}?mode=ro", uri=True)
+        self.nodes_table = nodes_table
+        self.edges_table = edges_table
+        table_names = {row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.is_normalized = get_child_table_name("node", "publications") in table_names
+
+    def close(self):
+        self.connection.close()
+
+    def get_node_properties(self, node_ids: Iterable[str]) -> Dict[str, Dict[str, any]]:
+        """
+        Returns the text and list properties (see NODE_TEXT_PROPERTIES/NODE_LIST_PROPERTIES) of each of the given
+        nodes that is in the database.
+        """
+        if not self.is_normalized:
+            return self._get_legacy_properties(self.nodes_table, "id", node_ids, NODE_TEXT_PROPERTIES,
+                                               NODE_LIST_PROPERTIES)
+        properties_by_node_num = dict()
+        node_ids_by_node_num = dict()
+        text_columns_str = ", ".join(NODE_TEXT_PROPERTIES)
+        for node_id_batch in self._get_batches(node_ids):
+            rows = self.connection.execute(f"SELECT node_num, id, {text_columns_str} FROM nodes "
+                                           f"WHERE id IN ({self._get_placeholders(node_id_batch)})", node_id_batch)
+            for node_num, node_id, *text_values in rows:
+                node_ids_by_node_num[node_num] = node_id
+                properties_by_node_num[node_num] = dict(zip(NODE_TEXT_PROPERTIES, text_values))
+        self._add_list_properties("node", NODE_LIST_PROPERTIES, properties_by_node_num)
+        return {node_ids_by_node_num[node_num]: properties for node_num, properties in properties_by_node_num.items()}
+
+    def get_edge_properties(self, search_keys: Iterable[str], search_key_column: str) -> Dict[str, List[Dict[str, any]]]:
+        """
+        Returns the list properties (see EDGE_LIST_PROPERTIES) and publications_info of all edges matching each of the
+        given search keys, which are values of the given column ("triple" or "node_pair").
+        """
+        assert search_key_column in {"triple", "node_pair"}
+        if not self.is_normalized:
+            return self._get_legacy_properties(self.edges_table, search_key_column, search_keys, [],
+                                               EDGE_LIST_PROPERTIES, dict_properties=["publications_info"],
+                                               allow_multiple=True)
+        properties_by_edge_num = dict()
+        search_keys_by_edge_num = dict()
+        for search_key_batch in self._get_batches(search_keys):
+            rows = self.connection.execute(f"SELECT edge_num, {search_key_column} FROM edges "
+                                           f"WHERE {search_key_column} IN ({self._get_placeholders(search_key_batch)})",
+                                           search_key_batch)
+            for edge_num, search_key in rows:
+                search_keys_by_edge_num[edge_num] = search_key
+                properties_by_edge_num[edge_num] = dict()
+        self._add_list_properties("edge", EDGE_LIST_PROPERTIES, properties_by_edge_num)
+        self._add_publications_info(properties_by_edge_num)
+        properties_by_search_key = defaultdict(list)
+        for edge_num, properties in properties_by_edge_num.items():
+            properties_by_search_key[search_keys_by_edge_num[edge_num]].append(properties)
+        return properties_by_search_key
+
+    def _add_list_properties(self, node_or_edge: str, list_properties: List[str],
+                             properties_by_num: Dict[int, Dict[str, any]]):
+        for properties in properties_by_num.values():
+            for property_name in list_properties:
+                properties[property_name] = []
+        for num_batch in self._get_batches(properties_by_num):
+            placeholders = self._get_placeholders(num_batch)
+            for property_name in list_properties:
+                rows = self.connection.execute(f"SELECT {node_or_edge}_num, value "
+                                               f"FROM {get_child_table_name(node_or_edge, property_name)} "
+                                               f"WHERE {node_or_edge}_num IN ({placeholders})", num_batch)
+                for num, value in rows:
+                    properties_by_num[num][property_name].append(value)
+
+    def _add_publications_info(self, properties_by_edge_num: Dict[int, Dict[str, any]]):
+        for properties in properties_by_edge_num.values():
+            properties["publications_info"] = dict()
+        info_keys = list(PUBLICATIONS_INFO_COLUMNS)
+        info_columns_str = ", ".join(column for column, _ in PUBLICATIONS_INFO_COLUMNS.values())
+        for edge_num_batch in self._get_batches(properties_by_edge_num):
+            rows = self.connection.execute(f"SELECT edge_num, pmid, {info_columns_str}, {PUBLICATIONS_INFO_OTHER_COLUMN} "
+                                           f"FROM {get_child_table_name('edge', 'publications_info')} "
+                                           f"WHERE edge_num IN ({self._get_placeholders(edge_num_batch)})",
+                                           edge_num_batch)
+            for edge_num, pmid, *info_values, other_info in rows:
+                info = {key: value for key, value in zip(info_keys, info_values) if value is not None}
+                if other_info is not None:
+                    other_info = ujson.loads(other_info)
+                    if isinstance(other_info, dict):
+                        info.update(other_info)
+                    else:
+                        info = other_info
+                properties_by_edge_num[edge_num]["publications_info"][pmid] = info
+
+    def _get_legacy_properties(self, table_name: str, key_column: str, keys: Iterable[str],
+                               text_properties: List[str], list_properties: List[str],
+                               dict_properties: Optional[List[str]] = None, allow_multiple: bool = False) -> dict:
+        # Older databases store every property as TEXT, with lists delimited and dicts dumped to JSON
+        dict_properties = dict_properties if dict_properties else []
+        property_names = text_properties + list_properties + dict_properties
+        columns_str = ", ".join(property_names)
+        properties_by_key = defaultdict(list) if allow_multiple else dict()
+        for key_batch in self._get_batches(keys):
+            rows = self.connection.execute(f"SELECT {key_column}, {columns_str} FROM {table_name} "
+                                           f"WHERE {key_column} IN ({self._get_placeholders(key_batch)})", key_batch)
+            for key, *raw_values in rows:
+                properties = dict()
+                for property_name, raw_value in zip(property_names, raw_values):
+                    if property_name in list_properties:
+                        properties[property_name] = [item for item in raw_value.split(LEGACY_ARRAY_DELIMITER) if item] if raw_value else []
+                    elif property_name in dict_properties:
+                        properties[property_name] = self._load_legacy_dict(raw_value)
+                    else:
+                        properties[property_name] = raw_value
+                if allow_multiple:
+                    properties_by_key[key].append(properties)
+                else:
+                    properties_by_key[key] = properties
+        return properties_by_key
+
+    @staticmethod
+    def _load_legacy_dict(raw_value: Optional[str]) -> Dict[str, any]:
+        if not raw_value:
+            return dict()
+        if '"' not in raw_value:
+            raw_value = raw_value.replace("'", '"')
+        try:
+            return ujson.loads(raw_value)
+        except Exception:
+            return dict()
+
+    def _get_batches(self, items: Iterable) -> Iterable[list]:
+        items = list(items)
+        for start_index in range(0, len(items), self.max_sql_variables):
+            yield items[start_index:start_index + self.max_sql_variables]
+
+    @staticmethod
+    def _get_placeholders(batch: list) -> str:
+        return ", ".join("?" * len(batch))
@@ -6,7 +6,8 @@ import pathlib
 import sqlite3
 import string
 import sys
-from collections import defaultdict
+import threading
+from collections import defaultdict, OrderedDict
 from typing import Optional, Union, List, Set, Dict, Tuple
 
 import pandas as pd
@@ -26,15 +27,55 @@ from openapi_server.models.edge import Edge
 from openapi_server.models.attribute import Attribute
 from openapi_server.models.retrieval_source import RetrievalSource
 
+# Read-only connections to synonymizer databases, shared by all NodeSynonymizer instances in a process. Sqlite
+# connections can't be used across threads (or forks), so there's one per thread (per process) per database.
+_connections = threading.local()
+# In-process caches of canonical info for curies, keyed by database path (see _CanonicalInfoCache)
+_canonical_info_caches = dict()
+_canonical_info_caches_lock = threading.Lock()
+
+
+class _CanonicalInfoCache:
+    """
+    A thread-safe, size-bounded LRU cache of capitalized curie -> canonical info (or None if the curie is not in
+    the synonymizer). Values are returned as copies since callers tend to modify the dicts they get back.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, curies: Set[str]) -> Dict[str, Optional[dict]]:
+        found = dict()
+        with self.lock:
+            for curie in curies:
+                if curie in self.entries:
+                    self.entries.move_to_end(curie)
+                    canonical_info = self.entries[curie]
+                    found[curie] = dict(canonical_info) if canonical_info else None
+        return found
+
+    def put_many(self, canonical_infos: Dict[str, Optional[dict]]):
+        with self.lock:
+            for curie, canonical_info in canonical_infos.items():
+                self.entries[curie] = dict(canonical_info) if canonical_info else None
+                self.entries.move_to_end(curie)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
 
 class NodeSynonymizer:
 
+    canonical_info_cache_size = 500000  # Max number of curies to remember canonical info for
+    max_sql_variables = 999  # Older sqlite versions don't allow more than this many '?' parameters per query
+
     def __init__(self):
         self.rtx_config = RTXConfiguration()
         self.database_name = self.rtx_config.node_synonymizer_path.split("/")[-1]
         synonymizer_dir = os.path.dirname(os.path.abspath(__file__))
         self.database_path = f"{synonymizer_dir}/{self.database_name}"
-        self.placeholder_lookup_values_str = "**LOOKUP_VALUES_GO_HERE**"
+        self.placeholder_lookup_values_str = "**LOOKUP_VALUES_GO_HERE**"  # Replaced with '?' parameter markers
         self.unnecessary_chars_map = {ord(char): None for char in string.punctuation + string.whitespace}
         self.kg2_infores_curie = "infores:rtx-kg2"
         self.sri_nn_infores_curie = "infores:sri-node-normalizer"
@@ -43,12 +84,30 @@ class NodeSynonymizer:
         if not pathlib.Path(self.database_path).exists():
             raise ValueError(f"Synonymizer specified in config_dbs file does not exist locally."
                              f" It should be at: {self.database_path}")
-        else:
-            self.db_connection = sqlite3.connect(self.database_path)
+        with _canonical_info_caches_lock:
+            if self.database_path not in _canonical_info_caches:
+                _canonical_info_caches[self.database_path] = _CanonicalInfoCache(self.canonical_info_cache_size)
+            self.canonical_info_cache = _canonical_info_caches[self.database_path]
 
-    def __del__(self):
-        if hasattr(self, "db_connection"):
-            self.db_connection.close()
+    @property
+    def db_connection(self) -> sqlite3.Connection:
+        """
+        Returns this thread's shared connection to the synonymizer database, opening it if needed. The database is
+        opened read-only and immutable (it's never modified once built), so sqlite can skip all file locking, and
+        reads go through a memory map and a large page cache.
+        """
+        connections_by_path = getattr(_connections, "by_path", None)
+        if connections_by_path is None or _connections.pid != os.getpid():
+            connections_by_path = dict()  # Don't reuse connections inherited from a parent process
+            _connections.by_path = connections_by_path
+            _connections.pid = os.getpid()
+        if self.database_path not in connections_by_path:
+            connection = sqlite3.connect(f"{pathlib.Path(self.database_path).as_uri()}?mode=ro&immutable=1", uri=True)
+            connection.execute("PRAGMA mmap_size = 8589934592")  # Map up to 8 GB of the database into memory
+            connection.execute("PRAGMA cache_size = -262144")  # 256 MB page cache (negative means KiB)
+            connection.execute("PRAGMA temp_store = MEMORY")
+            connections_by_path[self.database_path] = connection
+        return connections_by_path[self.database_path]
 
     # --------------------------------------- EXTERNAL MAIN METHODS ----------------------------------------------- #
 
@@ -65,22 +124,29 @@ class NodeSynonymizer:
             # First transform curies so that their prefixes are entirely uppercase
             curies_to_capitalized_curies, capitalized_curies = self._map_to_capitalized_curies(curies_set)
 
+            # Only go to the database for curies we don't already have (recent) canonical info for
+            results_dict_capitalized = self.canonical_info_cache.get_many(capitalized_curies)
+            uncached_curies = capitalized_curies.difference(results_dict_capitalized)
+
             # Query the synonymizer sqlite database for these identifiers
             sql_query_template = f"""
                         SELECT N.id_simplified, N.cluster_id, C.name, C.category
                         FROM nodes as N
                         INNER JOIN clusters as C on C.cluster_id == N.cluster_id
-                        WHERE N.id_simplified in ('{self.placeholder_lookup_values_str}')"""
-            matching_rows = self._run_sql_query_in_batches(sql_query_template, capitalized_curies)
+                        WHERE N.id_simplified in ({self.placeholder_lookup_values_str})"""
+            matching_rows = self._run_sql_query_in_batches(sql_query_template, uncached_curies)
 
             # Transform the results into the proper response format
-            results_dict_capitalized = {row[0]: self._create_preferred_node_dict(preferred_id=row[1],
-                                                                                 preferred_category=row[3],
-                                                                                 preferred_name=row[2])
-                                        for row in matching_rows}
+            looked_up_results = {row[0]: self._create_preferred_node_dict(preferred_id=row[1],
+                                                                          preferred_category=row[3],
+                                                                          preferred_name=row[2])
+                                 for row in matching_rows}
+            looked_up_results.update({curie: None for curie in uncached_curies.difference(looked_up_results)})
+            self.canonical_info_cache.put_many(looked_up_results)
+            results_dict_capitalized.update(looked_up_results)
             results_dict = {input_curie: results_dict_capitalized[capitalized_curie]
                             for input_curie, capitalized_curie in curies_to_capitalized_curies.items()
-                            if capitalized_curie in results_dict_capitalized}
+                            if results_dict_capitalized.get(capitalized_curie)}
 
         if names_set:
             # First transform to simplified names (lowercase, no punctuation/whitespace)
@@ -91,7 +157,7 @@ class NodeSynonymizer:
                         SELECT N.id, N.name_simplified, N.cluster_id, C.name, C.category
                         FROM nodes as N
                         INNER JOIN clusters as C on C.cluster_id == N.cluster_id
-                        WHERE N.name_simplified in ('{self.placeholder_lookup_values_str}')"""
+                        WHERE N.name_simplified in ({self.placeholder_lookup_values_str})"""
             matching_rows = self._run_sql_query_in_batches(sql_query_template, simplified_names)
 
             # For each simplified name, pick the cluster that nodes with that simplified name most often belong to
@@ -122,7 +188,7 @@ class NodeSynonymizer:
             sql_query_template = f"""
                         SELECT N.cluster_id, N.category
                         FROM nodes as N
-                        WHERE N.cluster_id in ('{self.placeholder_lookup_values_str}')"""
+                        WHERE N.cluster_id in ({self.placeholder_lookup_values_str})"""
             matching_rows = self._run_sql_query_in_batches(sql_query_template, cluster_ids)
 
             # Count up how many members this cluster has with different categories
@@ -162,7 +228,7 @@ class NodeSynonymizer:
                         SELECT N.id_simplified, C.member_ids
                         FROM nodes as N
                         INNER JOIN clusters as C on C.cluster_id == N.cluster_id
-                        WHERE N.id_simplified in ('{self.placeholder_lookup_values_str}')"""
+                        WHERE N.id_simplified in ({self.placeholder_lookup_values_str})"""
             matching_rows = self._run_sql_query_in_batches(sql_query_template, capitalized_curies)
 
             # Transform the results into the proper response format
@@ -180,7 +246,7 @@ class NodeSynonymizer:
                         SELECT N.id, N.name_simplified, C.cluster_id, C.member_ids
                         FROM nodes as N
                         INNER JOIN clusters as C on C.cluster_id == N.cluster_id
-                        WHERE N.name_simplified in ('{self.placeholder_lookup_values_str}')"""
+                        WHERE N.name_simplified in ({self.placeholder_lookup_values_str})"""
             matching_rows = self._run_sql_query_in_batches(sql_query_template, simplified_names)
 
             # For each simplified name, pick the cluster that nodes with that simplified name most often belong to
@@ -237,7 +303,7 @@ class NodeSynonymizer:
                     SELECT N.id, N.cluster_id, N.name, N.category, N.major_branch, N.name_sri, N.category_sri, N.name_kg2pre, N.category_kg2pre, C.name
                     FROM nodes as N
                     INNER JOIN clusters as C on C.cluster_id == N.cluster_id
-                    WHERE N.id in ('{self.placeholder_lookup_values_str}')"""
+                    WHERE N.id in ({self.placeholder_lookup_values_str})"""
         matching_rows = self._run_sql_query_in_batches(sql_query_template, all_node_ids)
         nodes_dict = {row[0]: {"identifier": row[0],
                                "category": self._add_biolink_prefix(row[3]),
@@ -310,8 +376,8 @@ class NodeSynonymizer:
         if canonical_info[curie_or_name]:
             cluster_id = canonical_info[curie_or_name]["preferred_curie"]
 
-            sql_query = f"SELECT member_ids, intra_cluster_edge_ids FROM clusters WHERE cluster_id = '{cluster_id}'"
-            results = self._execute_sql_query(sql_query)
+            sql_query = "SELECT member_ids, intra_cluster_edge_ids FROM clusters WHERE cluster_id = ?"
+            results = self._execute_sql_query(sql_query, [cluster_id])
             if results:
                 cluster_row = results[0]
                 member_ids = ast.literal_eval(cluster_row[0])  # Lists are stored as strings in sqlite
@@ -319,14 +385,14 @@ class NodeSynonymizer:
                 intra_cluster_edge_ids = ast.literal_eval(
                     intra_cluster_edge_ids_str)  # Lists are stored as strings in sqlite
 
-                nodes_query = f"SELECT * FROM nodes WHERE id IN ('{self._convert_to_str_format(member_ids)}')"
-                node_rows = self._execute_sql_query(nodes_query)
+                nodes_query = f"SELECT * FROM nodes WHERE id IN ({self.placeholder_lookup_values_str})"
+                node_rows = self._run_sql_query_in_batches(nodes_query, set(member_ids))
                 nodes_df = self._load_records_into_dataframe(node_rows, "nodes")
 
                 # TODO: Improve formatting! (indicate if in SRI vs. KG2pre, etc...)
                 nodes_df = nodes_df[["id", "category", "name"]]
-                edges_query = f"SELECT * FROM edges WHERE id IN ('{self._convert_to_str_format(intra_cluster_edge_ids)}')"
-                edge_rows = self._execute_sql_query(edges_query)
+                edges_query = f"SELECT * FROM edges WHERE id IN ({self.placeholder_lookup_values_str})"
+                edge_rows = self._run_sql_query_in_batches(edges_query, set(intra_cluster_edge_ids))
                 edges_df = self._load_records_into_dataframe(edge_rows, "edges")
                 edges_df = edges_df[["subject", "predicate", "object", "upstream_resource_id", "primary_knowledge_source"]]
 
@@ -342,12 +408,6 @@ class NodeSynonymizer:
 
     # ---------------------------------------- INTERNAL HELPER METHODS -------------------------------------------- #
 
-    @staticmethod
-    def _convert_to_str_format(list_or_set: Union[Set[str], List[str]]) -> str:
-        preprocessed_list = [item.replace("'", "''") for item in list_or_set if item]  # Need to escape ' characters for SQL
-        list_str = "','".join(preprocessed_list)  # SQL wants ('id1', 'id2') format for string lists
-        return list_str
-
     @staticmethod
     def _convert_to_set_format(some_value: any) -> set:
         if isinstance(some_value, set):
@@ -408,15 +468,15 @@ class NodeSynonymizer:
         kg.nodes = trapi_nodes
 
         # Add TRAPI edges for any intra-cluster edges
-        sql_query = f"SELECT intra_cluster_edge_ids FROM clusters WHERE cluster_id = '{cluster_id}'"
-        results = self._execute_sql_query(sql_query)
+        sql_query = "SELECT intra_cluster_edge_ids FROM clusters WHERE cluster_id = ?"
+        results = self._execute_sql_query(sql_query, [cluster_id])
         if results:
             cluster_row = results[0]
             intra_cluster_edge_ids_str = "[]" if cluster_row[0] == "nan" else cluster_row[0]
             intra_cluster_edge_ids = ast.literal_eval(intra_cluster_edge_ids_str)  # Lists are stored as strings in sqlite
 
-            edges_query = f"SELECT * FROM edges WHERE id IN ('{self._convert_to_str_format(intra_cluster_edge_ids)}')"
-            edge_rows = self._execute_sql_query(edges_query)
+            edges_query = f"SELECT * FROM edges WHERE id IN ({self.placeholder_lookup_values_str})"
+            edge_rows = self._run_sql_query_in_batches(edges_query, set(intra_cluster_edge_ids))
             edges_df = self._load_records_into_dataframe(edge_rows, "edges")
             edge_dicts = edges_df.to_dict(orient="records")
             trapi_edges = {edge["id"]: self._convert_to_trapi_edge(edge)
@@ -528,20 +588,19 @@ class NodeSynonymizer:
 
     def _run_sql_query_in_batches(self, sql_query_template: str, lookup_values: Set[str]) -> list:
         """
-        Sqlite has a max length allowed for SQL statements, so we divide really long curie/name lists into batches.
+        Sqlite limits the number of parameters a query can have, so we divide really long curie/name lists into batches.
         """
-        lookup_values_batches = self._divide_into_chunks(lookup_values, 5000)
+        lookup_values = {lookup_value for lookup_value in lookup_values if lookup_value}
         all_matching_rows = []
-        for lookup_values_batch in lookup_values_batches:
-            sql_query = sql_query_template.replace(self.placeholder_lookup_values_str,
-                                                   self._convert_to_str_format(lookup_values_batch))
-            matching_rows = self._execute_sql_query(sql_query)
-            all_matching_rows += matching_rows
+        for lookup_values_batch in self._divide_into_chunks(lookup_values, self.max_sql_variables):
+            parameter_markers = ",".join("?" * len(lookup_values_batch))
+            sql_query = sql_query_template.replace(self.placeholder_lookup_values_str, parameter_markers)
+            all_matching_rows += self._execute_sql_query(sql_query, lookup_values_batch)
         return all_matching_rows
 
-    def _execute_sql_query(self, sql_query: str) -> list:
+    def _execute_sql_query(self, sql_query: str, parameters: Optional[List[str]] = None) -> list:
         cursor = self.db_connection.cursor()
-        cursor.execute(sql_query)
+        cursor.execute(sql_query, parameters if parameters else [])
         matching_rows = cursor.fetchall()
         cursor.close()
         return matching_rows
@@ -1472,5 +1472,627 @@ def test_missing_epc_attributes():
                 assert publications
 
 
+def test_kp_selector_shares_meta_map_index():
+    from Expand.kp_selector import KPSelector
+    kp_selector_a = KPSelector()
+    kp_selector_b = KPSelector()
+    # The KP info cache should only be loaded once per process
+    assert kp_selector_a.meta_map is kp_selector_b.meta_map
+    assert kp_selector_a.meta_map_index is kp_selector_b.meta_map_index
+    assert kp_selector_a.meta_map_index
+
+
+def test_kp_response_cacher(tmp_path):
+    import asyncio
+    from Expand.kp_response_cacher import KPResponseCacher
+    cacher = KPResponseCacher()
+    cacher.cache_path = str(tmp_path / "kp_responses.sqlite")
+    cache_key = cacher.get_cache_key("infores:molepro", {"message": {"query_graph": {"nodes": {}, "edges": {}}},
+                                                         "submitter": "infores:arax"})
+    # Key should not depend on the order of the request body's properties
+    assert cache_key == cacher.get_cache_key("infores:molepro", {"submitter": "infores:arax",
+                                                                 "message": {"query_graph": {"edges": {}, "nodes": {}}}})
+    assert not cacher.get_cached_answer(cache_key, "infores:molepro")
+    answer_kg = eu.QGOrganizedKnowledgeGraph()
+    answer_kg.add_node("CHEMBL.COMPOUND:CHEMBL112", Node(name="acetaminophen"), "n00")
+    assert cacher.cache_answer(cache_key, "infores:molepro", answer_kg)
+    cached_kg, _ = cacher.get_cached_answer(cache_key, "infores:molepro")
+    assert cached_kg.nodes_by_qg_id["n00"]["CHEMBL.COMPOUND:CHEMBL112"].name == "acetaminophen"
+    # The async versions should see the same cache
+    loop = asyncio.new_event_loop()
+    cached_kg, _ = loop.run_until_complete(cacher.get_cached_answer_async(cache_key, "infores:molepro"))
+    assert cached_kg.nodes_by_qg_id["n00"]["CHEMBL.COMPOUND:CHEMBL112"].name == "acetaminophen"
+    other_cache_key = cacher.get_cache_key("infores:molepro", {"message": {}})
+    assert loop.run_until_complete(cacher.cache_answer_async(other_cache_key, "infores:molepro", answer_kg))
+    loop.close()
+    # The tracked total size should match the entries' sizes, and the least recently used entry goes first
+    with cacher._open_cache() as connection:
+        entry_size = connection.execute("SELECT size FROM kp_responses WHERE cache_key = ?", (cache_key,)).fetchone()[0]
+        assert connection.execute("SELECT total_size FROM kp_responses_size").fetchone()[0] == 2 * entry_size
+    cacher.get_cached_answer(cache_key, "infores:molepro")
+    cacher.max_size_bytes = 3 * entry_size - 1
+    cacher.cache_answer(cacher.get_cache_key("infores:molepro", {}), "infores:molepro", answer_kg)
+    assert not cacher.get_cached_answer(other_cache_key, "infores:molepro")
+    with cacher._open_cache() as connection:
+        assert connection.execute("SELECT total_size FROM kp_responses_size").fetchone()[0] == 2 * entry_size
+    # Entries should expire after the KP's time-to-live
+    cacher.kp_ttls = {"infores:molepro": -1}
+    assert not cacher.get_cached_answer(cache_key, "infores:molepro")
+    with cacher._open_cache() as connection:
+        assert connection.execute("SELECT total_size FROM kp_responses_size").fetchone()[0] == entry_size
+    # Answers that can't be saved are reported as such, whether they're too big or the cache can't be written
+    cacher.max_size_bytes = entry_size - 1
+    assert not cacher.cache_answer(cache_key, "infores:molepro", answer_kg)
+    cacher.max_size_bytes = 3 * entry_size
+    cacher.cache_path = str(tmp_path / "no_such_dir" / "kp_responses.sqlite")
+    assert not cacher.cache_answer(cache_key, "infores:molepro", answer_kg)
+
+
+def test_kp_soft_and_hard_deadlines(monkeypatch):
+    import asyncio
+    import contextlib
+    import queue
+    import ARAX_expander
+    from ARAX_expander import ARAXExpander
+    from openapi_server.models.query_graph import QueryGraph
+    from openapi_server.models.q_node import QNode
+    from openapi_server.models.q_edge import QEdge
+    kp_delays_and_edge_counts = {"infores:fast": (0.1, 3), "infores:empty": (0.1, 0), "infores:slow": (5, 4)}
+
+    async def fake_expand_edge_async(self, edge_qg, kp_to_use, *args, **kwargs):
+        delay, num_edges = kp_delays_and_edge_counts[kp_to_use]
+        await asyncio.sleep(delay)
+        answer_kg = eu.QGOrganizedKnowledgeGraph()
+        for edge_num in range(num_edges):
+            answer_kg.add_edge(f"{kp_to_use}:{edge_num}", Edge(subject="MONDO:1", object="CHEBI:1",
+                                                               predicate="biolink:related_to"), "e00")
+        return answer_kg, None
+
+    @contextlib.asynccontextmanager
+    async def fake_client_session(*args):
+        yield None
+
+    monkeypatch.setattr(ARAXExpander, "_expand_edge_async", fake_expand_edge_async)
+    monkeypatch.setattr(ARAX_expander, "create_kp_client_session", fake_client_session)
+    expander = ARAXExpander()
+    edge_qg = QueryGraph(nodes={"n00": QNode(ids=["MONDO:1"]), "n01": QNode()},
+                         edges={"e00": QEdge(subject="n00", object="n01")})
+
+    def expand_with_deadlines(**deadline_parameters) -> tuple:
+        response = ARAXResponse()
+        answer_queue = queue.Queue()
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(expander._expand_edge_using_kps_async(
+            edge_qg, list(kp_delays_and_edge_counts), False, None, False, False, None, response, answer_queue,
+            **deadline_parameters))
+        loop.close()
+        # Each KP (answered or not) should hand back its own log, and the queue should end with None
+        merged_edge_keys = set()
+        answered_kps = 0
+        for answer_kg, kp_log in iter(answer_queue.get, None):
+            assert kp_log is not response
+            response.merge(kp_log)
+            answered_kps += 1
+            if answer_kg is not None:
+                merged_edge_keys.update(answer_kg.edges_by_qg_id.get("e00", dict()))
+        assert answered_kps == len(kp_delays_and_edge_counts) and answer_queue.empty()
+        return merged_edge_keys, response.query_plan["qedge_keys"].get("e00", dict())
+
+    # The slow KP should be cut off once the fast KP has answered and the soft deadline has passed
+    merged_edge_keys, query_plan = expand_with_deadlines(kp_soft_deadline=1)
+    assert merged_edge_keys == {"infores:fast:0", "infores:fast:1", "infores:fast:2"}
+    assert query_plan["infores:slow"]["status"] == "Timed out"  # Query plan updates go straight to the main response
+    # But not if more KPs (or edges) than have come in are required
+    merged_edge_keys, query_plan = expand_with_deadlines(kp_soft_deadline=1, kp_soft_deadline_min_kps=2)
+    assert len(merged_edge_keys) == 7
+    assert not query_plan
+    merged_edge_keys, query_plan = expand_with_deadlines(kp_soft_deadline=1, kp_soft_deadline_min_kps=2,
+                                                         kp_soft_deadline_min_edges=3)
+    assert len(merged_edge_keys) == 3
+    # The hard deadline applies to each KP regardless of how the others did
+    merged_edge_keys, query_plan = expand_with_deadlines(kp_hard_deadline=1)
+    assert len(merged_edge_keys) == 3
+    assert query_plan["infores:slow"]["status"] == "Timed out"
+
+
+def test_stream_kp_message():
+    import asyncio
+    import json
+    from Expand.trapi_querier import TRAPIQuerier
+
+    class FakeKPSelector:
+        kp_urls = {"infores:molepro": "https://fake.kp"}
+
+    class FakeStreamedResponse:
+        """Mimics an aiohttp response whose body arrives a few bytes at a time"""
+        def __init__(self, body: dict, chunk_size: int = 7):
+            self.body = json.dumps(body).encode()
+            self.chunk_size = chunk_size
+            self.num_bytes_read = 0
+            self.content = self
+
+        async def read(self, num_bytes: int = -1) -> bytes:
+            chunk = self.body[self.num_bytes_read:self.num_bytes_read + min(num_bytes, self.chunk_size)]
+            self.num_bytes_read += len(chunk)
+            return chunk
+
+    nodes = {f"CHEBI:{num}": {"name": f"chemical {num}", "categories": "biolink:ChemicalEntity"} for num in range(4)}
+    nodes["MONDO:1"] = {"name": "disease", "categories": ["biolink:Disease"]}
+    edges = {f"edge{num}": {"subject": f"CHEBI:{num}", "object": "MONDO:1", "predicate": "biolink:treats"}
+             for num in range(4)}
+    results = [{"node_bindings": {"n00": [{"id": "MONDO:1"}], "n01": [{"id": f"CHEBI:{num}"}]},
+                "analyses": [{"resource_id": "infores:molepro", "edge_bindings": {"e00": [{"id": f"edge{num}"}]}}]}
+               for num in range(4)]
+
+    def stream_message(body: dict, edge_budget: int) -> tuple:
+        querier = TRAPIQuerier(ARAXResponse(), "infores:molepro", False, None, kp_selector=FakeKPSelector(),
+                               edge_budget=edge_budget)
+        response = FakeStreamedResponse(body)
+        loop = asyncio.new_event_loop()
+        message = loop.run_until_complete(querier._stream_kp_message_async(response))
+        loop.close()
+        return message, querier, response
+
+    body = {"message": {"query_graph": None, "knowledge_graph": {"edges": edges, "nodes": nodes}, "results": results},
+            "logs": [{"message": "ignored"}]}
+    message, querier, _ = stream_message(body, edge_budget=10)
+    assert set(message.knowledge_graph.edges) == set(edges)
+    assert set(message.knowledge_graph.nodes) == set(nodes)
+    assert message.knowledge_graph.nodes["CHEBI:0"].categories == ["biolink:ChemicalEntity"]
+    assert message.knowledge_graph.edges["edge2"].subject == "CHEBI:2"
+    assert len(message.results) == 4
+    assert not querier.edge_budget_message
+
+    # Edges past the budget are skipped, along with the nodes only they use
+    message, querier, response = stream_message(body, edge_budget=2)
+    assert set(message.knowledge_graph.edges) == {"edge0", "edge1"}
+    assert set(message.knowledge_graph.nodes) == {"CHEBI:0", "CHEBI:1", "MONDO:1"}
+    assert len(message.results) == 4
+    assert "skipped 2 edges" in querier.edge_budget_message
+    assert response.num_bytes_read == len(response.body)
+    # Once the edges are all that's left, reading stops as soon as the budget is hit
+    body = {"message": {"results": results, "knowledge_graph": {"nodes": nodes, "edges": edges}}}
+    message, querier, response = stream_message(body, edge_budget=2)
+    assert set(message.knowledge_graph.edges) == {"edge0", "edge1"}
+    assert "skipped 1+ edges" in querier.edge_budget_message
+    assert response.num_bytes_read < len(response.body)
+
+    message, _, _ = stream_message({"logs": []}, edge_budget=2)
+    assert message is None
+
+
+def test_trapi_querier_reports_cache_writes(monkeypatch):
+    import asyncio
+    import json
+    from Expand.kp_response_cacher import KPResponseCacher
+    from Expand.trapi_querier import TRAPIQuerier
+    from openapi_server.models.query_graph import QueryGraph
+    from openapi_server.models.q_node import QNode
+    from openapi_server.models.q_edge import QEdge
+
+    class FakeKPSelector:
+        kp_urls = {"infores:molepro": "https://fake.kp"}
+
+    class FakeKPResponse:
+        status = 200
+
+        def __init__(self):
+            self.content = self
+            self.body = json.dumps({"message": {"knowledge_graph": {"nodes": {}, "edges": {}}, "results": []}}).encode()
+
+        async def read(self, num_bytes: int = -1) -> bytes:
+            chunk, self.body = self.body[:num_bytes], self.body[num_bytes:]
+            return chunk
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            return False
+
+    class FakeSession:
+        def post(self, *args, **kwargs):
+            return FakeKPResponse()
+
+    cache_writes = []
+
+    async def fake_cache_answer_async(self, cache_key, kp_curie, answer_kg):
+        cache_writes.append(kp_curie)
+        return cache_write_succeeds
+
+    async def fake_get_cached_answer_async(self, cache_key, kp_curie):
+        return None
+
+    monkeypatch.setattr(KPResponseCacher, "cache_answer_async", fake_cache_answer_async)
+    monkeypatch.setattr(KPResponseCacher, "get_cached_answer_async", fake_get_cached_answer_async)
+    qg = QueryGraph(nodes={"n00": QNode(ids=["MONDO:1"]), "n01": QNode(categories=["biolink:ChemicalEntity"])},
+                    edges={"e00": QEdge(subject="n01", object="n00", predicates=["biolink:treats"])})
+
+    def get_done_message(bypass_cache: bool) -> str:
+        log = ARAXResponse()
+        querier = TRAPIQuerier(log, "infores:molepro", False, None, kp_selector=FakeKPSelector(),
+                               session=FakeSession(), bypass_cache=bypass_cache)
+        asyncio.run(querier._answer_query_using_kp_async(qg))
+        kp_plan = log.query_plan["qedge_keys"]["e00"]["infores:molepro"]
+        assert kp_plan["status"] == "Done"
+        return kp_plan["description"]
+
+    cache_write_succeeds = True
+    assert get_done_message(bypass_cache=False).endswith("(cache miss)")
+    assert get_done_message(bypass_cache=True).endswith("(cache bypassed)")
+    # Answers that couldn't be cached aren't labeled as cache misses
+    cache_write_succeeds = False
+    for bypass_cache in [False, True]:
+        assert not get_done_message(bypass_cache).endswith(")")
+    assert cache_writes == ["infores:molepro"] * 4
+
+
+def test_kg2_querier_curie_batches():
+    import asyncio
+    import json
+    from Expand.kg2_querier import KG2Querier
+    from openapi_server.models.query_graph import QueryGraph
+    from openapi_server.models.q_node import QNode
+    from openapi_server.models.q_edge import QEdge
+
+    class FakePlover:
+        """Mimics a pooled session to Plover; each batch is answered (or failed) according to its first curie"""
+        def __init__(self, batch_behaviors: dict):
+            self.batch_behaviors = batch_behaviors  # First curie -> (delay, status code, num edges per input curie)
+            self.events = []
+
+        def post(self, url, json=None, **kwargs):
+            return FakePloverResponse(self, json["nodes"]["n00"]["ids"])
+
+    class FakePloverResponse:
+        def __init__(self, plover: FakePlover, curie_batch: list):
+            self.plover = plover
+            self.curie_batch = curie_batch
+
+        async def __aenter__(self):
+            delay, self.status, self.num_edges_per_curie = self.plover.batch_behaviors[self.curie_batch[0]]
+            self.plover.events.append(("sent", self.curie_batch[0]))
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.plover.events.append(("cancelled", self.curie_batch[0]))
+                raise
+            return self
+
+        async def __aexit__(self, *args):
+            pass
+
+        async def text(self) -> str:
+            if self.status != 200:
+                return "Internal server error"
+            nodes = {"n00": dict(), "n01": dict()}
+            edges = {"e00": dict()}
+            for curie in self.curie_batch:
+                nodes["n00"][curie] = [curie, ["biolink:Disease"], [curie]]
+                for num in range(self.num_edges_per_curie):
+                    nodes["n01"][f"{curie}-{num}"] = [f"{curie}-{num}", ["biolink:Gene"], []]
+                    edges["e00"][f"{curie}-edge{num}"] = [curie, f"{curie}-{num}", "biolink:related_to",
+                                                          "infores:fake", "", "", "", "False"]
+            return json.dumps({"nodes": nodes, "edges": edges})
+
+    def answer_batches(batch_behaviors: dict, **querier_settings) -> tuple:
+        query_graph = QueryGraph(nodes={"n00": QNode(ids=list(batch_behaviors)), "n01": QNode()},
+                                 edges={"e00": QEdge(subject="n00", object="n01")})
+        plover = FakePlover(batch_behaviors)
+        querier = KG2Querier(ARAXResponse(), "https://fake.plover", session=plover)
+        querier.curie_batch_size = 1
+        for setting, value in querier_settings.items():
+            setattr(querier, setting, value)
+
+        async def answer() -> eu.QGOrganizedKnowledgeGraph:
+            kg = await querier._answer_curie_batches_async(query_graph, "e00", "n00",
+                                                           [[curie] for curie in batch_behaviors])
+            # Nothing should be left running once the batches have been answered
+            assert asyncio.all_tasks() == {asyncio.current_task()}
+            return kg
+
+        return asyncio.run(answer()), querier.response, plover.events
+
+    # A failed batch ends the query; batches in flight are cancelled and the rest are never sent
+    kg, log, events = answer_batches({"A": (0.01, 200, 2), "B": (0.05, 500, 2), "C": (5, 200, 2), "D": (5, 200, 2),
+                                      "E": (5, 200, 2), "F": (5, 200, 2)}, max_concurrent_batches=2)
+    assert log.status == "ERROR" and log.error_code == "RequestFailed"
+    assert set(kg.edges_by_qg_id["e00"]) == {"A-edge0", "A-edge1"}
+    sent_curies = [curie for event, curie in events if event == "sent"]
+    assert sent_curies[:3] == ["A", "B", "C"] and "E" not in sent_curies and "F" not in sent_curies
+    assert sorted(curie for event, curie in events if event == "cancelled") == sent_curies[2:]
+
+    # Going over max_allowed_edges prunes each input curie down to max_edges_per_input_curie edges
+    kg, log, events = answer_batches({"A": (0.01, 200, 2), "B": (0.02, 200, 2), "C": (0.03, 200, 2)},
+                                     max_allowed_edges=3, max_edges_per_input_curie=1)
+    assert log.status == "OK"
+    assert len(kg.edges_by_qg_id["e00"]) == 3
+    assert all(node.attributes[0].attribute_type_id == "biolink:incomplete_result_set"
+               for node in kg.nodes_by_qg_id["n00"].values())
+    assert len(kg.nodes_by_qg_id["n01"]) == 3  # Nodes orphaned by the pruning are removed
+
+    # If pruning can't get the answer under max_allowed_edges, the query errors out and remaining batches are cancelled
+    kg, log, events = answer_batches({"A": (0.01, 200, 2), "B": (0.02, 200, 2), "C": (5, 200, 2)},
+                                     max_allowed_edges=3, max_edges_per_input_curie=2)
+    assert log.status == "ERROR" and log.error_code == "QueryTooLarge"
+    assert ("cancelled", "C") in events
+
+
+def test_degree_scorer(monkeypatch):
+    from Expand.degree_scorer import DegreeScorer
+    from openapi_server.models.query_graph import QueryGraph
+    from openapi_server.models.q_node import QNode
+    from openapi_server.models.q_edge import QEdge
+    kg2c_degrees = {"NCBIGene:1": 5, "NCBIGene:2": 5, "NCBIGene:3": 5000}
+    monkeypatch.setattr(DegreeScorer, "_get_kg2c_degrees",
+                        lambda self, node_keys, category, log: {node_key: kg2c_degrees[node_key] for node_key in node_keys})
+    qg = QueryGraph(nodes={"n00": QNode(ids=["MONDO:1", "MONDO:2"], categories=["biolink:Disease"]),
+                           "n01": QNode(categories=["biolink:Gene"])},
+                    edges={"e00": QEdge(subject="n00", object="n01")})
+    kg = eu.QGOrganizedKnowledgeGraph()
+    kg.add_node("MONDO:1", Node(), "n00")
+    kg.add_node("MONDO:2", Node(), "n00")
+    for node_key in kg2c_degrees:
+        kg.add_node(node_key, Node(), "n01")
+    publications = Attribute(attribute_type_id="biolink:publications", value=["PMID:1", "PMID:2", "PMID:3", "PMID:4"])
+    kg.add_edge("edge1", Edge(subject="MONDO:1", object="NCBIGene:1", attributes=[publications]), "e00")
+    kg.add_edge("edge2", Edge(subject="MONDO:2", object="NCBIGene:1", attributes=[publications]), "e00")
+    kg.add_edge("edge3", Edge(subject="MONDO:1", object="NCBIGene:2", attributes=[]), "e00")
+    kg.add_edge("edge4", Edge(subject="MONDO:1", object="NCBIGene:3", attributes=[publications]), "e00")
+    kg.add_edge("edge5", Edge(subject="MONDO:2", object="NCBIGene:3", attributes=[publications]), "e00")
+    node_scores = DegreeScorer().score_nodes("n01", kg, qg, ARAXResponse())
+    # Well-published edges beat unpublished ones, and specific nodes beat hubs with the same edges
+    assert node_scores["NCBIGene:1"] > node_scores["NCBIGene:3"] > node_scores["NCBIGene:2"]
+
+    from ARAX_expander import ARAXExpander
+    ARAXExpander._prune_kg("n01", 1, kg, qg, ARAXResponse(), "degree")
+    assert set(kg.nodes_by_qg_id["n01"]) == {"NCBIGene:1"}
+    ARAXExpander._prune_kg("n01", 0, kg, qg, ARAXResponse(), "degree")
+    assert not kg.nodes_by_qg_id["n01"]
+
+
+def test_degree_scorer_kg2c_degrees(tmp_path):
+    import sqlite3
+    from Expand.degree_scorer import DegreeScorer
+    sqlite_file_path = f"{tmp_path}/kg2c.sqlite"
+    connection = sqlite3.connect(sqlite_file_path)
+    connection.execute('CREATE TABLE neighbor_counts_by_category (id TEXT, "biolink:Disease" INT, "biolink:Gene" INT)')
+    connection.executemany("INSERT INTO neighbor_counts_by_category VALUES (?, ?, ?)",
+                           [("NCBIGene:1", 5, 2), ("NCBIGene:2", None, 7), ("NCBIGene:3", 5000, 1)])
+    connection.commit()
+    connection.close()
+    degree_scorer = DegreeScorer()
+    degree_scorer.sqlite_file_path = sqlite_file_path
+    log = ARAXResponse()
+    node_keys = ["NCBIGene:1", "NCBIGene:2", "NCBIGene:3", "NCBIGene:4"]
+    assert degree_scorer._get_kg2c_degrees(node_keys, "biolink:Disease", log) == {"NCBIGene:1": 5, "NCBIGene:3": 5000}
+    # Categories that aren't neighbor count columns (including ones crafted to inject SQL) just get no degrees
+    for category in ["biolink:Protein", 'biolink:Gene" FROM neighbor_counts_by_category --', "id"]:
+        assert degree_scorer._get_kg2c_degrees(node_keys, category, log) == dict()
+    assert log.status == "OK"
+
+
+def test_qedge_dependencies():
+    from ARAX_expander import ARAXExpander
+    from openapi_server.models.query_graph import QueryGraph
+    from openapi_server.models.q_node import QNode
+    from openapi_server.models.q_edge import QEdge
+    # n00 and n02 are pinned, so e00 and e01 don't need each other's answers, but e02 needs e00's n01 curies
+    qg = QueryGraph(nodes={"n00": QNode(ids=["MONDO:1"]), "n01": QNode(), "n02": QNode(ids=["CHEBI:1"]),
+                           "n03": QNode()},
+                    edges={"e00": QEdge(subject="n00", object="n01"), "e01": QEdge(subject="n02", object="n00"),
+                           "e02": QEdge(subject="n01", object="n03")})
+    qedge_dependencies = ARAXExpander._get_qedge_dependencies(["e00", "e01", "e02"], qg)
+    assert qedge_dependencies == {"e00": set(), "e01": set(), "e02": {"e00"}}
+    kg = eu.QGOrganizedKnowledgeGraph()
+    assert ARAXExpander._can_expand_qedge_early("e01", qedge_dependencies, set(), qg, kg)
+    assert not ARAXExpander._can_expand_qedge_early("e02", qedge_dependencies, set(), qg, kg)
+    # Answers already in the KG for any of a qedge's qnodes could still be pruned, so such qedges wait their turn
+    kg.add_node("NCBIGene:1", Node(), "n01")
+    assert not ARAXExpander._can_expand_qedge_early("e02", qedge_dependencies, {"e00"}, qg, kg)
+    assert ARAXExpander._can_expand_qedge_early("e01", qedge_dependencies, set(), qg, kg)
+    kg.add_node("MONDO:1", Node(), "n00")
+    assert not ARAXExpander._can_expand_qedge_early("e01", qedge_dependencies, set(), qg, kg)
+
+
+def test_expand_independent_qedges_concurrently(monkeypatch):
+    import asyncio
+    import ARAX_expander
+    from ARAX_expander import ARAXExpander
+    from ARAX_decorator import ARAXDecorator
+    from background_event_loop import get_background_event_loop
+    from openapi_server.models.knowledge_graph import KnowledgeGraph
+    from openapi_server.models.message import Message
+    from openapi_server.models.query_graph import QueryGraph
+    from openapi_server.models.q_node import QNode
+    from openapi_server.models.q_edge import QEdge
+    from openapi_server.models.response import Response
+    kp_events = []
+    failing_qedge_keys = set()
+
+    class FakeKPSelector:
+        def __init__(self, *args, **kwargs):
+            self.valid_kps = {"infores:fast", "infores:slow"}
+
+        def get_kps_for_single_hop_qg(self, qg):
+            return sorted(self.valid_kps)
+
+    async def fake_expand_edge_async(self, edge_qg, kp_to_use, user_specified_kp, kp_timeout, bypass_cache,
+                                     force_local, kp_selector, log, *args, **kwargs):
+        qedge_key = next(iter(edge_qg.edges))
+        qedge = edge_qg.edges[qedge_key]
+        kp_events.append(("sent", qedge_key))
+        try:
+            await asyncio.sleep(0.1 if kp_to_use == "infores:fast" else 0.3)
+        finally:
+            kp_events.append(("stopped", qedge_key))
+        log.info(f"{kp_to_use} answered {qedge_key}")
+        if qedge_key in failing_qedge_keys:
+            log.error(f"{kp_to_use} failed", error_code="KPError")
+        answer_kg = eu.QGOrganizedKnowledgeGraph()
+        for subject_id in edge_qg.nodes[qedge.subject].ids:
+            answer_kg.add_node(subject_id, Node(categories=["biolink:NamedThing"]), qedge.subject)
+            for object_num in range(2):
+                object_id = f"{qedge.object}:{kp_to_use}:{object_num}"
+                answer_kg.add_node(object_id, Node(categories=["biolink:NamedThing"]), qedge.object)
+                answer_kg.add_edge(f"{subject_id}-{qedge_key}-{object_id}",
+                                   Edge(subject=subject_id, object=object_id, predicate="biolink:related_to"),
+                                   qedge_key)
+        kp_events.append(("answered", qedge_key))
+        return answer_kg, None
+
+    class FakeSession:
+        closed = False
+
+        def __init__(self, *args):
+            pass
+
+        async def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(ARAX_expander, "KPSelector", FakeKPSelector)
+    monkeypatch.setattr(ARAXExpander, "_expand_edge_async", fake_expand_edge_async)
+    monkeypatch.setattr(ARAX_expander, "create_kp_client_session", FakeSession)
+    monkeypatch.setattr(get_background_event_loop(), "sessions", dict())  # Don't leave the fake session on the loop
+    monkeypatch.setattr(ARAXDecorator, "decorate_nodes", lambda self, response: response)
+    monkeypatch.setattr(ARAXDecorator, "decorate_edges", lambda self, response, kind=None: response)
+
+    def expand(expected_status: str = "OK") -> tuple:
+        # e00 and e01 both hang off pinned n00, so they're independent; e02 needs e00's n01 curies
+        query_graph = QueryGraph(nodes={"n00": QNode(ids=["MONDO:1"]), "n01": QNode(), "n02": QNode(),
+                                        "n03": QNode()},
+                                 edges={"e00": QEdge(subject="n00", object="n01"),
+                                        "e01": QEdge(subject="n00", object="n02"),
+                                        "e02": QEdge(subject="n01", object="n03")})
+        response = ARAXResponse()
+        response.envelope = Response(message=Message(query_graph=query_graph,
+                                                     knowledge_graph=KnowledgeGraph(nodes=dict(), edges=dict()),
+                                                     results=[]))
+        kp_events.clear()
+        ARAXExpander().apply(response, {"kp_timeout": 30})
+        assert response.status == expected_status
+        kg = response.envelope.message.knowledge_graph
+        return ({node_key: sorted(node.qnode_keys) for node_key, node in kg.nodes.items()},
+                {edge_key: sorted(edge.qedge_keys) for edge_key, edge in kg.edges.items()},
+                list(kp_events))
+
+    nodes, edges, events = expand()
+    # e01's KPs are queried while e00's are still answering (but e02's have to wait for e00)
+    assert events.index(("sent", "e01")) < events.index(("answered", "e00"))
+    assert len([event for event in events[:events.index(("sent", "e02"))] if event == ("answered", "e00")]) == 2
+    assert len(edges) == 2 * 2 + 2 * 2 + 4 * 4
+
+    # An error from one of e00's KPs should stop Expand, and the early-started e01 queries should be cancelled (and
+    # finished winding down) by the time it returns
+    failing_qedge_keys.add("e00")
+    _, _, events = expand(expected_status="ERROR")
+    assert events.count(("answered", "e01")) < events.count(("sent", "e01")) == events.count(("stopped", "e01"))
+    assert ("sent", "e02") not in events
+    failing_qedge_keys.clear()
+
+    # The KG should be exactly what expanding the qedges one after another gives
+    monkeypatch.setattr(ARAXExpander, "_can_expand_qedge_early", staticmethod(lambda *args: False))
+    sequential_nodes, sequential_edges, sequential_events = expand()
+    assert sequential_events.index(("sent", "e01")) > sequential_events.index(("answered", "e00"))
+    assert nodes == sequential_nodes
+    assert edges == sequential_edges
+
+
+def test_kp_queries_share_one_limited_session(monkeypatch):
+    import ARAX_expander
+    from ARAX_expander import ARAXExpander
+    from ARAX_decorator import ARAXDecorator
+    from background_event_loop import get_background_event_loop
+    from openapi_server.models.knowledge_graph import KnowledgeGraph
+    from openapi_server.models.message import Message
+    from openapi_server.models.query_graph import QueryGraph
+    from openapi_server.models.q_node import QNode
+    from openapi_server.models.q_edge import QEdge
+    from openapi_server.models.response import Response
+    sessions_used = []
+
+    class FakeKPSelector:
+        def __init__(self, *args, **kwargs):
+            self.valid_kps = {"infores:a", "infores:b"}
+
+        def get_kps_for_single_hop_qg(self, qg):
+            return sorted(self.valid_kps)
+
+    async def fake_expand_edge_async(self, edge_qg, kp_to_use, user_specified_kp, kp_timeout, bypass_cache,
+                                     force_local, kp_selector, log, *args, session=None, **kwargs):
+        sessions_used.append(session)
+        qedge_key, qedge = next(iter(edge_qg.edges.items()))
+        answer_kg = eu.QGOrganizedKnowledgeGraph()
+        object_id = f"{qedge.object}:{kp_to_use}"
+        answer_kg.add_node("MONDO:1", Node(categories=["biolink:NamedThing"]), qedge.subject)
+        answer_kg.add_node(object_id, Node(categories=["biolink:NamedThing"]), qedge.object)
+        answer_kg.add_edge(f"{kp_to_use}-{qedge_key}", Edge(subject="MONDO:1", object=object_id,
+                                                           predicate="biolink:related_to"), qedge_key)
+        return answer_kg, None
+
+    monkeypatch.setattr(ARAX_expander, "KPSelector", FakeKPSelector)
+    monkeypatch.setattr(ARAXExpander, "_expand_edge_async", fake_expand_edge_async)
+    monkeypatch.setattr(get_background_event_loop(), "sessions", dict())  # Start (and end) without a pooled session
+    monkeypatch.setattr(ARAXDecorator, "decorate_nodes", lambda self, response: response)
+    monkeypatch.setattr(ARAXDecorator, "decorate_edges", lambda self, response, kind=None: response)
+    expander = ARAXExpander()
+    monkeypatch.setattr(expander.rtxc, "kp_connection_limit", 7)
+    monkeypatch.setattr(expander.rtxc, "kp_connection_limit_per_kp", 3)
+
+    for _ in range(2):
+        query_graph = QueryGraph(nodes={"n00": QNode(ids=["MONDO:1"]), "n01": QNode(), "n02": QNode()},
+                                 edges={"e00": QEdge(subject="n00", object="n01"),
+                                        "e01": QEdge(subject="n00", object="n02")})
+        response = ARAXResponse()
+        response.envelope = Response(message=Message(query_graph=query_graph,
+                                                     knowledge_graph=KnowledgeGraph(nodes=dict(), edges=dict()),
+                                                     results=[]))
+        expander.apply(response, {"kp_timeout": 30})
+        assert response.status == "OK"
+        assert len(response.envelope.message.knowledge_graph.edges) == 4
+
+    # Every KP query, for every qedge and every query, went through the same pooled session
+    assert len(sessions_used) == 8
+    session = sessions_used[0]
+    assert session is not None and all(session_used is session for session_used in sessions_used)
+    assert (session.connector.limit, session.connector.limit_per_host) == (7, 3)
+    get_background_event_loop().run(session.close())
+
+
+def test_background_event_loop():
+    import asyncio
+    import threading
+    from background_event_loop import get_background_event_loop
+
+    class FakeSession:
+        closed = False
+
+        async def close(self):
+            self.closed = True
+
+    async def get_session_and_thread():
+        await asyncio.sleep(0.01)
+        return get_background_event_loop().get_session("test", FakeSession), threading.current_thread()
+
+    background_event_loop = get_background_event_loop()
+    assert get_background_event_loop() is background_event_loop
+    # Coroutines submitted from different threads all run on the loop's thread and share its sessions
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(background_event_loop.run(get_session_and_thread())))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(session) for session, _ in results}) == 1
+    assert {loop_thread for _, loop_thread in results} == {background_event_loop.thread}
+    assert background_event_loop.get_session("test", FakeSession) is None  # Not on the loop
+
+    # Blocking on the loop from a coroutine running on it mustn't deadlock
+    async def run_nested():
+        return background_event_loop.run(asyncio.sleep(0.01, result="nested"), timeout=5)
+    assert background_event_loop.run(run_nested(), timeout=10) == "nested"
+
+
 if __name__ == "__main__":
     pytest.main(['-v', 'test_ARAX_expand.py'])
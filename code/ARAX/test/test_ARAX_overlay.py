@@ -801,5 +801,104 @@ def test_ngd_sqlite_syntax_error():
     assert response.status == 'OK'
 
 
+def test_ngd_bulk_computation():
+    sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../ARAXQuery/Overlay")
+    import numpy as np
+    from compute_ngd import ComputeNGD
+    ngd = ComputeNGD(ARAXResponse(), Message(), {})
+    ngd.curie_to_pmids_map = {"A": np.arange(0, 100, dtype=np.int32),
+                              "B": np.arange(50, 1000, 2, dtype=np.int32),
+                              "C": np.array([7], dtype=np.int32)}
+    ngd_results = ngd.calculate_ngd_in_bulk([("A", "B"), ("B", "A"), ("A", "C"), ("B", "C"), ("A", "D")])
+    ngd._close_database()
+    ngd_value, pmids = ngd_results[("A", "B")]
+    assert pmids == list(range(50, 100, 2))  # Fewer than 30 shared PMIDs, so all of them are included
+    assert ngd_value == ngd_results[("B", "A")][0]
+    assert ngd_value > 0
+    assert ngd_results[("A", "C")][1] == [7]
+    assert np.isnan(ngd_results[("B", "C")][0]) and ngd_results[("B", "C")][1] == []
+    assert np.isnan(ngd_results[("A", "D")][0])
+    # PMIDs decoded from the sqlite database are never truncated to fit the compact dtype
+    assert ngd._get_pmids_array([30, 10, 30]).dtype == np.int32
+    large_pmids = ngd._get_pmids_array([2 ** 31, 10])
+    assert large_pmids.tolist() == [10, 2 ** 31]
+    assert ngd._intersect_sorted_pmids(large_pmids, np.array([10], dtype=np.int32)).tolist() == [10]
+
+
+def test_curie_to_pmids_store(tmp_path):
+    sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../ARAXQuery/Overlay/ngd")
+    import sqlite3
+    import shutil
+    from curie_to_pmids_store import CuriePMIDStore, build_curie_to_pmids_store, build_curie_to_pmids_store_from_sqlite
+    db_path = str(tmp_path / "curie_to_pmids_v1.0_test.sqlite")
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE curie_to_pmids (curie TEXT, pmids TEXT)")
+    connection.executemany("INSERT INTO curie_to_pmids (curie, pmids) VALUES (?, ?)",
+                           [("MONDO:1", json.dumps([30, 10, 20, 10])), ("CHEBI:2", json.dumps([])),
+                            ("NCBIGene:3", json.dumps([36000000]))])
+    connection.commit()
+    connection.close()
+    assert CuriePMIDStore.open(db_path) is None
+
+    build_curie_to_pmids_store_from_sqlite(db_path)
+    store = CuriePMIDStore.open(db_path)
+    assert store is CuriePMIDStore.open(db_path)
+    curie_to_pmids = store.get_pmids(["MONDO:1", "CHEBI:2", "NCBIGene:3", "FAKE:4"])
+    assert curie_to_pmids["MONDO:1"].tolist() == [10, 20, 30]
+    assert curie_to_pmids["CHEBI:2"].tolist() == []
+    assert curie_to_pmids["NCBIGene:3"].tolist() == [36000000]
+    assert "FAKE:4" not in curie_to_pmids
+
+    # A rebuilt store replaces the one cached by open(), and an index can't be paired with another build's PMIDs
+    old_pmids_path = str(tmp_path / "old.pmids.int32")
+    shutil.copy(db_path.replace(".sqlite", ".pmids.int32"), old_pmids_path)
+    build_curie_to_pmids_store(iter([("MONDO:1", [5])]), db_path)
+    rebuilt_store = CuriePMIDStore.open(db_path)
+    assert rebuilt_store is not store
+    assert rebuilt_store.get_pmids(["MONDO:1"])["MONDO:1"].tolist() == [5]
+    os.replace(old_pmids_path, db_path.replace(".sqlite", ".pmids.int32"))
+    assert CuriePMIDStore.open(db_path) is rebuilt_store
+    CuriePMIDStore._open_stores.clear()
+    assert CuriePMIDStore.open(db_path) is None
+
+    # PMIDs that don't fit in the store are left out rather than failing the whole build
+    build_curie_to_pmids_store(iter([("MONDO:1", [2 ** 31, 7, -2 ** 40]), ("CHEBI:2", [8])]), db_path)
+    curie_to_pmids = CuriePMIDStore.open(db_path).get_pmids(["MONDO:1", "CHEBI:2"])
+    assert curie_to_pmids["MONDO:1"].tolist() == [7]
+    assert curie_to_pmids["CHEBI:2"].tolist() == [8]
+
+
+def test_ngd_reopens_rebuilt_curie_to_pmids_store(tmp_path, monkeypatch):
+    sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../ARAXQuery/Overlay")
+    sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../ARAXQuery/Overlay/ngd")
+    from compute_ngd import ComputeNGD
+    from curie_to_pmids_store import CuriePMIDStore, build_curie_to_pmids_store
+    db_path = str(tmp_path / "curie_to_pmids_v1.0_test.sqlite")
+    build_curie_to_pmids_store(iter([("MONDO:1", [1, 2])]), db_path)
+    ngd = ComputeNGD(ARAXResponse(), Message(), {})
+    monkeypatch.setattr(ngd, "_get_ngd_database_path", lambda: db_path)
+    ngd.curie_to_pmids_store = CuriePMIDStore.open(db_path)
+
+    # The store's index is rebuilt before this thread first queries it
+    build_curie_to_pmids_store(iter([("MONDO:1", [3])]), db_path)
+    with pytest.raises(ValueError):
+        ngd.curie_to_pmids_store.get_pmids(["MONDO:1"])
+    ngd.load_curie_to_pmids_data(["MONDO:1"])
+    ngd._close_database()
+    assert ngd.curie_to_pmids_map["MONDO:1"].tolist() == [3]
+
+
+def test_vectorized_fisher_exact_pvalues():
+    sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../ARAXQuery/Overlay")
+    import numpy as np
+    import scipy.stats as stats
+    from fisher_exact_test import compute_fisher_exact_pvalues
+    tables = [(1, 10, 3, 100), (5, 3, 8, 50), (0, 4, 2, 6), (7, 2, 9, 70), (2, 2, 2, 2), (0, 0, 0, 0),
+              (30, 4970, 200, 8000000), (0, 120, 45, 600000), (3, 0, 0, 5)]
+    a, b, c, d = (np.array(counts) for counts in zip(*tables))
+    expected_pvalues = [stats.fisher_exact([[w, x], [y, z]])[1] for w, x, y, z in tables]
+    assert np.allclose(compute_fisher_exact_pvalues(a, b, c, d), expected_pvalues, rtol=1e-9)
+
+
 if __name__ == "__main__":
     pytest.main(['-v'])
@@ -28,4 +28,141 @@ def test_query_by_query_graph_2():
     assert response.envelope.schema_version == '1.4.0'
 
 
+def test_query_return_stream_relays_events(monkeypatch):
+    import json
+    import threading
+    from openapi_server.models.message import Message
+    from openapi_server.models.response import Response
+
+    def fake_query(self, query, mode='ARAX', origin=None):
+        self.response.info("Starting the query")
+        self.response.update_query_plan('e00', 'infores:rtx-kg2', 'Waiting', "Query with 12 CURIEs sent: waiting for response", query={'message': {}})
+        #### Events must reach the client while the query is still running
+        assert relayed_first_events.wait(timeout=10)
+        self.response.update_query_plan('e00', 'infores:rtx-kg2', 'Done', "Query returned 89 results")
+        self.response.envelope = Response(message=Message(), status='OK', description="x" * 100)
+
+    relayed_first_events = threading.Event()
+    monkeypatch.setattr(ARAXQuery, "query", fake_query)
+    monkeypatch.setattr(ARAXQuery, "track_query_finish", lambda self: None)
+    monkeypatch.setattr(ARAXQuery, "STREAM_CHUNK_SIZE", 16)
+    araxq = ARAXQuery()
+    stream = araxq.query_return_stream({'message': {}})
+
+    assert "authorization" in json.loads(next(stream))
+    events = [json.loads(next(stream))]
+    while 'qedge_keys' not in events[-1]:
+        events.append(json.loads(next(stream)))
+    relayed_first_events.set()
+    assert sorted(event['message'] for event in events[:-1]) == ["In query_return_stream", "Starting the query", "in asynchronous_query"]
+    assert events[-1] == { 'qedge_keys': { 'e00': { 'infores:rtx-kg2': { 'status': 'Waiting', 'description': "Query with 12 CURIEs sent: waiting for response", 'query': {'message': {}} } } }, 'counter': 1, 'is_delta': True }
+    #### Later query_plan deltas only carry what changed
+    assert json.loads(next(stream)) == { 'qedge_keys': { 'e00': { 'infores:rtx-kg2': { 'status': 'Done', 'description': "Query returned 89 results" } } }, 'counter': 2, 'is_delta': True }
+
+    #### The final message comes in chunks that add up to the whole envelope
+    chunks = list(stream)
+    assert len(chunks) > 1 and all(len(chunk) <= 16 for chunk in chunks)
+    envelope = json.loads(''.join(chunks))
+    assert envelope['status'] == 'Success'
+    assert envelope['description'] == "x" * 100
+    assert araxq.response.event_queue is None
+
+
+def _run_fake_async_query_worker(connection):
+    # Stands in for run_async_query_worker(); a job's "query" says how long to take, or that the worker should die
+    import os
+    import time
+    while True:
+        try:
+            query, job_id = connection.recv()
+        except EOFError:
+            return
+        if query.get("die"):
+            os._exit(1)
+        time.sleep(query.get("seconds", 0))
+        connection.send(job_id)
+
+
+@pytest.fixture
+def fake_async_query_pool(monkeypatch):
+    import ARAX_async_query_pool
+    from ARAX_async_query_pool import ARAXAsyncQueryPool
+    lost_jobs = []
+    monkeypatch.setattr(ARAX_async_query_pool, "run_async_query_worker", _run_fake_async_query_worker)
+    monkeypatch.setattr(ARAXAsyncQueryPool, "_record_lost_job",
+                        staticmethod(lambda job_id, was_cancelled: lost_jobs.append((job_id, was_cancelled))))
+    monkeypatch.setattr(ARAXAsyncQueryPool, "n_workers", 2)
+    monkeypatch.setattr(ARAXAsyncQueryPool, "max_queued_jobs", 1)
+    monkeypatch.setattr(ARAXAsyncQueryPool, "monitor_interval", 0.05)
+    pool = ARAXAsyncQueryPool()
+    pool.lost_jobs = lost_jobs
+    yield pool
+    pool.shutdown()
+
+
+def _wait_for(condition, timeout: float = 10) -> bool:
+    import time
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def _pool_is_idle(pool) -> bool:
+    with pool.lock:
+        return not pool.queued_jobs and all(worker.job_id is None for worker in pool.workers)
+
+
+def test_async_query_pool_rejects_jobs_when_full(fake_async_query_pool):
+    pool = fake_async_query_pool
+    # Two workers plus one queued job is all the pool will take
+    assert all(pool.submit({"seconds": 0.5}, job_id) for job_id in [1, 2, 3])
+    assert not pool.submit({"seconds": 0}, 4)
+    with pool.lock:
+        assert [job_id for _, job_id in pool.queued_jobs] == [3]
+    # Once jobs finish, their slots are freed for new submissions
+    assert _wait_for(lambda: _pool_is_idle(pool))
+    assert pool.submit({"seconds": 0}, 5)
+    assert _wait_for(lambda: _pool_is_idle(pool))
+    assert pool.lost_jobs == []
+
+
+def test_async_query_pool_replaces_dead_workers(fake_async_query_pool):
+    pool = fake_async_query_pool
+    assert pool.submit({"die": True}, 1)
+    original_pids = {worker.process.pid for worker in pool.workers}
+    assert _wait_for(lambda: pool.lost_jobs == [(1, False)])
+    assert _wait_for(lambda: len(pool.workers) == 2 and {worker.process.pid for worker in pool.workers} != original_pids)
+
+    # A cancelled job's worker is terminated and replaced too, and the job is recorded as terminated
+    assert pool.submit({"seconds": 30}, 2)
+    running_pid = next(worker.process.pid for worker in pool.workers if worker.job_id == 2)
+    assert pool.is_worker(running_pid)
+    assert pool.cancel_job_on_worker(running_pid) == 2
+    assert _wait_for(lambda: pool.lost_jobs == [(1, False), (2, True)])
+    assert _wait_for(lambda: len(pool.workers) == 2 and not pool.is_worker(running_pid))
+
+    # The replacement workers still run jobs
+    assert pool.submit({"seconds": 0}, 3)
+    assert _wait_for(lambda: _pool_is_idle(pool))
+    assert len(pool.lost_jobs) == 2
+
+
+def test_async_query_pool_shutdown(fake_async_query_pool):
+    pool = fake_async_query_pool
+    assert pool.submit({"seconds": 30}, 1)
+    assert pool.submit({"seconds": 0}, 2)
+    processes = [worker.process for worker in pool.workers]
+    pool.shutdown()
+    for process in processes:
+        process.join(timeout=10)
+        assert not process.is_alive()
+    pool.monitor_thread.join(timeout=10)
+    assert not pool.monitor_thread.is_alive()
+    assert pool.workers == []
+    assert pool.lost_jobs == []  # Jobs stopped by a shutdown aren't reported as lost
+
+
 if __name__ == "__main__": pytest.main(['-v'])
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import pytest
+
+import math
+import random
+import warnings
+
+import networkx as nx
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../ARAXQuery")
+import ARAX_ranker
+from ARAX_ranker import ARAXRanker, EDGE_ATTRIBUTE_NORMALIZERS, register_edge_attribute_normalizer, \
+    _get_query_graph_networkx_from_query_graph, _get_weighted_adjacency_matrices, \
+    _get_qnode_index_pairs_with_max_path_len, _score_adjacency_matrices_by_max_flow, \
+    _score_adjacency_matrices_by_longest_path, _score_adjacency_matrices_by_frobenius_norm
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../UI/OpenAPI/python-flask-server/")
+from openapi_server.models.query_graph import QueryGraph
+from openapi_server.models.q_node import QNode
+from openapi_server.models.q_edge import QEdge
+from openapi_server.models.edge import Edge
+from openapi_server.models.result import Result
+from openapi_server.models.analysis import Analysis
+from openapi_server.models.edge_binding import EdgeBinding
+from openapi_server.models.attribute import Attribute
+from openapi_server.models.knowledge_graph import KnowledgeGraph
+from ARAX_response import ARAXResponse
+
+
+def _get_random_query_graph_and_results(rng: random.Random, num_qnodes: int, num_results: int) -> tuple:
+    # A random tree (so the query graph is connected) plus a few extra qedges, some of which may be parallel
+    qnode_keys = [f"n{qnode_num:02}" for qnode_num in range(num_qnodes)]
+    qnode_pairs = [(qnode_keys[rng.randrange(qnode_num)], qnode_keys[qnode_num]) for qnode_num in range(1, num_qnodes)]
+    qnode_pairs += [tuple(rng.sample(qnode_keys, 2)) for _ in range(rng.randint(0, 3)) if num_qnodes > 1]
+    qnode_pairs = [pair if rng.random() < 0.5 else pair[::-1] for pair in qnode_pairs]
+    query_graph = QueryGraph(nodes={qnode_key: QNode() for qnode_key in qnode_keys},
+                             edges={f"e{qedge_num:02}": QEdge(subject=subject, object=object)
+                                    for qedge_num, (subject, object) in enumerate(qnode_pairs)})
+    kg_edge_id_to_edge = dict()
+    results = []
+    for result_num in range(num_results):
+        edge_bindings = dict()
+        for qedge_key in query_graph.edges:
+            edge_bindings[qedge_key] = []
+            for edge_num in range(rng.randint(0, 3)):
+                edge = Edge()
+                edge.confidence = rng.choice([0., rng.random(), rng.random() * 10])
+                edge.qedge_keys = [qedge_key]
+                edge_key = f"r{result_num}:{qedge_key}:{edge_num}"
+                kg_edge_id_to_edge[edge_key] = edge
+                edge_bindings[qedge_key].append(EdgeBinding(id=edge_key))
+        results.append(Result(node_bindings=dict(),
+                              analyses=[Analysis(resource_id="infores:arax", edge_bindings=edge_bindings)]))
+    return query_graph, kg_edge_id_to_edge, results
+
+
+def _get_result_graph_networkx(query_graph: QueryGraph, kg_edge_id_to_edge: dict, result: Result) -> nx.DiGraph:
+    # Scores used to be computed one result at a time from graphs like this one (parallel qedges collapsed into one)
+    result_graph_nx = nx.DiGraph()
+    result_graph_nx.add_nodes_from(query_graph.nodes)
+    for qedge in query_graph.edges.values():
+        result_graph_nx.add_edge(qedge.subject, qedge.object, weight=0.)
+    for edge_binding_list in result.analyses[0].edge_bindings.values():
+        for edge_binding in edge_binding_list:
+            kg_edge = kg_edge_id_to_edge[edge_binding.id]
+            for qedge_key in kg_edge.qedge_keys:
+                qedge = query_graph.edges[qedge_key]
+                result_graph_nx[qedge.subject][qedge.object]['weight'] += kg_edge.confidence
+    return result_graph_nx
+
+
+@pytest.mark.parametrize("num_qnodes", [1, 2, 3, 4, 6, 8, 13, 15])
+def test_result_graph_scores_match_networkx(num_qnodes):
+    rng = random.Random(num_qnodes)
+    for _ in range(5):
+        query_graph, kg_edge_id_to_edge, results = _get_random_query_graph_and_results(rng, num_qnodes, num_results=6)
+        adjacency_matrices = _get_weighted_adjacency_matrices(kg_edge_id_to_edge, query_graph, results)
+        max_path_len, pairs_with_max_path_len = _get_qnode_index_pairs_with_max_path_len(
+            _get_query_graph_networkx_from_query_graph(query_graph))
+        max_flow_scores = _score_adjacency_matrices_by_max_flow(adjacency_matrices, max_path_len,
+                                                                pairs_with_max_path_len)
+        longest_path_scores = _score_adjacency_matrices_by_longest_path(adjacency_matrices, max_path_len,
+                                                                        pairs_with_max_path_len)
+        frobenius_norm_scores = _score_adjacency_matrices_by_frobenius_norm(adjacency_matrices, max_path_len,
+                                                                            pairs_with_max_path_len)
+
+        qnode_keys = list(query_graph.nodes)
+        for result_index, result in enumerate(results):
+            result_graph_nx = _get_result_graph_networkx(query_graph, kg_edge_id_to_edge, result)
+            adjacency_matrix = nx.to_numpy_array(result_graph_nx, nodelist=qnode_keys)
+            assert np.allclose(adjacency_matrices[result_index], adjacency_matrix)
+            apsp_dict = dict(nx.all_pairs_shortest_path_length(result_graph_nx))
+            expected_max_path_len = max(path_len for path_lens in apsp_dict.values() for path_len in path_lens.values())
+            pairs = [(source, target) for source, path_lens in apsp_dict.items()
+                     for target, path_len in path_lens.items() if path_len == expected_max_path_len]
+            assert max_path_len == expected_max_path_len
+
+            if num_qnodes > 1:
+                expected_max_flow = np.mean([nx.maximum_flow_value(result_graph_nx, source, target, capacity="weight")
+                                             for source, target in pairs])
+            else:
+                expected_max_flow = 1.
+            assert max_flow_scores[result_index] == pytest.approx(expected_max_flow)
+            adjacency_matrix_power = np.linalg.matrix_power(adjacency_matrix, max_path_len) / math.factorial(max_path_len)
+            expected_longest_path = np.mean([adjacency_matrix_power[qnode_keys.index(source), qnode_keys.index(target)]
+                                             for source, target in pairs])
+            assert longest_path_scores[result_index] == pytest.approx(expected_longest_path)
+            assert frobenius_norm_scores[result_index] == pytest.approx(np.linalg.norm(adjacency_matrix, ord='fro'))
+
+
+def test_max_flow_cut_enumeration_matches_networkx_fallback(monkeypatch):
+    rng = random.Random(0)
+    for num_qnodes in range(2, 9):
+        query_graph, kg_edge_id_to_edge, results = _get_random_query_graph_and_results(rng, num_qnodes, num_results=8)
+        adjacency_matrices = _get_weighted_adjacency_matrices(kg_edge_id_to_edge, query_graph, results)
+        max_path_len, pairs_with_max_path_len = _get_qnode_index_pairs_with_max_path_len(
+            _get_query_graph_networkx_from_query_graph(query_graph))
+        enumerated_scores = _score_adjacency_matrices_by_max_flow(adjacency_matrices, max_path_len,
+                                                                  pairs_with_max_path_len)
+        with monkeypatch.context() as patch:
+            patch.setattr(ARAX_ranker, "MAX_QNODES_FOR_CUT_ENUMERATION", 1)
+            fallback_scores = _score_adjacency_matrices_by_max_flow(adjacency_matrices, max_path_len,
+                                                                    pairs_with_max_path_len)
+        assert np.allclose(enumerated_scores, fallback_scores)
+
+
+def _scalar_logistic(value: float, max_value: float, curve_steepness: float, logistic_midpoint: float) -> float:
+    return max_value / float(1 + np.exp(-curve_steepness * (value - logistic_midpoint)))
+
+
+def _scalar_fisher_exact_test_p_value(value: float) -> float:
+    if value <= np.finfo(float).eps:
+        return 1.
+    return _scalar_logistic(-np.log(value), max_value=1.0, curve_steepness=3, logistic_midpoint=2.7)
+
+
+# The one-value-at-a-time normalizers that the vectorized ones replaced, as a reference
+SCALAR_EDGE_ATTRIBUTE_NORMALIZERS = {
+    'probability_treats': lambda value, stats: _scalar_logistic(value, 1, 15, 0.60),
+    'normalized_google_distance': lambda value, stats: _scalar_logistic(value, 1, -9, 0.60),
+    'probability': lambda value, stats: _scalar_logistic(value, 1, 20, 0.8),
+    'jaccard_index': lambda value, stats: value / stats['maximum'],
+    'paired_concept_frequency': lambda value, stats: _scalar_logistic(value, 1, 2000, 0.002),
+    'observed_expected_ratio': lambda value, stats: _scalar_logistic(value, 1, 2, 2),
+    'chi_square': lambda value, stats: _scalar_logistic(-np.log(value), 1, 0.03, 200),
+    'chi_square_pvalue': lambda value, stats: _scalar_logistic(-np.log(value), 1, 0.03, 200),
+    'MAGMA-pvalue': lambda value, stats: _scalar_logistic(-np.log(value), 1.0, 0.849, 4.97),
+    'pValue': lambda value, stats: _scalar_logistic(-np.log(value), 1.0, 0.849, 4.97),
+    'Genetics-quantile': lambda value, stats: value,
+    'fisher_exact_test_p-value': lambda value, stats: _scalar_fisher_exact_test_p_value(value),
+    'CMAP similarity score': lambda value, stats: abs(value / 100),
+    'Richards-effector-genes': lambda value, stats: value,
+    'feature_coefficient': lambda value, stats: _scalar_logistic(np.log(abs(value)), 1, 2.75, 0.15),
+}
+
+
+@pytest.mark.parametrize("attribute_name", sorted(SCALAR_EDGE_ATTRIBUTE_NORMALIZERS))
+def test_edge_attribute_normalizers_match_scalar_versions(attribute_name):
+    values = np.array([-3., -0.2, 0., 1e-300, 1e-20, 1e-5, 0.002, 0.03, 0.05, 0.5, 0.6, 0.8, 0.99, 1., 2., 2.5, 50.,
+                       1e4, 1e9])
+    stats = {'minimum': float(values.min()), 'maximum': 2.}
+    with np.errstate(all='ignore'):
+        expected_values = [SCALAR_EDGE_ATTRIBUTE_NORMALIZERS[attribute_name](value, stats) for value in values]
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        normalized_values = EDGE_ATTRIBUTE_NORMALIZERS[attribute_name].normalize(values, stats)
+    assert np.allclose(normalized_values, expected_values, equal_nan=True)
+
+
+def test_jaccard_index_normalizer_without_positive_maximum():
+    values = np.array([0., 0., 0.])
+    normalize_jaccard_index = EDGE_ATTRIBUTE_NORMALIZERS['jaccard_index'].normalize
+    assert normalize_jaccard_index(values, {'minimum': 0., 'maximum': 0.}).tolist() == [0., 0., 0.]
+    assert normalize_jaccard_index(values, {'minimum': None, 'maximum': None}).tolist() == [0., 0., 0.]
+    assert normalize_jaccard_index(values, None).tolist() == [0., 0., 0.]
+
+
+def test_register_edge_attribute_normalizer(monkeypatch):
+    monkeypatch.setattr(ARAX_ranker, "EDGE_ATTRIBUTE_NORMALIZERS", dict(EDGE_ATTRIBUTE_NORMALIZERS))
+
+    @register_edge_attribute_normalizer('made_up_score', 'biolink:made_up_score', trust=0.3)
+    def normalize_made_up_score(values, stats):
+        return values / 10
+
+    assert normalize_made_up_score(np.array([5.]), None).tolist() == [0.5]  # The decorator returns the function
+    for attribute_name in ['made_up_score', 'biolink:made_up_score']:
+        assert ARAX_ranker.EDGE_ATTRIBUTE_NORMALIZERS[attribute_name].normalize is normalize_made_up_score
+        assert ARAX_ranker.EDGE_ATTRIBUTE_NORMALIZERS[attribute_name].trust == 0.3
+    assert 'made_up_score' not in EDGE_ATTRIBUTE_NORMALIZERS
+    ranker = ARAXRanker()
+    assert 'biolink:made_up_score' in ranker.known_attributes
+    assert ranker.known_attributes_to_trust['made_up_score'] == 0.3
+
+    # Newly registered attributes are scored along with the rest
+    knowledge_graph = KnowledgeGraph(nodes=dict(), edges={
+        "edge1": Edge(attributes=[Attribute(attribute_type_id='biolink:made_up_score', value=5),
+                                  Attribute(attribute_type_id='biolink:publications', value=["PMID:1", "PMID:2"])])})
+    confidences = ranker.compute_edge_confidences(knowledge_graph, ARAXResponse())
+    assert confidences["edge1"] == pytest.approx(0.5 * _scalar_logistic(np.log(2), 1.0, 3.16993, 1.38629))
+
+
+def test_compute_edge_confidences_match_scalar_versions():
+    def get_attributes(num_publications: int, **attribute_values) -> list:
+        attributes = [Attribute(attribute_type_id="biolink:has_attribute", original_attribute_name=attribute_name,
+                                value=value) for attribute_name, value in attribute_values.items()]
+        publications = [f"PMID:{pmid}" for pmid in range(num_publications)]
+        return attributes + [Attribute(attribute_type_id="biolink:publications", value=publications)]
+
+    knowledge_graph = KnowledgeGraph(nodes=dict(), edges={
+        "edge1": Edge(attributes=get_attributes(3, probability_treats=0.9, jaccard_index=0.)),
+        "edge2": Edge(attributes=get_attributes(0, jaccard_index=0., normalized_google_distance=0.3)),
+        "edge3": Edge(attributes=get_attributes(1, chi_square=0., observed_expected_ratio="no value!")),
+        "edge4": Edge(attributes=get_attributes(5, feature_coefficient=-1.2)),
+        "edge5": Edge(attributes=get_attributes(5, normalized_google_distance="not a number")),
+        "edge6": Edge(attributes=None)})
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        confidences = ARAXRanker().compute_edge_confidences(knowledge_graph, ARAXResponse())
+
+    def score_publications(num_publications: int) -> float:
+        return 0.01 if not num_publications else _scalar_logistic(np.log(num_publications), 1.0, 3.16993, 1.38629)
+    # The jaccard indexes are all 0, so their maximum is too; they should score 0 rather than making NaN confidences
+    assert confidences["edge1"] == 0.
+    assert confidences["edge2"] == 0.
+    with np.errstate(all='ignore'):
+        assert confidences["edge3"] == pytest.approx(SCALAR_EDGE_ATTRIBUTE_NORMALIZERS['chi_square'](0., None) *
+                                                     SCALAR_EDGE_ATTRIBUTE_NORMALIZERS['observed_expected_ratio'](0., None) *
+                                                     score_publications(1))
+    assert confidences["edge4"] == pytest.approx(SCALAR_EDGE_ATTRIBUTE_NORMALIZERS['feature_coefficient'](-1.2, None) *
+                                                 score_publications(5))
+    assert confidences["edge5"] == 0.  # Attribute values that aren't numbers score 0
+    assert confidences["edge6"] == score_publications(0)
+    assert all(np.isfinite(list(confidences.values())))
+
+if __name__ == "__main__":
+    pytest.main(['-v', 'test_ARAX_ranker.py'])
@@ -1407,6 +1407,52 @@ def test_multi_node_edgeless_qg():
     assert len(message.results) == 1
 
 
+def test_set_qnode_dead_ends_pruned_per_result():
+    # Tests that each result's is_set qnode only keeps nodes connected to that result's other nodes
+    shorthand_qnodes = {"n00": "",
+                        "n01": "true",
+                        "n02": ""}
+    shorthand_qedges = {"e00": "n00--n01",
+                        "e01": "n01--n02"}
+    query_graph = _convert_shorthand_to_qg(shorthand_qnodes, shorthand_qedges)
+    shorthand_kg_nodes = {"n00": ["CHEBI:1"],
+                          "n01": ["UniProtKB:1", "UniProtKB:2", "UniProtKB:3", "UniProtKB:4"],
+                          "n02": ["DOID:1", "DOID:2"]}
+    shorthand_kg_edges = {"e00": ["CHEBI:1--UniProtKB:1", "CHEBI:1--UniProtKB:2", "CHEBI:1--UniProtKB:3"],
+                          "e01": ["UniProtKB:1--DOID:1", "UniProtKB:2--DOID:1", "UniProtKB:3--DOID:2",
+                                  "UniProtKB:4--DOID:2"]}
+    knowledge_graph = _convert_shorthand_to_kg(shorthand_kg_nodes, shorthand_kg_edges)
+    results_list = ARAX_resultify._get_results_for_kg_by_qg(knowledge_graph, query_graph)
+    set_nodes_by_n02_node = {result.node_bindings["n02"][0].id: {binding.id for binding in result.node_bindings["n01"]}
+                             for result in results_list}
+    assert set_nodes_by_n02_node == {"DOID:1": {"UniProtKB:1", "UniProtKB:2"},
+                                     "DOID:2": {"UniProtKB:3"}}
+    for result in results_list:
+        assert len(result.analyses[0].edge_bindings["e00"]) == len(result.node_bindings["n01"])
+
+
+def test_max_results():
+    # Tests that resultify(max_results) keeps only the results with the most edge confidence
+    shorthand_qnodes = {"n00": "",
+                        "n01": "true",
+                        "n02": ""}
+    shorthand_qedges = {"e00": "n00--n01",
+                        "e01": "n01--n02"}
+    query_graph = _convert_shorthand_to_qg(shorthand_qnodes, shorthand_qedges)
+    shorthand_kg_nodes = {"n00": ["CHEBI:1"],
+                          "n01": ["UniProtKB:1", "UniProtKB:2", "UniProtKB:3"],
+                          "n02": ["DOID:1", "DOID:2"]}
+    shorthand_kg_edges = {"e00": ["CHEBI:1--UniProtKB:1", "CHEBI:1--UniProtKB:2", "CHEBI:1--UniProtKB:3"],
+                          "e01": ["UniProtKB:1--DOID:1", "UniProtKB:2--DOID:1", "UniProtKB:3--DOID:2"]}
+    knowledge_graph = _convert_shorthand_to_kg(shorthand_kg_nodes, shorthand_kg_edges)
+    all_results = ARAX_resultify._get_results_for_kg_by_qg(knowledge_graph, query_graph)
+    assert len(all_results) == 2
+    top_results = ARAX_resultify._get_results_for_kg_by_qg(knowledge_graph, query_graph, max_results=1)
+    assert len(top_results) == 1
+    assert top_results[0].node_bindings["n02"][0].id == "DOID:1"
+    assert len(top_results[0].node_bindings["n01"]) == 2
+
+
 @pytest.mark.slow
 def test_issue_1446():
     actions = [
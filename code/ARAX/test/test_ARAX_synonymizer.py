@@ -327,6 +327,22 @@ def test_improper_curie_prefix_capitalization():
     assert len(results) == 1
 
 
+def test_cached_canonical_curies():
+    curies = [ACETAMINOPHEN_CURIE, ACETAMINOPHEN_CURIE_2, FAKE_CURIE]
+    results = NodeSynonymizer().get_canonical_curies(curies, return_all_categories=True)
+    assert results[ACETAMINOPHEN_CURIE]["all_categories"]
+    assert results[FAKE_CURIE] is None
+
+    # A second lookup (by a new instance) should be served from the in-process cache, unaffected by the first
+    cached_results = NodeSynonymizer().get_canonical_curies(curies)
+    assert cached_results[FAKE_CURIE] is None
+    for curie in [ACETAMINOPHEN_CURIE, ACETAMINOPHEN_CURIE_2]:
+        assert "all_categories" not in cached_results[curie]
+        assert cached_results[curie]["preferred_curie"] == results[curie]["preferred_curie"]
+    cached_results[ACETAMINOPHEN_CURIE]["preferred_name"] = "changed"
+    assert NodeSynonymizer().get_canonical_curies(ACETAMINOPHEN_CURIE)[ACETAMINOPHEN_CURIE]["preferred_name"] != "changed"
+
+
 def test_approximate_name_based_matching():
     synonymizer = NodeSynonymizer()
 
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import pytest
+
+import sqlite3
+import subprocess
+import threading
+
+AUTOCOMPLETE_DIR = os.path.dirname(os.path.abspath(__file__))+"/../../autocomplete"
+sys.path.append(AUTOCOMPLETE_DIR)
+import rtxcomplete
+from term_prefix_index import TermPrefixIndex
+
+# curie, name, full name, type (the same layout as NodeNamesDescriptions_KG2.tsv)
+NODE_NAMES = [("CHEBI:1", "aspirin", "aspirin", "biolink:SmallMolecule"),
+              ("CHEBI:2", "Aspirin", "Aspirin", "biolink:SmallMolecule"),
+              ("CHEBI:3", "asthma drug", "asthma drug", "biolink:SmallMolecule"),
+              ("CHEBI:4", "baby aspirin", "baby aspirin", "biolink:SmallMolecule"),
+              ("CHEBI:5", "ast", "ast", "biolink:SmallMolecule"),
+              ("MONDO:1", "asthma", "asthma", "biolink:Disease"),
+              ("MONDO:2", "Asthma", "Asthma", "biolink:Disease"),
+              ("MONDO:3", "acute asthma", "acute asthma", "biolink:Disease"),
+              ("NCBIGene:1", "aspire", "aspire", "biolink:Gene")]
+
+
+def _create_autocomplete_db(tmp_path, node_names: list) -> str:
+    input_path = f"{tmp_path}/node_names.tsv"
+    with open(input_path, "w") as input_file:
+        for row in node_names:
+            input_file.write("\t".join(row) + "\n")
+    database_path = f"{tmp_path}/autocomplete.sqlite"
+    subprocess.run([sys.executable, f"{AUTOCOMPLETE_DIR}/create_load_db.py", "-i", input_path, "-o", database_path],
+                   check=True, capture_output=True)
+    return database_path
+
+
+def _load_autocomplete_db(monkeypatch, database_path: str, use_prefix_index: bool = False):
+    monkeypatch.setattr(rtxcomplete, "autocomplete_filepath", os.path.dirname(database_path))
+    monkeypatch.setattr(rtxcomplete.RTXConfig, "autocomplete_path", f"/some/path/{os.path.basename(database_path)}")
+    monkeypatch.setattr(rtxcomplete, "connections", threading.local())
+    monkeypatch.setattr(rtxcomplete, "prefix_index", None)
+    assert rtxcomplete.load(use_prefix_index=use_prefix_index)
+
+
+def _get_names(word: str, limit: int) -> list:
+    return [properties["name"] for properties in rtxcomplete.get_nodes_like(word, limit)]
+
+
+@pytest.fixture
+def autocomplete_db(tmp_path):
+    return _create_autocomplete_db(tmp_path, NODE_NAMES)
+
+
+def test_create_load_db_ranks_terms(autocomplete_db):
+    conn = sqlite3.connect(autocomplete_db)
+    ranked_terms = [row for row in conn.execute("SELECT term, popularity FROM terms ORDER BY rowid")
+                    if not row[0].startswith(("CHEBI:", "MONDO:", "NCBIGene:"))]
+    assert "terms_fts" in {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    # Shortest first, then most popular; each term keeps the first spelling seen of it
+    assert ranked_terms == [("ast", 1), ("asthma", 2), ("aspire", 1), ("aspirin", 2), ("asthma drug", 1),
+                            ("acute asthma", 1), ("baby aspirin", 1)]
+
+
+def test_get_nodes_like_prefix_and_trigram_matches(monkeypatch, autocomplete_db):
+    _load_autocomplete_db(monkeypatch, autocomplete_db)
+    assert rtxcomplete.has_trigram_index
+    # Prefix matches come first, in rank order and ignoring case, then infix matches from the trigram index
+    assert _get_names("ast", 10) == ["ast", "asthma", "asthma drug", "acute asthma"]
+    assert _get_names("ASP", 10) == ["aspire", "aspirin", "baby aspirin"]
+    assert _get_names("pirin", 10) == ["aspirin", "baby aspirin"]
+    assert _get_names("ast", 2) == ["ast", "asthma"]
+    assert _get_names('a"s', 10) == []
+    assert _get_names("a", 10) == []
+
+
+def test_get_nodes_like_two_character_input(monkeypatch, autocomplete_db):
+    _load_autocomplete_db(monkeypatch, autocomplete_db)
+    # The trigram index can't match two characters, so only prefix matches are returned, in rank order
+    assert _get_names("as", 10) == ["ast", "asthma", "aspire", "aspirin", "asthma drug"]
+    assert _get_names("As", 3) == ["ast", "asthma", "aspire"]
+
+
+def test_get_nodes_like_falls_back_to_like(monkeypatch, autocomplete_db):
+    conn = sqlite3.connect(autocomplete_db)
+    conn.execute("DROP TABLE terms_fts")
+    conn.commit()
+    conn.close()
+    _load_autocomplete_db(monkeypatch, autocomplete_db)
+    assert not rtxcomplete.has_trigram_index
+    # Without the trigram index, terms are ranked by length and then alphabetically, and LIKE finds infix matches
+    assert _get_names("ast", 10) == ["ast", "asthma", "asthma drug", "acute asthma"]
+    assert _get_names("as", 10) == ["ast", "aspire", "asthma", "aspirin", "asthma drug", "acute asthma",
+                                    "baby aspirin"]
+    assert _get_names("pirin", 10) == ["aspirin", "baby aspirin"]
+    assert _get_names("s%", 10) == []
+
+
+def test_term_prefix_index_matches_sqlite(monkeypatch, autocomplete_db):
+    index = TermPrefixIndex.load(autocomplete_db)
+    assert os.path.isdir(f"{autocomplete_db}.prefix_index")
+    _load_autocomplete_db(monkeypatch, autocomplete_db)
+    conn = rtxcomplete.get_connection()
+    for prefix in ["as", "AS", "ast", "Asth", "asp", "aspirin", "c", "chebi:", "MONDO:1", "x"]:
+        for limit in [1, 3, 20]:
+            sqlite_terms = [row[0] for row in conn.execute("SELECT term FROM terms WHERE term >= ? AND term < ? "
+                                                           "ORDER BY rowid LIMIT ?",
+                                                           (prefix, prefix + chr(0x10FFFF), limit))]
+            assert index.get_terms_with_prefix(prefix, limit) == sqlite_terms
+    assert index.get_terms_with_prefix("as", 0) == []
+
+    # get_nodes_like gives the same answers whether or not it uses the index
+    expected_names = {word: _get_names(word, 10) for word in ["as", "Ast", "pirin"]}
+    _load_autocomplete_db(monkeypatch, autocomplete_db, use_prefix_index=True)
+    assert rtxcomplete.prefix_index is not None
+    assert {word: _get_names(word, 10) for word in expected_names} == expected_names
+
+
+def test_term_prefix_index_rebuilds_when_stale(autocomplete_db):
+    assert TermPrefixIndex.load(autocomplete_db).get_terms_with_prefix("asp", 10) == ["aspire", "aspirin"]
+    index_mtime = os.path.getmtime(f"{autocomplete_db}.prefix_index")
+
+    # A fresh index is reused as is
+    TermPrefixIndex.load(autocomplete_db)
+    assert os.path.getmtime(f"{autocomplete_db}.prefix_index") == index_mtime
+
+    # Once the database is newer than the index, the index is rebuilt from it
+    _create_autocomplete_db(os.path.dirname(autocomplete_db),
+                            NODE_NAMES + [("CHEBI:6", "ASPARTAME", "ASPARTAME", "biolink:SmallMolecule")])
+    os.utime(autocomplete_db, (index_mtime + 10, index_mtime + 10))
+    index = TermPrefixIndex.load(autocomplete_db)
+    assert index.get_terms_with_prefix("asp", 10) == ["aspire", "aspirin", "ASPARTAME"]
+    assert index.get_terms_with_prefix("AsPa", 10) == ["ASPARTAME"]
+    assert not [file_name for file_name in os.listdir(os.path.dirname(autocomplete_db)) if ".tmp" in file_name]
+
+
+if __name__ == "__main__": pytest.main(['-v'])
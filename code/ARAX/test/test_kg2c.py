@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import pytest
+
+import csv
+import importlib
+import random
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../kg2c")
+import create_kg2c_files
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../kg2c/synonymizer_build")
+cluster_match_graph = importlib.import_module("4_cluster_match_graph")
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../ARAXQuery")
+from ARAX_decorator import ARAXDecorator
+from ARAX_response import ARAXResponse
+from kg2c_sqlite import KG2cSqliteReader
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../../UI/OpenAPI/python-flask-server/")
+from openapi_server.models.edge import Edge
+from openapi_server.models.knowledge_graph import KnowledgeGraph
+from openapi_server.models.message import Message
+from openapi_server.models.node import Node
+from openapi_server.models.response import Response
+from openapi_server.models.retrieval_source import RetrievalSource
+
+KG2PRE_EDGE_HEADERS = ["subject", "object", "predicate", "id", "primary_knowledge_source", "publications:string[]",
+                       "publications_info", "qualified_predicate", "qualified_object_aspect",
+                       "qualified_object_direction", "domain_range_exclusion"]
+
+
+def _write_kg2pre_edges_tsv(tsv_dir_path: str, rows: list):
+    with open(f"{tsv_dir_path}/edges_header.tsv", "w") as header_file:
+        csv.writer(header_file, delimiter="\t").writerow(KG2PRE_EDGE_HEADERS)
+    with open(f"{tsv_dir_path}/edges.tsv", "w") as edges_file:
+        csv.writer(edges_file, delimiter="\t").writerows(rows)
+
+
+@pytest.fixture
+def small_sharded_build(tmp_path, monkeypatch):
+    # Use tiny chunks and only a few shards so that merging edges has to work across both
+    monkeypatch.setattr(create_kg2c_files, "KG2PRE_CHUNK_SIZE", 2)
+    monkeypatch.setattr(create_kg2c_files, "NUM_EDGE_SHARDS", 3)
+    monkeypatch.setattr(create_kg2c_files, "EDGE_SHARDS_DIR", str(tmp_path / "edge_shards"))
+    return tmp_path
+
+
+def test_canonicalize_edges_sharded(small_sharded_build):
+    tsv_dir_path = str(small_sharded_build)
+    curie_map = {"MESH:1": "CHEBI:1", "CHEBI:1": "CHEBI:1", "MONDO:1": "MONDO:1", "DOID:1": "MONDO:1",
+                 "HGNC:1": "NCBIGene:1", "NCBIGene:1": "NCBIGene:1", "HGNC:2": "NCBIGene:2"}
+    _write_kg2pre_edges_tsv(tsv_dir_path, [
+        ["CHEBI:1", "MONDO:1", "biolink:treats", "E0", "infores:a", "PMID:1;PMID:2", "{'PMID:1': {'sentence': 'x'}}",
+         "", "", "", "False"],
+        ["HGNC:1", "MONDO:1", "biolink:related_to", "E1", "infores:a", "", "{}", "", "", "", "False"],
+        ["MONDO:1", "DOID:1", "biolink:subclass_of", "E2", "infores:a", "", "{}", "", "", "", "False"],  # Self-edge
+        ["MESH:1", "DOID:1", "biolink:treats", "E3", "infores:a", "PMID:2;PMID:3", "{'PMID:3': {'sentence': 'y'}}",
+         "", "", "", "False"],
+        ["HGNC:2", "MONDO:1", "biolink:related_to", "E4", "infores:a", "", "{}", "", "", "", "False"],
+        ["NCBIGene:1", "DOID:1", "biolink:related_to", "E5", "infores:a", "PMID:4", "{}", "", "", "", "False"],
+        ["MESH:1", "MONDO:1", "biolink:treats", "E6", "infores:b", "", "{}", "", "", "", "False"],
+        ["CHEBI:1", "MONDO:1", "biolink:treats", "E7", "infores:a", "", "{'PMID:5': {}, 'other': 1}",
+         "", "", "", "False"],
+    ])
+
+    canonicalized_edges = create_kg2c_files._canonicalize_edges(tsv_dir_path, curie_map, is_test=False)
+
+    # Edges come back in the order they first appeared in KG2pre, with duplicates (under the canonical curies) merged
+    assert [edge["kg2_ids"] for edge in canonicalized_edges.values()] == [["E0", "E3", "E7"], ["E1", "E5"], ["E4"],
+                                                                          ["E6"]]
+    treats_edge, related_edge = [canonicalized_edges[edge_key] for edge_key in list(canonicalized_edges)[:2]]
+    assert (treats_edge["subject"], treats_edge["object"]) == ("CHEBI:1", "MONDO:1")
+    assert sorted(treats_edge["publications"]) == ["PMID:1", "PMID:2", "PMID:3"]
+    assert treats_edge["publications_info"] == {"PMID:1": {"sentence": "x"}, "PMID:3": {"sentence": "y"}, "PMID:5": {}}
+    assert (related_edge["subject"], related_edge["object"]) == ("NCBIGene:1", "MONDO:1")
+    assert related_edge["publications"] == ["PMID:4"]
+    assert not any(edge["subject"] == edge["object"] for edge in canonicalized_edges.values())
+    assert not os.path.exists(create_kg2c_files.EDGE_SHARDS_DIR)
+
+
+def test_canonicalize_edges_cleans_up_shards_on_failure(small_sharded_build):
+    tsv_dir_path = str(small_sharded_build)
+    _write_kg2pre_edges_tsv(tsv_dir_path, [
+        ["CHEBI:1", "MONDO:1", "biolink:treats", "E0", "infores:a", "", "{}", "", "", "", "False"],
+        ["CHEBI:1", "UNMAPPED:1", "biolink:treats", "E1", "infores:a", "", "{}", "", "", "", "False"],
+    ])
+
+    # Outside of test mode, every curie must be in the curie map, so a worker raises on the second edge
+    with pytest.raises(AssertionError):
+        create_kg2c_files._canonicalize_edges(tsv_dir_path, {"CHEBI:1": "CHEBI:1", "MONDO:1": "MONDO:1"},
+                                              is_test=False)
+    assert not os.path.exists(create_kg2c_files.EDGE_SHARDS_DIR)
+
+
+def test_kg2c_sqlite_round_trip(tmp_path, monkeypatch):
+    nodes = {
+        "CHEBI:1": create_kg2c_files._create_node(preferred_curie="CHEBI:1", name="aspirin",
+                                                  category="biolink:SmallMolecule",
+                                                  all_categories=["biolink:SmallMolecule", "biolink:Drug"],
+                                                  equivalent_curies=["CHEBI:1", "MESH:1"],
+                                                  publications=["PMID:1", None, 7], all_names=["aspirin", "ASA"],
+                                                  iri="http://purl.obolibrary.org/obo/CHEBI_1",
+                                                  description="A drug", descriptions_list=["A drug"]),
+        "MONDO:1": create_kg2c_files._create_node(preferred_curie="MONDO:1", name="headache",
+                                                  category="biolink:Disease", all_categories=["biolink:Disease"],
+                                                  equivalent_curies=["MONDO:1"], publications=[],
+                                                  all_names=["headache"], iri=None, description="",
+                                                  descriptions_list=[])
+    }
+    publications_info = {"PMID:1": {"publication date": "2020 Jan 01", "sentence": "Aspirin treats headaches.",
+                                     "subject score": 1000, "object score": 861, "extra key": ["kept", 1]},
+                         "PMID:2": {"sentence": "Also this."},
+                         "PMID:3": "not a dict"}
+    edges = {
+        "edge": create_kg2c_files._create_edge(subject="CHEBI:1", object="MONDO:1", predicate="biolink:treats",
+                                               primary_knowledge_source="infores:semmeddb",
+                                               publications=["PMID:1", "PMID:2"],
+                                               publications_info=publications_info, kg2_ids=["E0", "E3"],
+                                               qualified_predicate="", qualified_object_aspect="",
+                                               qualified_object_direction="", domain_range_exclusion="False")
+    }
+    monkeypatch.chdir(tmp_path)
+    create_kg2c_files.create_kg2c_sqlite_db(nodes, edges, is_test=True)
+    sqlite_file_path = str(tmp_path / "kg2c.sqlite")
+    monkeypatch.setattr(ARAXDecorator, "_get_sqlite_reader", lambda self: KG2cSqliteReader(sqlite_file_path))
+
+    kg2_sources = [RetrievalSource(resource_id="infores:semmeddb", resource_role="primary_knowledge_source"),
+                   RetrievalSource(resource_id="infores:rtx-kg2", resource_role="aggregator_knowledge_source")]
+    response = ARAXResponse()
+    response.envelope = Response(message=Message(knowledge_graph=KnowledgeGraph(
+        nodes={"CHEBI:1": Node(attributes=[]), "MONDO:1": Node(attributes=[])},
+        edges={"e0": Edge(subject="CHEBI:1", object="MONDO:1", predicate="biolink:treats", sources=kg2_sources)})))
+    decorator = ARAXDecorator()
+    decorator.decorate_nodes(response)
+    decorator.decorate_edges(response, kind="RTX-KG2")
+    assert response.status == "OK"
+
+    kg = response.envelope.message.knowledge_graph
+    node_values = {attribute.attribute_type_id: attribute.value for attribute in kg.nodes["CHEBI:1"].attributes}
+    assert node_values == {"biolink:IriType": "http://purl.obolibrary.org/obo/CHEBI_1",
+                           "biolink:description": "A drug",
+                           "biolink:category": ["biolink:SmallMolecule", "biolink:Drug"],
+                           "biolink:synonym": ["aspirin", "ASA"],
+                           "biolink:xref": ["CHEBI:1", "MESH:1"],
+                           "biolink:publications": ["PMID:1"]}  # Non-str list items are left out
+    # Empty properties aren't stored, so they don't become attributes
+    assert [attribute.attribute_type_id for attribute in kg.nodes["MONDO:1"].attributes] == ["biolink:category",
+                                                                                            "biolink:synonym",
+                                                                                            "biolink:xref"]
+    edge_values = {attribute.attribute_type_id: attribute.value for attribute in kg.edges["e0"].attributes}
+    assert sorted(edge_values["biolink:original_predicate"]) == ["E0", "E3"]
+    assert sorted(edge_values["biolink:publications"]) == ["PMID:1", "PMID:2"]
+    assert edge_values["bts:sentence"] == publications_info
+
+
+def test_get_color_classes_ignores_self_loops():
+    adjacency_matrix = sparse.csr_matrix(np.array([[1, 1, 0],
+                                                   [1, 0, 1],
+                                                   [0, 1, 0]], dtype=float))
+    # Node 0 has a self-loop, which must not stop it from joining a color class
+    color_classes = cluster_match_graph.get_color_classes(adjacency_matrix, np.arange(3), np.random.default_rng(0))
+    assert sorted(node for color_class in color_classes for node in color_class) == [0, 1, 2]
+    for color_class in color_classes:
+        class_nodes = set(color_class.tolist())
+        assert not ({0, 1} <= class_nodes or {1, 2} <= class_nodes)
+
+
+def _get_label_propagation_graph():
+    # Nodes 0 and 5 are seeded with labels 0 and 1; 6 is a labeled orphan; 7 and 8 only neighbor each other
+    weighted_edges = [(0, 1, 1.0), (0, 2, 1.0), (1, 2, 0.5), (2, 3, 1.0), (3, 4, 0.1), (4, 5, 1.0), (7, 8, 0.5)]
+    unlabeled = cluster_match_graph.UNLABELED
+    labels = np.array([0, unlabeled, unlabeled, unlabeled, unlabeled, 1, 2, unlabeled, unlabeled])
+    rows, cols, weights = zip(*weighted_edges)
+    adjacency_matrix = sparse.coo_matrix((weights + weights, (rows + cols, cols + rows)),
+                                         shape=(len(labels), len(labels))).tocsr()
+    return labels, adjacency_matrix, weighted_edges
+
+
+def _get_most_common_neighbor_label_sequential(node_id, adj_list_weighted, label_map, update_label_map):
+    # The original (one node at a time) implementation, which the vectorized version must agree with
+    weighted_neighbors = adj_list_weighted.get(node_id)
+    if weighted_neighbors:
+        summed_label_weights = defaultdict(float)
+        for neighbor_id, weight in weighted_neighbors.items():
+            neighbor_label = label_map[neighbor_id]
+            if neighbor_label == neighbor_label:  # Means it's not NaN
+                summed_label_weights[neighbor_label] += weight
+        most_common_label = max(summed_label_weights, key=summed_label_weights.get) if summed_label_weights else np.nan
+        if update_label_map:
+            label_map[node_id] = most_common_label
+        return most_common_label
+    else:
+        return label_map[node_id]
+
+
+def test_get_majority_labels():
+    unlabeled = cluster_match_graph.UNLABELED
+    # Node 0's two light label-1 edges are outweighed by its one heavy label-2 edge (and its heaviest edge, to an
+    # unlabeled node, doesn't count); node 4 has a tie between labels 1 and 3, which goes to the highest label; node 5
+    # only has unlabeled neighbors; node 6 is an orphan, so it keeps its label
+    labels = np.array([unlabeled, 1, 1, 2, unlabeled, unlabeled, 0, unlabeled, 3])
+    weighted_edges = [(0, 1, 0.1), (0, 2, 0.1), (0, 3, 1.0), (0, 7, 5.0), (4, 1, 0.5), (4, 8, 0.5), (5, 7, 1.0)]
+    rows, cols, weights = zip(*weighted_edges)
+    adjacency_matrix = sparse.coo_matrix((weights + weights, (rows + cols, cols + rows)), shape=(9, 9)).tocsr()
+    majority_labels = cluster_match_graph.get_majority_labels(np.array([0, 4, 5, 6]), adjacency_matrix, labels)
+    assert majority_labels.tolist() == [2, 3, unlabeled, 0]
+
+
+def test_label_propagation_ties_are_seeded():
+    unlabeled = cluster_match_graph.UNLABELED
+    # Node 0 is pulled equally toward labels 0 and 1
+    labels = np.array([unlabeled, 0, 1])
+    adjacency_matrix = sparse.csr_matrix(np.array([[0, 1, 1], [1, 0, 0], [1, 0, 0]], dtype=float))
+    nodes_to_label = np.array([0])
+    winners = {seed: cluster_match_graph.do_label_propagation(labels, adjacency_matrix, nodes_to_label, seed=seed)[0]
+               for seed in range(20)}
+    assert set(winners.values()) == {0, 1}
+    assert all(cluster_match_graph.do_label_propagation(labels, adjacency_matrix, nodes_to_label, seed=seed)[0] == winner
+               for seed, winner in winners.items())
+    assert labels.tolist() == [unlabeled, 0, 1]  # The input labels aren't modified
+
+
+def test_label_propagation_matches_sequential_version():
+    labels, adjacency_matrix, weighted_edges = _get_label_propagation_graph()
+    nodes_to_label = np.array([1, 2, 3, 4, 7, 8])
+    propagated_labels = cluster_match_graph.do_label_propagation(labels, adjacency_matrix, nodes_to_label)
+
+    adj_list_weighted = defaultdict(dict)
+    for node_a, node_b, weight in weighted_edges:
+        adj_list_weighted[node_a][node_b] = weight
+        adj_list_weighted[node_b][node_a] = weight
+    for seed in range(5):
+        random.seed(seed)
+        label_map = {node: (label if label != cluster_match_graph.UNLABELED else np.nan)
+                     for node, label in enumerate(labels.tolist())}
+        node_ids = nodes_to_label.tolist()
+        for _ in range(cluster_match_graph.LABEL_PROPAGATION_MAX_ITERATIONS):
+            random.shuffle(node_ids)
+            current_labels = [_get_most_common_neighbor_label_sequential(node, adj_list_weighted, label_map, True)
+                              for node in node_ids]
+            major_labels = [_get_most_common_neighbor_label_sequential(node, adj_list_weighted, label_map, False)
+                            for node in node_ids]
+            if np.array_equal(current_labels, major_labels, equal_nan=True):
+                break
+        sequential_labels = [label if label == label else cluster_match_graph.UNLABELED
+                             for label in label_map.values()]
+        assert propagated_labels.tolist() == sequential_labels == [0, 0, 0, 0, 1, 1, 2, cluster_match_graph.UNLABELED,
+                                                                    cluster_match_graph.UNLABELED]
+
+
+@pytest.fixture
+def sri_nn_stand_in():
+    # A local stand-in for the SRI NN's get_normalized_nodes endpoint; each batch's reply can be scripted
+    import http.server
+    import json
+    import threading
+
+    class SRINNStandIn:
+        def __init__(self):
+            self.requested_batches = []
+            self.scripted_replies = dict()  # First curie in batch -> list of (status, body) to reply with, in order
+
+    stand_in = SRINNStandIn()
+
+    class RequestHandler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            curies = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["curies"]
+            stand_in.requested_batches.append(curies)
+            scripted_replies = stand_in.scripted_replies.get(curies[0])
+            if scripted_replies:
+                status, body = scripted_replies.pop(0)
+            else:
+                status, body = 200, json.dumps({curie: {"id": {"identifier": f"CLUSTER:{curie}"},
+                                                        "equivalent_identifiers": [{"identifier": curie}]}
+                                                for curie in curies})
+            self.send_response(status)
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stand_in.url = f"http://127.0.0.1:{server.server_address[1]}/get_normalized_nodes"
+    yield stand_in
+    server.shutdown()
+    server.server_close()
+
+
+def test_sri_nn_batches_retry_resume_and_refetch(sri_nn_stand_in, tmp_path, monkeypatch):
+    build_match_graph_sri = importlib.import_module("2_build_match_graph_sri")
+    monkeypatch.setattr(build_match_graph_sri, "SYNONYMIZER_BUILD_DIR", str(tmp_path))
+    monkeypatch.setattr(build_match_graph_sri, "SRI_NN_BATCHES_DIR", str(tmp_path / "2_sri_nn_batches"))
+    monkeypatch.setattr(build_match_graph_sri, "SRI_NN_BATCH_SIZE", 2)
+    monkeypatch.setattr(build_match_graph_sri, "SRI_NN_RETRY_BASE_DELAY", 0)
+    node_ids = {"A:1", "A:2", "B:1", "B:2", "C:1", "C:2", "D:1"}
+
+    def get_mappings(refetch: bool = False) -> dict:
+        sri_nn_stand_in.requested_batches.clear()
+        return build_match_graph_sri.get_sri_cluster_id_mappings(node_ids, sri_nn_url=sri_nn_stand_in.url,
+                                                                 refetch=refetch)
+
+    # Batch B gets a server error and then a truncated response before succeeding; batch C keeps getting truncated
+    # responses (so it fails), and batch D's response isn't shaped like an SRI NN response (so it isn't retried)
+    sri_nn_stand_in.scripted_replies = {"B:1": [(503, "busy"), (200, '{"B:1": ')],
+                                        "C:1": [(200, "{")] * build_match_graph_sri.SRI_NN_MAX_ATTEMPTS,
+                                        "D:1": [(200, '{"D:1": {"id": {}}}')]}
+    mappings = get_mappings()
+    assert sorted(mappings) == ["A:1", "A:2", "B:1", "B:2"]
+    assert sorted(batch[0] for batch in sri_nn_stand_in.requested_batches) == ["A:1"] + ["B:1"] * 3 + \
+        ["C:1"] * build_match_graph_sri.SRI_NN_MAX_ATTEMPTS + ["D:1"]
+
+    # A rerun only resends the batches that failed
+    mappings = get_mappings()
+    assert sorted(batch[0] for batch in sri_nn_stand_in.requested_batches) == ["C:1", "D:1"]
+    assert sorted(mappings) == sorted(node_ids)
+    assert mappings["C:2"] == "CLUSTER:C:2"
+    assert not os.path.exists(build_match_graph_sri.SRI_NN_BATCHES_DIR)  # Nothing is left to resume
+
+    # A refetch ignores saved batch results from an interrupted run
+    sri_nn_stand_in.scripted_replies = {"D:1": [(200, "[]")]}
+    get_mappings()
+    assert sorted(batch[0] for batch in sri_nn_stand_in.requested_batches) == ["A:1", "B:1", "C:1", "D:1"]
+    mappings = get_mappings(refetch=True)
+    assert sorted(batch[0] for batch in sri_nn_stand_in.requested_batches) == ["A:1", "B:1", "C:1", "D:1"]
+    assert sorted(mappings) == sorted(node_ids)
+
+
+if __name__ == "__main__":
+    pytest.main(['-v', 'test_kg2c.py'])
@@ -220,6 +220,11 @@ class RTXConfiguration:
             t1 = timeit.default_timer()
             print(f"Elapsed time: {(t1-t0)*1000:.2f} ms. Read override file {file_dir}/plover_url_override.txt")
 
+        # Limits on the pooled connections that Expand's KP queries share (None means use Expand's defaults)
+        kp_connections = self.config_dbs.get("kp_connections", dict())
+        self.kp_connection_limit = kp_connections.get("limit")
+        self.kp_connection_limit_per_kp = kp_connections.get("limit_per_kp")
+
         # Set KG2 url if an override was provided
         kg2_url_override_value = self._read_override_file(f"{file_dir}/kg2_url_override.txt")
         if kg2_url_override_value:
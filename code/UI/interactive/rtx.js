@@ -503,6 +503,7 @@ function postQuery_ARAX(qtype,queryObj) {
 	var finishedSteps = 0;
 	var decoder = new TextDecoder();
 	var respjson = '';
+	var queryplan = null;
 
 	function scan() {
 	    return reader.read().then(function(result) {
@@ -580,9 +581,25 @@ function postQuery_ARAX(qtype,queryObj) {
 				document.getElementById("status_container").before(div);
 			    }
 
+			    // query plan updates arrive as deltas; merge them into what we have so far
+			    if (jsonMsg.is_delta && queryplan) {
+				for (var qedge in jsonMsg.qedge_keys) {
+				    if (!queryplan.qedge_keys[qedge])
+					queryplan.qedge_keys[qedge] = {};
+				    for (var provider in jsonMsg.qedge_keys[qedge]) {
+					if (!queryplan.qedge_keys[qedge][provider])
+					    queryplan.qedge_keys[qedge][provider] = {};
+					Object.assign(queryplan.qedge_keys[qedge][provider], jsonMsg.qedge_keys[qedge][provider]);
+				    }
+				}
+				queryplan.counter = jsonMsg.counter;
+			    }
+			    else
+				queryplan = jsonMsg;
+
 			    div.innerHTML = '';
 			    div.appendChild(document.createElement("br"));
-			    render_queryplan_table(jsonMsg, div);
+			    render_queryplan_table(JSON.parse(JSON.stringify(queryplan)), div);
 			    div.appendChild(document.createElement("br"));
 			}
                         else if (jsonMsg.pid) {
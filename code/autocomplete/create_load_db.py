@@ -21,13 +21,19 @@ conn = sqlite3.connect(database_name)
 conn.text_factory = str
 c = conn.cursor()
 
+#### Check whether this SQLite can build the trigram index used for infix matching (needs SQLite 3.34+ with FTS5)
+try:
+    c.execute("CREATE VIRTUAL TABLE temp.trigram_check USING fts5(term, tokenize='trigram')")
+    c.execute("DROP TABLE temp.trigram_check")
+    has_trigram_tokenizer = True
+except sqlite3.OperationalError:
+    print(f"WARNING: SQLite {sqlite3.sqlite_version} has no FTS5 trigram tokenizer; infix matches will fall back to slow LIKE scans")
+    has_trigram_tokenizer = False
+
 print(f"Creating tables")
 #c.execute(f"CREATE TABLE {tablename}(curie TEXT, name TEXT, type TEXT, rank INTEGER)")
-c.execute(f"CREATE TABLE terms(term VARCHAR(255) COLLATE NOCASE)")
-c.execute(f"CREATE TABLE cached_fragments(fragment VARCHAR(255) COLLATE NOCASE)")
-c.execute(f"CREATE TABLE cached_fragment_terms(fragment_id INT, term VARCHAR(255) COLLATE NOCASE)")
+c.execute(f"CREATE TABLE terms(term VARCHAR(255) COLLATE NOCASE, popularity INTEGER)")
 
-rank = 1
 row_count = 0
 uc_terms = {}
 
@@ -37,12 +43,14 @@ with open(arguments.input, 'r', encoding="latin-1", errors="replace") as nodeDat
         curie, name, full_name, type = line[:-1].split("\t")
         #c.execute("INSERT INTO term(curie,name,type,rank) VALUES(?,?,?,?)" % (tablename), (curie,name,type,rank,))
 
+        #### Keep the first spelling seen of each term, and count how many nodes use it (its popularity)
         for term in [ name, curie ]:
 
             uc_term = term.upper()
             if uc_term not in uc_terms:
-                c.execute("INSERT INTO terms(term) VALUES(?)", (term,))
-                uc_terms[uc_term] = 1
+                uc_terms[uc_term] = [ term, 1 ]
+            else:
+                uc_terms[uc_term][1] += 1
 
         row_count += 1
         if row_count == int(row_count/1000000) * 1000000:
@@ -50,9 +58,22 @@ with open(arguments.input, 'r', encoding="latin-1", errors="replace") as nodeDat
             #break
 
 print()
+#### Insert terms in rank order (shortest first, then most popular), so that rowid order is rank order and the
+#### index lookups in rtxcomplete can stop as soon as they have enough matches, without sorting
+print(f"Inserting {len(uc_terms)} terms in rank order")
+ranked_terms = sorted(uc_terms.values(), key=lambda term_and_count: (len(term_and_count[0]), -term_and_count[1], term_and_count[0].upper()))
+uc_terms = None
+c.executemany("INSERT INTO terms(rowid, term, popularity) VALUES(?,?,?)",
+              ((rank, term, popularity) for rank, (term, popularity) in enumerate(ranked_terms, start=1)))
+ranked_terms = None
+
 print(f"Creating indexes")
 c.execute(f"CREATE INDEX idx_terms_term ON terms(term)")
-c.execute(f"CREATE INDEX idx_cached_fragments_fragment ON cached_fragments(fragment)")
+if has_trigram_tokenizer:
+    print(f"Building trigram index for infix matching")
+    c.execute(f"CREATE VIRTUAL TABLE terms_fts USING fts5(term, content='terms', content_rowid='rowid', tokenize='trigram')")
+    c.execute(f"INSERT INTO terms_fts(terms_fts) VALUES('rebuild')")
+    c.execute(f"INSERT INTO terms_fts(terms_fts) VALUES('optimize')")
 
 conn.commit()
 conn.close()
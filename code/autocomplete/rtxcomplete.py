@@ -1,5 +1,6 @@
 import sqlite3
 import re
+import threading
 import timeit
 import sys
 import os
@@ -9,37 +10,52 @@ pathlist = os.path.realpath(__file__).split(os.path.sep)
 RTXindex = pathlist.index("RTX")
 sys.path.append(os.path.sep.join([*pathlist[:(RTXindex + 1)], 'code']))
 from RTXConfiguration import RTXConfiguration
+from term_prefix_index import TermPrefixIndex
 
 RTXConfig = RTXConfiguration()
 autocomplete_filepath = os.path.sep.join([*pathlist[:(RTXindex + 1)], 'code', 'autocomplete'])
 
 
-conn = None
-cursor = None
-cache_conn = None
-cache_cursor = None
+database_name = None
+connections = threading.local()
+has_trigram_index = False
+term_order_by = "length(term),term"
+prefix_index = None
 
 
-def load():
-    global conn
-    global cursor
-    global cache_conn
-    global cache_cursor
+def load(use_prefix_index=False):
+    global database_name
+    global has_trigram_index
+    global term_order_by
+    global prefix_index
     database_name = f"{autocomplete_filepath}{os.path.sep}{RTXConfig.autocomplete_path.split('/')[-1]}"
-    conn = sqlite3.connect(database_name)
-    cursor = conn.cursor()
+    conn = sqlite3.connect(f"file:{database_name}?mode=ro", uri=True)
     print(f"INFO: Connected to {database_name}",file=sys.stderr)
 
-    cache_database_name = os.path.dirname(os.path.abspath(__file__)) + '/rtxcomplete_cache.sqlite'
-    cache_conn = sqlite3.connect(cache_database_name)
-    cache_cursor = cache_conn.cursor()
-    print(f"INFO: Connected to {cache_database_name}",file=sys.stderr)
-    cache_cursor.execute("CREATE TABLE IF NOT EXISTS cached_fragments(fragment VARCHAR(1024))")
-    cache_cursor.execute("CREATE TABLE IF NOT EXISTS cached_fragment_terms(fragment_id VARCHAR(1024), term VARCHAR(1024))")
+    #### Databases built by the current create_load_db.py store terms in rank order and have a trigram index of them
+    table_names = { row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table','view')") }
+    has_trigram_index = 'terms_fts' in table_names
+    term_order_by = "rowid" if has_trigram_index else "length(term),term"
+    if not has_trigram_index:
+        eprint(f"WARNING: {database_name} has no trigram index; infix matches will use slow LIKE scans")
+    conn.close()
+
+    #### Optionally answer prefix queries from a memory-mapped sorted index of all terms instead of SQLite
+    if use_prefix_index:
+        prefix_index = TermPrefixIndex.load(database_name)
 
     return True
 
 
+def get_connection():
+    #### Each thread gets its own read-only connection (opened on first use, so none are inherited across a fork)
+    conn = getattr(connections, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(f"file:{database_name}?mode=ro", uri=True)
+        connections.conn = conn
+    return conn
+
+
 def get_nodes_like(word,requested_limit):
 
     debug = True
@@ -53,18 +69,15 @@ def get_nodes_like(word,requested_limit):
     if len(word) < 2:
         return values
 
-    #### Try to avoid SQL injection exploits by sanitizing input #1823
-    word = word.replace('"','')
-
-    floor = word[:-1]
-    ceiling = floor + 'zz'
-
     #### Get a list of matching node names that begin with these letters
+    #### (an index range scan unless the prefix index is loaded; chr(0x10FFFF) sorts after any character that could follow the prefix)
     if debug:
         eprint(f"INFO: Query 1")
-    #cursor.execute("SELECT term FROM term WHERE term LIKE \"%s%%\" ORDER BY length(term),term LIMIT %s" % (word,1000))
-    cursor.execute(f"SELECT term FROM terms WHERE term > \"{floor}\" AND term < \"{ceiling}\" AND term LIKE \"{word}%%\" ORDER BY length(term),term LIMIT {requested_limit}")
-    rows = cursor.fetchall()
+    if prefix_index is not None:
+        rows = [ (term,) for term in prefix_index.get_terms_with_prefix(word, requested_limit) ]
+    else:
+        rows = get_connection().execute(f"SELECT term FROM terms WHERE term >= ? AND term < ? ORDER BY {term_order_by} LIMIT ?",
+                                        (word, word + chr(0x10FFFF), requested_limit)).fetchall()
     values_dict = {}
     for row in rows:
         term = row[0]
@@ -86,67 +99,32 @@ def get_nodes_like(word,requested_limit):
         if debug:
             eprint(f"INFO: Query 2")
 
-        #### See if there is a cached entry already
-        word_part = word
-        found_fragment = None
-        while len(word_part) > 2:
-            cache_cursor.execute(f"SELECT rowid, fragment FROM cached_fragments WHERE fragment == \"{word_part}\"")
-            rows = cache_cursor.fetchall()
-            if len(rows) > 0:
-                fragment_id = rows[0][0]
-                found_fragment = rows[0][1]
-                break
-            word_part = word_part[:-1]
-
-        if found_fragment:
-            if debug:
-                eprint(f"Found matching fragment {found_fragment} as fragment_id {fragment_id}")
-
-            cache_cursor.execute(f"SELECT term FROM cached_fragment_terms WHERE fragment_id = {fragment_id} AND term LIKE \"%%{word}%%\"")
-            rows = cache_cursor.fetchall()
-
-            for row in rows:
-                term = row[0]
-                if term.upper() not in values_dict:
-
-                    if n_values < requested_limit:
-                        if debug:
-                            print(f"    - {term}")
-                        properties = { "curie": '??', "name": term, "type": '??' }
-                        values.append(properties)
-                        n_values += 1
-
-
-        if found_fragment is None:
-
-            #### Cache this fragment in the database
-            try:
-                cache_cursor.execute("INSERT INTO cached_fragments(fragment) VALUES(?)", (word,))
-                fragment_id = cache_cursor.lastrowid
-            except:
-                eprint(f"ERROR: Unable to INSERT into cached_fragments(fragment)",file=sys.stderr)
-                fragment_id = 0
-            if debug:
-                eprint(f"fragment_id = {fragment_id}")
-
-            #### Execute an expensive LIKE query
-            cursor.execute("SELECT term FROM terms WHERE term LIKE \"%%%s%%\" ORDER BY length(term),term LIMIT %s" % (word,10000))
-            rows = cursor.fetchall()
-
-            for row in rows:
-                term = row[0]
-                if term.upper() not in values_dict:
-
-                    if n_values < requested_limit:
-                        if debug:
-                            eprint(f"    - {term}")
-                        properties = { "curie": '??', "name": term, "type": '??' }
-                        values.append(properties)
-                        n_values += 1
-
-                    values_dict[term.upper()] = 1
-                    cache_cursor.execute("INSERT INTO cached_fragment_terms(fragment_id, term) VALUES(?,?)", (fragment_id, term,))
-            cache_conn.commit()
+        #### Ask for enough extra terms to make up for those already found by the prefix query
+        infix_limit = requested_limit + n_values
+        if has_trigram_index:
+            #### The trigram index can only match strings of three or more characters
+            if len(word) >= 3:
+                fts_phrase = '"' + word.replace('"', '""') + '"'
+                rows = get_connection().execute("SELECT term FROM terms_fts WHERE terms_fts MATCH ? ORDER BY rowid LIMIT ?",
+                                    (fts_phrase, infix_limit)).fetchall()
+            else:
+                rows = []
+        else:
+            like_pattern = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            rows = get_connection().execute(f"SELECT term FROM terms WHERE term LIKE ? ESCAPE '\\' ORDER BY {term_order_by} LIMIT ?",
+                                (like_pattern, infix_limit)).fetchall()
+
+        for row in rows:
+            term = row[0]
+            if term.upper() not in values_dict:
+                if debug:
+                    eprint(f"    - {term}")
+                properties = { "curie": '??', "name": term, "type": '??' }
+                values.append(properties)
+                values_dict[term.upper()] = 1
+                n_values += 1
+                if n_values >= requested_limit:
+                    break
 
         t2 = timeit.default_timer()
         if debug:
@@ -154,4 +132,3 @@ def get_nodes_like(word,requested_limit):
 
 
     return(values)
-
@@ -1,5 +1,10 @@
+import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
+import argparse
+import concurrent.futures
 import os
 import json
 import sys
@@ -9,9 +14,12 @@ import re
 import setproctitle
 
 root = os.path.dirname(os.path.abspath(__file__))
-rtxcomplete.load()
 
 SERVER_TCP_PORT = 4999
+DEFAULT_QUERY_THREADS = 8
+
+#### Completion queries (which may hit sqlite) run on this bounded pool, never on the IOLoop thread itself
+query_executor = None
 
 #### Sanitize the client-provided callback function name
 def sanitize_callback(callback):
@@ -25,92 +33,39 @@ def sanitize_callback(callback):
     return callback
 
 
-class autoSearch(tornado.web.RequestHandler):
+class completionSearch(tornado.web.RequestHandler):
+    #### Name of the rtxcomplete function that answers this kind of search
+    completion_function_name = None
 
-    def get(self, arg,word=None):
+    async def get(self, arg,word=None):
         try:
             limit = self.get_argument("limit")
             word = self.get_argument("word")
             callback = sanitize_callback(self.get_argument("callback"))
 
-            result = rtxcomplete.prefix(word,limit)
-            
-            result = callback+"("+json.dumps(result)+");"
-            
-            self.write(result)
-            
-        except:
-            print(sys.exc_info()[:])
-            traceback.print_tb(sys.exc_info()[-1])
-            #print sys.exc_info()[2]
-            self.write("error")
+            completion_function = getattr(rtxcomplete, self.completion_function_name)
+            result = await tornado.ioloop.IOLoop.current().run_in_executor(query_executor, completion_function, word, limit)
 
-class fuzzySearch(tornado.web.RequestHandler):
-    def get(self, arg,word=None):
-        #print "matched fuzzy"
-        try:
-            limit = self.get_argument("limit")
-            word = self.get_argument("word")
-            callback = sanitize_callback(self.get_argument("callback"))
-            #print word
-            #cursor.execute("SELECT word FROM spell WHERE word MATCH \"" + word + "\" LIMIT " + limit)
-            #cursor.execute("SELECT word FROM spell WHERE word MATCH \"" + word + "*\" LIMIT " + limit)
-            result = rtxcomplete.fuzzy(word,limit);
-            #rows = cursor.fetchall()
-            #print type(rows)
             result = callback+"("+json.dumps(result)+");"
-            #print arg, result
-            #if (len(rows) > 0):
-            self.write(result)
-            #else:
-            #self.write(callback+"("+json.dumps([["NO SUGGESTIONS"]])+");")
-            #self.write(json.dumps(rows))
-        except:
-            print(sys.exc_info()[:])
-            traceback.print_tb(sys.exc_info()[-1])
-            #print sys.exc_info()[:]
-            self.write("error")
 
-class autofuzzySearch(tornado.web.RequestHandler):
-    def get(self, arg,word=None):
-        #print "matched autofuzzy"
-        try:
-            limit = self.get_argument("limit")
-            word = self.get_argument("word")
-            callback = sanitize_callback(self.get_argument("callback"))
-            #print word
-            #cursor.execute("SELECT word FROM spell WHERE word MATCH \"" + word + "\" LIMIT " + limit)
-            #cursor.execute("SELECT word FROM spell WHERE word MATCH \"" + word + "*\" LIMIT " + limit)
-            result = rtxcomplete.autofuzzy(word,limit);
-            #rows = cursor.fetchall()
-            #print type(rows)
-            result = callback+"("+json.dumps(result)+");"
-            #print arg, result
-            #if (len(rows) > 0):
             self.write(result)
-            #else:
-            #self.write(callback+"("+json.dumps([["NO SUGGESTIONS"]])+");")
-            #self.write(json.dumps(rows))
+
         except:
             print(sys.exc_info()[:])
             traceback.print_tb(sys.exc_info()[-1])
-            #print sys.exc_info()[:]
             self.write("error")
 
+class autoSearch(completionSearch):
+    completion_function_name = "prefix"
 
-class nodesLikeSearch(tornado.web.RequestHandler):
-    def get(self, arg,word=None):
-        try:
-            limit = self.get_argument("limit")
-            word = self.get_argument("word")
-            callback = sanitize_callback(self.get_argument("callback"))
-            result = rtxcomplete.get_nodes_like(word,limit);
-            result = callback+"("+json.dumps(result)+");"
-            self.write(result)
-        except:
-            print(sys.exc_info()[:])
-            traceback.print_tb(sys.exc_info()[-1])
-            self.write("error")
+class fuzzySearch(completionSearch):
+    completion_function_name = "fuzzy"
+
+class autofuzzySearch(completionSearch):
+    completion_function_name = "autofuzzy"
+
+class nodesLikeSearch(completionSearch):
+    completion_function_name = "get_nodes_like"
 
 
 class defineSearch(tornado.web.RequestHandler):
@@ -147,16 +102,28 @@ def make_redirect_app():
     ])
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=1, help="Number of server processes to fork (0 means one per CPU)")
+    parser.add_argument("--threads", type=int, default=DEFAULT_QUERY_THREADS, help="Number of query threads per server process")
+    parser.add_argument("--prefixindex", action="store_true", help="Answer prefix queries from a memory-mapped index of all terms")
+    arguments = parser.parse_args()
+
     print("root: " + root)
+    #### Load before forking, so that all processes share the (memory-mapped) prefix index
+    rtxcomplete.load(use_prefix_index=arguments.prefixindex)
 
     proc_title = setproctitle.getproctitle()
     setproctitle.setproctitle(proc_title.replace('server.py',
                                                  "autocomplete/server.py" +
                                                  f" [port={SERVER_TCP_PORT}]"))
     if True: #FW/EWD: clean this up later
+        sockets = tornado.netutil.bind_sockets(SERVER_TCP_PORT)
+        if arguments.processes != 1:
+            tornado.process.fork_processes(arguments.processes)
+        query_executor = concurrent.futures.ThreadPoolExecutor(max_workers=arguments.threads)
         http_app = make_https_app()
         http_server = tornado.httpserver.HTTPServer(http_app)
-        http_server.listen(SERVER_TCP_PORT)
+        http_server.add_sockets(sockets)
 
     else:
         redirect_app = make_redirect_app()
@@ -0,0 +1,91 @@
+#!/bin/env python3
+"""
+An in-memory index of all autocomplete terms for answering prefix queries without SQLite. The terms are sorted
+case-insensitively and stored as three numpy arrays (a blob of UTF-8 terms, the offset of each term in the blob, and
+each term's rank), which are saved next to the autocomplete database and memory-mapped, so every server process
+shares a single page-cache copy of them.
+"""
+import os
+import shutil
+import sqlite3
+import sys
+from typing import List
+
+import numpy as np
+def eprint(*args, **kwargs): print(*args, file=sys.stderr, **kwargs)
+
+# Sorts after any character that could follow a prefix
+MAX_CHAR = chr(0x10FFFF)
+
+
+class TermPrefixIndex:
+
+    def __init__(self, terms_blob: np.ndarray, term_offsets: np.ndarray, term_ranks: np.ndarray):
+        self.terms_blob = terms_blob
+        self.term_offsets = term_offsets
+        self.term_ranks = term_ranks
+        self.num_terms = len(term_ranks)
+
+    @classmethod
+    def load(cls, database_path: str) -> "TermPrefixIndex":
+        """Opens the index for the given autocomplete database, (re)building it first if it's missing or stale"""
+        index_dir = f"{database_path}.prefix_index"
+        if not os.path.exists(index_dir) or os.path.getmtime(index_dir) < os.path.getmtime(database_path):
+            cls.build(database_path, index_dir)
+        return cls(*(np.load(f"{index_dir}/{array_name}.npy", mmap_mode="r")
+                     for array_name in ["terms_blob", "term_offsets", "term_ranks"]))
+
+    @staticmethod
+    def build(database_path: str, index_dir: str):
+        eprint(f"INFO: Building prefix index of the terms in {database_path}")
+        conn = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
+        table_names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        # Newer databases store terms in rank order; rank older ones the way rtxcomplete does
+        order_by = "rowid" if "terms_fts" in table_names else "length(term),term"
+        ranked_terms = [row[0] for row in conn.execute(f"SELECT term FROM terms ORDER BY {order_by}")]
+        conn.close()
+
+        sorted_ranks = sorted(range(len(ranked_terms)), key=lambda rank: ranked_terms[rank].upper())
+        encoded_terms = [ranked_terms[rank].encode() for rank in sorted_ranks]
+        term_offsets = np.zeros(len(encoded_terms) + 1, dtype=np.int64)
+        np.cumsum([len(encoded_term) for encoded_term in encoded_terms], out=term_offsets[1:])
+        terms_blob = np.frombuffer(b"".join(encoded_terms), dtype=np.uint8)
+
+        # Write to a temporary directory first, so other processes never see a partially written index
+        temp_index_dir = f"{index_dir}.tmp{os.getpid()}"
+        os.makedirs(temp_index_dir)
+        np.save(f"{temp_index_dir}/terms_blob.npy", terms_blob)
+        np.save(f"{temp_index_dir}/term_offsets.npy", term_offsets)
+        np.save(f"{temp_index_dir}/term_ranks.npy", np.array(sorted_ranks, dtype=np.int64))
+        if os.path.exists(index_dir):
+            shutil.rmtree(index_dir)
+        os.replace(temp_index_dir, index_dir)
+        eprint(f"INFO: Prefix index of {len(ranked_terms)} terms saved to {index_dir}")
+
+    def get_terms_with_prefix(self, prefix: str, limit: int) -> List[str]:
+        """Returns the (up to) limit best-ranked terms that start with the given prefix, ignoring case"""
+        if limit < 1:
+            return []
+        prefix_key = prefix.upper()
+        start = self._get_lower_bound(prefix_key)
+        end = self._get_lower_bound(prefix_key + MAX_CHAR)
+        if end - start > limit:
+            term_nums = start + np.argpartition(self.term_ranks[start:end], limit - 1)[:limit]
+        else:
+            term_nums = np.arange(start, end)
+        term_nums = term_nums[np.argsort(self.term_ranks[term_nums])]
+        return [self._get_term(term_num) for term_num in term_nums]
+
+    def _get_term(self, term_num: int) -> str:
+        return self.terms_blob[self.term_offsets[term_num]:self.term_offsets[term_num + 1]].tobytes().decode()
+
+    def _get_lower_bound(self, key: str) -> int:
+        # Binary search for the first term whose (upper-cased) key is not less than the given key
+        low, high = 0, self.num_terms
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_term(middle).upper() < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
@@ -7,20 +7,25 @@ import argparse
 import ast
 import csv
 import gc
+import heapq
 import json
 import logging
 import os
 import pathlib
 import pickle
+import shutil
 import sqlite3
 import subprocess
 import sys
 import time
+import zlib
 from collections import defaultdict
+from contextlib import ExitStack
 
 from datetime import datetime
+from itertools import islice
 from multiprocessing import Pool
-from typing import List, Dict, Tuple, Union, Optional, Set
+from typing import List, Dict, Tuple, Union, Optional, Set, Iterator
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from utils import select_best_description
@@ -28,12 +33,20 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../ARAX/NodeSynonym
 from node_synonymizer import NodeSynonymizer
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../ARAX/BiolinkHelper/")
 from biolink_helper import BiolinkHelper
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../ARAX/ARAXQuery/")
+from kg2c_sqlite import NODE_TEXT_PROPERTIES, NODE_LIST_PROPERTIES, EDGE_LIST_PROPERTIES, PUBLICATIONS_INFO_COLUMNS, \
+    PUBLICATIONS_INFO_OTHER_COLUMN, get_child_table_name, get_publications_info_row_values
 
 KG2C_ARRAY_DELIMITER = "ǂ"  # Need to use a delimiter that does not appear in any list items (strings)
 KG2PRE_ARRAY_DELIMITER = ";"
 KG2C_DIR = os.path.dirname(os.path.abspath(__file__))
+EDGE_SHARDS_DIR = f"{KG2C_DIR}/kg2c_edge_shards"
+KG2PRE_CHUNK_SIZE = 100000  # Number of KG2pre TSV rows handed to a worker process at a time
+NUM_EDGE_SHARDS = 64
 csv.field_size_limit(sys.maxsize)  # Required because some KG2pre fields are massive
 
+_worker_state = dict()  # Set up in each worker process by _init_canonicalization_worker()
+
 
 PROPERTIES_LOOKUP = {
     "nodes": {
@@ -75,20 +88,6 @@ def _convert_list_to_string_encoded_format(input_list_or_str: Union[List[str], s
         return input_list_or_str
 
 
-def _prep_for_sqlite(item: Union[str, List[str], Dict[str, any]]) -> str:
-    if isinstance(item, str):
-        return item
-    elif not item:
-        return ""
-    elif isinstance(item, list):
-        return _convert_list_to_string_encoded_format(item)
-    elif isinstance(item, dict):
-        return json.dumps(item)
-    else:
-        raise ValueError(f"Unknown data type - don't know how to prep for sqlite. Type is: {type(item)},"
-                         f"value is: {item}")
-
-
 def _merge_two_lists(list_a: List[any], list_b: List[any]) -> List[any]:
     unique_items = list(set(list_a + list_b))
     return [item for item in unique_items if item]
@@ -210,25 +209,52 @@ def _load_publications_info(raw_publications_info: Union[str, dict], kg2_edge_id
     return publications_info
 
 
-def _load_kg2pre_tsv(local_tsv_dir_path: str, nodes_or_edges: str) -> List[Dict[str, any]]:
+def _get_kg2pre_property_columns(local_tsv_dir_path: str, nodes_or_edges: str) -> List[Tuple[str, int, any]]:
+    # Look up which column each property is in just once, rather than for every row
+    headers = _get_kg2pre_headers(f"{local_tsv_dir_path}/{nodes_or_edges}_header.tsv")
+    return [(property_name, headers.index(property_name), PROPERTIES_LOOKUP[nodes_or_edges][property_name]["type"])
+            for property_name in _get_kg2pre_properties(nodes_or_edges)]
+
+
+def _stream_kg2pre_tsv_chunks(local_tsv_dir_path: str, nodes_or_edges: str) -> Iterator[Tuple[int, List[List[str]]]]:
+    """
+    Yields the raw rows of a KG2pre TSV in chunks of KG2PRE_CHUNK_SIZE, along with the row number each chunk starts at,
+    so that we never hold the whole TSV in memory.
+    """
     tsv_path = f"{local_tsv_dir_path}/{nodes_or_edges}.tsv"
-    tsv_header_path = f"{local_tsv_dir_path}/{nodes_or_edges}_header.tsv"
-    kg2pre_objects = []
-    logging.info(f"Loading {nodes_or_edges} from KG2pre TSV ({tsv_path})..")
-    headers = _get_kg2pre_headers(tsv_header_path)
-    kg2pre_property_names = _get_kg2pre_properties(nodes_or_edges)
-    counter = 0
+    logging.info(f"Streaming {nodes_or_edges} from KG2pre TSV ({tsv_path})..")
     with open(tsv_path) as kg2pre_file:
         reader = csv.reader(kg2pre_file, delimiter="\t")
-        for row in reader:
-            counter += 1
-            new_object = dict()
-            for property_name in kg2pre_property_names:
-                property_info = PROPERTIES_LOOKUP[nodes_or_edges][property_name]
-                raw_property_value = row[headers.index(property_name)]
-                new_object[property_name] = _load_property(raw_property_value, property_info["type"])
-            kg2pre_objects.append(new_object)
-    return kg2pre_objects
+        start_row_num = 0
+        while True:
+            rows = list(islice(reader, KG2PRE_CHUNK_SIZE))
+            if not rows:
+                break
+            yield start_row_num, rows
+            start_row_num += len(rows)
+
+
+def _load_kg2pre_rows(rows: List[List[str]], property_columns: List[Tuple[str, int, any]]) -> List[Dict[str, any]]:
+    return [{property_name: _load_property(row[column_index], property_type)
+             for property_name, column_index, property_type in property_columns}
+            for row in rows]
+
+
+def _get_batches(iterable, batch_size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            break
+        yield batch
+
+
+def _init_canonicalization_worker(property_columns: List[Tuple[str, int, any]],
+                                  curie_map: Optional[Dict[str, str]] = None, is_test: bool = False):
+    # Worker processes are forked, so they share the parent's (potentially huge) curie map rather than copying it
+    _worker_state["property_columns"] = property_columns
+    _worker_state["curie_map"] = curie_map
+    _worker_state["is_test"] = is_test
 
 
 def _modify_column_headers_for_neo4j(plain_column_headers: List[str], file_name_root: str) -> List[str]:
@@ -390,54 +416,101 @@ def create_kg2c_tsv_files(canonicalized_nodes_dict: Dict[str, Dict[str, any]],
     _write_list_to_neo4j_ready_tsv(list(canonicalized_edges_dict.values()), "edges_c", is_test)
 
 
+def _get_list_items(list_or_encoded_str: Union[List[str], str]) -> List[str]:
+    # List properties may have already been converted to delimited strings (for the TSVs) by the time we get them
+    if isinstance(list_or_encoded_str, str):
+        return [item for item in list_or_encoded_str.split(KG2C_ARRAY_DELIMITER) if item]
+    filtered_list = [item for item in list_or_encoded_str if item] if list_or_encoded_str else []  # Get rid of any None items
+    str_items = [item for item in filtered_list if isinstance(item, str)]
+    if len(str_items) < len(filtered_list):
+        logging.warning(f"  List contains non-str items (this is unexpected; I'll exclude them)")
+    return str_items
+
+
+def _insert_child_table_rows(connection: sqlite3.Connection, node_or_edge: str, property_name: str,
+                             items_dict: Dict[str, Dict[str, any]]):
+    table_name = get_child_table_name(node_or_edge, property_name)
+    connection.execute(f"CREATE TABLE {table_name} ({node_or_edge}_num INTEGER NOT NULL, value TEXT NOT NULL)")
+    rows = ((num, item) for num, item_dict in enumerate(items_dict.values(), start=1)
+            for item in _get_list_items(item_dict[property_name]))
+    connection.executemany(f"INSERT INTO {table_name} ({node_or_edge}_num, value) VALUES (?, ?)", rows)
+
+
 def create_kg2c_sqlite_db(canonicalized_nodes_dict: Dict[str, Dict[str, any]],
                           canonicalized_edges_dict: Dict[str, Dict[str, any]], is_test: bool):
+    """
+    Writes nodes/edges to kg2c.sqlite in the layout described in kg2c_sqlite.py: text properties are typed columns
+    and list properties go in child tables with one row per item, keyed by the node/edge's row number.
+    """
     logging.info(" Creating KG2c sqlite database..")
     db_name = f"kg2c.sqlite"
     # Remove any preexisting version of this database
     if os.path.exists(db_name):
         os.remove(db_name)
     connection = sqlite3.connect(db_name)
-
-    # Add all nodes (node object is dumped into a JSON string)
-    logging.info(f"  Creating nodes table..")
-    sqlite_node_properties = list(set(PROPERTIES_LOOKUP["nodes"]).difference(_get_lite_properties("nodes")).union({"id", _get_node_labels_property()}))
-    logging.info(f"   Node properties to store in sqlite db are: {sqlite_node_properties}")
-    cols_with_types_string = ", ".join([f"{property_name} TEXT" for property_name in sqlite_node_properties])
-    question_marks_string = ", ".join(["?" for _ in range(len(sqlite_node_properties))])
-    cols_string = ", ".join(sqlite_node_properties)
-    connection.execute(f"CREATE TABLE nodes ({cols_with_types_string})")
-    node_rows = [[_prep_for_sqlite(node[property_name]) for property_name in sqlite_node_properties]
-                 for node in canonicalized_nodes_dict.values()]
-    connection.executemany(f"INSERT INTO nodes ({cols_string}) VALUES ({question_marks_string})", node_rows)
-    connection.execute("CREATE UNIQUE INDEX node_id_index ON nodes (id)")
-    connection.commit()
-    cursor = connection.execute(f"SELECT COUNT(*) FROM nodes")
-    logging.info(f"  Done creating nodes table; contains {cursor.fetchone()[0]} rows.")
-    cursor.close()
-
-    # Add all edges (edge object is dumped into a JSON string)
-    logging.info(f"  Creating edges table..")
-    sqlite_edge_properties = list(set(PROPERTIES_LOOKUP["edges"]).difference(_get_lite_properties("edges")).union({"primary_knowledge_source"}))
-    logging.info(f"   Edge properties to store in sqlite db are: {sqlite_edge_properties}")
-    cols_with_types_string = ", ".join([f"{property_name} TEXT" for property_name in sqlite_edge_properties])
-    question_marks_string = ", ".join(["?" for _ in range(len(sqlite_edge_properties))])
-    cols_string = ", ".join(sqlite_edge_properties)
-    connection.execute(f"CREATE TABLE edges (triple TEXT, node_pair TEXT, {cols_with_types_string})")
-    edge_rows = [[_get_edge_key(subject=edge['subject'],
+    # Nothing reads the database while we build it (and a failed build is just redone), so skip journaling/syncing
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("PRAGMA cache_size = -2000000")  # ~2GB
+
+    # Add all nodes (node numbers are 1-based row numbers, in the order nodes appear in canonicalized_nodes_dict)
+    logging.info(f"  Creating nodes tables..")
+    text_columns_str = ", ".join(NODE_TEXT_PROPERTIES)
+    connection.execute(f"CREATE TABLE nodes (node_num INTEGER PRIMARY KEY, id TEXT NOT NULL, "
+                       f"{', '.join(f'{property_name} TEXT' for property_name in NODE_TEXT_PROPERTIES)})")
+    node_rows = ([num, node["id"]] + [node[property_name] if node[property_name] else None
+                                      for property_name in NODE_TEXT_PROPERTIES]
+                 for num, node in enumerate(canonicalized_nodes_dict.values(), start=1))
+    connection.executemany(f"INSERT INTO nodes (node_num, id, {text_columns_str}) "
+                           f"VALUES (?, ?, {', '.join('?' * len(NODE_TEXT_PROPERTIES))})", node_rows)
+    for property_name in NODE_LIST_PROPERTIES:
+        _insert_child_table_rows(connection, "node", property_name, canonicalized_nodes_dict)
+
+    # Add all edges
+    logging.info(f"  Creating edges tables..")
+    connection.execute("CREATE TABLE edges (edge_num INTEGER PRIMARY KEY, triple TEXT NOT NULL, node_pair TEXT NOT NULL, "
+                       "primary_knowledge_source TEXT)")
+    edge_rows = ((num,
+                  _get_edge_key(subject=edge['subject'],
                                 object=edge['object'],
                                 predicate=edge['predicate'],
                                 qualified_predicate=edge['qualified_predicate'],
                                 qualified_object_aspect=edge['qualified_object_aspect'],
                                 qualified_object_direction=edge['qualified_object_direction'],
                                 primary_knowledge_source=edge['primary_knowledge_source']),
-                  f"{edge['subject']}--{edge['object']}"] + [_prep_for_sqlite(edge[property_name]) for property_name in sqlite_edge_properties]
-
-                 for edge in canonicalized_edges_dict.values()]
-    connection.executemany(f"INSERT INTO edges (triple, node_pair, {cols_string}) VALUES (?, ?, {question_marks_string})", edge_rows)
+                  f"{edge['subject']}--{edge['object']}",
+                  edge['primary_knowledge_source'])
+                 for num, edge in enumerate(canonicalized_edges_dict.values(), start=1))
+    connection.executemany("INSERT INTO edges (edge_num, triple, node_pair, primary_knowledge_source) "
+                           "VALUES (?, ?, ?, ?)", edge_rows)
+    for property_name in EDGE_LIST_PROPERTIES:
+        _insert_child_table_rows(connection, "edge", property_name, canonicalized_edges_dict)
+    publications_info_table_name = get_child_table_name("edge", "publications_info")
+    info_columns = [column for column, _ in PUBLICATIONS_INFO_COLUMNS.values()] + [PUBLICATIONS_INFO_OTHER_COLUMN]
+    connection.execute(f"CREATE TABLE {publications_info_table_name} (edge_num INTEGER NOT NULL, pmid TEXT NOT NULL, "
+                       f"{', '.join(f'{column} {column_type}' for column, column_type in PUBLICATIONS_INFO_COLUMNS.values())}, "
+                       f"{PUBLICATIONS_INFO_OTHER_COLUMN} TEXT)")
+    publications_info_rows = ([num, pmid] + get_publications_info_row_values(info)
+                              for num, edge in enumerate(canonicalized_edges_dict.values(), start=1)
+                              for pmid, info in edge['publications_info'].items())
+    connection.executemany(f"INSERT INTO {publications_info_table_name} (edge_num, pmid, {', '.join(info_columns)}) "
+                           f"VALUES (?, ?, {', '.join('?' * len(info_columns))})", publications_info_rows)
+
+    # Index everything now that it's all loaded (much faster than maintaining indexes while inserting)
+    logging.info(f"  Creating indexes..")
+    connection.execute("CREATE UNIQUE INDEX node_id_index ON nodes (id)")
     connection.execute("CREATE UNIQUE INDEX triple_index ON edges (triple)")
     connection.execute("CREATE INDEX node_pair_index ON edges (node_pair)")
+    for property_name in NODE_LIST_PROPERTIES:
+        table_name = get_child_table_name("node", property_name)
+        connection.execute(f"CREATE INDEX {table_name}_index ON {table_name} (node_num)")
+    for property_name in EDGE_LIST_PROPERTIES + ["publications_info"]:
+        table_name = get_child_table_name("edge", property_name)
+        connection.execute(f"CREATE INDEX {table_name}_index ON {table_name} (edge_num)")
     connection.commit()
+
+    cursor = connection.execute(f"SELECT COUNT(*) FROM nodes")
+    logging.info(f"  Done creating nodes table; contains {cursor.fetchone()[0]} rows.")
     cursor = connection.execute(f"SELECT COUNT(*) FROM edges")
     logging.info(f"  Done creating edges table; contains {cursor.fetchone()[0]} rows.")
     cursor.close()
@@ -464,22 +537,56 @@ def _create_build_node(kg2_version: str, biolink_version: str) -> Dict[str, any]
     return kg2c_build_node
 
 
-def _canonicalize_nodes(kg2pre_nodes: List[Dict[str, any]]) -> Tuple[Dict[str, Dict[str, any]], Dict[str, str]]:
-    logging.info(f"Canonicalizing nodes..")
-    synonymizer = NodeSynonymizer()
+def _get_synonymizer_info_for_node_chunk(chunk: Tuple[int, List[List[str]]]) -> Tuple[List[Dict[str, any]], Dict[str, any], Dict[str, List[str]]]:
+    # Runs in a worker process, each of which opens its own connection to the synonymizer
+    if "synonymizer" not in _worker_state:
+        _worker_state["synonymizer"] = NodeSynonymizer()
+    synonymizer = _worker_state["synonymizer"]
+    _, rows = chunk
+    kg2pre_nodes = _load_kg2pre_rows(rows, _worker_state["property_columns"])
     node_ids = [node.get('id') for node in kg2pre_nodes if node.get('id')]
-    logging.info(f"  Sending NodeSynonymizer.get_canonical_curies() {len(node_ids)} curies..")
-    canonicalized_info = synonymizer.get_canonical_curies(curies=node_ids, return_all_categories=True)
-    all_canonical_curies = {canonical_info['preferred_curie'] for canonical_info in canonicalized_info.values() if canonical_info}
-    logging.info(f"  Sending NodeSynonymizer.get_equivalent_nodes() {len(all_canonical_curies)} curies..")
-    equivalent_curies_info = synonymizer.get_equivalent_nodes(all_canonical_curies)
-    recognized_curies = {curie for curie in equivalent_curies_info if equivalent_curies_info.get(curie)}
-    equivalent_curies_dict = {curie: list(equivalent_curies_info.get(curie)) for curie in recognized_curies}
-    with open(f"{KG2C_DIR}/equivalent_curies.pickle", "wb") as equiv_curies_dump:  # Save these for use by downstream script
-        pickle.dump(equivalent_curies_dict, equiv_curies_dump, protocol=pickle.HIGHEST_PROTOCOL)
-    logging.info(f"  Creating canonicalized nodes..")
+    canonicalized_info = synonymizer.get_canonical_curies(curies=node_ids, return_all_categories=True) if node_ids else dict()
+    canonical_curies = {canonical_info['preferred_curie'] for canonical_info in canonicalized_info.values() if canonical_info}
+    equivalent_curies_info = synonymizer.get_equivalent_nodes(canonical_curies) if canonical_curies else dict()
+    equivalent_curies_dict = {curie: list(equivalent_curies) for curie, equivalent_curies in equivalent_curies_info.items()
+                              if equivalent_curies}
+    return kg2pre_nodes, canonicalized_info, equivalent_curies_dict
+
+
+def _canonicalize_nodes(local_tsv_dir_path: str) -> Tuple[Dict[str, Dict[str, any]], Dict[str, str]]:
+    """
+    Streams the KG2pre nodes TSV in chunks, which worker processes parse and look up in the NodeSynonymizer; the
+    chunks are then merged into canonical nodes here, in their original order.
+    """
+    logging.info(f"Canonicalizing nodes..")
+    num_cpus = os.cpu_count()
+    property_columns = _get_kg2pre_property_columns(local_tsv_dir_path, "nodes")
+    equivalent_curies_dict = dict()
     curie_map = dict()
     canonicalized_nodes = dict()
+    num_kg2pre_nodes = 0
+    with Pool(num_cpus, initializer=_init_canonicalization_worker, initargs=(property_columns,)) as pool:
+        # Work on a few chunks per cpu at a time so that we don't read the whole TSV into the pool's task queue
+        for chunk_batch in _get_batches(_stream_kg2pre_tsv_chunks(local_tsv_dir_path, "nodes"), num_cpus * 2):
+            for kg2pre_nodes, canonicalized_info, chunk_equivalent_curies in pool.map(_get_synonymizer_info_for_node_chunk,
+                                                                                      chunk_batch):
+                equivalent_curies_dict.update(chunk_equivalent_curies)
+                num_kg2pre_nodes += len(kg2pre_nodes)
+                _merge_kg2pre_nodes_into_canonicalized_nodes(kg2pre_nodes, canonicalized_info, equivalent_curies_dict,
+                                                             canonicalized_nodes, curie_map)
+            logging.info(f"  Have canonicalized {num_kg2pre_nodes} KG2pre nodes so far..")
+    with open(f"{KG2C_DIR}/equivalent_curies.pickle", "wb") as equiv_curies_dump:  # Save these for use by downstream script
+        pickle.dump(equivalent_curies_dict, equiv_curies_dump, protocol=pickle.HIGHEST_PROTOCOL)
+    logging.info(f"Number of KG2pre nodes was reduced to {len(canonicalized_nodes)} "
+                 f"({round((len(canonicalized_nodes) / num_kg2pre_nodes) * 100)}%)")
+    return canonicalized_nodes, curie_map
+
+
+def _merge_kg2pre_nodes_into_canonicalized_nodes(kg2pre_nodes: List[Dict[str, any]],
+                                                 canonicalized_info: Dict[str, any],
+                                                 equivalent_curies_dict: Dict[str, List[str]],
+                                                 canonicalized_nodes: Dict[str, Dict[str, any]],
+                                                 curie_map: Dict[str, str]):
     for kg2pre_node in kg2pre_nodes:
         # Grab relevant info for this node and its canonical version
         canonical_info = canonicalized_info.get(kg2pre_node['id'])
@@ -516,65 +623,153 @@ def _canonicalize_nodes(kg2pre_nodes: List[Dict[str, any]]) -> Tuple[Dict[str, D
                                               all_names=all_names)
             canonicalized_nodes[canonicalized_node['id']] = canonicalized_node
         curie_map[kg2pre_node['id']] = canonicalized_curie  # Record this mapping for easy lookup later
-    logging.info(f"Number of KG2pre nodes was reduced to {len(canonicalized_nodes)} "
-                 f"({round((len(canonicalized_nodes) / len(kg2pre_nodes)) * 100)}%)")
-    return canonicalized_nodes, curie_map
 
 
-def _canonicalize_edges(kg2pre_edges: List[Dict[str, any]], curie_map: Dict[str, str], is_test: bool) -> Dict[str, Dict[str, any]]:
+def _canonicalize_edge(kg2pre_edge: Dict[str, any], curie_map: Dict[str, str], is_test: bool) -> Optional[Tuple[str, Dict[str, any]]]:
+    """
+    Returns the key and canonicalized version of the given KG2pre edge, or None if it becomes a self-edge.
+    """
+    kg2_edge_id = kg2pre_edge['id']
+    original_subject = kg2pre_edge['subject']
+    original_object = kg2pre_edge['object']
+    if not is_test:  # Make sure we have the mappings we expect
+        assert original_subject in curie_map
+        assert original_object in curie_map
+    canonicalized_subject = curie_map.get(original_subject, original_subject)
+    canonicalized_object = curie_map.get(original_object, original_object)
+    if canonicalized_subject == canonicalized_object:  # Don't allow self-edges
+        return None
+    edge_publications = kg2pre_edge['publications'] if kg2pre_edge.get('publications') else []
+    edge_primary_knowledge_source = kg2pre_edge['primary_knowledge_source'] if kg2pre_edge.get('primary_knowledge_source') else ""
+    edge_qualified_predicate = kg2pre_edge['qualified_predicate'] if kg2pre_edge.get('qualified_predicate') else ""
+    edge_qualified_object_aspect = kg2pre_edge['qualified_object_aspect'] if kg2pre_edge.get('qualified_object_aspect') else ""
+    edge_qualified_object_direction = kg2pre_edge['qualified_object_direction'] if kg2pre_edge.get('qualified_object_direction') else ""
+    edge_domain_range_exclusion = kg2pre_edge['domain_range_exclusion']
+
+    '''Patch for lack of qualified_predicate when qualified_object_direction is present'''
+    predicate = kg2pre_edge['predicate']
+    if predicate == "biolink:regulates" and edge_qualified_object_direction and not edge_qualified_predicate:
+        edge_qualified_predicate = "biolink:causes"
+        edge_qualified_object_aspect = "activity_or_abundance"
+
+    edge_publications_info = _load_publications_info(kg2pre_edge['publications_info'], kg2_edge_id) if kg2pre_edge.get('publications_info') else dict()
+    canonicalized_edge_key = _get_edge_key(subject=canonicalized_subject,
+                                           object=canonicalized_object,
+                                           predicate=kg2pre_edge['predicate'],
+                                           qualified_predicate=edge_qualified_predicate,
+                                           qualified_object_aspect=edge_qualified_object_aspect,
+                                           qualified_object_direction=edge_qualified_object_direction,
+                                           primary_knowledge_source=edge_primary_knowledge_source)
+    canonicalized_edge = _create_edge(subject=canonicalized_subject,
+                                      object=canonicalized_object,
+                                      predicate=kg2pre_edge['predicate'],
+                                      primary_knowledge_source=edge_primary_knowledge_source,
+                                      publications=edge_publications,
+                                      publications_info=edge_publications_info,
+                                      kg2_ids=[kg2_edge_id],
+                                      qualified_predicate=edge_qualified_predicate,
+                                      qualified_object_aspect=edge_qualified_object_aspect,
+                                      qualified_object_direction=edge_qualified_object_direction,
+                                      domain_range_exclusion=edge_domain_range_exclusion)
+    return canonicalized_edge_key, canonicalized_edge
+
+
+def _get_edge_shard_num(canonicalized_subject: str) -> int:
+    # Edges are sharded by their canonical subject, so every edge that could merge with another lands in the same shard
+    # (crc32 rather than hash() since string hashes differ between processes)
+    return zlib.crc32(canonicalized_subject.encode()) % NUM_EDGE_SHARDS
+
+
+def _get_edge_shard_path(shard_num: int) -> str:
+    return f"{EDGE_SHARDS_DIR}/edges_shard_{shard_num}.pickle"
+
+
+def _canonicalize_edge_chunk(chunk: Tuple[int, List[List[str]]]) -> Dict[int, List[Tuple[int, str, Dict[str, any]]]]:
+    # Runs in a worker process; returns (row number, edge key, canonicalized edge) tuples grouped by shard
+    start_row_num, rows = chunk
+    kg2pre_edges = _load_kg2pre_rows(rows, _worker_state["property_columns"])
+    edges_by_shard = defaultdict(list)
+    for row_num, kg2pre_edge in enumerate(kg2pre_edges, start=start_row_num):
+        canonicalized_edge_info = _canonicalize_edge(kg2pre_edge, _worker_state["curie_map"], _worker_state["is_test"])
+        if canonicalized_edge_info:
+            canonicalized_edge_key, canonicalized_edge = canonicalized_edge_info
+            edges_by_shard[_get_edge_shard_num(canonicalized_edge["subject"])].append((row_num, canonicalized_edge_key,
+                                                                                       canonicalized_edge))
+    return edges_by_shard
+
+
+def _merge_edge_shard(shard_num: int) -> str:
+    """
+    Runs in a worker process; merges all the edges in the given shard that share a key and saves the merged edges
+    (in the order they first appeared in KG2pre) to a new file, whose path is returned.
+    """
+    shard_path = _get_edge_shard_path(shard_num)
+    merged_edges = dict()
+    with open(shard_path, "rb") as shard_file:
+        while True:
+            try:
+                shard_rows = pickle.load(shard_file)
+            except EOFError:
+                break
+            for row_num, canonicalized_edge_key, canonicalized_edge in shard_rows:
+                if canonicalized_edge_key in merged_edges:
+                    _, existing_edge = merged_edges[canonicalized_edge_key]
+                    existing_edge['publications'] = _merge_two_lists(existing_edge['publications'], canonicalized_edge['publications'])
+                    existing_edge['publications_info'].update(canonicalized_edge['publications_info'])
+                    existing_edge['kg2_ids'] += canonicalized_edge['kg2_ids']
+                else:
+                    merged_edges[canonicalized_edge_key] = (row_num, canonicalized_edge)
+    merged_shard_path = f"{shard_path}.merged"
+    with open(merged_shard_path, "wb") as merged_shard_file:
+        pickle.dump([(row_num, canonicalized_edge_key, canonicalized_edge)
+                     for canonicalized_edge_key, (row_num, canonicalized_edge) in merged_edges.items()],
+                    merged_shard_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.remove(shard_path)
+    return merged_shard_path
+
+
+def _canonicalize_edges(local_tsv_dir_path: str, curie_map: Dict[str, str], is_test: bool) -> Dict[str, Dict[str, any]]:
+    """
+    Streams the KG2pre edges TSV in chunks, which worker processes canonicalize and split into shards (on disk) keyed
+    by canonical subject. Each shard is then merged in parallel, and the merged shards are finally combined here, in
+    the order the edges first appeared in KG2pre.
+    """
     logging.info(f"Canonicalizing edges..")
-    canonicalized_edges = dict()
-    for kg2pre_edge in kg2pre_edges:
-        kg2_edge_id = kg2pre_edge['id']
-        original_subject = kg2pre_edge['subject']
-        original_object = kg2pre_edge['object']
-        if not is_test:  # Make sure we have the mappings we expect
-            assert original_subject in curie_map
-            assert original_object in curie_map
-        canonicalized_subject = curie_map.get(original_subject, original_subject)
-        canonicalized_object = curie_map.get(original_object, original_object)
-        edge_publications = kg2pre_edge['publications'] if kg2pre_edge.get('publications') else []
-        edge_primary_knowledge_source = kg2pre_edge['primary_knowledge_source'] if kg2pre_edge.get('primary_knowledge_source') else ""
-        edge_qualified_predicate = kg2pre_edge['qualified_predicate'] if kg2pre_edge.get('qualified_predicate') else ""
-        edge_qualified_object_aspect = kg2pre_edge['qualified_object_aspect'] if kg2pre_edge.get('qualified_object_aspect') else ""
-        edge_qualified_object_direction = kg2pre_edge['qualified_object_direction'] if kg2pre_edge.get('qualified_object_direction') else ""
-        edge_domain_range_exclusion = kg2pre_edge['domain_range_exclusion']
-
-        '''Patch for lack of qualified_predicate when qualified_object_direction is present'''
-        predicate = kg2pre_edge['predicate']
-        if predicate == "biolink:regulates" and edge_qualified_object_direction and not edge_qualified_predicate:
-            edge_qualified_predicate = "biolink:causes"
-            edge_qualified_object_aspect = "activity_or_abundance"
-
-        edge_publications_info = _load_publications_info(kg2pre_edge['publications_info'], kg2_edge_id) if kg2pre_edge.get('publications_info') else dict()
-        if canonicalized_subject != canonicalized_object:  # Don't allow self-edges
-            canonicalized_edge_key = _get_edge_key(subject=canonicalized_subject,
-                                                   object=canonicalized_object,
-                                                   predicate=kg2pre_edge['predicate'],
-                                                   qualified_predicate=edge_qualified_predicate,
-                                                   qualified_object_aspect=edge_qualified_object_aspect,
-                                                   qualified_object_direction=edge_qualified_object_direction,
-                                                   primary_knowledge_source=edge_primary_knowledge_source)
-            if canonicalized_edge_key in canonicalized_edges:
-                canonicalized_edge = canonicalized_edges[canonicalized_edge_key]
-                canonicalized_edge['publications'] = _merge_two_lists(canonicalized_edge['publications'], edge_publications)
-                canonicalized_edge['publications_info'].update(edge_publications_info)
-                canonicalized_edge['kg2_ids'].append(kg2_edge_id)
-            else:
-                new_canonicalized_edge = _create_edge(subject=canonicalized_subject,
-                                                      object=canonicalized_object,
-                                                      predicate=kg2pre_edge['predicate'],
-                                                      primary_knowledge_source=edge_primary_knowledge_source,
-                                                      publications=edge_publications,
-                                                      publications_info=edge_publications_info,
-                                                      kg2_ids=[kg2_edge_id],
-                                                      qualified_predicate=edge_qualified_predicate,
-                                                      qualified_object_aspect=edge_qualified_object_aspect,
-                                                      qualified_object_direction=edge_qualified_object_direction,
-                                                      domain_range_exclusion=edge_domain_range_exclusion)
-                canonicalized_edges[canonicalized_edge_key] = new_canonicalized_edge
+    num_cpus = os.cpu_count()
+    property_columns = _get_kg2pre_property_columns(local_tsv_dir_path, "edges")
+    if os.path.exists(EDGE_SHARDS_DIR):
+        shutil.rmtree(EDGE_SHARDS_DIR)
+    os.makedirs(EDGE_SHARDS_DIR)
+    num_kg2pre_edges = 0
+    try:
+        with Pool(num_cpus, initializer=_init_canonicalization_worker, initargs=(property_columns, curie_map, is_test)) as pool:
+            with ExitStack() as shard_files_stack:  # Closes the shard files even if a worker raises
+                shard_files = [shard_files_stack.enter_context(open(_get_edge_shard_path(shard_num), "wb"))
+                               for shard_num in range(NUM_EDGE_SHARDS)]
+                # Work on a few chunks per cpu at a time so that we don't read the whole TSV into the pool's task queue
+                for chunk_batch in _get_batches(_stream_kg2pre_tsv_chunks(local_tsv_dir_path, "edges"), num_cpus * 2):
+                    for edges_by_shard in pool.map(_canonicalize_edge_chunk, chunk_batch):
+                        for shard_num, shard_rows in edges_by_shard.items():
+                            pickle.dump(shard_rows, shard_files[shard_num], protocol=pickle.HIGHEST_PROTOCOL)
+                    num_kg2pre_edges += sum(len(rows) for _, rows in chunk_batch)
+                    logging.info(f"  Have canonicalized {num_kg2pre_edges} KG2pre edges so far..")
+
+            logging.info(f"  Merging edges within each of {NUM_EDGE_SHARDS} shards..")
+            merged_shard_paths = pool.map(_merge_edge_shard, range(NUM_EDGE_SHARDS))
+
+        logging.info(f"  Combining merged shards..")
+        merged_shards = []
+        for merged_shard_path in merged_shard_paths:
+            with open(merged_shard_path, "rb") as merged_shard_file:
+                merged_shards.append(pickle.load(merged_shard_file))
+        canonicalized_edges = {canonicalized_edge_key: canonicalized_edge
+                               for _, canonicalized_edge_key, canonicalized_edge in heapq.merge(*merged_shards,
+                                                                                                key=lambda row: row[0])}
+        del merged_shards
+    finally:
+        shutil.rmtree(EDGE_SHARDS_DIR, ignore_errors=True)
     logging.info(f"Number of KG2pre edges was reduced to {len(canonicalized_edges)} "
-                 f"({round((len(canonicalized_edges) / len(kg2pre_edges)) * 100)}%)")
+                 f"({round((len(canonicalized_edges) / num_kg2pre_edges) * 100)}%)")
     return canonicalized_edges
 
 
@@ -706,9 +901,8 @@ def create_kg2c_files(is_test=False):
         else:
             logging.info(f"Using the KG2pre TSVs in {local_tsv_dir_path} (not downloading fresh versions)")
 
-        # Load the KG2pre nodes
-        kg2pre_nodes = _load_kg2pre_tsv(local_tsv_dir_path, "nodes")
-        canonicalized_nodes_dict, curie_map = _canonicalize_nodes(kg2pre_nodes)
+        # Canonicalize the KG2pre nodes
+        canonicalized_nodes_dict, curie_map = _canonicalize_nodes(local_tsv_dir_path)
 
         # Make sure that the KG2pre version matches the version we're supposed to be building a KG2c off of
         kg2pre_build_node = canonicalized_nodes_dict.get("RTX:KG2")
@@ -727,13 +921,11 @@ def create_kg2c_files(is_test=False):
         build_node = _create_build_node(kg2_version, biolink_version)
         canonicalized_nodes_dict[build_node['id']] = build_node
         canonicalized_nodes_dict = _post_process_nodes(canonicalized_nodes_dict, kg2c_config_info)
-        del kg2pre_nodes  # Try to free up as much memory as possible for edge processing
-        gc.collect()
+        gc.collect()  # Try to free up as much memory as possible for edge processing
 
         # Canonicalize edges
-        kg2pre_edges = _load_kg2pre_tsv(local_tsv_dir_path, "edges")
-        canonicalized_edges_dict = _canonicalize_edges(kg2pre_edges, curie_map, is_test)
-        del kg2pre_edges
+        canonicalized_edges_dict = _canonicalize_edges(local_tsv_dir_path, curie_map, is_test)
+        del curie_map
         gc.collect()
         canonicalized_edges_dict = _post_process_edges(canonicalized_edges_dict)
 
@@ -140,6 +140,17 @@ def add_neighbor_counts_to_sqlite(nodes_by_id: Dict[str, Dict[str, any]], edges_
     cursor = connection.execute(f"SELECT COUNT(*) FROM neighbors")
     logging.info(f" Done adding neighbor counts to sqlite; neighbors table contains {cursor.fetchone()[0]} rows")
     cursor.close()
+    # Also save the counts in typed form (one integer column per category), which is what FET queries
+    logging.info(f" Saving neighbor counts to typed neighbor_counts_by_category table..")
+    labels = sorted({label for counts in neighbor_counts.values() for label in counts})
+    column_definitions = ", ".join(f'"{label}" INTEGER' for label in labels)
+    connection.execute("DROP TABLE IF EXISTS neighbor_counts_by_category")
+    connection.execute(f"CREATE TABLE neighbor_counts_by_category (id TEXT PRIMARY KEY, {column_definitions}) WITHOUT ROWID")
+    placeholders = ", ".join("?" * (len(labels) + 1))
+    rows = ([node_id] + [counts.get(label) for label in labels] for node_id, counts in neighbor_counts.items())
+    connection.executemany(f"INSERT INTO neighbor_counts_by_category VALUES ({placeholders})", rows)
+    connection.commit()
+    logging.info(f" Done adding neighbor_counts_by_category table (with {len(labels)} category columns)")
     connection.close()
 
     # Additionally record top node degrees (used for dev purposes)
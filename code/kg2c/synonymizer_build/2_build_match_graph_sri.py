@@ -1,12 +1,17 @@
 import argparse
+import asyncio
+import hashlib
 import itertools
 import json
 import logging
 import os
 import pathlib
+import random
+import shutil
 import subprocess
-from typing import Set, Dict
+from typing import Set, Dict, List, Optional
 
+import aiohttp
 import json_lines
 import numpy as np
 import pandas as pd
@@ -23,6 +28,14 @@ logging.basicConfig(level=logging.INFO,
 SRI_NN_NODES_FILE_NAME = "KGX_NN_data-2023apr7_nodes.jsonl"
 SRI_NN_EDGES_FILE_NAME = "KGX_NN_data-2023apr7_edges.jsonl"
 SRI_NN_REMOTE_ROOT_PATH = "https://stars.renci.org/var/babel_outputs/2022dec2-2/kgx/"
+# Note: This is their development (non-ITRB) server, which seems to be faster for us..
+SRI_NN_URL = "https://nodenormalization-sri.renci.org/1.3/get_normalized_nodes"
+SRI_NN_BATCH_SIZE = 1000  # This is the suggested max batch size from Chris Bizon (in Translator slack..)
+SRI_NN_MAX_CONCURRENT_REQUESTS = 8
+SRI_NN_MAX_ATTEMPTS = 5
+SRI_NN_RETRY_BASE_DELAY = 2  # Seconds; doubles with each retry
+SRI_NN_REQUEST_TIMEOUT = 600  # Seconds
+SRI_NN_BATCHES_DIR = f"{SYNONYMIZER_BUILD_DIR}/2_sri_nn_batches"  # Per-batch results, so interrupted runs can resume
 
 
 def strip_biolink_prefix(item: str) -> str:
@@ -40,8 +53,91 @@ def get_sri_edge_id(subject_id: str, object_id: str) -> str:
     return f"SRI:{subject_id}--{object_id}"
 
 
-def get_sri_cluster_id_mappings(kg2pre_node_ids_set: Set[str]):
-    kg2pre_node_ids = list(kg2pre_node_ids_set)
+def get_sri_nn_batch_file_path(node_id_batch: List[str]) -> str:
+    # Named after the batch's contents, so a result file can never be mistaken for that of a different batch
+    batch_hash = hashlib.md5("\n".join(node_id_batch).encode()).hexdigest()
+    return f"{SRI_NN_BATCHES_DIR}/{batch_hash}.json"
+
+
+def save_sri_nn_batch_result(node_id_batch: List[str], response_json: dict):
+    # Only keep what we need from the SRI NN response: each recognized node's cluster ID and its equivalent IDs
+    batch_result = dict()
+    for kg2pre_node_id, normalized_info in response_json.items():
+        if normalized_info:
+            batch_result[kg2pre_node_id] = {"cluster_id": normalized_info["id"]["identifier"],
+                                            "equivalent_ids": [equivalent_node["identifier"] for equivalent_node
+                                                               in normalized_info["equivalent_identifiers"]]}
+        else:
+            batch_result[kg2pre_node_id] = None
+    # Write to a temporary file first, so an interruption can't leave behind a partial result file
+    batch_file_path = get_sri_nn_batch_file_path(node_id_batch)
+    with open(f"{batch_file_path}.tmp", "w+") as batch_file:
+        json.dump(batch_result, batch_file)
+    os.replace(f"{batch_file_path}.tmp", batch_file_path)
+
+
+async def fetch_sri_nn_batch(session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, sri_nn_url: str,
+                             node_id_batch: List[str], batch_num: int) -> bool:
+    """
+    Sends one batch of node IDs to the SRI NN and saves its result, retrying (with exponential backoff) after
+    connection errors, timeouts, 429/5xx responses, and responses that aren't valid JSON. Returns whether the batch
+    succeeded.
+    """
+    query_body = {"curies": node_id_batch,
+                  "conflate": True}
+    for attempt in range(1, SRI_NN_MAX_ATTEMPTS + 1):
+        async with semaphore:
+            try:
+                async with session.post(sri_nn_url, json=query_body) as response:
+                    if response.status == 200:
+                        save_sri_nn_batch_result(node_id_batch, await response.json(content_type=None))
+                        return True
+                    error_message = f"non-200 status ({response.status}): {(await response.text())[:500]}"
+                    is_retryable = response.status == 429 or response.status >= 500
+            except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+                # (A response body that isn't valid JSON is most likely truncated, so it's worth another try)
+                error_message = f"{type(e).__name__}: {e}"
+                is_retryable = True
+            except (KeyError, TypeError, AttributeError) as e:
+                # The response is JSON, but not in the shape we expect; asking again won't change that
+                error_message = f"unexpected response structure ({type(e).__name__}: {e})"
+                is_retryable = False
+        if not is_retryable or attempt == SRI_NN_MAX_ATTEMPTS:
+            logging.warning(f"Batch {batch_num} failed after {attempt} attempt(s); last error was {error_message}")
+            return False
+        retry_delay = SRI_NN_RETRY_BASE_DELAY * 2 ** (attempt - 1) + random.uniform(0, 1)
+        logging.warning(f"Batch {batch_num} returned {error_message}. Retrying in {round(retry_delay, 1)} seconds..")
+        await asyncio.sleep(retry_delay)
+
+
+async def fetch_sri_nn_batches(node_id_batches: List[List[str]], sri_nn_url: str,
+                               max_concurrent_requests: int) -> int:
+    # Sends all batches that don't already have a saved result to the SRI NN; returns the number that failed
+    batches_to_fetch = [(batch_num, node_id_batch) for batch_num, node_id_batch in enumerate(node_id_batches)
+                        if not os.path.exists(get_sri_nn_batch_file_path(node_id_batch))]
+    logging.info(f"{len(node_id_batches) - len(batches_to_fetch)} batches already have saved results; "
+                 f"sending the other {len(batches_to_fetch)} to SRI NN ({max_concurrent_requests} at a time)..")
+    semaphore = asyncio.Semaphore(max_concurrent_requests)
+    timeout = aiohttp.ClientTimeout(total=SRI_NN_REQUEST_TIMEOUT)
+    num_processed = 0
+    num_failed_batches = 0
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        tasks = [fetch_sri_nn_batch(session, semaphore, sri_nn_url, node_id_batch, batch_num)
+                 for batch_num, node_id_batch in batches_to_fetch]
+        for task in asyncio.as_completed(tasks):
+            if not await task:
+                num_failed_batches += 1
+            num_processed += 1
+            if num_processed % 100 == 0:
+                logging.info(f"Have processed {num_processed} of {len(batches_to_fetch)} batches..")
+    return num_failed_batches
+
+
+def get_sri_cluster_id_mappings(kg2pre_node_ids_set: Set[str], sri_nn_url: str = SRI_NN_URL,
+                                max_concurrent_requests: int = SRI_NN_MAX_CONCURRENT_REQUESTS,
+                                refetch: bool = False):
+    # Sorted so that batches are the same from run to run (which lets an interrupted run pick up where it left off)
+    kg2pre_node_ids = sorted(kg2pre_node_ids_set)
     logging.info(f"Starting to build SRI match graph based on {len(kg2pre_node_ids):,} KG2pre node IDs..")
 
     # Save the current version of SRI match graph, if it exists (as backup, in case the SRI NN API is down)
@@ -54,48 +150,38 @@ def get_sri_cluster_id_mappings(kg2pre_node_ids_set: Set[str]):
         subprocess.check_call(["mv", sri_match_edges_file_path, f"{sri_match_edges_file_path}_PREVIOUS"])
 
     # Divide KG2pre node IDs into batches
-    batch_size = 1000  # This is the suggested max batch size from Chris Bizon (in Translator slack..)
+    batch_size = SRI_NN_BATCH_SIZE
     logging.info(f"Dividing KG2pre node IDs into batches of {batch_size}")
     kg2pre_node_id_batches = [kg2pre_node_ids[batch_start:batch_start + batch_size]
                               for batch_start in range(0, len(kg2pre_node_ids), batch_size)]
 
-    # Ask the SRI NodeNormalizer for normalized info for each batch of KG2pre IDs
-    logging.info(f"Beginning to send {len(kg2pre_node_id_batches)} batches to SRI NN..")
+    # Ask the SRI NodeNormalizer for normalized info for each batch of KG2pre IDs (saving each batch's result to disk)
+    if refetch and pathlib.Path(SRI_NN_BATCHES_DIR).exists():
+        logging.info(f"Deleting saved SRI NN batch results from a previous run, since a refetch was requested..")
+        shutil.rmtree(SRI_NN_BATCHES_DIR)
+    pathlib.Path(SRI_NN_BATCHES_DIR).mkdir(exist_ok=True)
+    logging.info(f"Beginning to send {len(kg2pre_node_id_batches)} batches to SRI NN at {sri_nn_url}..")
+    num_failed_batches = asyncio.run(fetch_sri_nn_batches(kg2pre_node_id_batches, sri_nn_url, max_concurrent_requests))
+
+    # Extract the canonical identifiers and any other equivalent IDs from the results for each batch
+    logging.info(f"Loading saved SRI NN batch results..")
     sri_node_id_to_cluster_id_map = dict()
-    batch_size = 1000  # This is the preferred max batch size, according to Chris Bizon in Translator slack
-    batch_num = 0
-    num_failed_batches = 0
     num_unrecognized_nodes = 0
     for node_id_batch in kg2pre_node_id_batches:
-        # Send the batch to the SRI NN RestAPI
-        # Note: This is their development (non-ITRB) server, which seems to be faster for us..
-        sri_nn_url = "https://nodenormalization-sri.renci.org/1.3/get_normalized_nodes"
-        query_body = {"curies": node_id_batch,
-                      "conflate": True}
-        response = requests.post(sri_nn_url, json=query_body)
-
-        # Extract the canonical identifiers and any other equivalent IDs from the response for this batch
-        if response.status_code == 200:
-            for kg2pre_node_id, normalized_info in response.json().items():
-                # This means the SRI NN recognized the KG2pre node ID we asked for
-                if normalized_info:
-                    # Process this cluster if we haven't seen it before
-                    cluster_id = normalized_info["id"]["identifier"]
-                    if cluster_id not in sri_node_id_to_cluster_id_map:
-                        for equivalent_node in normalized_info["equivalent_identifiers"]:
-                            node_id = equivalent_node["identifier"]
-                            sri_node_id_to_cluster_id_map[node_id] = cluster_id
-                else:
-                    # The SRI NN did not recognize the KG2pre node ID we asked for
-                    num_unrecognized_nodes += 1
-        else:
-            logging.warning(f"Batch {batch_num} returned non-200 status ({response.status_code}): {response.text}")
-            num_failed_batches += 1
-
-        # Log our progress
-        batch_num += 1
-        if batch_num % 100 == 0:
-            logging.info(f"Have processed {batch_num} of {len(kg2pre_node_id_batches)} batches..")
+        batch_result = load_sri_nn_batch_result(node_id_batch)
+        if batch_result is None:  # Means this batch failed
+            continue
+        for kg2pre_node_id, normalized_info in batch_result.items():
+            # This means the SRI NN recognized the KG2pre node ID we asked for
+            if normalized_info:
+                # Process this cluster if we haven't seen it before
+                cluster_id = normalized_info["cluster_id"]
+                if cluster_id not in sri_node_id_to_cluster_id_map:
+                    for node_id in normalized_info["equivalent_ids"]:
+                        sri_node_id_to_cluster_id_map[node_id] = cluster_id
+            else:
+                # The SRI NN did not recognize the KG2pre node ID we asked for
+                num_unrecognized_nodes += 1
 
     # Save map of cluster IDs
     logging.info(f"Done getting SRI cluster ID mappings. Saving cluster ID map to JSON file..")
@@ -108,11 +194,22 @@ def get_sri_cluster_id_mappings(kg2pre_node_ids_set: Set[str]):
     logging.info(f"Got cluster ID mappings for {len(sri_node_id_to_cluster_id_map):,} SRI nodes")
     if num_failed_batches:
         logging.warning(f"{num_failed_batches} requests to SRI NN API failed. Each failed request included "
-                        f"{batch_size} KG2pre node IDs.")
+                        f"{batch_size} KG2pre node IDs. Rerunning this script will resend only the failed batches.")
+    else:
+        # Every batch succeeded, so there's nothing to resume; a later build should ask the SRI NN afresh
+        shutil.rmtree(SRI_NN_BATCHES_DIR)
 
     return sri_node_id_to_cluster_id_map
 
 
+def load_sri_nn_batch_result(node_id_batch: List[str]) -> Optional[Dict[str, Optional[dict]]]:
+    batch_file_path = get_sri_nn_batch_file_path(node_id_batch)
+    if not os.path.exists(batch_file_path):
+        return None
+    with open(batch_file_path) as batch_file:
+        return json.load(batch_file)
+
+
 def create_match_nodes_sri(sri_node_id_to_cluster_id_map: Dict[str, str], is_test: bool) -> Set[str]:
     # Grab the KG2pre-related nodes from the SRI NN json lines file (which is huge - has ~600 million nodes in total)
     logging.info(f"Extracting relevant nodes from bulk SRI NN json lines file..")
@@ -191,6 +288,10 @@ def main():
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument('--downloadfresh', dest='download_fresh', action='store_true')
     arg_parser.add_argument('--test', dest='test', action='store_true')
+    arg_parser.add_argument('--refetch', dest='refetch', action='store_true',
+                            help="Ignore SRI NN batch results saved by a previous (interrupted) run")
+    arg_parser.add_argument('--srinnurl', dest='sri_nn_url', default=SRI_NN_URL,
+                            help="SRI NodeNormalizer get_normalized_nodes endpoint to use")
     args = arg_parser.parse_args()
 
     # Download a fresh copy of the bulk SRI NN data, if requested
@@ -199,7 +300,8 @@ def main():
 
     # First grab the SRI cluster IDs ('preferred'/canonical curies) for all KG2pre nodes from SRI NN RestAPI
     kg2pre_node_ids = get_kg2pre_node_ids()
-    sri_node_id_to_cluster_id_map = get_sri_cluster_id_mappings(kg2pre_node_ids)
+    sri_node_id_to_cluster_id_map = get_sri_cluster_id_mappings(kg2pre_node_ids, sri_nn_url=args.sri_nn_url,
+                                                                refetch=args.refetch)
 
     # Then build an SRI 'match graph' using the SRI NN bulk download
     sri_node_ids = create_match_nodes_sri(sri_node_id_to_cluster_id_map, args.test)
@@ -1,15 +1,14 @@
 import itertools
 import logging
 import os
-import random
 import string
 import time
-from collections import defaultdict
-from typing import Dict, List, Optional
+from typing import Dict, List
 
 import numpy as np
 import pandas as pd
 import requests
+from scipy import sparse
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 KG2C_DIR = f"{SCRIPT_DIR}/../"
@@ -25,6 +24,9 @@ PREDICATE_WEIGHTS = {
 BIO_RELATED_MAJOR_BRANCHES = {"BiologicalEntity", "GeneticOrMolecularBiologicalEntity", "DiseaseOrPhenotypicFeature",
                               "BiologicalProcessOrActivity", "OrganismalEntity"}
 UNNECESSARY_CHARS_MAP = {ord(char): None for char in string.punctuation + string.whitespace}
+LABEL_PROPAGATION_MAX_ITERATIONS = 100
+LABEL_PROPAGATION_SEED = 42
+UNLABELED = -1
 
 
 def assign_edge_weights(edges_df: pd.DataFrame):
@@ -44,34 +46,35 @@ def remove_close_match_edges(edges_df: pd.DataFrame):
     return edges_df[edges_df.predicate != "close_match"]
 
 
-def get_weighted_adjacency_dict(edges_df: pd.DataFrame) -> Dict[str, Dict[str, float]]:
-    logging.info(f"Creating weighted adjacency dict from edges data frame...")
+def get_weighted_adjacency_matrix(nodes_df: pd.DataFrame, edges_df: pd.DataFrame) -> sparse.csr_matrix:
+    """
+    Returns a symmetric matrix whose rows/columns are in the same order as the nodes DataFrame and whose entry for
+    each pair of nodes is the summed weight of all edges between them (in either direction).
+    """
+    logging.info(f"Creating weighted adjacency matrix from edges data frame...")
     start = time.time()
 
-    edges_df_ordered_pairs = edges_df.loc[:, ["weight"]]
-    logging.info(f"First creating a new DataFrame with ordered node pairs..")
-    edges_df_ordered_pairs["nodea"] = np.where(edges_df.subject < edges_df.object, edges_df.subject, edges_df.object)
-    edges_df_ordered_pairs["nodeb"] = np.where(edges_df.subject < edges_df.object, edges_df.object, edges_df.subject)
-
-    logging.info(f"Now grouping by node pair and summing weights..")
-    grouped_df = edges_df_ordered_pairs.groupby(by=["nodea", "nodeb"]).sum()
-
-    logging.info(f"Now converting the grouped node pair sums into nested adj dict format..")
-    adj_list_weighted = defaultdict(lambda: defaultdict(float))
-    add_node_pair_to_adj_list_vectorized = np.vectorize(add_node_pair_to_adj_list)
-    add_node_pair_to_adj_list_vectorized(grouped_df.index.values, grouped_df.weight, adj_list_weighted)
+    logging.info(f"Converting edge subjects/objects to node row numbers..")
+    subject_indexes = nodes_df.index.get_indexer(edges_df.subject)
+    object_indexes = nodes_df.index.get_indexer(edges_df.object)
+    unknown_node_mask = (subject_indexes < 0) | (object_indexes < 0)
+    if unknown_node_mask.any():
+        raise ValueError(f"{unknown_node_mask.sum()} edges use nodes that are not in the nodes DataFrame: "
+                         f"{list(edges_df.index[unknown_node_mask][:10])}")
+
+    logging.info(f"Building sparse matrix (duplicate node pairs get their weights summed)..")
+    weights = edges_df.weight.values.astype(float)
+    num_nodes = len(nodes_df)
+    adjacency_matrix = sparse.coo_matrix((np.concatenate([weights, weights]),
+                                          (np.concatenate([subject_indexes, object_indexes]),
+                                           np.concatenate([object_indexes, subject_indexes]))),
+                                         shape=(num_nodes, num_nodes)).tocsr()
 
     stop = time.time()
-    logging.info(f"Creating weighted adjacency dict took {round(stop - start, 2)} seconds")
+    logging.info(f"Creating weighted adjacency matrix took {round(stop - start, 2)} seconds "
+                 f"({adjacency_matrix.nnz:,} non-zero entries)")
 
-    return adj_list_weighted
-
-
-def add_node_pair_to_adj_list(node_pair_tuple, summed_weight, adj_list_weighted: Dict[str, Dict[str, float]]):
-    node_a = node_pair_tuple[0]
-    node_b = node_pair_tuple[1]
-    adj_list_weighted[node_a][node_b] = summed_weight
-    adj_list_weighted[node_b][node_a] = summed_weight
+    return adjacency_matrix
 
 
 def assign_major_category_branches(nodes_df: pd.DataFrame):
@@ -164,34 +167,40 @@ def remove_conflicting_category_edges(nodes_df: pd.DataFrame, edges_df: pd.DataF
     return edges_df
 
 
-def do_label_propagation(label_map: Dict[str, str], adj_list_weighted: Dict[str, Dict[str, float]],
-                         nodes_to_label: Optional[List[str]] = None) -> Dict[str, str]:
-    # Run label propagation, starting with whatever labels were provided
-    node_ids = nodes_to_label if nodes_to_label else list(label_map.keys())
-    logging.info(f"Starting label propagation; {len(node_ids)} nodes need labeling")
+def do_label_propagation(labels: np.ndarray, adjacency_matrix: sparse.csr_matrix, nodes_to_label: np.ndarray,
+                         seed: int = LABEL_PROPAGATION_SEED) -> np.ndarray:
+    """
+    Runs label propagation, starting with whatever labels were provided. Labels are integer codes (UNLABELED for nodes
+    without a label) and nodes are row numbers in the adjacency matrix; only the nodes in nodes_to_label may change
+    labels. Each sweep updates one color class (set of mutually non-adjacent nodes) at a time, which gives the same
+    result as updating those nodes one by one, but is vectorized. Ties between labels are broken by a random (but
+    seeded, and fixed for the whole run) ranking of the labels.
+    """
+    logging.info(f"Starting label propagation; {len(nodes_to_label):,} nodes need labeling")
+    rng = np.random.default_rng(seed)
+    # Work with labels' ranks, so that ties can simply go to the highest label
+    label_ranks = rng.permutation(labels.max(initial=UNLABELED) + 1)
+    labels = labels.copy()
+    is_labeled = labels != UNLABELED
+    labels[is_labeled] = label_ranks[labels[is_labeled]]
+    color_classes = get_color_classes(adjacency_matrix, nodes_to_label, rng)
+    logging.info(f"Nodes to label were split into {len(color_classes):,} color classes")
     iteration = 1
     done = False
-    get_most_common_neighbor_label_vectorized = np.vectorize(get_most_common_neighbor_label, otypes=[str])
-    while not done and iteration < 100:
+    while not done and iteration < LABEL_PROPAGATION_MAX_ITERATIONS:
         logging.info(f"Starting iteration {iteration} of label propagation..")
-        # Put nodes into a new DF in a random order
-        random.shuffle(node_ids)
-        nodes_df_random = pd.DataFrame(node_ids, columns=["id"]).set_index("id")
-        # Then update their current majority labels (changes to one node may impact others)
-        logging.info(f"Updating current majority labels (updating label map as we go)..")
-        nodes_df_random["current_label"] = get_most_common_neighbor_label_vectorized(nodes_df_random.index,
-                                                                                     adj_list_weighted,
-                                                                                     label_map,
-                                                                                     update_label_map=True)
+        # Update color classes in a random order (changes to one class may impact others)
+        logging.info(f"Updating current majority labels (one color class at a time)..")
+        for class_num in rng.permutation(len(color_classes)):
+            class_nodes = color_classes[class_num]
+            labels[class_nodes] = get_majority_labels(class_nodes, adjacency_matrix, labels)
         # Then determine the majority label for each node, when considering the current labeling 'frozen'
         logging.info(f"Determining majority labels for nodes, considering current labeling to be 'frozen'..")
-        nodes_df_random["major_label"] = get_most_common_neighbor_label_vectorized(nodes_df_random.index,
-                                                                                   adj_list_weighted,
-                                                                                   label_map,
-                                                                                   update_label_map=False)
-        logging.info(f"After iteration {iteration}, nodes_df_random is: \n{nodes_df_random}")
+        majority_labels = get_majority_labels(nodes_to_label, adjacency_matrix, labels)
+        num_not_at_majority = int((majority_labels != labels[nodes_to_label]).sum())
+        logging.info(f"After iteration {iteration}, {num_not_at_majority:,} nodes don't have their majority label")
         # Stop if all nodes have the label most prevalent among their neighbors
-        if nodes_df_random["current_label"].equals(nodes_df_random["major_label"]):
+        if not num_not_at_majority:
             done = True
             logging.info(f"Label propagation reached convergence (in {iteration} iterations)")
         else:
@@ -199,24 +208,74 @@ def do_label_propagation(label_map: Dict[str, str], adj_list_weighted: Dict[str,
 
     if not done:
         logging.info(f"Label propagation reached iteration limit ({iteration} iterations); unable to converge")
-    return label_map
-
-
-def get_most_common_neighbor_label(node_id: str, adj_list_weighted: dict, label_map: Dict[str, any], update_label_map: bool) -> any:
-    weighted_neighbors = adj_list_weighted.get(node_id)
-    if weighted_neighbors:
-        summed_label_weights = defaultdict(float)
-        for neighbor_id, weight in weighted_neighbors.items():
-            neighbor_label = label_map[neighbor_id]
-            if neighbor_label == neighbor_label:  # Means it's not NaN
-                summed_label_weights[neighbor_label] += weight
-            # TODO: How does this handle ties? Supposed to break ties in random fashion...
-        most_common_label = max(summed_label_weights, key=summed_label_weights.get) if summed_label_weights else np.NaN
-        if update_label_map:
-            label_map[node_id] = most_common_label  # Important to update label_map itself...
-        return most_common_label
-    else:
-        return label_map[node_id]  # Ensures orphan nodes always return something (their label will never change)
+    is_labeled = labels != UNLABELED
+    labels[is_labeled] = np.argsort(label_ranks)[labels[is_labeled]]
+    return labels
+
+
+def get_color_classes(adjacency_matrix: sparse.csr_matrix, node_indexes: np.ndarray,
+                      rng: np.random.Generator) -> List[np.ndarray]:
+    """
+    Splits the given nodes into classes in which no two nodes are adjacent. Each round (following Luby/Jones-Plassmann)
+    every remaining node whose random priority beats those of all its remaining neighbors joins the new class.
+    """
+    subgraph = adjacency_matrix[node_indexes][:, node_indexes].tocoo()
+    # A node can never beat its own priority, so self-loops must go (otherwise the loop below would never finish)
+    is_self_loop = subgraph.row == subgraph.col
+    rows, cols = subgraph.row[~is_self_loop], subgraph.col[~is_self_loop]
+    order = np.argsort(rows, kind="stable")
+    rows, cols = rows[order], cols[order]
+    priorities = rng.permutation(len(node_indexes))
+    max_neighbor_priorities = np.full(len(node_indexes), -1)
+    remaining_nodes = np.arange(len(node_indexes))
+    is_remaining = np.ones(len(node_indexes), dtype=bool)
+    color_classes = []
+    while len(remaining_nodes):
+        if len(rows):
+            row_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+            max_neighbor_priorities[rows[row_starts]] = np.maximum.reduceat(priorities[cols], row_starts)
+        is_selected = priorities[remaining_nodes] > max_neighbor_priorities[remaining_nodes]
+        selected_nodes = remaining_nodes[is_selected]
+        color_classes.append(node_indexes[selected_nodes])
+        # Drop the selected nodes (and their edges) before the next round
+        max_neighbor_priorities[remaining_nodes] = -1
+        remaining_nodes = remaining_nodes[~is_selected]
+        is_remaining[selected_nodes] = False
+        edge_mask = is_remaining[rows] & is_remaining[cols]
+        rows, cols = rows[edge_mask], cols[edge_mask]
+    return color_classes
+
+
+def get_majority_labels(node_indexes: np.ndarray, adjacency_matrix: sparse.csr_matrix,
+                        labels: np.ndarray) -> np.ndarray:
+    """
+    Returns the label with the greatest summed edge weight among each node's labeled neighbors (UNLABELED if none of
+    its neighbors have labels), breaking ties in favor of the highest label. Orphan nodes keep their current label.
+    """
+    rows = adjacency_matrix[node_indexes]
+    degrees = np.diff(rows.indptr)
+    majority_labels = labels[node_indexes].copy()
+    majority_labels[degrees > 0] = UNLABELED
+    neighbor_labels = labels[rows.indices]
+    is_labeled = neighbor_labels != UNLABELED
+    if not is_labeled.any():
+        return majority_labels
+
+    # Sum the weights for each (node, label) pair; results come out sorted by node
+    num_labels = labels.max() + 1
+    neighbor_rows = np.repeat(np.arange(len(node_indexes)), degrees)
+    pair_keys = neighbor_rows[is_labeled].astype(np.int64) * num_labels + neighbor_labels[is_labeled]
+    unique_pair_keys, pair_nums = np.unique(pair_keys, return_inverse=True)
+    pair_weights = np.bincount(pair_nums, weights=rows.data[is_labeled])
+    pair_rows, pair_labels = np.divmod(unique_pair_keys, num_labels)
+
+    # Pick the heaviest label for each node
+    row_starts = np.flatnonzero(np.r_[True, pair_rows[1:] != pair_rows[:-1]])
+    max_weights = np.maximum.reduceat(pair_weights, row_starts)
+    num_pairs_per_row = np.diff(np.r_[row_starts, len(pair_rows)])
+    candidate_labels = np.where(pair_weights == np.repeat(max_weights, num_pairs_per_row), pair_labels, UNLABELED)
+    majority_labels[pair_rows[row_starts]] = np.maximum.reduceat(candidate_labels, row_starts)
+    return majority_labels
 
 
 def create_name_sim_edges(nodes_df: pd.DataFrame, edges_df: pd.DataFrame):
@@ -270,21 +329,21 @@ def cluster_match_graph(nodes_df: pd.DataFrame, edges_df: pd.DataFrame):
     logging.info(f"Determining which nodes need labeling..")
     # Note: A NaN value is not equal to itself
     non_sri_nodes_df = nodes_df[nodes_df.cluster_id != nodes_df.cluster_id]
-    non_sri_node_ids = list(non_sri_nodes_df.index.values)
     logging.info(f"Nodes missing cluster ID (non-SRI nodes) are: \n{non_sri_nodes_df}")
 
-    adj_list_weighted = get_weighted_adjacency_dict(edges_df)
+    non_sri_node_indexes = np.flatnonzero(nodes_df.cluster_id.isna().values)
+
+    adjacency_matrix = get_weighted_adjacency_matrix(nodes_df, edges_df)
 
     # First do label propagation without assigning node IDs as initial labels (this allows SRI cluster IDs
     # to be propagated as far as possible, rather than a KG2 node ID becoming a cluster ID and dominating, thus
     # preventing a small SRI cluster from being merged with the larger KG2 cluster
     logging.info(f"Starting run 1 of label propagation (using NaN as default starting labels)..")
-    logging.info(f"Zipping node IDs with cluster IDs and converting to dictionary format..")
-    label_map_initial_1 = dict(zip(nodes_df.index, nodes_df.cluster_id))
-    label_map_1 = do_label_propagation(label_map_initial_1, adj_list_weighted,
-                                       nodes_to_label=non_sri_node_ids)
+    logging.info(f"Converting cluster IDs to integer labels..")
+    labels_initial_1, label_values_1 = pd.factorize(nodes_df.cluster_id)
+    labels_1 = do_label_propagation(labels_initial_1, adjacency_matrix, non_sri_node_indexes)
     logging.info(f"Updating the nodes DataFrame with the cluster IDs determined by first label propagation run..")
-    nodes_df.cluster_id = nodes_df.index.map(label_map_1)
+    nodes_df.cluster_id = pd.Categorical.from_codes(labels_1, categories=label_values_1).astype(object)
 
     # Then do another run of label propagation where we use node IDs as initial labels (this allows nodes that are only
     # weakly clustered in an SRI cluster to be won over by a dominating KG2 cluster), and also to allow clustering of
@@ -293,12 +352,11 @@ def cluster_match_graph(nodes_df: pd.DataFrame, edges_df: pd.DataFrame):
     logging.info(f"Assigning node IDs as cluster labels for nodes that don't yet have one..")
     nodes_df.fillna(value={"cluster_id": nodes_df.index.to_series()}, inplace=True)
     logging.info(f"Nodes DataFrame after assigning initial cluster IDs is: \n{nodes_df}")
-    logging.info(f"Zipping node IDs with cluster IDs and converting to dictionary format..")
-    label_map_initial_2 = dict(zip(nodes_df.index, nodes_df.cluster_id))
-    label_map_2 = do_label_propagation(label_map_initial_2, adj_list_weighted,
-                                       nodes_to_label=non_sri_node_ids)
+    logging.info(f"Converting cluster IDs to integer labels..")
+    labels_initial_2, label_values_2 = pd.factorize(nodes_df.cluster_id)
+    labels_2 = do_label_propagation(labels_initial_2, adjacency_matrix, non_sri_node_indexes)
     logging.info(f"Updating the nodes DataFrame with the cluster IDs determined by second label propagation run..")
-    nodes_df.cluster_id = nodes_df.index.map(label_map_2)
+    nodes_df.cluster_id = pd.Categorical.from_codes(labels_2, categories=label_values_2).astype(object)
 
     logging.info(f"The final nodes DataFrame is: \n{nodes_df}")
 